@@ -1,5 +1,6 @@
 import logging
 import os
+import tempfile
 from typing import Literal
 
 import datasets
@@ -7,8 +8,12 @@ import diffusers
 import torch
 import transformers
 from accelerate import Accelerator
+from accelerate.data_loader import prepare_data_loader as accelerate_prepare_data_loader
 from accelerate.logging import MultiProcessAdapter, get_logger
-from accelerate.utils import ProjectConfiguration
+from accelerate.utils import ProjectConfiguration, gather_object
+from torch.utils.data import DataLoader
+
+from invoke_training._shared.data.samplers.sampler_state import is_sharded_sampler
 
 
 def initialize_accelerator(
@@ -68,6 +73,94 @@ def initialize_logging(logger_name: str, accelerator: Accelerator) -> MultiProce
     return get_logger(logger_name)
 
 
+def create_shared_temp_dir(accelerator: Accelerator) -> tuple[tempfile.TemporaryDirectory | None, str]:
+    """Create a temporary directory on the local main process of each node, and share its path with the other processes
+    on the same node.
+
+    The directory is only visible to the processes on the node that created it. Use `get_cache_process_info(...)` with
+    `node_local=True` to split work on the directory between the processes of each node.
+
+    Args:
+        accelerator (Accelerator): The Accelerator.
+
+    Returns:
+        tuple[tempfile.TemporaryDirectory | None, str]: The TemporaryDirectory (None on all processes other than the
+            local main process), and the path of the directory. The directory is deleted when the TemporaryDirectory is
+            destroyed, so the local main process must keep a reference to it for as long as the directory is in use.
+    """
+    tmp_dir = None
+    tmp_dir_name = None
+    if accelerator.is_local_main_process:
+        tmp_dir = tempfile.TemporaryDirectory()
+        tmp_dir_name = tmp_dir.name
+    all_tmp_dir_names = gather_object([tmp_dir_name])
+    return tmp_dir, all_tmp_dir_names[_get_node_main_process_index(accelerator)]
+
+
+def _get_node_main_process_index(accelerator: Accelerator) -> int:
+    # Processes are numbered contiguously on each node, starting from the node's local main process.
+    return accelerator.process_index - accelerator.local_process_index
+
+
+def get_cache_process_info(accelerator: Accelerator, node_local: bool) -> tuple[int, int]:
+    """Get the index of this process and the number of processes that share the work of populating a cache.
+
+    Must be called from every process, with the same `node_local` value.
+
+    Args:
+        accelerator (Accelerator): The Accelerator.
+        node_local (bool): If True, the cache is only visible to the processes on this node (e.g. it was created with
+            `create_shared_temp_dir(...)`), so the work is split between the processes on this node. Otherwise, the
+            cache must be on storage that is shared by all processes, and the work is split between all processes.
+
+    Returns:
+        tuple[int, int]: The index of this process and the number of processes that share the work.
+    """
+    if not node_local:
+        return accelerator.process_index, accelerator.num_processes
+
+    all_local_process_indices = gather_object([accelerator.local_process_index])
+    node_main_process_index = _get_node_main_process_index(accelerator)
+    num_node_processes = 1
+    for local_process_index in all_local_process_indices[node_main_process_index + 1 :]:
+        if local_process_index == 0:
+            # The start of the next node.
+            break
+        num_node_processes += 1
+    return accelerator.local_process_index, num_node_processes
+
+
+def prepare_data_loader(accelerator: Accelerator, data_loader: DataLoader) -> DataLoader:
+    """Prepare a training DataLoader with accelerate.
+
+    `accelerator.prepare(...)` always shards a DataLoader between the processes (an IterableDataset is dispatched: every
+    batch is read on the main process, and split between the processes). A DataLoader whose batch sampler or dataset is
+    already sharded (see `is_sharded_sampler(...)` and `EvenLengthIterableDataset`) is instead only wrapped so that its
+    batches are placed on the accelerator device.
+
+    Args:
+        accelerator (Accelerator): The Accelerator.
+        data_loader (DataLoader): The DataLoader to prepare.
+
+    Returns:
+        DataLoader: The prepared DataLoader.
+    """
+    is_sharded = getattr(data_loader.dataset, "is_sharded", False) or (
+        data_loader.batch_sampler is not None and is_sharded_sampler(data_loader.batch_sampler)
+    )
+    if not is_sharded:
+        return accelerator.prepare(data_loader)
+
+    return accelerate_prepare_data_loader(
+        data_loader,
+        device=accelerator.device,
+        num_processes=1,
+        process_index=0,
+        put_on_device=accelerator.device_placement,
+        dispatch_batches=False,
+    )
+
+
 def get_mixed_precision_dtype(accelerator: Accelerator):
     """Extract torch.dtype from Accelerator config.
 
@@ -1,25 +1,145 @@
 import typing
 
 from torch.utils.data import ConcatDataset, DataLoader
-from torch.utils.data.sampler import RandomSampler, SequentialSampler
+from torch.utils.data.sampler import Sampler, SequentialSampler
 
 from invoke_training._shared.data.data_loaders.image_caption_sd_dataloader import (
-    build_aspect_ratio_bucket_manager,
+    build_aspect_ratio_bucket_batch_samplers,
+    build_vae_output_cache_transform,
     sd_image_caption_collate_fn,
 )
+from invoke_training._shared.data.datasets.compiled_dataset import CompiledDataset
 from invoke_training._shared.data.datasets.image_dir_dataset import ImageDirDataset
+from invoke_training._shared.data.datasets.imageless_dataset import ImagelessDataset
 from invoke_training._shared.data.datasets.transform_dataset import TransformDataset
-from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import AspectRatioBucketBatchSampler
 from invoke_training._shared.data.samplers.batch_offset_sampler import BatchOffsetSampler
 from invoke_training._shared.data.samplers.concat_sampler import ConcatSampler
 from invoke_training._shared.data.samplers.interleaved_sampler import InterleavedSampler
 from invoke_training._shared.data.samplers.offset_sampler import OffsetSampler
+from invoke_training._shared.data.samplers.seeded_random_sampler import SeededRandomSampler
 from invoke_training._shared.data.transforms.constant_field_transform import ConstantFieldTransform
 from invoke_training._shared.data.transforms.drop_field_transform import DropFieldTransform
 from invoke_training._shared.data.transforms.load_cache_transform import LoadCacheTransform
 from invoke_training._shared.data.transforms.sd_image_transform import SDImageTransform
-from invoke_training._shared.data.transforms.tensor_disk_cache import TensorDiskCache
+from invoke_training._shared.data.transforms.tensor_cache import open_tensor_cache
+from invoke_training._shared.data.utils.aspect_ratio_bucket_manager import AspectRatioBucketManager
 from invoke_training.config.data.data_loader_config import DreamboothSDDataLoaderConfig
+from invoke_training.config.data.dataset_config import CompiledDatasetConfig, ImageDirDatasetConfig
+
+
+def _build_image_dir_dataset(
+    config: DreamboothSDDataLoaderConfig, dataset_config: ImageDirDatasetConfig | CompiledDatasetConfig, id_prefix: str
+) -> ImageDirDataset | CompiledDataset:
+    if isinstance(dataset_config, CompiledDatasetConfig):
+        return CompiledDataset(dataset_config.dataset_dir, id_prefix=id_prefix)
+    return ImageDirDataset(
+        dataset_config.dataset_dir,
+        id_prefix=id_prefix,
+        keep_in_memory=dataset_config.keep_in_memory,
+        keep_in_memory_format=dataset_config.keep_in_memory_format,
+        keep_in_memory_max_mb=dataset_config.keep_in_memory_max_mb,
+        lazy_image_decode=config.jpeg_draft_decode,
+        decode_to_tensor=config.image_decode_backend == "torchvision",
+    )
+
+
+def _build_samplers(
+    config: DreamboothSDDataLoaderConfig,
+    base_instance_dataset: ImageDirDataset | CompiledDataset | ImagelessDataset,
+    base_class_dataset: ImageDirDataset | CompiledDataset | ImagelessDataset | None,
+    batch_size: int,
+    shuffle: bool,
+    use_aspect_ratio_buckets: bool,
+    seed: typing.Optional[int],
+    num_processes: int,
+    process_index: int,
+) -> tuple[AspectRatioBucketManager | None, list[Sampler]]:
+    """Build the instance sampler and (if there is a class dataset) the class sampler. The class sampler is offset so
+    that it indexes into the class examples of the merged dataset.
+
+    Returns:
+        tuple[AspectRatioBucketManager | None, list[Sampler]]: The aspect ratio bucket manager (None if aspect ratio
+            buckets are not used), and the samplers. If aspect ratio buckets are used, the samplers are batch samplers.
+    """
+    if not use_aspect_ratio_buckets:
+        seed = seed if seed is not None else 0
+        instance_sampler = (
+            SeededRandomSampler(base_instance_dataset, seed=seed)
+            if shuffle
+            else SequentialSampler(base_instance_dataset)
+        )
+        if base_class_dataset is None:
+            return None, [instance_sampler]
+        class_sampler = (
+            SeededRandomSampler(base_class_dataset, seed=seed) if shuffle else SequentialSampler(base_class_dataset)
+        )
+        return None, [instance_sampler, OffsetSampler(class_sampler, offset=len(base_instance_dataset))]
+
+    # The instance and class datasets share a bucket manager, so that they use the same (possibly merged) buckets.
+    image_sizes = [base_instance_dataset.get_image_dimensions()]
+    if base_class_dataset is not None:
+        image_sizes.append(base_class_dataset.get_image_dimensions())
+    aspect_ratio_bucket_manager, batch_samplers = build_aspect_ratio_bucket_batch_samplers(
+        config.aspect_ratio_buckets,
+        image_sizes=image_sizes,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        seed=seed,
+        num_processes=num_processes,
+        process_index=process_index,
+    )
+
+    samplers = [batch_samplers[0]]
+    if base_class_dataset is not None:
+        samplers.append(BatchOffsetSampler(batch_samplers[1], offset=len(base_instance_dataset)))
+    return aspect_ratio_bucket_manager, samplers
+
+
+def _build_transforms(
+    config: DreamboothSDDataLoaderConfig,
+    aspect_ratio_bucket_manager: AspectRatioBucketManager | None,
+    text_encoder_output_cache_dir: typing.Optional[str],
+    text_encoder_cache_field_to_output_field: typing.Optional[dict[str, str]],
+    vae_output_cache_dir: typing.Optional[str],
+    load_images: bool,
+    random_crop_seed: typing.Optional[int],
+    memory_cache_size_mb: int,
+) -> list:
+    """Build the transforms that are applied to the merged instance and class dataset."""
+    all_transforms = []
+    if vae_output_cache_dir is None and load_images:
+        all_transforms.append(
+            SDImageTransform(
+                image_field_names=["image"],
+                fields_to_normalize_to_range_minus_one_to_one=["image"],
+                resolution=config.resolution if aspect_ratio_bucket_manager is None else None,
+                aspect_ratio_bucket_manager=aspect_ratio_bucket_manager,
+                center_crop=config.center_crop,
+                random_flip=config.random_flip,
+                random_crop_seed=random_crop_seed,
+                jpeg_draft=config.jpeg_draft_decode,
+            )
+        )
+    elif vae_output_cache_dir is not None:
+        all_transforms.append(
+            build_vae_output_cache_transform(vae_output_cache_dir, memory_cache_size_mb=memory_cache_size_mb)
+        )
+        # We drop the image to avoid having to either convert from PIL, or handle PIL batch collation.
+        all_transforms.append(DropFieldTransform("image"))
+
+    if text_encoder_output_cache_dir is not None:
+        assert text_encoder_cache_field_to_output_field is not None
+        text_encoder_cache = open_tensor_cache(
+            text_encoder_output_cache_dir, memory_cache_size_bytes=memory_cache_size_mb * 2**20, read_only=True
+        )
+        all_transforms.append(
+            LoadCacheTransform(
+                cache=text_encoder_cache,
+                cache_key_field="id",
+                cache_field_to_output_field=text_encoder_cache_field_to_output_field,
+            )
+        )
+    return all_transforms
 
 
 def build_dreambooth_sd_dataloader(
@@ -30,6 +150,12 @@ def build_dreambooth_sd_dataloader(
     vae_output_cache_dir: typing.Optional[str] = None,
     shuffle: bool = True,
     sequential_batching: bool = False,
+    load_images: bool = True,
+    random_crop_seed: typing.Optional[int] = None,
+    memory_cache_size_mb: int = 0,
+    seed: typing.Optional[int] = None,
+    num_processes: int = 1,
+    process_index: int = 0,
 ) -> DataLoader:
     """Construct a DataLoader for a DreamBooth dataset for Stable Diffusion XL.
 
@@ -44,16 +170,29 @@ def build_dreambooth_sd_dataloader(
         sequential_batching (bool, optional): If True, the internal dataset will be processed sequentially rather than
             interleaving class and instance examples. This is intended to be used when processing the entire dataset for
             caching purposes. Defaults to False.
+        load_images (bool, optional): If False, images are not loaded at all, and the DataLoader only produces the
+            non-image fields (e.g. "id" and "caption"). This is much faster for passes over the dataset that do not need
+            the images (e.g. populating a text encoder output cache). Aspect ratio bucketing is not applied in this
+            mode.
+        random_crop_seed (int, optional): If set, and `config.center_crop` is False, each example is cropped at a
+            position derived deterministically from this seed and the example id (see `SDImageTransform`). This is
+            used when populating a VAE output cache with several crop variants per image.
+        memory_cache_size_mb (int, optional): If greater than 0, the output caches are read through an in-memory tier
+            with this size budget (see `MemoryTensorCache`).
+        seed (int, optional): The shuffle seed. Must be the same on all processes. If None, 0 is used.
+        num_processes (int, optional): If greater than 1, the aspect ratio bucket batches are split between this many
+            processes, and the DataLoader only yields the batches of `process_index` (see
+            `build_aspect_ratio_bucket_batch_samplers(...)`).
+        process_index (int, optional): The index of this process, in the range [0, num_processes).
 
     Returns:
         DataLoader
     """
     # Prepare instance dataset.
-    base_instance_dataset = ImageDirDataset(
-        config.instance_dataset.dataset_dir,
-        id_prefix="instance_",
-        keep_in_memory=config.instance_dataset.keep_in_memory,
-    )
+    base_instance_dataset = _build_image_dir_dataset(config, config.instance_dataset, id_prefix="instance_")
+    if not load_images:
+        assert vae_output_cache_dir is None
+        base_instance_dataset = ImagelessDataset(base_instance_dataset)
     instance_dataset = TransformDataset(
         base_instance_dataset,
         [
@@ -65,11 +204,10 @@ def build_dreambooth_sd_dataloader(
 
     # Prepare class dataset.
     base_class_dataset = None
-    class_dataset = None
     if config.class_dataset is not None:
-        base_class_dataset = ImageDirDataset(
-            config.class_dataset.dataset_dir, id_prefix="class_", keep_in_memory=config.class_dataset.keep_in_memory
-        )
+        base_class_dataset = _build_image_dir_dataset(config, config.class_dataset, id_prefix="class_")
+        if not load_images:
+            base_class_dataset = ImagelessDataset(base_class_dataset)
         class_dataset = TransformDataset(
             base_class_dataset,
             [
@@ -79,95 +217,44 @@ def build_dreambooth_sd_dataloader(
         )
         datasets.append(class_dataset)
 
-    # Merge instance dataset and class dataset.
-    merged_dataset = ConcatDataset(datasets)
-
-    # Initialize either the fixed target resolution or aspect ratio buckets.
-    target_resolution = None
-    aspect_ratio_bucket_manager = None
-    instance_sampler = None
-    class_sampler = None
-    if config.aspect_ratio_buckets is None:
-        target_resolution = config.resolution
-        # TODO(ryand): Provide a seeded generator.
-        instance_sampler = RandomSampler(instance_dataset) if shuffle else SequentialSampler(instance_dataset)
-        if base_class_dataset is not None:
-            class_sampler = RandomSampler(class_dataset) if shuffle else SequentialSampler(class_dataset)
-            class_sampler = OffsetSampler(class_sampler, offset=len(base_instance_dataset))
-    else:
-        aspect_ratio_bucket_manager = build_aspect_ratio_bucket_manager(config=config.aspect_ratio_buckets)
-        # TODO(ryand): Drill-down the seed parameter rather than hard-coding to 0 here.
-        instance_sampler = AspectRatioBucketBatchSampler.from_image_sizes(
-            bucket_manager=aspect_ratio_bucket_manager,
-            image_sizes=base_instance_dataset.get_image_dimensions(),
-            batch_size=batch_size,
-            shuffle=shuffle,
-            seed=0,
-        )
-        if base_class_dataset is not None:
-            class_sampler = AspectRatioBucketBatchSampler.from_image_sizes(
-                bucket_manager=aspect_ratio_bucket_manager,
-                image_sizes=base_class_dataset.get_image_dimensions(),
-                batch_size=batch_size,
-                shuffle=shuffle,
-                seed=0,
-            )
-            class_sampler = BatchOffsetSampler(class_sampler, offset=len(base_instance_dataset))
-
-    # Add transforms to the merged dataset.
-    all_transforms = []
-    if vae_output_cache_dir is None:
-        all_transforms.append(
-            SDImageTransform(
-                image_field_names=["image"],
-                fields_to_normalize_to_range_minus_one_to_one=["image"],
-                resolution=target_resolution,
-                aspect_ratio_bucket_manager=aspect_ratio_bucket_manager,
-                center_crop=config.center_crop,
-                random_flip=config.random_flip,
-            )
-        )
-    else:
-        vae_cache = TensorDiskCache(vae_output_cache_dir)
-        all_transforms.append(
-            LoadCacheTransform(
-                cache=vae_cache,
-                cache_key_field="id",
-                cache_field_to_output_field={
-                    "vae_output": "vae_output",
-                    "original_size_hw": "original_size_hw",
-                    "crop_top_left_yx": "crop_top_left_yx",
-                },
-            )
-        )
-        # We drop the image to avoid having to either convert from PIL, or handle PIL batch collation.
-        all_transforms.append(DropFieldTransform("image"))
-
-    if text_encoder_output_cache_dir is not None:
-        assert text_encoder_cache_field_to_output_field is not None
-        text_encoder_cache = TensorDiskCache(text_encoder_output_cache_dir)
-        all_transforms.append(
-            LoadCacheTransform(
-                cache=text_encoder_cache,
-                cache_key_field="id",
-                cache_field_to_output_field=text_encoder_cache_field_to_output_field,
-            )
-        )
+    # Initialize either the fixed target resolution (aspect_ratio_bucket_manager is None) or aspect ratio buckets.
+    use_aspect_ratio_buckets = config.aspect_ratio_buckets is not None and load_images
+    aspect_ratio_bucket_manager, samplers = _build_samplers(
+        config,
+        base_instance_dataset=base_instance_dataset,
+        base_class_dataset=base_class_dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        use_aspect_ratio_buckets=use_aspect_ratio_buckets,
+        seed=seed,
+        num_processes=num_processes,
+        process_index=process_index,
+    )
 
-    merged_dataset = TransformDataset(merged_dataset, all_transforms)
+    # Merge instance dataset and class dataset, and add transforms to the merged dataset.
+    merged_dataset = TransformDataset(
+        ConcatDataset(datasets),
+        _build_transforms(
+            config,
+            aspect_ratio_bucket_manager=aspect_ratio_bucket_manager,
+            text_encoder_output_cache_dir=text_encoder_output_cache_dir,
+            text_encoder_cache_field_to_output_field=text_encoder_cache_field_to_output_field,
+            vae_output_cache_dir=vae_output_cache_dir,
+            load_images=load_images,
+            random_crop_seed=random_crop_seed,
+            memory_cache_size_mb=memory_cache_size_mb,
+        ),
+    )
 
     # Choose between sequential vs. interleaved merging of the instance and class samplers.
     # Sequential sampling is typically used to populate a cache, because it guarantees that all examples will be
     # included in an epoch.
-    samplers = [instance_sampler]
-    if class_sampler is not None:
-        samplers.append(class_sampler)
     if sequential_batching:
         sampler = ConcatSampler(samplers)
     else:
         sampler = InterleavedSampler(samplers)
 
-    if config.aspect_ratio_buckets is None:
+    if not use_aspect_ratio_buckets:
         return DataLoader(
             merged_dataset,
             sampler=sampler,
@@ -176,7 +263,7 @@ def build_dreambooth_sd_dataloader(
             num_workers=config.dataloader_num_workers,
         )
     else:
-        # If config.aspect_ratio_buckets is not None, then we are using a batch sampler.
+        # If aspect ratio buckets are being used, then we are using a batch sampler.
         return DataLoader(
             merged_dataset,
             batch_sampler=sampler,
@@ -3,61 +3,75 @@ import typing
 import torch
 from torch.utils.data import DataLoader
 
+from invoke_training._shared.data.datasets.aspect_ratio_bucket_batch_dataset import AspectRatioBucketBatchDataset
 from invoke_training._shared.data.datasets.build_dataset import (
     build_hf_hub_image_caption_dataset,
+    build_hf_hub_streaming_image_caption_dataset,
     build_image_caption_dir_dataset,
     build_image_caption_jsonl_dataset,
 )
-from invoke_training._shared.data.datasets.transform_dataset import TransformDataset
-from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import AspectRatioBucketBatchSampler
+from invoke_training._shared.data.datasets.compiled_dataset import CompiledDataset
+from invoke_training._shared.data.datasets.even_length_iterable_dataset import EvenLengthIterableDataset
+from invoke_training._shared.data.datasets.imageless_dataset import ImagelessDataset
+from invoke_training._shared.data.datasets.tar_shard_image_caption_dataset import TarShardImageCaptionDataset
+from invoke_training._shared.data.datasets.transform_dataset import IterableTransformDataset, TransformDataset
+from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import (
+    AspectRatioBucketBatchSampler,
+    get_bucket_batch_size,
+    merge_small_aspect_ratio_buckets,
+)
+from invoke_training._shared.data.samplers.distributed_aspect_ratio_bucket_batch_sampler import (
+    DistributedAspectRatioBucketBatchSampler,
+)
+from invoke_training._shared.data.samplers.seeded_random_sampler import SeededRandomSampler
 from invoke_training._shared.data.transforms.caption_prefix_transform import CaptionPrefixTransform
 from invoke_training._shared.data.transforms.drop_field_transform import DropFieldTransform
 from invoke_training._shared.data.transforms.load_cache_transform import LoadCacheTransform
 from invoke_training._shared.data.transforms.sd_image_transform import SDImageTransform
-from invoke_training._shared.data.transforms.tensor_disk_cache import TensorDiskCache
+from invoke_training._shared.data.transforms.tensor_cache import open_tensor_cache, read_cache_info
 from invoke_training._shared.data.utils.aspect_ratio_bucket_manager import AspectRatioBucketManager
+from invoke_training._shared.data.utils.resolution import Resolution
 from invoke_training.config.data.data_loader_config import AspectRatioBucketConfig, ImageCaptionSDDataLoaderConfig
 from invoke_training.config.data.dataset_config import (
+    CompiledDatasetConfig,
     HFHubImageCaptionDatasetConfig,
     ImageCaptionDirDatasetConfig,
     ImageCaptionJsonlDatasetConfig,
+    ImageCaptionTarShardDatasetConfig,
 )
 
+# The example fields that are collated into a list, and the tensor fields that are stacked along a new batch dimension.
+_LIST_FIELD_NAMES = ["id", "original_size_hw", "crop_top_left_yx", "caption"]
+_STACKED_FIELD_NAMES = [
+    "image",
+    "prompt_embeds",
+    "pooled_prompt_embeds",
+    "text_encoder_output",
+    "vae_output",
+    "vae_latent_dist",
+    "mask",
+]
 
-def sd_image_caption_collate_fn(examples):
-    """A batch collation function for the image-caption SDXL data loader."""
-    out_examples = {
-        "id": [example["id"] for example in examples],
-    }
 
-    if "image" in examples[0]:
-        out_examples["image"] = torch.stack([example["image"] for example in examples])
+def _stack_field(examples: list[dict[str, typing.Any]], field_name: str) -> torch.Tensor:
+    return torch.stack([example[field_name] for example in examples])
 
-    if "original_size_hw" in examples[0]:
-        out_examples["original_size_hw"] = [example["original_size_hw"] for example in examples]
 
-    if "crop_top_left_yx" in examples[0]:
-        out_examples["crop_top_left_yx"] = [example["crop_top_left_yx"] for example in examples]
+def sd_image_caption_collate_fn(examples):
+    """A batch collation function for the image-caption SDXL data loader."""
+    out_examples = {}
 
-    if "caption" in examples[0]:
-        out_examples["caption"] = [example["caption"] for example in examples]
+    for field_name in _LIST_FIELD_NAMES:
+        if field_name in examples[0]:
+            out_examples[field_name] = [example[field_name] for example in examples]
+
+    for field_name in _STACKED_FIELD_NAMES:
+        if field_name in examples[0]:
+            out_examples[field_name] = _stack_field(examples, field_name)
 
     if "loss_weight" in examples[0]:
         out_examples["loss_weight"] = torch.tensor([example["loss_weight"] for example in examples])
 
-    if "prompt_embeds" in examples[0]:
-        out_examples["prompt_embeds"] = torch.stack([example["prompt_embeds"] for example in examples])
-        out_examples["pooled_prompt_embeds"] = torch.stack([example["pooled_prompt_embeds"] for example in examples])
-
-    if "text_encoder_output" in examples[0]:
-        out_examples["text_encoder_output"] = torch.stack([example["text_encoder_output"] for example in examples])
-
-    if "vae_output" in examples[0]:
-        out_examples["vae_output"] = torch.stack([example["vae_output"] for example in examples])
-
-    if "mask" in examples[0]:
-        out_examples["mask"] = torch.stack([example["mask"] for example in examples])
-
     return out_examples
 
 
@@ -70,6 +84,110 @@ def build_aspect_ratio_bucket_manager(config: AspectRatioBucketConfig):
     )
 
 
+def build_aspect_ratio_bucket_batch_samplers(
+    config: AspectRatioBucketConfig,
+    image_sizes: list[list[Resolution]],
+    batch_size: int,
+    shuffle: bool,
+    seed: int | None = None,
+    num_processes: int = 1,
+    process_index: int = 0,
+) -> tuple[AspectRatioBucketManager, list[AspectRatioBucketBatchSampler]]:
+    """Build an aspect ratio bucket manager, and a batch sampler for each of one or more datasets that share it.
+
+    If `config.partial_batch_policy` is "merge", small buckets are merged based on the combined image counts of all of
+    the datasets (see `merge_small_aspect_ratio_buckets(...)`). The returned bucket manager must also be used to resize
+    the images, so that the images agree with the batch samplers on the bucket of every image.
+
+    If `num_processes` is greater than 1, the batch samplers are `DistributedAspectRatioBucketBatchSampler`s that only
+    yield the batches of `process_index`, so the DataLoader must not be sharded again (see `is_sharded_sampler(...)`).
+
+    Args:
+        config (AspectRatioBucketConfig): The aspect ratio bucket config.
+        image_sizes (list[list[Resolution]]): The image resolutions of each dataset.
+        batch_size (int): The batch size.
+        shuffle (bool): Whether to shuffle the batches.
+        seed (int | None, optional): The shuffle seed. Must be the same on all processes. If None, 0 is used.
+        num_processes (int, optional): The number of processes that the batches are split between.
+        process_index (int, optional): The index of this process, in the range [0, num_processes).
+
+    Returns:
+        tuple[AspectRatioBucketManager, list[AspectRatioBucketBatchSampler]]: The bucket manager, and a batch sampler
+            for each dataset.
+    """
+    bucket_manager = build_aspect_ratio_bucket_manager(config=config)
+    if config.partial_batch_policy == "merge":
+        bucket_manager = merge_small_aspect_ratio_buckets(
+            bucket_manager,
+            image_sizes=[size for dataset_image_sizes in image_sizes for size in dataset_image_sizes],
+            batch_size=batch_size,
+            max_pixels_per_batch=config.max_pixels_per_batch,
+        )
+
+    sampler_cls = AspectRatioBucketBatchSampler
+    distributed_kwargs = {}
+    if num_processes > 1:
+        sampler_cls = DistributedAspectRatioBucketBatchSampler
+        distributed_kwargs = {"num_replicas": num_processes, "rank": process_index}
+    batch_samplers = [
+        sampler_cls.from_image_sizes(
+            bucket_manager=bucket_manager,
+            image_sizes=dataset_image_sizes,
+            batch_size=batch_size,
+            shuffle=shuffle,
+            seed=seed if seed is not None else 0,
+            max_pixels_per_batch=config.max_pixels_per_batch,
+            partial_batch_policy=config.partial_batch_policy,
+            **distributed_kwargs,
+        )
+        for dataset_image_sizes in image_sizes
+    ]
+    return bucket_manager, batch_samplers
+
+
+def get_loss_normalization_batch_size(config: AspectRatioBucketConfig | None, batch_size: int) -> int | None:
+    """Get the batch size that the training loss should be normalized by, or None if the loss should be averaged over
+    each batch. This is only set when the batch size varies between aspect ratio buckets (see
+    `AspectRatioBucketConfig.max_pixels_per_batch`).
+    """
+    if config is None or config.max_pixels_per_batch is None:
+        return None
+    return batch_size
+
+
+def build_vae_output_cache_transform(
+    vae_output_cache_dir: str, use_masks: bool = False, memory_cache_size_mb: int = 0
+) -> LoadCacheTransform:
+    """Build a transform that loads cached VAE outputs into each example.
+
+    Depending on how the cache was populated (see `read_cache_info()`), the cached VAE output is either a latent sample
+    in the "vae_output" field, or the parameters of the latent distribution in the "vae_latent_dist" field.
+
+    Args:
+        vae_output_cache_dir (str): The VAE output cache directory.
+        use_masks (bool, optional): Whether to also load the cached "mask" field.
+        memory_cache_size_mb (int, optional): If greater than 0, the cache is read through an in-memory tier with this
+            size budget (see `MemoryTensorCache`).
+    """
+    cache_info = read_cache_info(vae_output_cache_dir)
+    vae_output_field = "vae_latent_dist" if cache_info.get("latent_distribution", False) else "vae_output"
+    cache_field_to_output_field = {
+        vae_output_field: vae_output_field,
+        "original_size_hw": "original_size_hw",
+        "crop_top_left_yx": "crop_top_left_yx",
+    }
+    if use_masks:
+        cache_field_to_output_field["mask"] = "mask"
+    return LoadCacheTransform(
+        cache=open_tensor_cache(
+            vae_output_cache_dir, memory_cache_size_bytes=memory_cache_size_mb * 2**20, read_only=True
+        ),
+        cache_key_field="id",
+        cache_field_to_output_field=cache_field_to_output_field,
+        num_variants=cache_info.get("num_variants", 1),
+    )
+
+
 def build_image_caption_sd_dataloader(  # noqa: C901
     config: ImageCaptionSDDataLoaderConfig,
     batch_size: int,
@@ -78,6 +196,12 @@ def build_image_caption_sd_dataloader(  # noqa: C901
     text_encoder_cache_field_to_output_field: typing.Optional[dict[str, str]] = None,
     vae_output_cache_dir: typing.Optional[str] = None,
     shuffle: bool = True,
+    load_images: bool = True,
+    random_crop_seed: typing.Optional[int] = None,
+    memory_cache_size_mb: int = 0,
+    seed: typing.Optional[int] = None,
+    num_processes: int = 1,
+    process_index: int = 0,
 ) -> DataLoader:
     """Construct a DataLoader for an image-caption dataset for Stable Diffusion XL.
 
@@ -89,41 +213,110 @@ def build_image_caption_sd_dataloader(  # noqa: C901
         vae_output_cache_dir (str, optional): The directory where VAE outputs are cached and should be loaded from. If
             set, then the image augmentation transforms will be skipped, and the image will not be copied to VRAM.
         shuffle (bool, optional): Whether to shuffle the dataset order.
+        load_images (bool, optional): If False, images are not loaded at all, and the DataLoader only produces the
+            non-image fields (e.g. "id" and "caption"). This is much faster for passes over the dataset that do not need
+            the images (e.g. populating a text encoder output cache). Aspect ratio bucketing is not applied in this
+            mode.
+        random_crop_seed (int, optional): If set, and `config.center_crop` is False, each example is cropped at a
+            position derived deterministically from this seed and the example id (see `SDImageTransform`). This is
+            used when populating a VAE output cache with several crop variants per image.
+        memory_cache_size_mb (int, optional): If greater than 0, the output caches are read through an in-memory tier
+            with this size budget (see `MemoryTensorCache`).
+        seed (int, optional): The shuffle seed. Must be the same on all processes. If None, 0 is used.
+        num_processes (int, optional): If greater than 1, the dataset is split between this many processes, and the
+            DataLoader only yields the batches of `process_index`. Map-style datasets are split by their aspect ratio
+            bucket batch sampler (see `build_aspect_ratio_bucket_batch_samplers(...)`). Streaming datasets are split
+            by the dataset itself, and padded or truncated so that every process yields the same number of batches
+            (see `EvenLengthIterableDataset`).
+        process_index (int, optional): The index of this process, in the range [0, num_processes).
     Returns:
         DataLoader
     """
-    if isinstance(config.dataset, HFHubImageCaptionDatasetConfig):
+    if isinstance(config.dataset, HFHubImageCaptionDatasetConfig) and config.dataset.streaming:
+        if text_encoder_output_cache_dir is not None or vae_output_cache_dir is not None:
+            raise ValueError("Output caching is not supported for streaming HF_HUB_IMAGE_CAPTION_DATASET datasets.")
+        base_dataset = build_hf_hub_streaming_image_caption_dataset(
+            config.dataset,
+            shuffle=shuffle,
+            load_images=load_images,
+            rank=process_index,
+            world_size=num_processes,
+            seed=seed if seed is not None else 0,
+        )
+    elif isinstance(config.dataset, HFHubImageCaptionDatasetConfig):
         base_dataset = build_hf_hub_image_caption_dataset(config.dataset)
     elif isinstance(config.dataset, ImageCaptionJsonlDatasetConfig):
-        base_dataset = build_image_caption_jsonl_dataset(config.dataset)
+        base_dataset = build_image_caption_jsonl_dataset(
+            config.dataset,
+            lazy_image_decode=config.jpeg_draft_decode,
+            decode_to_tensor=config.image_decode_backend == "torchvision",
+        )
     elif isinstance(config.dataset, ImageCaptionDirDatasetConfig):
-        base_dataset = build_image_caption_dir_dataset(config.dataset)
+        base_dataset = build_image_caption_dir_dataset(
+            config.dataset,
+            lazy_image_decode=config.jpeg_draft_decode,
+            decode_to_tensor=config.image_decode_backend == "torchvision",
+        )
+    elif isinstance(config.dataset, CompiledDatasetConfig):
+        base_dataset = CompiledDataset(config.dataset.dataset_dir)
+    elif isinstance(config.dataset, ImageCaptionTarShardDatasetConfig):
+        base_dataset = TarShardImageCaptionDataset(
+            shards=config.dataset.shards,
+            image_extension=config.dataset.image_extension,
+            caption_extension=config.dataset.caption_extension,
+            mask_extension=config.dataset.mask_extension if use_masks else None,
+            shuffle=shuffle,
+            shuffle_buffer_size=config.dataset.shuffle_buffer_size,
+            rank=process_index,
+            world_size=num_processes,
+            num_examples=config.dataset.num_examples,
+            # When the VAE outputs are cached, the images are not needed, so we skip decoding them.
+            load_images=load_images and vae_output_cache_dir is None,
+            lazy_image_decode=config.jpeg_draft_decode,
+            decode_to_tensor=config.image_decode_backend == "torchvision",
+        )
     else:
         raise ValueError(f"Unexpected dataset config type: '{type(config.dataset)}'.")
 
+    if not load_images:
+        assert vae_output_cache_dir is None
+        if not isinstance(base_dataset, torch.utils.data.IterableDataset):
+            base_dataset = ImagelessDataset(base_dataset)
+
     # Initialize either the fixed target resolution or aspect ratio buckets.
-    if config.aspect_ratio_buckets is None:
+    if config.aspect_ratio_buckets is None or not load_images:
         target_resolution = config.resolution
         aspect_ratio_bucket_manager = None
         batch_sampler = None
     else:
         target_resolution = None
-        aspect_ratio_bucket_manager = build_aspect_ratio_bucket_manager(config=config.aspect_ratio_buckets)
-        # TODO(ryand): Drill-down the seed parameter rather than hard-coding to 0 here.
-        batch_sampler = AspectRatioBucketBatchSampler.from_image_sizes(
-            bucket_manager=aspect_ratio_bucket_manager,
-            image_sizes=base_dataset.get_image_dimensions(),
-            batch_size=batch_size,
-            shuffle=shuffle,
-            seed=0,
-        )
+        if isinstance(base_dataset, torch.utils.data.IterableDataset):
+            # The image dimensions of a streaming dataset are not known up front, so examples are grouped into bucket
+            # batches as they are streamed (see AspectRatioBucketBatchDataset below).
+            if config.aspect_ratio_buckets.partial_batch_policy != "keep":
+                raise ValueError(
+                    f"partial_batch_policy='{config.aspect_ratio_buckets.partial_batch_policy}' is not supported for "
+                    "streaming datasets."
+                )
+            aspect_ratio_bucket_manager = build_aspect_ratio_bucket_manager(config=config.aspect_ratio_buckets)
+            batch_sampler = None
+        else:
+            aspect_ratio_bucket_manager, (batch_sampler,) = build_aspect_ratio_bucket_batch_samplers(
+                config.aspect_ratio_buckets,
+                image_sizes=[base_dataset.get_image_dimensions()],
+                batch_size=batch_size,
+                shuffle=shuffle,
+                seed=seed,
+                num_processes=num_processes,
+                process_index=process_index,
+            )
 
     all_transforms = []
 
     if config.caption_prefix is not None:
         all_transforms.append(CaptionPrefixTransform(caption_field_name="caption", prefix=config.caption_prefix + " "))
 
-    if vae_output_cache_dir is None:
+    if vae_output_cache_dir is None and load_images:
         image_field_names = ["image"]
         if use_masks:
             image_field_names.append("mask")
@@ -138,33 +331,25 @@ def build_image_caption_sd_dataloader(  # noqa: C901
                 aspect_ratio_bucket_manager=aspect_ratio_bucket_manager,
                 center_crop=config.center_crop,
                 random_flip=config.random_flip,
+                random_crop_seed=random_crop_seed,
+                jpeg_draft=config.jpeg_draft_decode,
             )
         )
-    else:
+    elif vae_output_cache_dir is not None:
         # We drop the image to avoid having to either convert from PIL, or handle PIL batch collation.
         all_transforms.append(DropFieldTransform("image"))
         all_transforms.append(DropFieldTransform("mask"))
-
-        vae_cache = TensorDiskCache(vae_output_cache_dir)
-
-        cache_field_to_output_field = {
-            "vae_output": "vae_output",
-            "original_size_hw": "original_size_hw",
-            "crop_top_left_yx": "crop_top_left_yx",
-        }
-        if use_masks:
-            cache_field_to_output_field["mask"] = "mask"
         all_transforms.append(
-            LoadCacheTransform(
-                cache=vae_cache,
-                cache_key_field="id",
-                cache_field_to_output_field=cache_field_to_output_field,
+            build_vae_output_cache_transform(
+                vae_output_cache_dir, use_masks=use_masks, memory_cache_size_mb=memory_cache_size_mb
             )
         )
 
     if text_encoder_output_cache_dir is not None:
         assert text_encoder_cache_field_to_output_field is not None
-        text_encoder_cache = TensorDiskCache(text_encoder_output_cache_dir)
+        text_encoder_cache = open_tensor_cache(
+            text_encoder_output_cache_dir, memory_cache_size_bytes=memory_cache_size_mb * 2**20, read_only=True
+        )
         all_transforms.append(
             LoadCacheTransform(
                 cache=text_encoder_cache,
@@ -173,12 +358,46 @@ def build_image_caption_sd_dataloader(  # noqa: C901
             )
         )
 
+    if isinstance(base_dataset, torch.utils.data.IterableDataset):
+        # Shuffling is handled by the dataset.
+        dataset = IterableTransformDataset(base_dataset, all_transforms)
+        if aspect_ratio_bucket_manager is not None:
+            max_pixels_per_batch = config.aspect_ratio_buckets.max_pixels_per_batch
+            max_bucket_batch_size = max(
+                get_bucket_batch_size(bucket, batch_size, max_pixels_per_batch)
+                for bucket in aspect_ratio_bucket_manager.buckets
+            )
+            batch_dataset = AspectRatioBucketBatchDataset(
+                dataset,
+                bucket_manager=aspect_ratio_bucket_manager,
+                batch_size=batch_size,
+                max_buffered_examples=max(config.aspect_ratio_buckets.stream_buffer_size, max_bucket_batch_size),
+                max_pixels_per_batch=max_pixels_per_batch,
+            )
+            if num_processes > 1:
+                batch_dataset = EvenLengthIterableDataset(batch_dataset, length=len(batch_dataset))
+            # The dataset produces whole batches, so automatic batching is disabled with batch_size=None.
+            return DataLoader(
+                batch_dataset,
+                collate_fn=sd_image_caption_collate_fn,
+                batch_size=None,
+                num_workers=config.dataloader_num_workers,
+            )
+        if num_processes > 1:
+            dataset = EvenLengthIterableDataset(dataset, length=len(dataset))
+        return DataLoader(
+            dataset,
+            collate_fn=sd_image_caption_collate_fn,
+            batch_size=batch_size,
+            num_workers=config.dataloader_num_workers,
+        )
+
     dataset = TransformDataset(base_dataset, all_transforms)
 
     if batch_sampler is None:
         return DataLoader(
             dataset,
-            shuffle=shuffle,
+            sampler=SeededRandomSampler(dataset, seed=seed if seed is not None else 0) if shuffle else None,
             collate_fn=sd_image_caption_collate_fn,
             batch_size=batch_size,
             num_workers=config.dataloader_num_workers,
@@ -8,7 +8,7 @@ from invoke_training._shared.data.datasets.image_pair_preference_dataset import
 from invoke_training._shared.data.datasets.transform_dataset import TransformDataset
 from invoke_training._shared.data.transforms.load_cache_transform import LoadCacheTransform
 from invoke_training._shared.data.transforms.sd_image_transform import SDImageTransform
-from invoke_training._shared.data.transforms.tensor_disk_cache import TensorDiskCache
+from invoke_training._shared.data.transforms.tensor_cache import open_tensor_cache
 from invoke_training.pipelines._experimental.sd_dpo_lora.config import ImagePairPreferenceSDDataLoaderConfig
 
 
@@ -106,7 +106,7 @@ def build_image_pair_preference_sd_dataloader(
         )
     else:
         raise NotImplementedError("VAE caching is not yet implemented.")
-        # vae_cache = TensorDiskCache(vae_output_cache_dir)
+        # vae_cache = open_tensor_cache(vae_output_cache_dir)
         # all_transforms.append(
         #     LoadCacheTransform(
         #         cache=vae_cache,
@@ -123,7 +123,7 @@ def build_image_pair_preference_sd_dataloader(
 
     if text_encoder_output_cache_dir is not None:
         assert text_encoder_cache_field_to_output_field is not None
-        text_encoder_cache = TensorDiskCache(text_encoder_output_cache_dir)
+        text_encoder_cache = open_tensor_cache(text_encoder_output_cache_dir, read_only=True)
         all_transforms.append(
             LoadCacheTransform(
                 cache=text_encoder_cache,
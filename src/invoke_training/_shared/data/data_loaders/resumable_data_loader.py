@@ -0,0 +1,118 @@
+import typing
+
+from torch.utils.data import DataLoader, IterableDataset, Sampler
+
+from invoke_training._shared.data.samplers.sampler_state import get_sampler_state_dict, load_sampler_state_dict
+
+
+class _SkipBatchSampler(Sampler[list[int]]):
+    """A batch sampler that wraps another batch sampler and skips its first `num_batches_to_skip` batches."""
+
+    def __init__(self, batch_sampler: Sampler[list[int]] | typing.Iterable[list[int]], num_batches_to_skip: int):
+        self._batch_sampler = batch_sampler
+        self._num_batches_to_skip = num_batches_to_skip
+
+    def __iter__(self) -> typing.Iterator[list[int]]:
+        for batch_idx, batch in enumerate(self._batch_sampler):
+            if batch_idx >= self._num_batches_to_skip:
+                yield batch
+
+    def __len__(self) -> int:
+        return max(0, len(self._batch_sampler) - self._num_batches_to_skip)
+
+
+class ResumableDataLoader:
+    """A wrapper around a DataLoader that keeps track of the position in the data order, so that training can be
+    resumed part way through an epoch.
+
+    `state_dict()` returns the state of the batch sampler at the start of the current epoch, and the number of batches
+    that have been consumed from this wrapper in the epoch. Unlike the position of the batch sampler itself, this is not
+    affected by the batches that the DataLoader fetches ahead of time.
+
+    After `load_state_dict(...)`, the next epoch restores the batch sampler state, and fast-forwards past the consumed
+    batches at the batch sampler level. The skipped examples are never loaded, so resuming does not pay the cost of
+    decoding them.
+
+    The batch order is only restored if the batch sampler implements `state_dict()` / `load_state_dict()` (e.g.
+    `AspectRatioBucketBatchSampler`), or if its order is deterministic.
+    """
+
+    def __init__(self, data_loader: DataLoader):
+        if isinstance(data_loader.dataset, IterableDataset) or data_loader.batch_sampler is None:
+            raise ValueError(
+                "ResumableDataLoader requires a DataLoader with a batch sampler. DataLoaders over an IterableDataset, "
+                "or with batch_size=None, are not supported."
+            )
+        self._data_loader = data_loader
+
+        # The state of the batch sampler at the start of the current epoch (None between epochs), and the number of
+        # batches consumed in the current epoch.
+        self._epoch_batch_sampler_state = None
+        self._num_batches_consumed = 0
+        # The number of batches to skip at the start of the next epoch (set by `load_state_dict()`).
+        self._num_batches_to_skip = 0
+
+    @property
+    def dataset(self):
+        return self._data_loader.dataset
+
+    @property
+    def batch_sampler(self):
+        return self._data_loader.batch_sampler
+
+    def _build_skip_data_loader(self, num_batches_to_skip: int) -> DataLoader:
+        """Build a copy of the wrapped DataLoader that skips the first `num_batches_to_skip` batches."""
+        data_loader = self._data_loader
+        return DataLoader(
+            data_loader.dataset,
+            batch_sampler=_SkipBatchSampler(data_loader.batch_sampler, num_batches_to_skip),
+            num_workers=data_loader.num_workers,
+            collate_fn=data_loader.collate_fn,
+            pin_memory=data_loader.pin_memory,
+            timeout=data_loader.timeout,
+            worker_init_fn=data_loader.worker_init_fn,
+            multiprocessing_context=data_loader.multiprocessing_context,
+            generator=data_loader.generator,
+            prefetch_factor=data_loader.prefetch_factor,
+            persistent_workers=data_loader.persistent_workers,
+            pin_memory_device=data_loader.pin_memory_device,
+        )
+
+    def __iter__(self) -> typing.Iterator[typing.Any]:
+        self._epoch_batch_sampler_state = get_sampler_state_dict(self._data_loader.batch_sampler)
+        num_batches_to_skip = self._num_batches_to_skip
+        self._num_batches_to_skip = 0
+        self._num_batches_consumed = num_batches_to_skip
+
+        data_loader = self._data_loader
+        if num_batches_to_skip > 0:
+            data_loader = self._build_skip_data_loader(num_batches_to_skip)
+
+        try:
+            for batch in data_loader:
+                # The batch is counted as consumed as soon as it is handed out, so that a state_dict() taken while
+                # training on it resumes from the next batch.
+                self._num_batches_consumed += 1
+                yield batch
+        finally:
+            self._epoch_batch_sampler_state = None
+            self._num_batches_consumed = 0
+
+    def __len__(self) -> int:
+        return len(self._data_loader)
+
+    def state_dict(self) -> dict:
+        """Get the state of the data order: the batch sampler state at the start of the epoch, and the number of batches
+        consumed in the epoch.
+        """
+        if self._epoch_batch_sampler_state is None:
+            return {
+                "batch_sampler": get_sampler_state_dict(self._data_loader.batch_sampler),
+                "num_batches": self._num_batches_to_skip,
+            }
+        return {"batch_sampler": self._epoch_batch_sampler_state, "num_batches": self._num_batches_consumed}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        """Restore a state from `state_dict()`. It takes effect on the next call to `__iter__()`."""
+        load_sampler_state_dict(self._data_loader.batch_sampler, state_dict["batch_sampler"])
+        self._num_batches_to_skip = state_dict["num_batches"]
@@ -3,7 +3,8 @@ from typing import Literal, Optional
 from torch.utils.data import DataLoader
 
 from invoke_training._shared.data.data_loaders.image_caption_sd_dataloader import (
-    build_aspect_ratio_bucket_manager,
+    build_aspect_ratio_bucket_batch_samplers,
+    build_vae_output_cache_transform,
     sd_image_caption_collate_fn,
 )
 from invoke_training._shared.data.datasets.build_dataset import (
@@ -11,18 +12,18 @@ from invoke_training._shared.data.datasets.build_dataset import (
     build_image_caption_dir_dataset,
     build_image_caption_jsonl_dataset,
 )
+from invoke_training._shared.data.datasets.compiled_dataset import CompiledDataset
 from invoke_training._shared.data.datasets.image_dir_dataset import ImageDirDataset
 from invoke_training._shared.data.datasets.transform_dataset import TransformDataset
-from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import AspectRatioBucketBatchSampler
+from invoke_training._shared.data.samplers.seeded_random_sampler import SeededRandomSampler
 from invoke_training._shared.data.transforms.concat_fields_transform import ConcatFieldsTransform
 from invoke_training._shared.data.transforms.drop_field_transform import DropFieldTransform
-from invoke_training._shared.data.transforms.load_cache_transform import LoadCacheTransform
 from invoke_training._shared.data.transforms.sd_image_transform import SDImageTransform
 from invoke_training._shared.data.transforms.shuffle_caption_transform import ShuffleCaptionTransform
 from invoke_training._shared.data.transforms.template_caption_transform import TemplateCaptionTransform
-from invoke_training._shared.data.transforms.tensor_disk_cache import TensorDiskCache
 from invoke_training.config.data.data_loader_config import TextualInversionSDDataLoaderConfig
 from invoke_training.config.data.dataset_config import (
+    CompiledDatasetConfig,
     HFHubImageCaptionDatasetConfig,
     ImageCaptionDirDatasetConfig,
     ImageCaptionJsonlDatasetConfig,
@@ -101,6 +102,11 @@ def build_textual_inversion_sd_dataloader(  # noqa: C901
     use_masks: bool = False,
     vae_output_cache_dir: Optional[str] = None,
     shuffle: bool = True,
+    random_crop_seed: Optional[int] = None,
+    memory_cache_size_mb: int = 0,
+    seed: Optional[int] = None,
+    num_processes: int = 1,
+    process_index: int = 0,
 ) -> DataLoader:
     """Construct a DataLoader for a Textual Inversion dataset for Stable Diffusion.
 
@@ -111,19 +117,44 @@ def build_textual_inversion_sd_dataloader(  # noqa: C901
         vae_output_cache_dir (str, optional): The directory where VAE outputs are cached and should be loaded from. If
             set, then the image augmentation transforms will be skipped, and the image will not be copied to VRAM.
         shuffle (bool, optional): Whether to shuffle the dataset order.
+        random_crop_seed (int, optional): If set, and `config.center_crop` is False, each example is cropped at a
+            position derived deterministically from this seed and the example id (see `SDImageTransform`). This is
+            used when populating a VAE output cache with several crop variants per image.
+        memory_cache_size_mb (int, optional): If greater than 0, the VAE output cache is read through an in-memory tier
+            with this size budget (see `MemoryTensorCache`).
+        seed (int, optional): The shuffle seed. Must be the same on all processes. If None, 0 is used.
+        num_processes (int, optional): If greater than 1, the aspect ratio bucket batches are split between this many
+            processes, and the DataLoader only yields the batches of `process_index` (see
+            `build_aspect_ratio_bucket_batch_samplers(...)`).
+        process_index (int, optional): The index of this process, in the range [0, num_processes).
     Returns:
         DataLoader
     """
     if isinstance(config.dataset, HFHubImageCaptionDatasetConfig):
         base_dataset = build_hf_hub_image_caption_dataset(config.dataset)
     elif isinstance(config.dataset, ImageCaptionJsonlDatasetConfig):
-        base_dataset = build_image_caption_jsonl_dataset(config.dataset)
+        base_dataset = build_image_caption_jsonl_dataset(
+            config.dataset,
+            lazy_image_decode=config.jpeg_draft_decode,
+            decode_to_tensor=config.image_decode_backend == "torchvision",
+        )
     elif isinstance(config.dataset, ImageCaptionDirDatasetConfig):
-        base_dataset = build_image_caption_dir_dataset(config.dataset)
+        base_dataset = build_image_caption_dir_dataset(
+            config.dataset,
+            lazy_image_decode=config.jpeg_draft_decode,
+            decode_to_tensor=config.image_decode_backend == "torchvision",
+        )
     elif isinstance(config.dataset, ImageDirDatasetConfig):
         base_dataset = ImageDirDataset(
-            image_dir=config.dataset.dataset_dir, keep_in_memory=config.dataset.keep_in_memory
+            image_dir=config.dataset.dataset_dir,
+            keep_in_memory=config.dataset.keep_in_memory,
+            keep_in_memory_format=config.dataset.keep_in_memory_format,
+            keep_in_memory_max_mb=config.dataset.keep_in_memory_max_mb,
+            lazy_image_decode=config.jpeg_draft_decode,
+            decode_to_tensor=config.image_decode_backend == "torchvision",
         )
+    elif isinstance(config.dataset, CompiledDatasetConfig):
+        base_dataset = CompiledDataset(config.dataset.dataset_dir)
     else:
         raise ValueError(f"Unexpected dataset config type: '{type(config.dataset)}'.")
 
@@ -134,14 +165,14 @@ def build_textual_inversion_sd_dataloader(  # noqa: C901
         batch_sampler = None
     else:
         target_resolution = None
-        aspect_ratio_bucket_manager = build_aspect_ratio_bucket_manager(config=config.aspect_ratio_buckets)
-        # TODO(ryand): Drill-down the seed parameter rather than hard-coding to 0 here.
-        batch_sampler = AspectRatioBucketBatchSampler.from_image_sizes(
-            bucket_manager=aspect_ratio_bucket_manager,
-            image_sizes=base_dataset.get_image_dimensions(),
+        aspect_ratio_bucket_manager, (batch_sampler,) = build_aspect_ratio_bucket_batch_samplers(
+            config.aspect_ratio_buckets,
+            image_sizes=[base_dataset.get_image_dimensions()],
             batch_size=batch_size,
             shuffle=shuffle,
-            seed=0,
+            seed=seed,
+            num_processes=num_processes,
+            process_index=process_index,
         )
 
     if sum([config.caption_templates is not None, config.caption_preset is not None]) != 1:
@@ -192,28 +223,17 @@ def build_textual_inversion_sd_dataloader(  # noqa: C901
                 aspect_ratio_bucket_manager=aspect_ratio_bucket_manager,
                 center_crop=config.center_crop,
                 random_flip=config.random_flip,
+                random_crop_seed=random_crop_seed,
+                jpeg_draft=config.jpeg_draft_decode,
             )
         )
     else:
         # We drop the image to avoid having to either convert from PIL, or handle PIL batch collation.
         all_transforms.append(DropFieldTransform("image"))
         all_transforms.append(DropFieldTransform("mask"))
-
-        vae_cache = TensorDiskCache(vae_output_cache_dir)
-
-        cache_field_to_output_field = {
-            "vae_output": "vae_output",
-            "original_size_hw": "original_size_hw",
-            "crop_top_left_yx": "crop_top_left_yx",
-        }
-        if use_masks:
-            cache_field_to_output_field["mask"] = "mask"
-
         all_transforms.append(
-            LoadCacheTransform(
-                cache=vae_cache,
-                cache_key_field="id",
-                cache_field_to_output_field=cache_field_to_output_field,
+            build_vae_output_cache_transform(
+                vae_output_cache_dir, use_masks=use_masks, memory_cache_size_mb=memory_cache_size_mb
             )
         )
 
@@ -222,7 +242,7 @@ def build_textual_inversion_sd_dataloader(  # noqa: C901
     if batch_sampler is None:
         return DataLoader(
             dataset,
-            shuffle=shuffle,
+            sampler=SeededRandomSampler(dataset, seed=seed if seed is not None else 0) if shuffle else None,
             collate_fn=sd_image_caption_collate_fn,
             batch_size=batch_size,
             num_workers=config.dataloader_num_workers,
@@ -0,0 +1,100 @@
+import math
+import typing
+
+import torch.utils.data
+
+from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import get_bucket_batch_size
+from invoke_training._shared.data.utils.aspect_ratio_bucket_manager import AspectRatioBucketManager
+from invoke_training._shared.data.utils.resize import get_image_size
+from invoke_training._shared.data.utils.resolution import Resolution
+
+
+class AspectRatioBucketBatchDataset(torch.utils.data.IterableDataset):
+    """An IterableDataset that groups the examples of a base IterableDataset into batches that adhere to aspect ratio
+    buckets. This is the streaming counterpart of `AspectRatioBucketBatchSampler`, for datasets whose image dimensions
+    are not known up front.
+
+    Examples are held in a per-bucket buffer, and a batch is emitted as soon as its bucket is full. To bound memory
+    usage, when the total number of buffered examples reaches `max_buffered_examples`, the fullest bucket is flushed as
+    a partial batch. All remaining partial batches are flushed at the end of the stream.
+
+    Each item of this dataset is a list of examples, so it should be used with a DataLoader with `batch_size=None`, and
+    a `collate_fn` that accepts a list of examples.
+    """
+
+    def __init__(
+        self,
+        base_dataset: torch.utils.data.IterableDataset,
+        bucket_manager: AspectRatioBucketManager,
+        batch_size: int,
+        max_buffered_examples: int,
+        image_field_name: str = "image",
+        max_pixels_per_batch: int | None = None,
+    ):
+        """Initialize an AspectRatioBucketBatchDataset.
+
+        Args:
+            base_dataset (torch.utils.data.IterableDataset): The base dataset.
+            bucket_manager (AspectRatioBucketManager): The aspect ratio bucket manager.
+            batch_size (int): The batch size.
+            max_buffered_examples (int): The maximum number of examples held across all bucket buffers. Must be at
+                least the largest bucket batch size.
+            image_field_name (str, optional): The image field that is used to determine the bucket of an example if
+                it does not have an "original_size_hw" field (i.e. if `SDImageTransform` has not been applied yet).
+            max_pixels_per_batch (int | None, optional): If set, the batch size of each bucket is derived from this
+                pixel budget rather than `batch_size` (see `get_bucket_batch_size(...)`).
+        """
+        super().__init__()
+        self._bucket_batch_sizes = {
+            bucket: get_bucket_batch_size(bucket, batch_size, max_pixels_per_batch) for bucket in bucket_manager.buckets
+        }
+        max_bucket_batch_size = max(self._bucket_batch_sizes.values())
+        if max_buffered_examples < max_bucket_batch_size:
+            raise ValueError(
+                f"max_buffered_examples ({max_buffered_examples}) must be at least the largest bucket batch size "
+                f"({max_bucket_batch_size})."
+            )
+        self._base_dataset = base_dataset
+        self._bucket_manager = bucket_manager
+        self._max_bucket_batch_size = max_bucket_batch_size
+        self._max_buffered_examples = max_buffered_examples
+        self._image_field_name = image_field_name
+
+    def __len__(self) -> int:
+        """The approximate number of batches. This is a lower bound, since each partial batch adds a batch."""
+        return math.ceil(len(self._base_dataset) / self._max_bucket_batch_size)
+
+    def set_epoch(self, epoch: int) -> None:
+        """Forward the epoch to the base dataset, if it supports it. Called by accelerate at the start of an epoch."""
+        if hasattr(self._base_dataset, "set_epoch"):
+            self._base_dataset.set_epoch(epoch)
+
+    def _get_bucket(self, example: typing.Dict[str, typing.Any]) -> Resolution:
+        if "original_size_hw" in example:
+            image_size = Resolution(*example["original_size_hw"])
+        else:
+            image_size = get_image_size(example[self._image_field_name])
+        return self._bucket_manager.get_aspect_ratio_bucket(image_size)
+
+    def __iter__(self) -> typing.Iterator[list[typing.Dict[str, typing.Any]]]:
+        buckets: dict[Resolution, list[typing.Dict[str, typing.Any]]] = {}
+        num_buffered = 0
+        for example in self._base_dataset:
+            bucket_resolution = self._get_bucket(example)
+            bucket = buckets.setdefault(bucket_resolution, [])
+            bucket.append(example)
+            num_buffered += 1
+
+            if len(bucket) == self._bucket_batch_sizes[bucket_resolution]:
+                yield bucket.copy()
+                num_buffered -= len(bucket)
+                bucket.clear()
+            elif num_buffered >= self._max_buffered_examples:
+                fullest_bucket = max(buckets.values(), key=len)
+                yield fullest_bucket.copy()
+                num_buffered -= len(fullest_bucket)
+                fullest_bucket.clear()
+
+        for bucket in sorted(buckets.values(), key=len, reverse=True):
+            if len(bucket) > 0:
+                yield bucket
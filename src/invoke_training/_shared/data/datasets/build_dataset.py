@@ -2,6 +2,7 @@ from datasets import VerificationMode
 
 from invoke_training._shared.data.datasets.hf_image_caption_dataset import HFImageCaptionDataset
 from invoke_training._shared.data.datasets.hf_image_pair_preference_dataset import HFImagePairPreferenceDataset
+from invoke_training._shared.data.datasets.hf_streaming_image_caption_dataset import HFStreamingImageCaptionDataset
 from invoke_training._shared.data.datasets.image_caption_dir_dataset import ImageCaptionDirDataset
 from invoke_training._shared.data.datasets.image_caption_jsonl_dataset import ImageCaptionJsonlDataset
 from invoke_training.config.data.dataset_config import (
@@ -13,6 +14,8 @@ from invoke_training.pipelines._experimental.sd_dpo_lora.config import HFHubImag
 
 
 def build_hf_hub_image_caption_dataset(config: HFHubImageCaptionDatasetConfig) -> HFImageCaptionDataset:
+    if config.streaming:
+        raise ValueError(f"Streaming is not supported for this use of the '{config.dataset_name}' HF dataset.")
     return HFImageCaptionDataset.from_hub(
         dataset_name=config.dataset_name,
         hf_load_dataset_kwargs={
@@ -24,19 +27,57 @@ def build_hf_hub_image_caption_dataset(config: HFHubImageCaptionDatasetConfig) -
     )
 
 
-def build_image_caption_jsonl_dataset(config: ImageCaptionJsonlDatasetConfig) -> HFImageCaptionDataset:
+def build_hf_hub_streaming_image_caption_dataset(
+    config: HFHubImageCaptionDatasetConfig,
+    shuffle: bool = False,
+    load_images: bool = True,
+    rank: int = 0,
+    world_size: int = 1,
+    seed: int | None = None,
+) -> HFStreamingImageCaptionDataset:
+    return HFStreamingImageCaptionDataset.from_hub(
+        dataset_name=config.dataset_name,
+        hf_load_dataset_kwargs={
+            "name": config.dataset_config_name,
+            "cache_dir": config.hf_cache_dir,
+        },
+        image_column=config.image_column,
+        caption_column=config.caption_column,
+        shuffle=shuffle,
+        shuffle_buffer_size=config.shuffle_buffer_size,
+        num_examples=config.num_examples,
+        load_images=load_images,
+        rank=rank,
+        world_size=world_size,
+        seed=seed,
+    )
+
+
+def build_image_caption_jsonl_dataset(
+    config: ImageCaptionJsonlDatasetConfig, lazy_image_decode: bool = False, decode_to_tensor: bool = False
+) -> HFImageCaptionDataset:
     return ImageCaptionJsonlDataset(
         jsonl_path=config.jsonl_path,
         image_column=config.image_column,
         caption_column=config.caption_column,
         keep_in_memory=config.keep_in_memory,
+        keep_in_memory_format=config.keep_in_memory_format,
+        keep_in_memory_max_mb=config.keep_in_memory_max_mb,
+        lazy_image_decode=lazy_image_decode,
+        decode_to_tensor=decode_to_tensor,
     )
 
 
-def build_image_caption_dir_dataset(config: ImageCaptionDirDatasetConfig) -> ImageCaptionDirDataset:
+def build_image_caption_dir_dataset(
+    config: ImageCaptionDirDatasetConfig, lazy_image_decode: bool = False, decode_to_tensor: bool = False
+) -> ImageCaptionDirDataset:
     return ImageCaptionDirDataset(
         dataset_dir=config.dataset_dir,
         keep_in_memory=config.keep_in_memory,
+        keep_in_memory_format=config.keep_in_memory_format,
+        keep_in_memory_max_mb=config.keep_in_memory_max_mb,
+        lazy_image_decode=lazy_image_decode,
+        decode_to_tensor=decode_to_tensor,
     )
 
 
@@ -0,0 +1,147 @@
+import logging
+import os
+import typing
+
+import numpy as np
+import torch.utils.data
+from torch.utils.data import DataLoader
+from tqdm.auto import tqdm
+
+from invoke_training._shared.data.datasets.build_dataset import (
+    build_hf_hub_image_caption_dataset,
+    build_image_caption_dir_dataset,
+    build_image_caption_jsonl_dataset,
+)
+from invoke_training._shared.data.datasets.compiled_dataset import CompiledDatasetWriter
+from invoke_training._shared.data.datasets.image_dir_dataset import ImageDirDataset
+from invoke_training._shared.data.datasets.transform_dataset import TransformDataset
+from invoke_training._shared.data.utils.aspect_ratio_bucket_manager import AspectRatioBucketManager
+from invoke_training._shared.data.utils.resize import resize_to_cover
+from invoke_training._shared.data.utils.resolution import Resolution
+from invoke_training.config.data.data_loader_config import (
+    DreamboothSDDataLoaderConfig,
+    ImageCaptionSDDataLoaderConfig,
+)
+from invoke_training.config.data.dataset_config import (
+    HFHubImageCaptionDatasetConfig,
+    ImageCaptionDirDatasetConfig,
+    ImageCaptionJsonlDatasetConfig,
+    ImageDirDatasetConfig,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _CompileExampleTransform:
+    """Resize the image (and mask) of an example to cover its target resolution, and convert them to uint8 CxHxW
+    arrays. Images are not cropped, so that random crops can still be applied at training time.
+    """
+
+    def __init__(self, resolution: Resolution | None, aspect_ratio_bucket_manager: AspectRatioBucketManager | None):
+        self._resolution = resolution
+        self._aspect_ratio_bucket_manager = aspect_ratio_bucket_manager
+
+    def __call__(self, data: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
+        image = data["image"]
+        original_size = Resolution(image.height, image.width)
+        if self._resolution is not None:
+            resolution = self._resolution
+        else:
+            resolution = self._aspect_ratio_bucket_manager.get_aspect_ratio_bucket(original_size)
+
+        out = {
+            "image": np.asarray(resize_to_cover(image, resolution)).transpose(2, 0, 1),
+            "original_size_hw": original_size.to_tuple(),
+            "caption": data.get("caption", None),
+            "mask": None,
+        }
+        if "mask" in data:
+            out["mask"] = np.asarray(resize_to_cover(data["mask"], resolution))[np.newaxis, ...]
+        return out
+
+
+def _identity_collate_fn(example):
+    return example
+
+
+def _compile(
+    dataset: torch.utils.data.Dataset,
+    out_dir: str,
+    config: ImageCaptionSDDataLoaderConfig | DreamboothSDDataLoaderConfig,
+    shard_size_mb: int,
+):
+    if config.aspect_ratio_buckets is None:
+        resolution = Resolution.parse(config.resolution)
+        aspect_ratio_bucket_manager = None
+    else:
+        resolution = None
+        aspect_ratio_bucket_manager = AspectRatioBucketManager.from_constraints(
+            target_resolution=config.aspect_ratio_buckets.target_resolution,
+            start_dim=config.aspect_ratio_buckets.start_dim,
+            end_dim=config.aspect_ratio_buckets.end_dim,
+            divisible_by=config.aspect_ratio_buckets.divisible_by,
+        )
+
+    writer = CompiledDatasetWriter(out_dir, shard_size_bytes=shard_size_mb * 2**20)
+    # The images are decoded and resized in DataLoader worker processes, but are written in order from this process.
+    data_loader = DataLoader(
+        TransformDataset(dataset, [_CompileExampleTransform(resolution, aspect_ratio_bucket_manager)]),
+        batch_size=None,
+        shuffle=False,
+        collate_fn=_identity_collate_fn,
+        num_workers=config.dataloader_num_workers,
+    )
+    for example in tqdm(data_loader, desc=f"Compiling dataset to '{out_dir}'"):
+        writer.add(
+            image=example["image"],
+            original_size_hw=example["original_size_hw"],
+            caption=example["caption"],
+            mask=example["mask"],
+        )
+    writer.close(metadata={"data_loader_config": config.model_dump()})
+    logger.info(f"Compiled {len(dataset)} examples to '{out_dir}'.")
+
+
+def compile_dataset(
+    config: ImageCaptionSDDataLoaderConfig | DreamboothSDDataLoaderConfig, out_dir: str, shard_size_mb: int = 1024
+) -> list[str]:
+    """Compile the dataset(s) of a data loader config.
+
+    Every image is resized to cover its target resolution (the fixed `resolution`, or its aspect ratio bucket), and
+    written to uint8 shards along with its caption, mask and original size (see `CompiledDatasetWriter`). The compiled
+    dataset can then be used in place of the original dataset with a `COMPILED_DATASET` dataset config, and the same
+    resolution / aspect ratio bucket config. Cropping and flipping are still applied at training time.
+
+    Args:
+        config (ImageCaptionSDDataLoaderConfig | DreamboothSDDataLoaderConfig): The data loader config.
+        out_dir (str): The output directory. For a `DreamboothSDDataLoaderConfig`, the instance dataset is compiled to
+            `out_dir/instance` and the class dataset (if set) to `out_dir/class`.
+        shard_size_mb (int, optional): The approximate size of each shard file.
+
+    Returns:
+        list[str]: The compiled dataset directories.
+    """
+    if isinstance(config, ImageCaptionSDDataLoaderConfig):
+        if isinstance(config.dataset, HFHubImageCaptionDatasetConfig):
+            dataset = build_hf_hub_image_caption_dataset(config.dataset)
+        elif isinstance(config.dataset, ImageCaptionJsonlDatasetConfig):
+            dataset = build_image_caption_jsonl_dataset(config.dataset)
+        elif isinstance(config.dataset, ImageCaptionDirDatasetConfig):
+            dataset = build_image_caption_dir_dataset(config.dataset)
+        else:
+            raise ValueError(f"Unsupported dataset config type for compilation: '{type(config.dataset)}'.")
+        _compile(dataset, out_dir, config, shard_size_mb)
+        return [out_dir]
+    elif isinstance(config, DreamboothSDDataLoaderConfig):
+        out_dirs = []
+        for name, dataset_config in [("instance", config.instance_dataset), ("class", config.class_dataset)]:
+            if dataset_config is None:
+                continue
+            if not isinstance(dataset_config, ImageDirDatasetConfig):
+                raise ValueError(f"Unsupported {name} dataset config type for compilation: '{type(dataset_config)}'.")
+            dataset_out_dir = os.path.join(out_dir, name)
+            _compile(ImageDirDataset(dataset_config.dataset_dir), dataset_out_dir, config, shard_size_mb)
+            out_dirs.append(dataset_out_dir)
+        return out_dirs
+    else:
+        raise ValueError(f"Unsupported data loader config type for compilation: '{type(config)}'.")
@@ -0,0 +1,196 @@
+import json
+import os
+import typing
+
+import numpy as np
+import torch.utils.data
+
+from invoke_training._shared.data.utils.resolution import Resolution
+from invoke_training._shared.utils.jsonl import load_jsonl, save_jsonl
+
+COMPILED_DATASET_FORMAT_VERSION = 1
+MANIFEST_FILE_NAME = "manifest.json"
+EXAMPLES_FILE_NAME = "examples.jsonl"
+
+
+def _get_shard_file_name(shard_idx: int) -> str:
+    return f"shard_{shard_idx:05d}.bin"
+
+
+class CompiledDatasetWriter:
+    """Writes a compiled dataset: images that have already been resized for training, packed into uint8 shard files.
+
+    A compiled dataset directory contains:
+    - `shard_*.bin`: Raw uint8 CxHxW image (and mask) data, concatenated.
+    - `examples.jsonl`: One record per example, with the location and shape of its image (and mask) in the shards, its
+      caption, and the size of the original image.
+    - `manifest.json`: The format version, the list of shards, and any additional metadata. The manifest is written
+      last by `close()`, so a directory without a manifest is an incomplete compiled dataset.
+    """
+
+    def __init__(self, out_dir: str, shard_size_bytes: int = 2**30):
+        """Initialize a CompiledDatasetWriter.
+
+        Args:
+            out_dir (str): The output directory. Must be empty or not exist.
+            shard_size_bytes (int, optional): The size at which to start a new shard. Shards can exceed this size by up
+                to the size of one example.
+        """
+        if os.path.exists(out_dir) and len(os.listdir(out_dir)) > 0:
+            raise ValueError(f"The compiled dataset output directory '{out_dir}' is not empty.")
+        os.makedirs(out_dir, exist_ok=True)
+
+        self._out_dir = out_dir
+        self._shard_size_bytes = shard_size_bytes
+        self._shard_file_names: list[str] = []
+        self._shard_file: typing.BinaryIO | None = None
+        self._shard_offset = 0
+        self._examples: list[dict[str, typing.Any]] = []
+
+    def _write_array(self, array: np.ndarray) -> dict[str, typing.Any]:
+        """Append `array` to the current shard, and return a record of its location."""
+        if self._shard_file is None or self._shard_offset >= self._shard_size_bytes:
+            if self._shard_file is not None:
+                self._shard_file.close()
+            self._shard_file_names.append(_get_shard_file_name(len(self._shard_file_names)))
+            self._shard_file = open(os.path.join(self._out_dir, self._shard_file_names[-1]), "wb")
+            self._shard_offset = 0
+
+        array = np.ascontiguousarray(array, dtype=np.uint8)
+        record = {"shard": len(self._shard_file_names) - 1, "offset": self._shard_offset, "shape": list(array.shape)}
+        self._shard_file.write(array.tobytes())
+        self._shard_offset += array.nbytes
+        return record
+
+    def add(
+        self,
+        image: np.ndarray,
+        original_size_hw: tuple[int, int],
+        caption: str | None = None,
+        mask: np.ndarray | None = None,
+    ):
+        """Add an example.
+
+        Args:
+            image (np.ndarray): The resized uint8 CxHxW image.
+            original_size_hw (tuple[int, int]): The size of the original image, before it was resized.
+            caption (str | None, optional): The caption, if the dataset has captions.
+            mask (np.ndarray | None, optional): The resized uint8 1xHxW mask, if the example has a mask.
+        """
+        example = {
+            "image": self._write_array(image),
+            "original_size_hw": list(original_size_hw),
+            "caption": caption,
+            "mask": self._write_array(mask) if mask is not None else None,
+        }
+        self._examples.append(example)
+
+    def close(self, metadata: dict[str, typing.Any] | None = None):
+        """Finish writing the compiled dataset.
+
+        Args:
+            metadata (dict[str, typing.Any] | None, optional): Additional JSON-serializable metadata to store in the
+                manifest (e.g. the config that the dataset was compiled from).
+        """
+        if self._shard_file is not None:
+            self._shard_file.close()
+            self._shard_file = None
+
+        save_jsonl(self._examples, os.path.join(self._out_dir, EXAMPLES_FILE_NAME))
+        manifest = {
+            "format_version": COMPILED_DATASET_FORMAT_VERSION,
+            "num_examples": len(self._examples),
+            "shards": self._shard_file_names,
+            "metadata": metadata or {},
+        }
+        with open(os.path.join(self._out_dir, MANIFEST_FILE_NAME), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+
+class CompiledDataset(torch.utils.data.Dataset):
+    """A dataset that loads pre-resized images from a compiled dataset (see `CompiledDatasetWriter`).
+
+    Images (and masks) are read from memory-mapped shard files and returned as uint8 CxHxW tensors, so no image decoding
+    or resizing is needed at training time. The "original_size_hw" of each example is also returned, so that
+    `SDImageTransform` can still apply random crops and flips, and report crop coordinates relative to the original
+    image.
+    """
+
+    def __init__(self, dataset_dir: str, id_prefix: str = ""):
+        """Initialize a CompiledDataset.
+
+        Args:
+            dataset_dir (str): The compiled dataset directory.
+            id_prefix (str): A prefix added to the 'id' field in every example.
+        """
+        super().__init__()
+        self._dataset_dir = dataset_dir
+        self._id_prefix = id_prefix
+
+        manifest_path = os.path.join(dataset_dir, MANIFEST_FILE_NAME)
+        if not os.path.exists(manifest_path):
+            raise ValueError(
+                f"'{dataset_dir}' is not a compiled dataset, or the compilation did not complete ('{manifest_path}' "
+                "does not exist)."
+            )
+        with open(manifest_path) as f:
+            self._manifest = json.load(f)
+        if self._manifest["format_version"] != COMPILED_DATASET_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported compiled dataset format version: {self._manifest['format_version']}. Re-compile the "
+                "dataset."
+            )
+
+        self._examples = load_jsonl(os.path.join(dataset_dir, EXAMPLES_FILE_NAME))
+        assert len(self._examples) == self._manifest["num_examples"]
+
+        # The shards are memory-mapped lazily, so that each DataLoader worker process opens its own memory maps.
+        self._shards: dict[int, np.memmap] = {}
+
+    @property
+    def metadata(self) -> dict[str, typing.Any]:
+        """The metadata that was stored in the manifest when the dataset was compiled."""
+        return self._manifest["metadata"]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def _load_array(self, record: dict[str, typing.Any]) -> torch.Tensor:
+        shard_idx = record["shard"]
+        shard = self._shards.get(shard_idx)
+        if shard is None:
+            shard_path = os.path.join(self._dataset_dir, self._manifest["shards"][shard_idx])
+            shard = np.memmap(shard_path, dtype=np.uint8, mode="r")
+            self._shards[shard_idx] = shard
+
+        shape = record["shape"]
+        offset = record["offset"]
+        # Copy the data out of the memory map, so that the returned tensor is writable and owns its memory.
+        array = np.array(shard[offset : offset + int(np.prod(shape))]).reshape(shape)
+        return torch.from_numpy(array)
+
+    def load_example_without_images(self, idx: int) -> typing.Dict[str, typing.Any]:
+        """Load the example at `idx` without loading its image."""
+        example = {"id": f"{self._id_prefix}{idx}"}
+        caption = self._examples[idx]["caption"]
+        if caption is not None:
+            example["caption"] = caption
+        return example
+
+    def get_image_dimensions(self) -> list[Resolution]:
+        """Get the dimensions of the original images. No shard data is read."""
+        return [Resolution(*example["original_size_hw"]) for example in self._examples]
+
+    def __len__(self) -> int:
+        return len(self._examples)
+
+    def __getitem__(self, idx: int) -> typing.Dict[str, typing.Any]:
+        record = self._examples[idx]
+        example = self.load_example_without_images(idx)
+        example["image"] = self._load_array(record["image"])
+        example["original_size_hw"] = tuple(record["original_size_hw"])
+        if record["mask"] is not None:
+            example["mask"] = self._load_array(record["mask"])
+        return example
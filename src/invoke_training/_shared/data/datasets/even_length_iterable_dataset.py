@@ -0,0 +1,68 @@
+import typing
+
+import torch.utils.data
+from torch.utils.data import get_worker_info
+
+
+class EvenLengthIterableDataset(torch.utils.data.IterableDataset):
+    """An IterableDataset that wraps a base IterableDataset whose examples have already been split between processes
+    (e.g. a `TarShardImageCaptionDataset` with `rank` and `world_size` set), and yields exactly `length` items per
+    epoch.
+
+    The processes' shares of a streaming dataset are rarely exactly the same size, but every process must run the same
+    number of training steps. Otherwise, the processes with more steps hang in the gradient synchronization of a step
+    that the other processes never run. The base stream is truncated if it is longer than `length`, and restarted from
+    the beginning (i.e. items are repeated) if it is shorter.
+
+    The items are split evenly between DataLoader workers, so the number of batches is also the same on every process.
+    """
+
+    def __init__(self, base_dataset: torch.utils.data.IterableDataset, length: int):
+        """Initialize an EvenLengthIterableDataset.
+
+        Args:
+            base_dataset (torch.utils.data.IterableDataset): This process's share of the dataset.
+            length (int): The number of items to yield per epoch. Must be the same on all processes.
+        """
+        super().__init__()
+        self._base_dataset = base_dataset
+        self._length = length
+
+    @property
+    def is_sharded(self) -> bool:
+        """The dataset only yields this process's share of the examples, so it must not be sharded again (e.g. by
+        accelerate). See `prepare_data_loader(...)`.
+        """
+        return True
+
+    def __len__(self) -> int:
+        return self._length
+
+    def set_epoch(self, epoch: int) -> None:
+        """Forward the epoch to the base dataset, if it supports it. Called by accelerate at the start of an epoch."""
+        if hasattr(self._base_dataset, "set_epoch"):
+            self._base_dataset.set_epoch(epoch)
+
+    def __iter__(self) -> typing.Iterator[typing.Any]:
+        worker_info = get_worker_info()
+        num_items = self._length
+        if worker_info is not None:
+            num_items = self._length // worker_info.num_workers + int(
+                worker_info.id < self._length % worker_info.num_workers
+            )
+
+        num_yielded = 0
+        while num_yielded < num_items:
+            num_yielded_in_pass = 0
+            for item in self._base_dataset:
+                yield item
+                num_yielded += 1
+                num_yielded_in_pass += 1
+                if num_yielded >= num_items:
+                    break
+            if num_yielded_in_pass == 0:
+                raise RuntimeError(
+                    "The base dataset yielded no items for this process (or DataLoader worker). When training with "
+                    "multiple processes, every DataLoader worker of every process must have some data (e.g. there must "
+                    "be at least as many tar shards as processes x DataLoader workers)."
+                )
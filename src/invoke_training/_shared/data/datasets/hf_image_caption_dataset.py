@@ -1,12 +1,32 @@
+import io
 import os
 import typing
 
 import datasets
+import PIL.Image
 import torch.utils.data
 from PIL.Image import Image
 
 from invoke_training._shared.data.utils.resolution import Resolution
 
+# Datasets with fewer examples than this are probed for image dimensions in a single process, because the overhead of
+# starting worker processes would outweigh the benefit.
+_MIN_EXAMPLES_FOR_PARALLEL_PROBE = 10000
+
+
+def _probe_image_dimensions(examples: dict[str, list], image_column: str) -> dict[str, list[int]]:
+    """A batched `datasets.Dataset.map(...)` function that reads the dimensions of undecoded images (i.e. images from a
+    column cast to `datasets.Image(decode=False)`). Only the image headers are parsed.
+    """
+    heights: list[int] = []
+    widths: list[int] = []
+    for image in examples[image_column]:
+        image_file = io.BytesIO(image["bytes"]) if image["bytes"] is not None else image["path"]
+        with PIL.Image.open(image_file) as pil_image:
+            heights.append(pil_image.height)
+            widths.append(pil_image.width)
+    return {"height": heights, "width": widths}
+
 
 class HFImageCaptionDataset(torch.utils.data.Dataset):
     """An image-caption dataset wrapper for Hugging Face datasets.
@@ -28,6 +48,10 @@ class HFImageCaptionDataset(torch.utils.data.Dataset):
             )
 
         self._image_column = image_column
+        self._raw_dataset = hf_dataset["train"]
+        # A view of the dataset with only the caption column, so that captions can be accessed without decoding images.
+        self._caption_dataset = hf_dataset["train"].remove_columns([c for c in column_names if c != caption_column])
+        self._caption_column = caption_column
 
         def preprocess(examples):
             images = [image.convert("RGB") for image in examples[image_column]]
@@ -84,12 +108,41 @@ class HFImageCaptionDataset(torch.utils.data.Dataset):
 
         return cls(hf_dataset=hf_dataset, image_column=image_column, caption_column=caption_column)
 
-    def get_image_dimensions(self) -> list[Resolution]:
+    def load_example_without_images(self, idx: int) -> typing.Dict[str, typing.Any]:
+        """Load the example at `idx` without decoding its image. This is much faster than `__getitem__` for use cases
+        that only need the caption (e.g. caching text encoder outputs).
+        """
+        return {"id": idx, "caption": self._caption_dataset[idx][self._caption_column]}
+
+    def get_image_dimensions(self, num_proc: int | None = None) -> list[Resolution]:
         """Get the dimensions of all images in the dataset.
 
-        TODO(ryand): Re-think this approach. For large datasets (e.g. streaming from S3) it doesn't make sense to
-        calculate this dynamically every time.
+        The dimensions are parsed from the headers of the encoded images, without decoding them. The result is computed
+        with `datasets.Dataset.map(...)`, so it is stored as a cached Arrow dataset alongside the source dataset, and is
+        read directly from that cache on subsequent runs.
+
+        Args:
+            num_proc (int | None, optional): The number of processes to use to probe the images. If None, multiple
+                processes are only used for large datasets.
         """
+        if isinstance(self._raw_dataset.features[self._image_column], datasets.Image):
+            if num_proc is None and len(self._raw_dataset) >= _MIN_EXAMPLES_FOR_PARALLEL_PROBE:
+                num_proc = min(8, os.cpu_count() or 1)
+            dims_dataset = (
+                self._raw_dataset.remove_columns([c for c in self._raw_dataset.column_names if c != self._image_column])
+                .cast_column(self._image_column, datasets.Image(decode=False))
+                .map(
+                    _probe_image_dimensions,
+                    batched=True,
+                    fn_kwargs={"image_column": self._image_column},
+                    remove_columns=[self._image_column],
+                    num_proc=num_proc,
+                    desc="Probing image dimensions",
+                )
+            )
+            return [Resolution(height, width) for height, width in zip(dims_dataset["height"], dims_dataset["width"])]
+
+        # Fall back to decoding the images if the image column is not a `datasets.Image` feature.
         image_dims: list[Resolution] = []
         for i in range(len(self._hf_dataset)):
             example = self._hf_dataset[i]
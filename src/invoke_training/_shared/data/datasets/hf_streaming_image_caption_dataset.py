@@ -0,0 +1,148 @@
+import math
+import typing
+
+import datasets
+import torch.utils.data
+from datasets.distributed import split_dataset_by_node
+from torch.utils.data import get_worker_info
+
+from invoke_training._shared.data.utils.epoch_seed import get_epoch_seed
+
+
+class HFStreamingImageCaptionDataset(torch.utils.data.IterableDataset):
+    """An image-caption dataset wrapper for streaming Hugging Face datasets.
+
+    Unlike `HFImageCaptionDataset`, the dataset is not downloaded and prepared before training starts. Examples are
+    streamed from the dataset files as they are consumed. The dataset's shards are split between ranks (if
+    `world_size > 1`) and DataLoader workers by the `datasets` library, so there should be at least as many shards as
+    ranks x workers. Otherwise, every rank reads the whole stream and keeps 1 out of every `world_size` examples.
+
+    Since the examples of a streaming dataset have no stable index, the "id" of each example is only unique within one
+    pass over the dataset. It must not be used as a cache key.
+    """
+
+    def __init__(
+        self,
+        hf_dataset: datasets.IterableDataset,
+        image_column: str = "image",
+        caption_column: str = "text",
+        shuffle: bool = False,
+        shuffle_buffer_size: int = 1000,
+        num_examples: int | None = None,
+        load_images: bool = True,
+        rank: int = 0,
+        world_size: int = 1,
+        seed: int | None = None,
+    ):
+        """Initialize a HFStreamingImageCaptionDataset.
+
+        Args:
+            hf_dataset (datasets.IterableDataset): The streaming HF dataset split.
+            image_column (str, optional): The name of the image column in the dataset. Defaults to "image".
+            caption_column (str, optional): The name of the caption column in the dataset. Defaults to "text".
+            shuffle (bool, optional): If True, the shard order is shuffled on every epoch, and examples are shuffled
+                through a shuffle buffer.
+            shuffle_buffer_size (int, optional): The number of examples held in the shuffle buffer.
+            num_examples (int | None, optional): The number of examples in the dataset. If None, it is read from the
+                dataset info.
+            load_images (bool, optional): If False, the image column is not decoded, and examples only contain the "id"
+                and "caption" fields.
+            rank (int, optional): The rank of this process. Only the examples that belong to this rank are yielded.
+            world_size (int, optional): The number of ranks that the dataset is split between.
+            seed (int | None, optional): The shuffle seed. If set, the shuffle order is derived from the seed and the
+                epoch (see `set_epoch()`). Otherwise, a new seed is drawn on every epoch (see `get_epoch_seed()`). The
+                stream is shuffled before it is split between ranks, so the seed must be set, and be the same on all
+                ranks, if `world_size > 1`.
+        """
+        super().__init__()
+        if not 0 <= rank < world_size:
+            raise ValueError(f"rank must be in the range [0, {world_size}), but got {rank}.")
+        if shuffle and world_size > 1 and seed is None:
+            raise ValueError("A shuffle seed is required to shuffle a streaming dataset that is split between ranks.")
+        column_names = hf_dataset.column_names
+        # The column names of a streaming dataset are not always known without reading from it.
+        if column_names is not None:
+            for column_type, column in [("image_column", image_column), ("caption_column", caption_column)]:
+                if column not in column_names:
+                    raise ValueError(
+                        f"The {column_type}='{column}' is not in the set of dataset column names: '{column_names}'."
+                    )
+
+        if num_examples is None:
+            splits = hf_dataset.info.splits
+            split_name = str(hf_dataset.split) if hf_dataset.split is not None else "train"
+            if splits is None or split_name not in splits or splits[split_name].num_examples is None:
+                raise ValueError(
+                    "The number of examples in the streaming dataset is not known from the dataset info. Set "
+                    "`num_examples` in the dataset config."
+                )
+            num_examples = splits[split_name].num_examples
+
+        self._hf_dataset = hf_dataset
+        self._image_column = image_column
+        self._caption_column = caption_column
+        self._shuffle = shuffle
+        self._shuffle_buffer_size = shuffle_buffer_size
+        self._num_examples = num_examples
+        self._load_images = load_images
+        self._rank = rank
+        self._world_size = world_size
+        self._seed = seed
+        self._epoch = 0
+
+    @classmethod
+    def from_hub(
+        cls,
+        dataset_name: str,
+        hf_load_dataset_kwargs: typing.Optional[dict[str, typing.Any]] = None,
+        image_column: str = "image",
+        caption_column: str = "text",
+        **kwargs,
+    ):
+        """Initialize a HFStreamingImageCaptionDataset from the 'train' split of a Hugging Face Hub dataset.
+
+        Args:
+            dataset_name (str): The HF Hub dataset name (a.k.a. path).
+            hf_load_dataset_kwargs (dict[str, typing.Any], optional): kwargs to forward to `datasets.load_dataset(...)`.
+            image_column (str, optional): The name of the image column in the dataset. Defaults to "image".
+            caption_column (str, optional): The name of the caption column in the dataset. Defaults to "text".
+            **kwargs: Forwarded to `HFStreamingImageCaptionDataset.__init__(...)`.
+        """
+        hf_load_dataset_kwargs = hf_load_dataset_kwargs or {}
+        hf_dataset = datasets.load_dataset(dataset_name, split="train", streaming=True, **hf_load_dataset_kwargs)
+        return cls(hf_dataset=hf_dataset, image_column=image_column, caption_column=caption_column, **kwargs)
+
+    def __len__(self) -> int:
+        """The number of examples per rank: the total number of examples divided evenly between the ranks (rounded up).
+        The ranks' shares of the stream rarely hold exactly this many examples (see `EvenLengthIterableDataset`).
+        """
+        return math.ceil(self._num_examples / self._world_size)
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set the epoch that the shuffle order is derived from, if `seed` is set. Called by accelerate at the start of
+        every epoch.
+        """
+        self._epoch = epoch
+
+    def __iter__(self) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+        hf_dataset = self._hf_dataset
+        if not self._load_images:
+            hf_dataset = hf_dataset.remove_columns(self._image_column)
+        if self._shuffle:
+            # All ranks and workers must use the same seed, so that they split the shuffled shards between them
+            # consistently.
+            seed = self._seed if self._seed is not None else get_epoch_seed() % 2**32
+            hf_dataset = hf_dataset.shuffle(seed=seed, buffer_size=self._shuffle_buffer_size)
+        if self._world_size > 1:
+            hf_dataset = split_dataset_by_node(hf_dataset, rank=self._rank, world_size=self._world_size)
+        if self._seed is not None:
+            # The effective shuffle seed is `seed + epoch`.
+            hf_dataset.set_epoch(self._epoch)
+
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        for idx, example in enumerate(hf_dataset):
+            out = {"id": f"{self._rank}_{worker_id}_{idx}", "caption": example[self._caption_column]}
+            if self._load_images:
+                out["image"] = example[self._image_column].convert("RGB")
+            yield out
@@ -4,7 +4,14 @@ import typing
 import torch.utils.data
 from PIL import Image
 
+from invoke_training._shared.data.utils.cache_fingerprint import fingerprint_files
+from invoke_training._shared.data.utils.decode_image import decode_image_to_tensor
+from invoke_training._shared.data.utils.image_dimension_index import (
+    IMAGE_DIMENSION_INDEX_FILE_NAME,
+    get_image_dimensions,
+)
 from invoke_training._shared.data.utils.resolution import Resolution
+from invoke_training._shared.data.utils.shared_memory_image_store import ImageStoreFormat, SharedMemoryImageStore
 
 
 class ImageCaptionDirDataset(torch.utils.data.Dataset):
@@ -17,6 +24,10 @@ class ImageCaptionDirDataset(torch.utils.data.Dataset):
         image_extensions: typing.Optional[list[str]] = None,
         caption_extension: str = ".txt",
         keep_in_memory: bool = False,
+        keep_in_memory_format: ImageStoreFormat = "decoded",
+        keep_in_memory_max_mb: int | None = None,
+        lazy_image_decode: bool = False,
+        decode_to_tensor: bool = False,
     ):
         """Initialize an ImageDirDataset
 
@@ -25,10 +36,23 @@ class ImageCaptionDirDataset(torch.utils.data.Dataset):
             id_prefix (str): A prefix added to the 'id' field in every example.
             image_extensions (list[str], optional): The list of image file extensions to include in the dataset (not
                 case-sensitive). Defaults to [".jpg", ".jpeg", ".png"].
-            keep_in_memory (bool, optional): If True, keep all images loaded in memory. This improves performance for
-                datasets that are small enough to be kept in memory.
+            keep_in_memory (bool, optional): If True, keep all images loaded in memory (see `SharedMemoryImageStore`).
+                This improves performance for datasets that are small enough to be kept in memory.
+            keep_in_memory_format (ImageStoreFormat, optional): The format that images are kept in memory in.
+            keep_in_memory_max_mb (int | None, optional): The maximum size of the in-memory image store. Images that
+                do not fit are loaded from disk on every access.
+            lazy_image_decode (bool, optional): If True, images are opened but not decoded, and are returned in their
+                original mode. Decoding (and conversion to RGB) is left to the image transform, which can then decode
+                JPEGs at a reduced resolution (see `SDImageTransform`). Ignored for images that are kept in memory in
+                the "decoded" format.
+            decode_to_tensor (bool, optional): If True, images are decoded directly to uint8 CxHxW RGB tensors with
+                `torchvision.io`, bypassing PIL. `SDImageTransform` accepts tensor images. Takes precedence over
+                `lazy_image_decode`.
         """
         super().__init__()
+        self._dataset_dir = dataset_dir
+        self._decode_to_tensor = decode_to_tensor
+        self._lazy_image_decode = lazy_image_decode and not decode_to_tensor
         self._id_prefix = id_prefix
         if image_extensions is None:
             image_extensions = [".jpg", ".jpeg", ".png"]
@@ -55,34 +79,57 @@ class ImageCaptionDirDataset(torch.utils.data.Dataset):
         if len(missing_captions) > 0:
             raise Exception(f"The following expected caption files are missing: {missing_captions}")
 
-        self._images = None
+        self._image_store = None
         if keep_in_memory:
-            self._images = []
-            for image_path in self._image_paths:
-                self._images.append(self._load_image(image_path))
+            self._image_store = SharedMemoryImageStore(
+                self._image_paths,
+                store_format=keep_in_memory_format,
+                max_bytes=keep_in_memory_max_mb * 2**20 if keep_in_memory_max_mb is not None else None,
+            )
 
-    def _load_image(self, image_path: str) -> Image.Image:
+    def _load_image(self, image_path: str) -> Image.Image | torch.Tensor:
+        if self._decode_to_tensor:
+            return decode_image_to_tensor(image_path)
+        if self._lazy_image_decode:
+            return Image.open(image_path)
         # We call `convert("RGB")` to drop the alpha channel from RGBA images, or to repeat channels for greyscale
         # images.
         return Image.open(image_path).convert("RGB")
 
+    def _get_image(self, idx: int) -> Image.Image | torch.Tensor:
+        if self._image_store is not None:
+            image = self._image_store.load(
+                idx, decode_to_tensor=self._decode_to_tensor, lazy_image_decode=self._lazy_image_decode
+            )
+            if image is not None:
+                return image
+        return self._load_image(self._image_paths[idx])
+
+    def load_example_without_images(self, idx: int) -> typing.Dict[str, typing.Any]:
+        """Load the example at `idx` without loading its image. This is much faster than `__getitem__` for use cases
+        that only need the caption (e.g. caching text encoder outputs).
+        """
+        return {"id": f"{self._id_prefix}{idx}", "caption": self._captions[idx]}
+
+    def get_image_source_fingerprint(self, idx: int) -> str:
+        """Get a fingerprint of the source image file of the example at `idx`, without reading the image. It changes if
+        the file is modified (e.g. it is used to check whether cached VAE outputs are still valid).
+        """
+        return fingerprint_files([self._image_paths[idx]])
+
     def get_image_dimensions(self) -> list[Resolution]:
         """Get the dimensions of all images in the dataset.
 
-        TODO(ryand): Re-think this approach. For large datasets (e.g. streaming from S3) it doesn't make sense to
-        calculate this dynamically every time.
+        The dimensions are stored in an `ImageDimensionIndex` in the dataset directory, so that only new or modified
+        images have to be read on subsequent runs.
         """
-        image_dims: list[Resolution] = []
-        for i in range(len(self._image_paths)):
-            image_path = self._image_paths[i]
-            image = Image.open(image_path)
-            image_dims.append(Resolution(image.height, image.width))
-
-        return image_dims
+        return get_image_dimensions(
+            self._image_paths, index_path=os.path.join(self._dataset_dir, IMAGE_DIMENSION_INDEX_FILE_NAME)
+        )
 
     def __len__(self) -> int:
         return len(self._image_paths)
 
     def __getitem__(self, idx: int) -> typing.Dict[str, typing.Any]:
-        image = self._images[idx] if self._images is not None else self._load_image(self._image_paths[idx])
+        image = self._get_image(idx)
         return {"id": f"{self._id_prefix}{idx}", "image": image, "caption": self._captions[idx]}
@@ -5,18 +5,31 @@ import torch.utils.data
 from PIL import Image
 from pydantic import BaseModel
 
+from invoke_training._shared.data.utils.cache_fingerprint import fingerprint_files
+from invoke_training._shared.data.utils.decode_image import decode_image_to_tensor
+from invoke_training._shared.data.utils.image_dimension_index import (
+    IMAGE_DIMENSION_INDEX_FILE_NAME,
+    get_image_dimensions,
+)
 from invoke_training._shared.data.utils.resolution import Resolution
-from invoke_training._shared.utils.jsonl import load_jsonl, save_jsonl
+from invoke_training._shared.data.utils.shared_memory_image_store import ImageStoreFormat, SharedMemoryImageStore
+from invoke_training._shared.utils.jsonl import IndexedJsonlReader, save_jsonl
 
 IMAGE_COLUMN_DEFAULT = "image"
 CAPTION_COLUMN_DEFAULT = "text"
 MASK_COLUMN_DEFAULT = "mask"
+WIDTH_COLUMN_DEFAULT = "width"
+HEIGHT_COLUMN_DEFAULT = "height"
 
 
 class ImageCaptionExample(BaseModel):
     image_path: str
     mask_path: str | None = None
     caption: str
+    # The image dimensions are optional. If they are provided for every example, the image files do not have to be
+    # opened to determine the aspect ratio buckets.
+    width: int | None = None
+    height: int | None = None
 
 
 class ImageCaptionJsonlDataset(torch.utils.data.Dataset):
@@ -28,44 +41,93 @@ class ImageCaptionJsonlDataset(torch.utils.data.Dataset):
         image_column: str = IMAGE_COLUMN_DEFAULT,
         caption_column: str = CAPTION_COLUMN_DEFAULT,
         keep_in_memory: bool = False,
+        keep_in_memory_format: ImageStoreFormat = "decoded",
+        keep_in_memory_max_mb: int | None = None,
+        lazy_image_decode: bool = False,
+        decode_to_tensor: bool = False,
     ):
         super().__init__()
         self._jsonl_path = Path(jsonl_path)
         self._image_column = image_column
         self._caption_column = caption_column
 
-        data = load_jsonl(jsonl_path)
-        examples: list[ImageCaptionExample] = []
-        for d in data:
-            # Clear error messages here are helpful in the Gradio UI.
-            if image_column not in d:
-                raise ValueError(f"Column '{image_column}' not found in jsonl file '{jsonl_path}'.")
-            if caption_column not in d:
-                raise ValueError(f"Column '{caption_column}' not found in jsonl file '{jsonl_path}'.")
-            examples.append(
-                ImageCaptionExample(
-                    image_path=d[image_column], mask_path=d.get(MASK_COLUMN_DEFAULT, None), caption=d[caption_column]
-                )
+        # Rows are parsed lazily, so that large jsonl files do not have to be fully parsed on initialization (and
+        # copied into every DataLoader worker).
+        self._reader = IndexedJsonlReader(jsonl_path)
+        # The fully-materialized list of examples. This is only built if the `examples` property is accessed (e.g. to
+        # edit the dataset).
+        self._examples: list[ImageCaptionExample] | None = None
+        if len(self._reader) > 0:
+            # Validate the first row, so that a misconfigured column is reported immediately.
+            self._get_example(0)
+
+        # If True, images are opened but not decoded (see `ImageCaptionDirDataset`).
+        self._lazy_image_decode = lazy_image_decode and not decode_to_tensor
+        # If True, images and masks are decoded directly to uint8 tensors (see `ImageCaptionDirDataset`).
+        self._decode_to_tensor = decode_to_tensor
+
+        # If `keep_in_memory` is True, images and masks are kept in shared-memory stores (see `ImageCaptionDirDataset`).
+        self._image_store = None
+        self._mask_store = None
+        if keep_in_memory:
+            max_bytes = keep_in_memory_max_mb * 2**20 if keep_in_memory_max_mb is not None else None
+            self._image_store = SharedMemoryImageStore(
+                [str(self._get_image_path(i)) for i in range(len(self))],
+                store_format=keep_in_memory_format,
+                max_bytes=max_bytes,
+            )
+            self._mask_store = SharedMemoryImageStore(
+                [str(self._get_mask_path(i)) if self._get_example(i).mask_path else None for i in range(len(self))],
+                mode="L",
+                store_format=keep_in_memory_format,
+                # The mask store gets whatever budget is left over by the image store.
+                max_bytes=max(max_bytes - self._image_store.num_bytes, 0) if max_bytes is not None else None,
             )
-        self.examples = examples
 
-        self._keep_in_memory = keep_in_memory
-        self._example_cache: dict[int, dict[str, typing.Any]] = {}
+    @property
+    def examples(self) -> list[ImageCaptionExample]:
+        """The list of all examples. Accessing this parses every row of the jsonl file. Modifications to the list are
+        written to the jsonl file by `save_jsonl()`.
+        """
+        if self._examples is None:
+            self._examples = [self._parse_row(self._reader[i]) for i in range(len(self._reader))]
+        return self._examples
+
+    def _parse_row(self, d: dict[str, typing.Any]) -> ImageCaptionExample:
+        # Clear error messages here are helpful in the Gradio UI.
+        if self._image_column not in d:
+            raise ValueError(f"Column '{self._image_column}' not found in jsonl file '{self._jsonl_path}'.")
+        if self._caption_column not in d:
+            raise ValueError(f"Column '{self._caption_column}' not found in jsonl file '{self._jsonl_path}'.")
+        return ImageCaptionExample(
+            image_path=d[self._image_column],
+            mask_path=d.get(MASK_COLUMN_DEFAULT, None),
+            caption=d[self._caption_column],
+            width=d.get(WIDTH_COLUMN_DEFAULT, None),
+            height=d.get(HEIGHT_COLUMN_DEFAULT, None),
+        )
+
+    def _get_example(self, idx: int) -> ImageCaptionExample:
+        if self._examples is not None:
+            return self._examples[idx]
+        return self._parse_row(self._reader[idx])
 
     def save_jsonl(self):
         data = []
         for example in self.examples:
-            data.append(
-                {
-                    self._image_column: example.image_path,
-                    self._caption_column: example.caption,
-                    MASK_COLUMN_DEFAULT: example.mask_path,
-                }
-            )
+            d = {
+                self._image_column: example.image_path,
+                self._caption_column: example.caption,
+                MASK_COLUMN_DEFAULT: example.mask_path,
+            }
+            if example.width is not None and example.height is not None:
+                d[WIDTH_COLUMN_DEFAULT] = example.width
+                d[HEIGHT_COLUMN_DEFAULT] = example.height
+            data.append(d)
         save_jsonl(data, self._jsonl_path)
 
     def _get_image_path(self, idx: int) -> str:
-        image_path = self.examples[idx].image_path
+        image_path = self._get_example(idx).image_path
         image_path = Path(image_path)
 
         # image_path could be either absolute, or relative to the jsonl file.
@@ -75,7 +137,7 @@ class ImageCaptionJsonlDataset(torch.utils.data.Dataset):
         return image_path
 
     def _get_mask_path(self, idx: int) -> str:
-        mask_path = self.examples[idx].mask_path
+        mask_path = self._get_example(idx).mask_path
         mask_path = Path(mask_path)
 
         # mask_path could be either absolute, or relative to the jsonl file.
@@ -84,45 +146,89 @@ class ImageCaptionJsonlDataset(torch.utils.data.Dataset):
 
         return mask_path
 
-    def _load_image(self, image_path: str) -> Image.Image:
+    def _load_image(self, image_path: str) -> Image.Image | torch.Tensor:
+        if self._decode_to_tensor:
+            return decode_image_to_tensor(image_path)
+        if self._lazy_image_decode:
+            return Image.open(image_path)
         # We call `convert("RGB")` to drop the alpha channel from RGBA images, or to repeat channels for greyscale
         # images.
         return Image.open(image_path).convert("RGB")
 
-    def _load_mask(self, mask_path: str) -> Image.Image:
+    def _load_mask(self, mask_path: str) -> Image.Image | torch.Tensor:
+        if self._decode_to_tensor:
+            return decode_image_to_tensor(mask_path, mode="L")
         return Image.open(mask_path).convert("L")
 
-    def _load_example(self, idx: int) -> dict[str, typing.Any]:
-        example = {
-            "id": str(idx),
-            "image": self._load_image(self._get_image_path(idx)),
-            "caption": self.examples[idx].caption,
-        }
-        if self.examples[idx].mask_path:
-            example["mask"] = self._load_mask(self._get_mask_path(idx))
-        return example
+    def _get_image(self, idx: int) -> Image.Image | torch.Tensor:
+        if self._image_store is not None:
+            image = self._image_store.load(
+                idx, decode_to_tensor=self._decode_to_tensor, lazy_image_decode=self._lazy_image_decode
+            )
+            if image is not None:
+                return image
+        return self._load_image(self._get_image_path(idx))
+
+    def _get_mask(self, idx: int) -> Image.Image | torch.Tensor:
+        if self._mask_store is not None:
+            mask = self._mask_store.load(idx, decode_to_tensor=self._decode_to_tensor)
+            if mask is not None:
+                return mask
+        return self._load_mask(self._get_mask_path(idx))
+
+    def load_example_without_images(self, idx: int) -> dict[str, typing.Any]:
+        """Load the example at `idx` without loading its image or mask. This is much faster than `__getitem__` for use
+        cases that only need the caption (e.g. caching text encoder outputs).
+        """
+        return {"id": str(idx), "caption": self._get_example(idx).caption}
+
+    def get_image_source_fingerprint(self, idx: int) -> str:
+        """Get a fingerprint of the source image (and mask) files of the example at `idx`, without reading them. It
+        changes if either file is modified (e.g. it is used to check whether cached VAE outputs are still valid).
+        """
+        paths = [self._get_image_path(idx)]
+        if self._get_example(idx).mask_path:
+            paths.append(self._get_mask_path(idx))
+        return fingerprint_files(paths)
 
     def get_image_dimensions(self) -> list[Resolution]:
         """Get the dimensions of all images in the dataset.
 
-        TODO(ryand): Re-think this approach. For large datasets (e.g. streaming from S3) it doesn't make sense to
-        calculate this dynamically every time.
+        Dimensions are taken from the optional "width" and "height" columns of the jsonl file where they are provided.
+        The dimensions of all other images are stored in an `ImageDimensionIndex` next to the jsonl file, so that only
+        new or modified images have to be read on subsequent runs.
         """
-        image_dims: list[Resolution] = []
-        for i in range(len(self.examples)):
-            image = Image.open(self._get_image_path(i))
-            image_dims.append(Resolution(image.height, image.width))
+        image_dims: list[Resolution | None] = [None] * len(self)
+        missing_idxs: list[int] = []
+        for i in range(len(self)):
+            example = self._get_example(i)
+            if example.width is not None and example.height is not None:
+                image_dims[i] = Resolution(example.height, example.width)
+            else:
+                missing_idxs.append(i)
+
+        if len(missing_idxs) > 0:
+            missing_dims = get_image_dimensions(
+                [str(self._get_image_path(i)) for i in missing_idxs],
+                index_path=str(self._jsonl_path.parent / IMAGE_DIMENSION_INDEX_FILE_NAME),
+            )
+            for i, resolution in zip(missing_idxs, missing_dims, strict=True):
+                image_dims[i] = resolution
 
         return image_dims
 
     def __len__(self) -> int:
-        return len(self.examples)
+        if self._examples is not None:
+            return len(self._examples)
+        return len(self._reader)
 
     def __getitem__(self, idx: int) -> typing.Dict[str, typing.Any]:
-        if self._keep_in_memory:
-            if idx not in self._example_cache:
-                self._example_cache[idx] = self._load_example(idx)
-            # Return a shallow copy of the example to prevent the caller from modifying the cached example.
-            # Shallow rather than deep, because we don't want to copy the image data.
-            return self._example_cache[idx].copy()
-        return self._load_example(idx)
+        example_record = self._get_example(idx)
+        example = {
+            "id": str(idx),
+            "image": self._get_image(idx),
+            "caption": example_record.caption,
+        }
+        if example_record.mask_path:
+            example["mask"] = self._get_mask(idx)
+        return example
@@ -0,0 +1,24 @@
+import typing
+
+import torch.utils.data
+
+
+class ImagelessDataset(torch.utils.data.Dataset):
+    """A Dataset that wraps a base image dataset and returns its examples without loading any images.
+
+    This is useful for passes over a dataset that only need the non-image fields (e.g. populating a text encoder output
+    cache), since it avoids reading and decoding every image file. The base dataset must implement
+    `load_example_without_images(idx)`.
+    """
+
+    def __init__(self, base_dataset: torch.utils.data.Dataset) -> None:
+        super().__init__()
+        if not hasattr(base_dataset, "load_example_without_images"):
+            raise ValueError(f"'{type(base_dataset).__name__}' does not support loading examples without images.")
+        self._base_dataset = base_dataset
+
+    def __len__(self) -> int:
+        return len(self._base_dataset)
+
+    def __getitem__(self, idx: int) -> typing.Dict[str, typing.Any]:
+        return self._base_dataset.load_example_without_images(idx)
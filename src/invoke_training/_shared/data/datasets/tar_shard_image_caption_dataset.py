@@ -0,0 +1,211 @@
+import glob
+import io
+import logging
+import math
+import os
+import random
+import tarfile
+import typing
+
+import torch
+import torch.utils.data
+from PIL import Image
+from torch.utils.data import get_worker_info
+
+from invoke_training._shared.data.utils.decode_image import decode_image_bytes_to_tensor
+from invoke_training._shared.data.utils.epoch_seed import get_epoch_seed
+
+logger = logging.getLogger(__name__)
+
+
+def _split_member_name(name: str) -> tuple[str, str]:
+    """Split a tar member name into a (key, extension) pair. Following the WebDataset convention, the extension is
+    everything after the first "." in the file name. For example, "dir/0001.mask.png" -> ("dir/0001", "mask.png").
+    """
+    dir_name, file_name = os.path.split(name)
+    key, _, extension = file_name.partition(".")
+    return os.path.join(dir_name, key), extension.lower()
+
+
+def _iter_tar_groups(shard_path: str) -> typing.Iterator[tuple[str, dict[str, bytes]]]:
+    """Read a tar shard sequentially, and yield (key, {extension: data}) groups of consecutive files with the same key.
+
+    The shard is read as a stream, so that it never has to be seeked. This requires that the files that belong to the
+    same example are stored consecutively in the shard, which is the case for shards produced by `tar` from sorted
+    files, or by WebDataset's `ShardWriter`.
+    """
+    with open(shard_path, "rb") as f, tarfile.open(fileobj=f, mode="r|*") as tar:
+        current_key = None
+        current_group: dict[str, bytes] = {}
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, extension = _split_member_name(member.name)
+            if key != current_key:
+                if current_key is not None:
+                    yield current_key, current_group
+                current_key = key
+                current_group = {}
+            current_group[extension] = tar.extractfile(member).read()
+        if current_key is not None:
+            yield current_key, current_group
+
+
+def expand_shard_paths(shards: str | list[str]) -> list[str]:
+    """Expand a list of shard paths and glob patterns into a sorted list of shard paths."""
+    if isinstance(shards, str):
+        shards = [shards]
+    shard_paths = []
+    for pattern in shards:
+        matches = sorted(glob.glob(pattern))
+        if len(matches) == 0:
+            raise ValueError(f"No tar shards found matching '{pattern}'.")
+        shard_paths.extend(matches)
+    return shard_paths
+
+
+class TarShardImageCaptionDataset(torch.utils.data.IterableDataset):
+    """A dataset that streams image-caption examples from WebDataset-style tar shards.
+
+    Each example is a group of consecutive files in a shard with the same key (e.g. "0001.jpg", "0001.txt" and
+    optionally "0001.png" for a mask). Shards are read sequentially from start to end, so this dataset is well-suited to
+    very large datasets on storage with slow random access.
+
+    Shards are split between ranks (if `world_size > 1`) and then between DataLoader workers, so every shard is read by
+    exactly one worker per epoch. For the best throughput there should be at least as many shards per rank as there are
+    DataLoader workers.
+    """
+
+    def __init__(
+        self,
+        shards: str | list[str],
+        image_extension: str = "jpg",
+        caption_extension: str = "txt",
+        mask_extension: str | None = "png",
+        shuffle: bool = False,
+        shuffle_buffer_size: int = 1000,
+        rank: int = 0,
+        world_size: int = 1,
+        num_examples: int | None = None,
+        load_images: bool = True,
+        lazy_image_decode: bool = False,
+        decode_to_tensor: bool = False,
+    ):
+        """Initialize a TarShardImageCaptionDataset.
+
+        Args:
+            shards (str | list[str]): The tar shard paths. Each entry can be a glob pattern (e.g. "/data/*.tar").
+            image_extension (str, optional): The extension of the image file in each example.
+            caption_extension (str, optional): The extension of the caption file in each example.
+            mask_extension (str | None, optional): The extension of the (optional) mask file in each example.
+            shuffle (bool, optional): If True, the shard order is shuffled on every epoch, and examples are shuffled
+                through a shuffle buffer.
+            shuffle_buffer_size (int, optional): The number of examples held in the shuffle buffer. Larger buffers give
+                a more uniform shuffle at the cost of memory (the buffer holds the encoded image data).
+            rank (int, optional): The rank of this process. Only the shards that belong to this rank are read.
+            world_size (int, optional): The number of ranks that the shards are split between.
+            num_examples (int | None, optional): The total number of examples in all shards (of all ranks), if known.
+                If None, it is counted (by reading the tar headers of every shard) the first time `len()` is called.
+            load_images (bool, optional): If False, images (and masks) are not decoded, and examples only contain the
+                "id" and "caption" fields.
+            lazy_image_decode (bool, optional): If True, images are opened but not decoded (see
+                `ImageCaptionDirDataset`).
+            decode_to_tensor (bool, optional): If True, images and masks are decoded directly to uint8 tensors (see
+                `ImageCaptionDirDataset`).
+        """
+        super().__init__()
+        if not 0 <= rank < world_size:
+            raise ValueError(f"rank must be in the range [0, {world_size}), but got {rank}.")
+        # Shards are assigned to ranks before shuffling, so that each rank always reads the same shards.
+        self._all_shard_paths = expand_shard_paths(shards)
+        self._shard_paths = self._all_shard_paths[rank::world_size]
+        self._world_size = world_size
+        if len(self._shard_paths) == 0:
+            raise ValueError(f"There are no tar shards for rank {rank} of {world_size}.")
+        self._image_extension = image_extension.lower()
+        self._caption_extension = caption_extension.lower()
+        self._mask_extension = mask_extension.lower() if mask_extension is not None else None
+        self._shuffle = shuffle
+        self._shuffle_buffer_size = shuffle_buffer_size
+        self._num_examples = num_examples
+        self._load_images = load_images
+        self._lazy_image_decode = lazy_image_decode and not decode_to_tensor
+        self._decode_to_tensor = decode_to_tensor
+
+    def __len__(self) -> int:
+        """The number of examples per rank: the total number of examples divided evenly between the ranks (rounded up).
+        The shards of each rank rarely hold exactly this many examples (see `EvenLengthIterableDataset`).
+        """
+        if self._num_examples is None:
+            self._num_examples = 0
+            for shard_path in self._all_shard_paths:
+                with tarfile.open(shard_path, mode="r:*") as tar:
+                    self._num_examples += sum(
+                        1
+                        for member in tar.getmembers()
+                        if member.isfile() and _split_member_name(member.name)[1] == self._image_extension
+                    )
+        return math.ceil(self._num_examples / self._world_size)
+
+    def _iter_groups(self, shard_paths: list[str]) -> typing.Iterator[tuple[str, dict[str, bytes]]]:
+        for shard_path in shard_paths:
+            for key, group in _iter_tar_groups(shard_path):
+                if self._image_extension not in group:
+                    logger.warning(f"Skipping '{key}' in '{shard_path}': no '.{self._image_extension}' file.")
+                    continue
+                if self._caption_extension not in group:
+                    raise ValueError(f"Example '{key}' in '{shard_path}' has no '.{self._caption_extension}' file.")
+                yield key, group
+
+    def _shuffle_groups(
+        self, groups: typing.Iterator[tuple[str, dict[str, bytes]]], rng: random.Random
+    ) -> typing.Iterator[tuple[str, dict[str, bytes]]]:
+        buffer = []
+        for group in groups:
+            if len(buffer) < self._shuffle_buffer_size:
+                buffer.append(group)
+                continue
+            idx = rng.randrange(len(buffer))
+            yield buffer[idx]
+            buffer[idx] = group
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _load_image(self, data: bytes, mode: typing.Literal["RGB", "L"]) -> Image.Image | torch.Tensor:
+        if self._decode_to_tensor:
+            return decode_image_bytes_to_tensor(data, mode=mode)
+        image = Image.open(io.BytesIO(data))
+        if self._lazy_image_decode and mode == "RGB":
+            return image
+        return image.convert(mode)
+
+    def _decode_example(self, key: str, group: dict[str, bytes]) -> typing.Dict[str, typing.Any]:
+        example = {"id": key, "caption": group[self._caption_extension].decode("utf-8").strip()}
+        if self._load_images:
+            example["image"] = self._load_image(group[self._image_extension], mode="RGB")
+            if self._mask_extension is not None and self._mask_extension in group:
+                example["mask"] = self._load_image(group[self._mask_extension], mode="L")
+        return example
+
+    def __iter__(self) -> typing.Iterator[typing.Dict[str, typing.Any]]:
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+
+        shard_paths = list(self._shard_paths)
+        epoch_seed = get_epoch_seed() if self._shuffle else None
+        if epoch_seed is not None:
+            # All workers shuffle the shards identically (they share the epoch seed), so the workers' shards never
+            # overlap after they are split below.
+            random.Random(epoch_seed).shuffle(shard_paths)
+
+        # Split the shards between DataLoader workers.
+        if worker_info is not None:
+            shard_paths = shard_paths[worker_info.id :: worker_info.num_workers]
+
+        groups = self._iter_groups(shard_paths)
+        if epoch_seed is not None and self._shuffle_buffer_size > 1:
+            groups = self._shuffle_groups(groups, random.Random(f"{epoch_seed}-{worker_id}"))
+
+        # Examples are decoded after shuffling, so that the shuffle buffer only holds the (smaller) encoded data.
+        for key, group in groups:
+            yield self._decode_example(key, group)
@@ -16,6 +16,11 @@ class TransformDataset(torch.utils.data.Dataset):
         self._base_dataset = base_dataset
         self._transforms = transforms
 
+    @property
+    def base_dataset(self) -> torch.utils.data.Dataset:
+        """The base dataset, e.g. to read example metadata without loading and transforming the whole example."""
+        return self._base_dataset
+
     def __len__(self) -> int:
         return len(self._base_dataset)
 
@@ -24,3 +29,26 @@ class TransformDataset(torch.utils.data.Dataset):
         for t in self._transforms:
             example = t(example)
         return example
+
+
+class IterableTransformDataset(torch.utils.data.IterableDataset):
+    """An IterableDataset that wraps a base IterableDataset and applies callable transforms to its outputs."""
+
+    def __init__(self, base_dataset: torch.utils.data.IterableDataset, transforms: list[TransformType]) -> None:
+        super().__init__()
+        self._base_dataset = base_dataset
+        self._transforms = transforms
+
+    def __len__(self) -> int:
+        return len(self._base_dataset)
+
+    def set_epoch(self, epoch: int) -> None:
+        """Forward the epoch to the base dataset, if it supports it. Called by accelerate at the start of an epoch."""
+        if hasattr(self._base_dataset, "set_epoch"):
+            self._base_dataset.set_epoch(epoch)
+
+    def __iter__(self) -> typing.Iterator[DataType]:
+        for example in self._base_dataset:
+            for t in self._transforms:
+                example = t(example)
+            yield example
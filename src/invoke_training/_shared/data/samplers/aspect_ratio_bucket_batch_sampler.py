@@ -2,15 +2,112 @@ import copy
 import logging
 import math
 import random
-from typing import Iterator
+from typing import Iterator, Literal
 
 from torch.utils.data import Sampler
 
 from invoke_training._shared.data.utils.aspect_ratio_bucket_manager import AspectRatioBucketManager
 from invoke_training._shared.data.utils.resolution import Resolution
 
+logger = logging.getLogger(__name__)
+
 AspectRatioBuckets = dict[Resolution, list[int]]
 
+# How the last, partial batch of each aspect ratio bucket is handled:
+# - "keep": Keep the partial batch.
+# - "drop": Drop the partial batch.
+# - "fill": Fill the partial batch with examples resampled from the same bucket.
+# - "merge": Buckets with fewer examples than a full batch are merged into the neighbouring aspect ratio buckets before
+#   the sampler is built (see `merge_small_aspect_ratio_buckets(...)`). Any remaining partial batches are kept.
+PartialBatchPolicy = Literal["keep", "drop", "fill", "merge"]
+
+
+def get_bucket_batch_size(bucket_resolution: Resolution, batch_size: int, max_pixels_per_batch: int | None) -> int:
+    """Get the batch size of an aspect ratio bucket.
+
+    Args:
+        bucket_resolution (Resolution): The bucket resolution.
+        batch_size (int): The batch size that is used if `max_pixels_per_batch` is None.
+        max_pixels_per_batch (int | None): If set, the batch size is the largest number of images at the bucket
+            resolution that fits within this pixel budget (at least 1).
+    """
+    if max_pixels_per_batch is None:
+        return batch_size
+    return max(1, max_pixels_per_batch // (bucket_resolution.height * bucket_resolution.width))
+
+
+def _count_partial_batches(
+    bucket_manager: AspectRatioBucketManager,
+    image_sizes: list[Resolution],
+    batch_size: int,
+    max_pixels_per_batch: int | None,
+) -> tuple[dict[Resolution, int], int]:
+    """Count the images in each aspect ratio bucket, and the number of partial batches."""
+    bucket_counts: dict[Resolution, int] = {}
+    for bucket in bucket_manager.get_aspect_ratio_buckets(image_sizes):
+        bucket_counts[bucket] = bucket_counts.get(bucket, 0) + 1
+    num_partial_batches = sum(
+        count % get_bucket_batch_size(bucket, batch_size, max_pixels_per_batch) != 0
+        for bucket, count in bucket_counts.items()
+    )
+    return bucket_counts, num_partial_batches
+
+
+def merge_small_aspect_ratio_buckets(
+    bucket_manager: AspectRatioBucketManager,
+    image_sizes: list[Resolution],
+    batch_size: int,
+    max_pixels_per_batch: int | None = None,
+) -> AspectRatioBucketManager:
+    """Merge aspect ratio buckets that have fewer images than a full batch into their neighbouring aspect ratios.
+
+    Empty buckets are removed. Then, the smallest bucket with fewer images than its batch size is removed repeatedly
+    (so that its images are assigned to the bucket with the nearest remaining aspect ratio), until every bucket holds at
+    least one full batch, or only one bucket is left.
+
+    The returned AspectRatioBucketManager must be used both to build the batch sampler and to resize the images, so
+    that they agree on the bucket of every image.
+
+    Args:
+        bucket_manager (AspectRatioBucketManager): The original bucket manager.
+        image_sizes (list[Resolution]): The image resolutions of the dataset.
+        batch_size (int): The batch size.
+        max_pixels_per_batch (int | None, optional): See `get_bucket_batch_size(...)`.
+
+    Returns:
+        AspectRatioBucketManager: A bucket manager with the merged buckets.
+    """
+    bucket_counts, original_num_partial_batches = _count_partial_batches(
+        bucket_manager, image_sizes, batch_size, max_pixels_per_batch
+    )
+    if len(bucket_counts) == 0:
+        return bucket_manager
+
+    num_merged_buckets = 0
+    while True:
+        # Empty buckets are removed, so that the images of a merged bucket are only moved to buckets that hold images.
+        bucket_manager = AspectRatioBucketManager(set(bucket_counts.keys()))
+        bucket_counts, num_partial_batches = _count_partial_batches(
+            bucket_manager, image_sizes, batch_size, max_pixels_per_batch
+        )
+        small_buckets = [
+            bucket
+            for bucket, count in bucket_counts.items()
+            if count < get_bucket_batch_size(bucket, batch_size, max_pixels_per_batch)
+        ]
+        if len(small_buckets) == 0 or len(bucket_counts) == 1:
+            break
+        # Merge the smallest bucket first. Ties are broken by resolution, so that the result is deterministic.
+        smallest_bucket = min(small_buckets, key=lambda bucket: (bucket_counts[bucket], bucket.to_tuple()))
+        del bucket_counts[smallest_bucket]
+        num_merged_buckets += 1
+
+    logger.info(
+        f"Merged {num_merged_buckets} aspect ratio buckets with fewer images than a full batch into their neighbours. "
+        f"Partial batches: {original_num_partial_batches} -> {num_partial_batches}."
+    )
+    return bucket_manager
+
 
 class AspectRatioBucketBatchSampler(Sampler[list[int]]):
     """A batch sampler that adheres to aspect ratio buckets."""
@@ -21,16 +118,32 @@ class AspectRatioBucketBatchSampler(Sampler[list[int]]):
         batch_size: int,
         shuffle: bool = False,
         seed: int | None = None,
+        max_pixels_per_batch: int | None = None,
+        partial_batch_policy: PartialBatchPolicy = "keep",
     ) -> None:
         """Initialize AspectRatioBucketBatchSampler.
 
         For most use cases, initialize via AspectRatioBucketBatchSampler.from_image_sizes(...).
+
+        If `max_pixels_per_batch` is set, the batch size of each bucket is derived from this pixel budget rather than
+        `batch_size` (see `get_bucket_batch_size(...)`). `partial_batch_policy` controls how the last, partial batch of
+        each bucket is handled (see `PartialBatchPolicy`).
         """
         self._buckets = buckets
         self._batch_size = batch_size
+        self._max_pixels_per_batch = max_pixels_per_batch
+        self._partial_batch_policy = partial_batch_policy
         self._shuffle = shuffle
         self._random = random.Random(seed)
 
+        # The number of completed epochs, the RNG state at the start of the current epoch (None between epochs), and the
+        # number of batches yielded in the current epoch. See `state_dict()`.
+        self._epoch = 0
+        self._epoch_rng_state = None
+        self._position = 0
+        # The number of batches to skip at the start of the next epoch (set by `load_state_dict()`).
+        self._num_batches_to_skip = 0
+
     def __str__(self) -> str:
         buckets = self.get_buckets()
         bucket_resolutions = sorted(list(buckets.keys()))
@@ -38,6 +151,24 @@ class AspectRatioBucketBatchSampler(Sampler[list[int]]):
         for bucket_resolution in bucket_resolutions:
             bucket_images = buckets[bucket_resolution]
             s += f"  {bucket_resolution.to_tuple()}: {len(bucket_images)}\n"
+
+        num_partial_batches = 0
+        num_missing_examples = 0
+        num_remainder_examples = 0
+        for bucket_resolution, bucket_images in buckets.items():
+            bucket_batch_size = self.get_bucket_batch_size(bucket_resolution)
+            num_remainder = len(bucket_images) % bucket_batch_size
+            if num_remainder > 0:
+                num_partial_batches += 1
+                num_remainder_examples += num_remainder
+                num_missing_examples += bucket_batch_size - num_remainder
+        s += f"Partial batches (partial_batch_policy='{self._partial_batch_policy}'): "
+        if self._partial_batch_policy == "drop":
+            s += f"{num_partial_batches} dropped, skipping {num_remainder_examples} examples per epoch.\n"
+        elif self._partial_batch_policy == "fill":
+            s += f"{num_partial_batches} filled with {num_missing_examples} resampled examples per epoch.\n"
+        else:
+            s += f"{num_partial_batches} kept, {num_missing_examples} examples short of full batches.\n"
         return s
 
     @classmethod
@@ -48,10 +179,19 @@ class AspectRatioBucketBatchSampler(Sampler[list[int]]):
         batch_size: int,
         shuffle: bool = False,
         seed: int | None = None,
+        max_pixels_per_batch: int | None = None,
+        partial_batch_policy: PartialBatchPolicy = "keep",
     ):
         """Initialize from an AspectRatioBucketManager and the list of dataset image resolutions."""
         buckets = cls._build_bucket_to_index_map(bucket_manager, image_sizes)
-        return cls(buckets=buckets, batch_size=batch_size, shuffle=shuffle, seed=seed)
+        return cls(
+            buckets=buckets,
+            batch_size=batch_size,
+            shuffle=shuffle,
+            seed=seed,
+            max_pixels_per_batch=max_pixels_per_batch,
+            partial_batch_policy=partial_batch_policy,
+        )
 
     @classmethod
     def _build_bucket_to_index_map(
@@ -64,8 +204,7 @@ class AspectRatioBucketBatchSampler(Sampler[list[int]]):
         for bucket_resolution in bucket_manager.buckets:
             bucket_to_indexes[bucket_resolution] = []
 
-        for index, image_size in enumerate(image_sizes):
-            aspect_ratio_bucket = bucket_manager.get_aspect_ratio_bucket(image_size)
+        for index, aspect_ratio_bucket in enumerate(bucket_manager.get_aspect_ratio_buckets(image_sizes)):
             bucket_to_indexes[aspect_ratio_bucket].append(index)
 
         return bucket_to_indexes
@@ -73,7 +212,55 @@ class AspectRatioBucketBatchSampler(Sampler[list[int]]):
     def get_buckets(self) -> AspectRatioBuckets:
         return copy.deepcopy(self._buckets)
 
+    def get_bucket_batch_size(self, bucket_resolution: Resolution) -> int:
+        return get_bucket_batch_size(bucket_resolution, self._batch_size, self._max_pixels_per_batch)
+
     def __iter__(self) -> Iterator[list[int]]:
+        self._epoch_rng_state = self._random.getstate()
+        try:
+            yield from self._iter_from_position(self._build_batches(self._random))
+        finally:
+            # The epoch ends when the iterator is either exhausted or closed.
+            self._epoch += 1
+            self._epoch_rng_state = None
+            self._position = 0
+
+    def _iter_from_position(self, batches: list[list[int]]) -> Iterator[list[int]]:
+        """Yield `batches`, starting after the batches to skip that were restored by `load_state_dict()`, and keep
+        track of the position.
+        """
+        self._position = self._num_batches_to_skip
+        self._num_batches_to_skip = 0
+        while self._position < len(batches):
+            batch = batches[self._position]
+            self._position += 1
+            yield batch
+
+    def state_dict(self) -> dict:
+        """Get the state of the sampler: the epoch, the RNG state at the start of the epoch, and the number of batches
+        that have been yielded in the epoch. Restoring this state with `load_state_dict()` resumes the epoch with the
+        same batch order, starting after the last yielded batch.
+
+        Note that a DataLoader fetches batches from its batch sampler ahead of time, so the position may be ahead of the
+        training loop. Use `ResumableDataLoader` to track the batches that have actually been consumed.
+        """
+        if self._epoch_rng_state is None:
+            # Between epochs, the next epoch starts from the current RNG state.
+            return {"epoch": self._epoch, "rng_state": self._random.getstate(), "position": self._num_batches_to_skip}
+        return {"epoch": self._epoch, "rng_state": self._epoch_rng_state, "position": self._position}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        """Restore a state from `state_dict()`. It takes effect on the next call to `__iter__()`."""
+        version, internal_state, gauss_next = state_dict["rng_state"]
+        # The RNG state may have been serialized with its tuples converted to lists (e.g. as JSON).
+        self._random.setstate((version, tuple(internal_state), gauss_next))
+        self._epoch = state_dict["epoch"]
+        self._epoch_rng_state = None
+        self._position = 0
+        self._num_batches_to_skip = state_dict["position"]
+
+    def _build_batches(self, rng: random.Random) -> list[list[int]]:
+        """Build the list of batches for one epoch. If `self._shuffle` is True, `rng` is used to shuffle them."""
         batches: list[list[int]] = []
 
         # TODO(ryand): If self._shuffle == False, should we still shuffle just with a fixed seed every time? If we
@@ -85,25 +272,38 @@ class AspectRatioBucketBatchSampler(Sampler[list[int]]):
             ordered_bucket_images = self._buckets[bucket_resolution].copy()
             if self._shuffle:
                 # Shuffle the images within a bucket.
-                self._random.shuffle(ordered_bucket_images)
+                rng.shuffle(ordered_bucket_images)
 
             # Prepare batches for a single bucket.
+            bucket_batch_size = self.get_bucket_batch_size(bucket_resolution)
+            num_images = len(ordered_bucket_images)
+            if self._partial_batch_policy == "drop":
+                num_images -= num_images % bucket_batch_size
             batch_start = 0
-            while batch_start < len(ordered_bucket_images):
-                batch_end = min(batch_start + self._batch_size, len(ordered_bucket_images))
-                batches.append(ordered_bucket_images[batch_start:batch_end])
-                batch_start += self._batch_size
+            while batch_start < num_images:
+                batch_end = min(batch_start + bucket_batch_size, num_images)
+                batch = ordered_bucket_images[batch_start:batch_end]
+                if self._partial_batch_policy == "fill" and len(batch) < bucket_batch_size:
+                    # Fill the partial batch with examples from the start of the (shuffled) bucket. These do not overlap
+                    # with the partial batch unless the whole bucket is smaller than a batch.
+                    num_missing = bucket_batch_size - len(batch)
+                    batch += [ordered_bucket_images[i % num_images] for i in range(num_missing)]
+                batches.append(batch)
+                batch_start += bucket_batch_size
 
         if self._shuffle:
             # We've already shuffled the images within each bucket, now we shuffle the batches.
-            self._random.shuffle(batches)
+            rng.shuffle(batches)
 
-        yield from batches
+        return batches
 
     def __len__(self) -> int:
         num_batches = 0
-        for bucket_images in self._buckets.values():
-            num_batches += math.ceil(len(bucket_images) / self._batch_size)
+        for bucket_resolution, bucket_images in self._buckets.items():
+            if self._partial_batch_policy == "drop":
+                num_batches += len(bucket_images) // self.get_bucket_batch_size(bucket_resolution)
+            else:
+                num_batches += math.ceil(len(bucket_images) / self.get_bucket_batch_size(bucket_resolution))
         return num_batches
 
 
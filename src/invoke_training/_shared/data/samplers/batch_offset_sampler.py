@@ -2,6 +2,13 @@ import typing
 
 from torch.utils.data import Sampler
 
+from invoke_training._shared.data.samplers.sampler_state import (
+    get_sampler_state_dict,
+    is_sharded_sampler,
+    load_sampler_state_dict,
+    set_sampler_epoch,
+)
+
 
 class BatchOffsetSampler(Sampler[int]):
     """A sampler that wraps a batch sampler and applies an offset to all returned batch elements."""
@@ -15,5 +22,22 @@ class BatchOffsetSampler(Sampler[int]):
             offset_batch = [x + self._offset for x in batch]
             yield offset_batch
 
+    @property
+    def is_sharded(self) -> bool:
+        """Whether the wrapped sampler only yields the examples of one process (see `is_sharded_sampler(...)`)."""
+        return is_sharded_sampler(self._sampler)
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set the epoch of the wrapped sampler (see `set_sampler_epoch(...)`)."""
+        set_sampler_epoch(self._sampler, epoch)
+
+    def state_dict(self) -> dict | None:
+        """Get the state of the wrapped sampler."""
+        return get_sampler_state_dict(self._sampler)
+
+    def load_state_dict(self, state_dict: dict | None) -> None:
+        """Restore the state of the wrapped sampler."""
+        load_sampler_state_dict(self._sampler, state_dict)
+
     def __len__(self) -> int:
         return len(self._sampler)
@@ -0,0 +1,153 @@
+import math
+import random
+from typing import Iterator
+
+import torch.distributed as dist
+
+from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import (
+    AspectRatioBucketBatchSampler,
+    AspectRatioBuckets,
+    PartialBatchPolicy,
+)
+from invoke_training._shared.data.utils.aspect_ratio_bucket_manager import AspectRatioBucketManager
+from invoke_training._shared.data.utils.resolution import Resolution
+
+
+class DistributedAspectRatioBucketBatchSampler(AspectRatioBucketBatchSampler):
+    """A rank-aware AspectRatioBucketBatchSampler, for use with DataLoaders that are not sharded by accelerate (i.e.
+    the distributed counterpart of `AspectRatioBucketBatchSampler`, in the same way that `DistributedSampler` is for
+    `RandomSampler`).
+
+    Every rank builds the same list of batches (from the same seed), and then takes every `num_replicas`-th batch
+    starting at its `rank`. The batch list is padded (by repeating batches from the start) or truncated, so that every
+    rank yields the same number of batches. Each batch only contains examples from a single aspect ratio bucket.
+
+    The batches are reshuffled every epoch based on `seed` and the epoch set by `set_epoch(...)`. Call `set_epoch(...)`
+    at the start of every epoch, otherwise the same order is used for every epoch.
+    """
+
+    def __init__(
+        self,
+        buckets: AspectRatioBuckets,
+        batch_size: int,
+        shuffle: bool = False,
+        seed: int = 0,
+        num_replicas: int | None = None,
+        rank: int | None = None,
+        drop_last: bool = False,
+        max_pixels_per_batch: int | None = None,
+        partial_batch_policy: PartialBatchPolicy = "keep",
+    ) -> None:
+        """Initialize DistributedAspectRatioBucketBatchSampler.
+
+        For most use cases, initialize via DistributedAspectRatioBucketBatchSampler.from_image_sizes(...).
+
+        Args:
+            buckets (AspectRatioBuckets): The example indices in each aspect ratio bucket.
+            batch_size (int): The batch size.
+            shuffle (bool, optional): Whether to shuffle the batches.
+            seed (int, optional): The shuffle seed. Must be the same on all ranks.
+            num_replicas (int | None, optional): The number of ranks. If None, it is read from the default process
+                group.
+            rank (int | None, optional): The rank of this process. If None, it is read from the default process group.
+            drop_last (bool, optional): If True, batches at the end of the batch list are dropped to make it evenly
+                divisible between the ranks. If False, batches from the start of the batch list are repeated instead.
+            max_pixels_per_batch (int | None, optional): If set, the batch size of each bucket is derived from this
+                pixel budget rather than `batch_size` (see `get_bucket_batch_size(...)`).
+            partial_batch_policy (PartialBatchPolicy, optional): How the last, partial batch of each bucket is handled.
+        """
+        super().__init__(
+            buckets=buckets,
+            batch_size=batch_size,
+            shuffle=shuffle,
+            seed=seed,
+            max_pixels_per_batch=max_pixels_per_batch,
+            partial_batch_policy=partial_batch_policy,
+        )
+        if num_replicas is None or rank is None:
+            if not dist.is_available() or not dist.is_initialized():
+                raise RuntimeError(
+                    "num_replicas and rank must be set if the default torch.distributed process group is not "
+                    "initialized."
+                )
+            num_replicas = dist.get_world_size() if num_replicas is None else num_replicas
+            rank = dist.get_rank() if rank is None else rank
+        if not 0 <= rank < num_replicas:
+            raise ValueError(f"rank must be in the range [0, {num_replicas}), but got {rank}.")
+
+        self._seed = seed
+        self._num_replicas = num_replicas
+        self._rank = rank
+        self._drop_last = drop_last
+
+    @classmethod
+    def from_image_sizes(
+        cls,
+        bucket_manager: AspectRatioBucketManager,
+        image_sizes: list[Resolution],
+        batch_size: int,
+        shuffle: bool = False,
+        seed: int = 0,
+        num_replicas: int | None = None,
+        rank: int | None = None,
+        drop_last: bool = False,
+        max_pixels_per_batch: int | None = None,
+        partial_batch_policy: PartialBatchPolicy = "keep",
+    ):
+        """Initialize from an AspectRatioBucketManager and the list of dataset image resolutions."""
+        buckets = cls._build_bucket_to_index_map(bucket_manager, image_sizes)
+        return cls(
+            buckets=buckets,
+            batch_size=batch_size,
+            shuffle=shuffle,
+            seed=seed,
+            num_replicas=num_replicas,
+            rank=rank,
+            drop_last=drop_last,
+            max_pixels_per_batch=max_pixels_per_batch,
+            partial_batch_policy=partial_batch_policy,
+        )
+
+    @property
+    def is_sharded(self) -> bool:
+        """Always True, since each rank only yields its share of the batches. Used to avoid sharding again (e.g. by
+        accelerate).
+        """
+        return True
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set the epoch. The batch order is derived from the seed and the epoch, so that all ranks agree on it."""
+        self._epoch = epoch
+
+    def _get_num_batches_per_rank(self, num_batches: int) -> int:
+        if self._drop_last:
+            return num_batches // self._num_replicas
+        return math.ceil(num_batches / self._num_replicas)
+
+    def __iter__(self) -> Iterator[list[int]]:
+        batches = self._build_batches(random.Random(self._seed + self._epoch))
+        if len(batches) == 0:
+            return
+
+        total_num_batches = self._get_num_batches_per_rank(len(batches)) * self._num_replicas
+        # Pad by cycling through the batches from the start (a no-op if the batches are to be truncated).
+        batches = [batches[i % len(batches)] for i in range(total_num_batches)]
+        try:
+            yield from self._iter_from_position(batches[self._rank :: self._num_replicas])
+        finally:
+            self._position = 0
+
+    def state_dict(self) -> dict:
+        """Get the state of the sampler: the epoch, and the number of batches that have been yielded in the epoch. The
+        batch order is derived from the seed and the epoch, so no RNG state is needed to restore it.
+        """
+        return {"epoch": self._epoch, "position": max(self._position, self._num_batches_to_skip)}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        """Restore a state from `state_dict()`. It takes effect on the next call to `__iter__()`."""
+        self._epoch = state_dict["epoch"]
+        self._position = 0
+        self._num_batches_to_skip = state_dict["position"]
+
+    def __len__(self) -> int:
+        return self._get_num_batches_per_rank(super().__len__())
@@ -2,6 +2,13 @@ import typing
 
 from torch.utils.data import Sampler
 
+from invoke_training._shared.data.samplers.sampler_state import (
+    get_sampler_state_dict,
+    is_sharded_sampler,
+    load_sampler_state_dict,
+    set_sampler_epoch,
+)
+
 T_co = typing.TypeVar("T_co", covariant=True)
 
 
@@ -22,7 +29,14 @@ class InterleavedSampler(Sampler[T_co]):
         self._samplers = samplers
         self._min_sampler_len = min([len(s) for s in self._samplers])
 
-    def __iter__(self) -> typing.Iterator[T_co]:
+        # The states of the input samplers at the start of the current epoch (None between epochs), and the number of
+        # samples yielded in the current epoch. See `state_dict()`.
+        self._epoch_sampler_states = None
+        self._position = 0
+        # The number of samples to skip at the start of the next epoch (set by `load_state_dict()`).
+        self._num_samples_to_skip = 0
+
+    def _iter_interleaved(self) -> typing.Iterator[T_co]:
         sampler_iters = [iter(s) for s in self._samplers]
         while True:
             samples = []
@@ -35,5 +49,47 @@ class InterleavedSampler(Sampler[T_co]):
 
             yield from samples
 
+    def __iter__(self) -> typing.Iterator[T_co]:
+        self._epoch_sampler_states = [get_sampler_state_dict(s) for s in self._samplers]
+        num_samples_to_skip = self._num_samples_to_skip
+        self._num_samples_to_skip = 0
+        self._position = 0
+        try:
+            for sample in self._iter_interleaved():
+                self._position += 1
+                # The skipped samples are only indices, so fast-forwarding through them is cheap.
+                if self._position > num_samples_to_skip:
+                    yield sample
+        finally:
+            self._epoch_sampler_states = None
+            self._position = 0
+
+    @property
+    def is_sharded(self) -> bool:
+        """Whether the input samplers only yield the examples of one process (see `is_sharded_sampler(...)`)."""
+        return any(is_sharded_sampler(s) for s in self._samplers)
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set the epoch of the input samplers (see `set_sampler_epoch(...)`)."""
+        for s in self._samplers:
+            set_sampler_epoch(s, epoch)
+
+    def state_dict(self) -> dict:
+        """Get the state of the sampler: the states of the input samplers at the start of the epoch, and the number of
+        samples that have been yielded in the epoch.
+        """
+        if self._epoch_sampler_states is None:
+            return {
+                "samplers": [get_sampler_state_dict(s) for s in self._samplers],
+                "position": self._num_samples_to_skip,
+            }
+        return {"samplers": self._epoch_sampler_states, "position": self._position}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        """Restore a state from `state_dict()`. It takes effect on the next call to `__iter__()`."""
+        for sampler, sampler_state_dict in zip(self._samplers, state_dict["samplers"], strict=True):
+            load_sampler_state_dict(sampler, sampler_state_dict)
+        self._num_samples_to_skip = state_dict["position"]
+
     def __len__(self) -> int:
         return self._min_sampler_len * len(self._samplers)
@@ -2,6 +2,13 @@ import typing
 
 from torch.utils.data import Sampler
 
+from invoke_training._shared.data.samplers.sampler_state import (
+    get_sampler_state_dict,
+    is_sharded_sampler,
+    load_sampler_state_dict,
+    set_sampler_epoch,
+)
+
 
 class OffsetSampler(Sampler[int]):
     """A sampler that wraps another sampler and applies an offset to all returned values."""
@@ -14,5 +21,22 @@ class OffsetSampler(Sampler[int]):
         for idx in self._sampler:
             yield idx + self._offset
 
+    @property
+    def is_sharded(self) -> bool:
+        """Whether the wrapped sampler only yields the examples of one process (see `is_sharded_sampler(...)`)."""
+        return is_sharded_sampler(self._sampler)
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set the epoch of the wrapped sampler (see `set_sampler_epoch(...)`)."""
+        set_sampler_epoch(self._sampler, epoch)
+
+    def state_dict(self) -> dict | None:
+        """Get the state of the wrapped sampler."""
+        return get_sampler_state_dict(self._sampler)
+
+    def load_state_dict(self, state_dict: dict | None) -> None:
+        """Restore the state of the wrapped sampler."""
+        load_sampler_state_dict(self._sampler, state_dict)
+
     def __len__(self) -> int:
         return len(self._sampler)
@@ -0,0 +1,47 @@
+import typing
+
+from torch.utils.data import BatchSampler, Sampler
+
+
+def get_sampler_state_dict(sampler: Sampler | typing.Iterable) -> dict | None:
+    """Get the state of a sampler, or None if the sampler does not implement `state_dict()` (e.g. torch's
+    `SequentialSampler`). For a torch `BatchSampler`, the state of the wrapped sampler is returned.
+    """
+    if isinstance(sampler, BatchSampler):
+        return get_sampler_state_dict(sampler.sampler)
+    if hasattr(sampler, "state_dict"):
+        return sampler.state_dict()
+    return None
+
+
+def load_sampler_state_dict(sampler: Sampler | typing.Iterable, state_dict: dict | None) -> None:
+    """Restore the state of a sampler from `get_sampler_state_dict()`. Samplers without state are left unchanged, so
+    their order is only restored if it is deterministic.
+    """
+    if state_dict is None:
+        return
+    if isinstance(sampler, BatchSampler):
+        load_sampler_state_dict(sampler.sampler, state_dict)
+    else:
+        sampler.load_state_dict(state_dict)
+
+
+def is_sharded_sampler(sampler: Sampler | typing.Iterable) -> bool:
+    """Check whether a sampler only yields the examples of one process (e.g.
+    `DistributedAspectRatioBucketBatchSampler`), in which case it must not be sharded again (e.g. by accelerate). For a
+    torch `BatchSampler`, the wrapped sampler is checked.
+    """
+    if isinstance(sampler, BatchSampler):
+        return is_sharded_sampler(sampler.sampler)
+    return getattr(sampler, "is_sharded", False)
+
+
+def set_sampler_epoch(sampler: Sampler | typing.Iterable, epoch: int) -> None:
+    """Set the epoch of a sampler whose order is derived from it (e.g. `DistributedAspectRatioBucketBatchSampler`).
+    Samplers that do not implement `set_epoch()` are left unchanged. For a torch `BatchSampler`, the epoch of the
+    wrapped sampler is set.
+    """
+    if isinstance(sampler, BatchSampler):
+        set_sampler_epoch(sampler.sampler, epoch)
+    elif hasattr(sampler, "set_epoch"):
+        sampler.set_epoch(epoch)
@@ -0,0 +1,61 @@
+import random
+import typing
+
+from torch.utils.data import Sampler
+
+
+class SeededRandomSampler(Sampler[int]):
+    """A sampler that yields the indices of a dataset in a random order, derived from a seed and the epoch.
+
+    Unlike torch's `RandomSampler`, the order of every epoch can be reproduced from the seed, and the state of the
+    sampler can be saved and restored part way through an epoch (see `state_dict()`). The epoch is advanced every time
+    that an iteration over the sampler ends.
+    """
+
+    def __init__(self, data_source: typing.Sized, seed: int = 0) -> None:
+        """Initialize SeededRandomSampler.
+
+        Args:
+            data_source (typing.Sized): The dataset to sample from.
+            seed (int, optional): The shuffle seed. Must be the same on all processes if the sampler is sharded between
+                processes (e.g. by accelerate).
+        """
+        self._num_samples = len(data_source)
+        self._seed = seed
+
+        # The number of completed epochs, and the number of samples yielded in the current epoch. See `state_dict()`.
+        self._epoch = 0
+        self._position = 0
+        # The number of samples to skip at the start of the next epoch (set by `load_state_dict()`).
+        self._num_samples_to_skip = 0
+
+    def __iter__(self) -> typing.Iterator[int]:
+        indices = list(range(self._num_samples))
+        random.Random(self._seed + self._epoch).shuffle(indices)
+
+        self._position = self._num_samples_to_skip
+        self._num_samples_to_skip = 0
+        try:
+            while self._position < len(indices):
+                idx = indices[self._position]
+                self._position += 1
+                yield idx
+        finally:
+            # The epoch ends when the iterator is either exhausted or closed.
+            self._epoch += 1
+            self._position = 0
+
+    def state_dict(self) -> dict:
+        """Get the state of the sampler: the epoch, and the number of samples that have been yielded in the epoch. The
+        order is derived from the seed and the epoch, so no RNG state is needed to restore it.
+        """
+        return {"epoch": self._epoch, "position": max(self._position, self._num_samples_to_skip)}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        """Restore a state from `state_dict()`. It takes effect on the next call to `__iter__()`."""
+        self._epoch = state_dict["epoch"]
+        self._position = 0
+        self._num_samples_to_skip = state_dict["position"]
+
+    def __len__(self) -> int:
+        return self._num_samples
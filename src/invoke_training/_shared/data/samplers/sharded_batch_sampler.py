@@ -0,0 +1,36 @@
+import math
+import typing
+
+from torch.utils.data import Sampler
+
+
+class ShardedBatchSampler(Sampler[list[int]]):
+    """A sampler that wraps a batch sampler and only yields the batches that belong to one shard. Batches are assigned
+    to shards in a round-robin fashion, so every batch of the wrapped sampler is yielded by exactly one shard.
+
+    This is used to split work between processes (e.g. to populate a cache from multiple processes). Each batch is kept
+    intact, so properties of the wrapped sampler's batches (e.g. all examples belonging to the same aspect ratio bucket)
+    are preserved.
+    """
+
+    def __init__(self, sampler: Sampler[list[int]], num_shards: int, shard_idx: int):
+        """Initialize a ShardedBatchSampler.
+
+        Args:
+            sampler (Sampler[list[int]]): The batch sampler to shard.
+            num_shards (int): The total number of shards.
+            shard_idx (int): The index of the shard to yield batches for, in the range [0, num_shards).
+        """
+        if not 0 <= shard_idx < num_shards:
+            raise ValueError(f"shard_idx must be in the range [0, {num_shards}), but got {shard_idx}.")
+        self._sampler = sampler
+        self._num_shards = num_shards
+        self._shard_idx = shard_idx
+
+    def __iter__(self) -> typing.Iterator[list[int]]:
+        for batch_idx, batch in enumerate(self._sampler):
+            if batch_idx % self._num_shards == self._shard_idx:
+                yield batch
+
+    def __len__(self) -> int:
+        return math.ceil((len(self._sampler) - self._shard_idx) / self._num_shards)
@@ -0,0 +1,60 @@
+import json
+import os
+
+
+class CacheManifest:
+    """An append-only record of the fingerprint of the data that was used to produce each entry in a cache.
+
+    The manifest is stored as a JSON Lines file. A record is appended only after the corresponding cache entry has been
+    fully written, so a manifest that was cut short by an interrupted cache build never refers to an incomplete entry.
+    When a key is recorded multiple times, the most recent record wins.
+    """
+
+    def __init__(self, manifest_path: str):
+        """Initialize a CacheManifest, loading any existing records from `manifest_path`.
+
+        Args:
+            manifest_path (str): The path of the manifest file. The file is created on the first call to `record()`.
+        """
+        self._manifest_path = manifest_path
+        self._fingerprints: dict[str, str] = {}
+        self._needs_newline = False
+
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                content = f.read()
+
+            for line in content.splitlines():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Skip blank lines and the partially-written final line of an interrupted cache build.
+                    continue
+                self._fingerprints[record["key"]] = record["fingerprint"]
+
+            # If the last write was interrupted mid-line, terminate that line before appending new records.
+            self._needs_newline = len(content) > 0 and not content.endswith("\n")
+
+    def __len__(self) -> int:
+        return len(self._fingerprints)
+
+    def get_fingerprint(self, key: int | str) -> str | None:
+        """Get the fingerprint that was recorded for `key`, or None if there is no record for `key`."""
+        return self._fingerprints.get(str(key))
+
+    def is_valid(self, key: int | str, fingerprint: str) -> bool:
+        """Check whether the cache entry for `key` was produced from data with the given `fingerprint`."""
+        return self.get_fingerprint(key) == fingerprint
+
+    def record(self, key: int | str, fingerprint: str):
+        """Record the fingerprint of the cache entry for `key`. Should be called after the entry has been written."""
+        key = str(key)
+        line = json.dumps({"key": key, "fingerprint": fingerprint}) + "\n"
+        if self._needs_newline:
+            line = "\n" + line
+            self._needs_newline = False
+        # The record is appended with a single write, so that records from multiple processes writing to the same
+        # manifest are not interleaved.
+        with open(self._manifest_path, "ab", buffering=0) as f:
+            f.write(line.encode("utf-8"))
+        self._fingerprints[key] = fingerprint
@@ -0,0 +1,36 @@
+import typing
+
+import torch
+
+from invoke_training._shared.data.transforms.memory_tensor_cache import MemoryTensorCache
+from invoke_training._shared.data.transforms.sharded_tensor_disk_cache import ShardedTensorDiskCache
+from invoke_training._shared.data.transforms.tensor_disk_cache import TensorDiskCache
+
+
+class KeyMappedTensorCache:
+    """A read-only view of a tensor cache in which many keys can share a single cache entry.
+
+    This is used to de-duplicate caches where many examples have identical cached data. For example, a text encoder
+    output cache stores one entry per unique caption, and `key_map` maps each example id to the key of its caption's
+    entry.
+    """
+
+    def __init__(self, cache: TensorDiskCache | ShardedTensorDiskCache | MemoryTensorCache, key_map: dict[str, str]):
+        """Initialize a KeyMappedTensorCache.
+
+        Args:
+            cache (TensorDiskCache | ShardedTensorDiskCache | MemoryTensorCache): The underlying cache.
+            key_map (dict[str, str]): A map from `str(key)` to the key of the entry in `cache` that holds its data.
+        """
+        self._cache = cache
+        self._key_map = key_map
+
+    def load(self, key: int | str) -> typing.Dict[str, torch.Tensor]:
+        """Load the data for `key` from the underlying cache.
+
+        Args:
+            key (int | str): The cache key to load.
+        Returns:
+            typing.Dict[str, torch.Tensor]: Data loaded from the cache.
+        """
+        return self._cache.load(self._key_map[str(key)])
@@ -1,28 +1,41 @@
+import random
 import typing
 
-from invoke_training._shared.data.transforms.tensor_disk_cache import TensorDiskCache
+from invoke_training._shared.data.transforms.tensor_cache import TensorCache, get_variant_cache_key
 
 
 class LoadCacheTransform:
-    """A transform that loads data from a TensorDiskCache."""
+    """A transform that loads data from a TensorCache (e.g. a TensorDiskCache or a ShardedTensorDiskCache)."""
 
     def __init__(
-        self, cache: TensorDiskCache, cache_key_field: str, cache_field_to_output_field: typing.Dict[str, str]
+        self,
+        cache: TensorCache,
+        cache_key_field: str,
+        cache_field_to_output_field: typing.Dict[str, str],
+        num_variants: int = 1,
     ):
         """Initialize LoadCacheTransform.
 
         Args:
-            cache (TensorDiskCache): The cache to load from.
+            cache (TensorCache): The cache to load from.
             cache_key_field (str): The name of the field to use as the cache key.
             cache_field_to_output_field (typing.Dict[str, str]): A map of field names in the cached data to the field
                 names where they should be inserted in the example data.
+            num_variants (int, optional): The number of variants that are cached for each example (e.g. different
+                augmentations of the same image). If greater than 1, one variant is selected at random each time an
+                example is loaded.
         """
         self._cache = cache
         self._cache_key_field = cache_key_field
         self._cache_field_to_output_field = cache_field_to_output_field
+        self._num_variants = num_variants
 
     def __call__(self, data: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:
         key = data[self._cache_key_field]
+        if self._num_variants > 1:
+            # The variant is drawn from the global `random` module. It is seeded by `set_seed(...)` in the main process,
+            # and by the DataLoader in each worker process, so the selection is repeatable for a fixed training seed.
+            key = get_variant_cache_key(key, random.randrange(self._num_variants), self._num_variants)
 
         cache_data = self._cache.load(key)
 
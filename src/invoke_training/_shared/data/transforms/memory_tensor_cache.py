@@ -0,0 +1,137 @@
+import typing
+from collections import OrderedDict
+
+import torch
+from torch.utils.data import get_worker_info
+
+from invoke_training._shared.data.transforms.sharded_tensor_disk_cache import ShardedTensorDiskCache
+from invoke_training._shared.data.transforms.tensor_disk_cache import TensorDiskCache
+
+
+def _get_entry_size_bytes(data: typing.Dict[str, typing.Any]) -> int:
+    return sum(v.numel() * v.element_size() for v in data.values() if isinstance(v, torch.Tensor))
+
+
+def _to_shared_memory(tensor: torch.Tensor) -> torch.Tensor:
+    """Copy `tensor` into shared memory. The copy does not reference the source tensor's storage (e.g. a memory map)."""
+    return torch.empty_like(tensor, device="cpu").share_memory_().copy_(tensor)
+
+
+class MemoryTensorCache:
+    """A read-only, in-memory tier in front of a disk-based tensor cache.
+
+    Loaded entries are kept in memory up to a byte budget, and the least-recently-used entries are evicted when the
+    budget is exceeded. Tensors are held in shared memory, so that the entries loaded in the main process (including all
+    entries loaded by `warm()`) are shared by all DataLoader worker processes without being copied.
+
+    In DataLoader worker processes, the cache is not modified: misses are loaded from the underlying cache, but are not
+    inserted. Otherwise, every worker would hold its own copy of up to `max_size_bytes` of entries.
+
+    Tensors returned by `load()` may be shared with the cache, and must not be modified in place.
+    """
+
+    def __init__(self, cache: TensorDiskCache | ShardedTensorDiskCache, max_size_bytes: int):
+        """Initialize a MemoryTensorCache.
+
+        Args:
+            cache (TensorDiskCache | ShardedTensorDiskCache): The underlying cache.
+            max_size_bytes (int): The maximum total size of the tensors held in memory.
+        """
+        self._cache = cache
+        self._max_size_bytes = max_size_bytes
+        self._entries: OrderedDict[str, typing.Dict[str, typing.Any]] = OrderedDict()
+        self._entry_sizes: dict[str, int] = {}
+        self._size_bytes = 0
+        # The hit and miss counts are kept in shared memory so that the counts from DataLoader worker processes are
+        # visible in the main process. Concurrent updates from multiple workers are not synchronized, so the counts are
+        # approximate when there are multiple workers.
+        self._counters = torch.zeros(2, dtype=torch.int64).share_memory_()
+
+    @property
+    def size_bytes(self) -> int:
+        """The total size of the tensors that are currently held in memory."""
+        return self._size_bytes
+
+    @property
+    def num_entries(self) -> int:
+        """The number of entries that are currently held in memory."""
+        return len(self._entries)
+
+    @property
+    def hits(self) -> int:
+        """The number of calls to `load()` that were served from memory."""
+        return int(self._counters[0])
+
+    @property
+    def misses(self) -> int:
+        """The number of calls to `load()` that were loaded from the underlying cache."""
+        return int(self._counters[1])
+
+    def get_stats(self) -> dict[str, int]:
+        """Get the cache statistics. This is intended to be used to choose an appropriate `max_size_bytes`."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "num_entries": self.num_entries,
+            "size_bytes": self.size_bytes,
+            "max_size_bytes": self._max_size_bytes,
+        }
+
+    def reset_stats(self):
+        """Reset the hit and miss counts."""
+        self._counters.zero_()
+
+    def _insert(self, key: str, data: typing.Dict[str, typing.Any]) -> bool:
+        """Insert an entry, evicting least-recently-used entries as necessary. Returns False if the entry is larger than
+        the entire budget, in which case it is not inserted.
+        """
+        entry_size = _get_entry_size_bytes(data)
+        if entry_size > self._max_size_bytes:
+            return False
+
+        while self._size_bytes + entry_size > self._max_size_bytes:
+            evicted_key, _ = self._entries.popitem(last=False)
+            self._size_bytes -= self._entry_sizes.pop(evicted_key)
+
+        self._entries[key] = {k: _to_shared_memory(v) if isinstance(v, torch.Tensor) else v for k, v in data.items()}
+        self._entry_sizes[key] = entry_size
+        self._size_bytes += entry_size
+        return True
+
+    def warm(self):
+        """Load entries from the underlying cache until the memory budget is full.
+
+        This should be called in the main process before the DataLoader workers are started, so that the loaded entries
+        are shared by all workers.
+        """
+        for key in self._cache.keys():
+            key = str(key)
+            if key in self._entries:
+                continue
+            data = self._cache.load(key)
+            if self._size_bytes + _get_entry_size_bytes(data) > self._max_size_bytes:
+                break
+            self._insert(key, data)
+
+    def load(self, key: int | str) -> typing.Dict[str, typing.Any]:
+        """Load data from memory, or from the underlying cache if it is not held in memory.
+
+        Args:
+            key (int | str): The cache key to load.
+        Returns:
+            typing.Dict[str, typing.Any]: Data loaded from the cache.
+        """
+        key = str(key)
+        data = self._entries.get(key)
+        if data is not None:
+            self._counters[0] += 1
+            if get_worker_info() is None:
+                self._entries.move_to_end(key)
+            # Return a copy of the dict so that callers can't add or remove fields from the cached entry.
+            return dict(data)
+
+        self._counters[1] += 1
+        data = self._cache.load(key)
+        if get_worker_info() is None:
+            self._insert(key, data)
+        return data
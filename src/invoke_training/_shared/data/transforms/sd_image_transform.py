@@ -1,15 +1,31 @@
 import random
 import typing
 
+import torch
+from PIL import Image, ImageFile
 from torchvision import transforms
 from torchvision.transforms.functional import crop
 
 from invoke_training._shared.data.utils.aspect_ratio_bucket_manager import AspectRatioBucketManager, Resolution
-from invoke_training._shared.data.utils.resize import resize_to_cover
+from invoke_training._shared.data.utils.resize import get_cover_size, get_image_size, resize_to_cover
+
+
+def _is_undecoded(image: Image.Image) -> bool:
+    """Check whether `image` has been opened, but its pixel data has not been decoded yet."""
+    return isinstance(image, ImageFile.ImageFile) and len(image.tile) > 0
 
 
 class SDImageTransform:
-    """A transform that prepares and augments images for Stable Diffusion training."""
+    """A transform that prepares and augments images for Stable Diffusion training.
+
+    Images can be either PIL images, or uint8 CxHxW tensors (e.g. decoded with `decode_image_to_tensor(...)`). Tensor
+    images are resized, cropped, flipped and normalized as tensors, without any conversion to PIL. Both input types
+    produce the same outputs (up to small differences in resize rounding).
+
+    If the input example already has an `orig_size_field_name` field, the images are assumed to be resized versions of
+    images of that original size (e.g. from a `CompiledDataset`). The target resolution and the crop coordinates are
+    then determined from the original size, and images that are already at the resized size are not resized again.
+    """
 
     def __init__(
         self,
@@ -21,6 +37,9 @@ class SDImageTransform:
         random_flip: bool = False,
         orig_size_field_name: str = "original_size_hw",
         crop_field_name: str = "crop_top_left_yx",
+        random_crop_seed: int | None = None,
+        id_field_name: str = "id",
+        jpeg_draft: bool = False,
     ):
         """Initialize SDImageTransform.
 
@@ -34,6 +53,17 @@ class SDImageTransform:
             center_crop (bool, optional): If True, crop to the center of the image to achieve the target resolution. If
                 False, crop at a random location.
             random_flip (bool, optional): Whether to apply a random horizontal flip to the images.
+            random_crop_seed (int | None, optional): If set (and `center_crop` is False), the random crop position of
+                each example is derived deterministically from this seed and the example's `id_field_name` field,
+                rather than being drawn from the global RNG. This makes the crops reproducible across epochs, runs and
+                DataLoader workers. Different seeds produce different crops.
+            id_field_name (str, optional): The name of the field that uniquely identifies each example. Only used if
+                `random_crop_seed` is set.
+            jpeg_draft (bool, optional): If True, JPEG images that have not been decoded yet (see the
+                `lazy_image_decode` option of the datasets) are decoded at a reduced resolution using JPEG DCT scaling,
+                which is much faster than a full-resolution decode for large images. The reduced resolution is never
+                smaller than the size that the image is resized to, so the output is nearly identical to a
+                full-resolution decode. Undecoded images are converted to RGB by this transform.
         """
         self._image_field_names = image_field_names
         self._fields_to_normalize_to_range_minus_one_to_one = fields_to_normalize_to_range_minus_one_to_one
@@ -55,6 +85,9 @@ class SDImageTransform:
 
         self._orig_size_field_name = orig_size_field_name
         self._crop_field_name = crop_field_name
+        self._random_crop_seed = random_crop_seed
+        self._id_field_name = id_field_name
+        self._jpeg_draft = jpeg_draft
 
     def __call__(self, data: typing.Dict[str, typing.Any]) -> typing.Dict[str, typing.Any]:  # noqa: C901
         # This SDXL image pre-processing logic is adapted from:
@@ -63,15 +96,18 @@ class SDImageTransform:
         image_fields: dict = {}
         for field_name in self._image_field_names:
             image_fields[field_name] = data[field_name]
-        sizes = [image.size for image in image_fields.values()]
+        sizes = [get_image_size(image) for image in image_fields.values()]
         # All images should have the same size.
         assert all(size == sizes[0] for size in sizes)
 
-        # Helper function to access the first image, which is sometimes used to infer the shape of all images.
-        def get_first_image():
-            return next(iter(image_fields.values()))
+        # Helper function to get the size of the first image, which is sometimes used to infer the size of all images.
+        def get_first_image_size() -> Resolution:
+            return get_image_size(next(iter(image_fields.values())))
 
-        original_size_hw = (get_first_image().height, get_first_image().width)
+        if self._orig_size_field_name in data:
+            original_size_hw = tuple(data[self._orig_size_field_name])
+        else:
+            original_size_hw = get_first_image_size().to_tuple()
 
         # Determine the target image resolution.
         if self._resolution is not None:
@@ -79,24 +115,49 @@ class SDImageTransform:
         else:
             resolution = self._aspect_ratio_bucket_manager.get_aspect_ratio_bucket(Resolution.parse(original_size_hw))
 
+        # Decode images that were opened lazily by the dataset.
+        original_size = Resolution.parse(original_size_hw)
+        undecoded_field_names = [name for name, image in image_fields.items() if _is_undecoded(image)]
+        if (
+            self._jpeg_draft
+            and len(undecoded_field_names) == len(image_fields)
+            and all(image.format == "JPEG" for image in image_fields.values())
+        ):
+            # Request a reduced-resolution decode. JPEG DCT scaling only supports scales of 1/2, 1/4 and 1/8, and PIL
+            # chooses the largest scale for which the decoded image is at least as large as the requested size. We
+            # request the size that the image will be resized to, so that the draft never falls below it.
+            cover_size = get_cover_size(original_size, resolution)
+            for image in image_fields.values():
+                image.draft("RGB", (cover_size.width, cover_size.height))
+                assert image.height >= cover_size.height and image.width >= cover_size.width
+        for field_name in undecoded_field_names:
+            image_fields[field_name] = image_fields[field_name].convert("RGB")
+
         # Resize to cover the target resolution while preserving aspect ratio.
         for field_name, image in image_fields.items():
-            image_fields[field_name] = resize_to_cover(image, resolution)
+            image_fields[field_name] = resize_to_cover(image, resolution, original_size=original_size)
 
         # Apply cropping, and record top left crop position.
+        resized_size = get_first_image_size()
         if self._center_crop_enabled:
-            top_left_y = max(0, (get_first_image().height - resolution.height) // 2)
-            top_left_x = max(0, (get_first_image().width - resolution.width) // 2)
+            top_left_y = max(0, (resized_size.height - resolution.height) // 2)
+            top_left_x = max(0, (resized_size.width - resolution.width) // 2)
+        elif self._random_crop_seed is not None:
+            rng = random.Random(f"{self._random_crop_seed}-{data[self._id_field_name]}")
+            top_left_y = rng.randint(0, max(0, resized_size.height - resolution.height))
+            top_left_x = rng.randint(0, max(0, resized_size.width - resolution.width))
         else:
             crop_transform = transforms.RandomCrop(resolution.to_tuple())
-            top_left_y, top_left_x, h, w = crop_transform.get_params(get_first_image(), resolution.to_tuple())
+            top_left_y, top_left_x, h, w = crop_transform.get_params(
+                next(iter(image_fields.values())), resolution.to_tuple()
+            )
         for field_name, image in image_fields.items():
             image_fields[field_name] = crop(image, top_left_y, top_left_x, resolution.height, resolution.width)
 
         # Apply random flip and update top left crop position accordingly.
         # TODO(ryand): Use a seed for repeatable results.
         if self._random_flip_enabled and random.random() < 0.5:
-            top_left_x = original_size_hw[1] - get_first_image().width - top_left_x
+            top_left_x = original_size_hw[1] - get_first_image_size().width - top_left_x
             for field_name, image in image_fields.items():
                 image_fields[field_name] = self._flip_transform(image)
 
@@ -104,7 +165,11 @@ class SDImageTransform:
 
         # Convert to Tensors.
         for field_name, image in image_fields.items():
-            image_fields[field_name] = self._to_tensor_transform(image)
+            if isinstance(image, torch.Tensor):
+                # Equivalent to ToTensor for uint8 images: convert to float in range [0, 1.0].
+                image_fields[field_name] = image.to(torch.float32).div_(255.0)
+            else:
+                image_fields[field_name] = self._to_tensor_transform(image)
 
         # Normalize to range [-1.0, 1.0].
         # HACK(ryand): We should find a better way to determine the normalization range of each image field.
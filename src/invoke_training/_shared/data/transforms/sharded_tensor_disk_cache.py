@@ -0,0 +1,284 @@
+import json
+import os
+import typing
+
+import numpy as np
+import torch
+
+# Offsets of tensors within a shard are aligned to this many bytes so that every tensor can be viewed in place with its
+# native dtype.
+_ALIGNMENT = 64
+
+_DTYPES: dict[str, torch.dtype] = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+    "float64": torch.float64,
+    "uint8": torch.uint8,
+    "int8": torch.int8,
+    "int16": torch.int16,
+    "int32": torch.int32,
+    "int64": torch.int64,
+    "bool": torch.bool,
+}
+
+
+def _dtype_to_str(dtype: torch.dtype) -> str:
+    return str(dtype).removeprefix("torch.")
+
+
+def _encode_value(value: typing.Any) -> typing.Any:
+    """Encode a non-tensor value as JSON-serializable data. Tuples are tagged so that they can be restored exactly."""
+    if isinstance(value, tuple):
+        return {"__tuple__": [_encode_value(v) for v in value]}
+    if isinstance(value, list):
+        return [_encode_value(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    raise ValueError(f"ShardedTensorDiskCache does not support values of type '{type(value)}'.")
+
+
+def _decode_value(value: typing.Any) -> typing.Any:
+    if isinstance(value, dict):
+        return tuple(_decode_value(v) for v in value["__tuple__"])
+    if isinstance(value, list):
+        return [_decode_value(v) for v in value]
+    return value
+
+
+class ShardedTensorDiskCache:
+    """A data cache that packs `torch.Tensor`s into large shard files on disk.
+
+    Compared to `TensorDiskCache`, which writes one pickled file per entry, this cache:
+
+    - Appends the raw bytes of every tensor to a small number of large shard files.
+    - Keeps an offset index in a JSON Lines file, which also holds any non-tensor values (ints, strings, tuples, etc.).
+    - Loads tensors via memory-mapping. Loaded tensors are views into the page cache (no unpickling, no copies), unless
+      a `storage_dtype` was used, in which case they are cast back to their original dtype.
+
+    Every process (e.g. each DataLoader worker) maps the shards lazily on first access. Entries are only visible in the
+    index after their data has been written, so an interrupted cache build never leaves a partial entry behind.
+
+    A single instance is not thread-safe for writing. Multiple processes can write to the same cache concurrently if
+    each uses a different `writer_id`: every writer appends to its own shard files, and index records are appended to
+    the shared index file with a single write each.
+
+    Shards are append-only. Overwriting an entry (`save(..., overwrite=True)`) appends the new data and a new index
+    record, and the space used by the old data is never reclaimed. A cache whose entries are frequently overwritten
+    should be deleted and rebuilt from scratch to reclaim this space.
+    """
+
+    INDEX_FILE_NAME = "sharded_index.jsonl"
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_shard_size_bytes: int = 2**30,
+        storage_dtype: torch.dtype | None = None,
+        writer_id: int = 0,
+        read_only: bool = False,
+    ):
+        """Initialize a ShardedTensorDiskCache.
+
+        Args:
+            cache_dir (str): The cache directory.
+            max_shard_size_bytes (int, optional): A new shard file is started once the current shard reaches this size.
+            storage_dtype (torch.dtype | None, optional): If set, floating point tensors are stored in this dtype (e.g.
+                `torch.float16` or `torch.bfloat16`) to reduce the cache size.
+            writer_id (int, optional): Identifies the shard files that this instance writes to. Processes that write to
+                the same cache concurrently must use different writer IDs. Has no effect on reading.
+            read_only (bool, optional): If True, the cache is assumed to not change while it is open (e.g. it is read
+                during training after it was populated). The index is read once, and is never checked for new entries.
+                `save()` is not allowed.
+        """
+        super().__init__()
+        self._cache_dir = cache_dir
+        self._max_shard_size_bytes = max_shard_size_bytes
+        self._storage_dtype = storage_dtype
+        self._writer_id = writer_id
+        self._read_only = read_only
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+
+        self._index_path = os.path.join(self._cache_dir, self.INDEX_FILE_NAME)
+        if not os.path.exists(self._index_path):
+            open(self._index_path, "a").close()
+
+        # The index is loaded lazily, so that it is loaded in each DataLoader worker process rather than being copied
+        # from the parent process.
+        self._index: dict[str, dict] | None = None
+        self._index_file_size = 0
+        self._shard_maps: dict[tuple[int, int], np.memmap] = {}
+
+    def _get_shard_path(self, shard_idx: int, writer_id: int = 0) -> str:
+        if writer_id == 0:
+            return os.path.join(self._cache_dir, f"shard-{shard_idx:05d}.bin")
+        return os.path.join(self._cache_dir, f"shard-w{writer_id:03d}-{shard_idx:05d}.bin")
+
+    def _refresh_index(self):
+        """Read any index records that have been appended since the index was last read."""
+        if self._index is None:
+            self._index = {}
+            self._index_file_size = 0
+
+        with open(self._index_path, "rb") as f:
+            f.seek(self._index_file_size)
+            new_content = f.read()
+
+        # Only consume complete lines. A partial final line is either still being written, or is the remnant of an
+        # interrupted write.
+        end = new_content.rfind(b"\n") + 1
+        for line in new_content[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self._index[record["key"]] = record
+        self._index_file_size += end
+
+    def _get_index(self) -> dict[str, dict]:
+        if self._index is None:
+            self._refresh_index()
+        return self._index
+
+    def _get_write_location(self, num_bytes: int) -> tuple[int, int]:
+        """Get the (shard_idx, offset) where the next entry of size `num_bytes` should be written."""
+        shard_idx = 0
+        while os.path.exists(self._get_shard_path(shard_idx + 1, self._writer_id)):
+            shard_idx += 1
+
+        shard_path = self._get_shard_path(shard_idx, self._writer_id)
+        shard_size = os.path.getsize(shard_path) if os.path.exists(shard_path) else 0
+        if shard_size > 0 and shard_size + num_bytes > self._max_shard_size_bytes:
+            return shard_idx + 1, 0
+        return shard_idx, shard_size
+
+    def __contains__(self, key: int | str) -> bool:
+        key = str(key)
+        if key not in self._get_index() and not self._read_only:
+            # The entry may have been written since the index was last read.
+            self._refresh_index()
+        return key in self._index
+
+    def keys(self) -> list[str]:
+        """Get the keys of all entries in the cache, in the order that they were first written."""
+        if not self._read_only:
+            self._refresh_index()
+        return list(self._get_index().keys())
+
+    def save(self, key: int | str, data: typing.Dict[str, typing.Any], overwrite: bool = False):
+        """Save data in the cache.
+        Raises:
+            AssertionError: If an entry already exists in the cache for this `key` and `overwrite` is False.
+        Args:
+            key (int | str): The cache key.
+            data (typing.Dict[str, typing.Any]): The data to save. Values must either be `torch.Tensor`s or
+                JSON-serializable values (tuples are supported).
+            overwrite (bool, optional): If True, an existing entry for this `key` will be replaced.
+        """
+        assert isinstance(data, dict)
+        if self._read_only:
+            raise RuntimeError(f"Cannot save to read-only cache '{self._cache_dir}'.")
+        key = str(key)
+        assert overwrite or key not in self
+
+        tensors: dict[str, torch.Tensor] = {}
+        record = {"key": key, "tensors": {}, "values": {}}
+        for field, value in data.items():
+            if isinstance(value, torch.Tensor):
+                tensors[field] = value
+            else:
+                record["values"][field] = _encode_value(value)
+
+        # Serialize all tensors into a single contiguous buffer.
+        buffers: list[bytes] = []
+        offset = 0
+        for field, tensor in tensors.items():
+            orig_dtype = tensor.dtype
+            tensor = tensor.detach().cpu()
+            if self._storage_dtype is not None and tensor.is_floating_point():
+                tensor = tensor.to(self._storage_dtype)
+            tensor_bytes = tensor.contiguous().reshape(-1).view(torch.uint8).numpy().tobytes()
+
+            padding = -offset % _ALIGNMENT
+            buffers.append(b"\0" * padding)
+            offset += padding
+            record["tensors"][field] = {
+                "offset": offset,
+                "num_bytes": len(tensor_bytes),
+                "shape": list(tensor.shape),
+                "dtype": _dtype_to_str(tensor.dtype),
+                "orig_dtype": _dtype_to_str(orig_dtype),
+            }
+            buffers.append(tensor_bytes)
+            offset += len(tensor_bytes)
+
+        shard_idx, shard_offset = self._get_write_location(offset)
+        shard_offset += -shard_offset % _ALIGNMENT
+        record["shard"] = shard_idx
+        if self._writer_id != 0:
+            record["writer"] = self._writer_id
+        for tensor_record in record["tensors"].values():
+            tensor_record["offset"] += shard_offset
+
+        shard_path = self._get_shard_path(shard_idx, self._writer_id)
+        with open(shard_path, "r+b" if os.path.exists(shard_path) else "wb") as f:
+            f.seek(shard_offset)
+            for buffer in buffers:
+                f.write(buffer)
+
+        # Append to the index only after the data has been written. The record is appended with a single write, so that
+        # records from concurrent writers are not interleaved.
+        with open(self._index_path, "ab", buffering=0) as f:
+            f.write((json.dumps(record) + "\n").encode("utf-8"))
+        if self._index is not None:
+            self._index[key] = record
+
+    def _get_shard_map(self, shard_idx: int, writer_id: int, min_size: int) -> np.memmap:
+        shard_map = self._shard_maps.get((writer_id, shard_idx))
+        if shard_map is None or len(shard_map) < min_size:
+            # Map (or re-map, if the shard has grown since it was mapped) the shard file. We use copy-on-write mode so
+            # that the resulting tensors are writable without ever modifying the file.
+            shard_map = np.memmap(self._get_shard_path(shard_idx, writer_id), dtype=np.uint8, mode="c")
+            self._shard_maps[(writer_id, shard_idx)] = shard_map
+        return shard_map
+
+    def load(self, key: int | str) -> typing.Dict[str, typing.Any]:
+        """Load data from the cache.
+        Args:
+            key (int | str): The cache key to load.
+        Returns:
+            typing.Dict[str, typing.Any]: Data loaded from the cache.
+        """
+        key = str(key)
+        index = self._get_index()
+        if not self._read_only and os.stat(self._index_path).st_size != self._index_file_size:
+            # Records have been appended since the index was last read. Read them, so that new entries are found, and
+            # entries that have been overwritten (e.g. stale entries that were re-computed) are never loaded from their
+            # old location.
+            self._refresh_index()
+        if key not in index:
+            raise KeyError(f"Key '{key}' not found in cache '{self._cache_dir}'.")
+        record = self._index[key]
+
+        data = {field: _decode_value(value) for field, value in record["values"].items()}
+        for field, tensor_record in record["tensors"].items():
+            start = tensor_record["offset"]
+            end = start + tensor_record["num_bytes"]
+            if start == end:
+                # Empty tensors have no data in the shard.
+                tensor = torch.empty(tensor_record["shape"], dtype=_DTYPES[tensor_record["dtype"]])
+            else:
+                shard_map = self._get_shard_map(record["shard"], record.get("writer", 0), min_size=end)
+                tensor = torch.from_numpy(shard_map[start:end])
+                tensor = tensor.view(_DTYPES[tensor_record["dtype"]]).reshape(tensor_record["shape"])
+            if tensor_record["dtype"] != tensor_record["orig_dtype"]:
+                tensor = tensor.to(_DTYPES[tensor_record["orig_dtype"]])
+            data[field] = tensor
+        return data
+
+    def __getstate__(self):
+        # Memory maps are re-opened lazily in each process rather than being pickled.
+        state = self.__dict__.copy()
+        state["_shard_maps"] = {}
+        return state
@@ -0,0 +1,152 @@
+import json
+import os
+import typing
+
+import torch
+
+from invoke_training._shared.data.transforms.key_mapped_tensor_cache import KeyMappedTensorCache
+from invoke_training._shared.data.transforms.memory_tensor_cache import MemoryTensorCache
+from invoke_training._shared.data.transforms.sharded_tensor_disk_cache import ShardedTensorDiskCache
+from invoke_training._shared.data.transforms.tensor_disk_cache import TensorDiskCache
+from invoke_training.config.data.output_cache_config import OutputCacheConfig
+
+TensorCache = TensorDiskCache | ShardedTensorDiskCache | MemoryTensorCache | KeyMappedTensorCache
+
+CACHE_INFO_FILE_NAME = "cache_info.json"
+KEY_MAP_FILE_NAME = "key_map.json"
+
+
+def get_variant_cache_key(key: int | str, variant: int, num_variants: int) -> int | str:
+    """Get the cache key of one variant of an example in a cache that holds `num_variants` variants per example (e.g.
+    different augmentations of the same image). If `num_variants` is 1, the example's key is used unchanged.
+    """
+    if num_variants == 1:
+        return key
+    return f"{key}_{variant}"
+
+
+def _write_json(path: str, data: typing.Any, indent: int | None = None):
+    """Write `data` to a JSON file. The file is written to a process-specific temporary file and then renamed, so that
+    readers never see a partially-written file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=indent)
+    os.replace(tmp_path, path)
+
+
+def write_cache_info(cache_dir: str, info: dict[str, typing.Any]):
+    """Write metadata describing the contents of the cache in `cache_dir` (e.g. `{"num_variants": 4}`)."""
+    _write_json(os.path.join(cache_dir, CACHE_INFO_FILE_NAME), info, indent=2)
+
+
+def read_cache_info(cache_dir: str) -> dict[str, typing.Any]:
+    """Read the metadata written by `write_cache_info()`. Returns an empty dict if there is no metadata."""
+    path = os.path.join(cache_dir, CACHE_INFO_FILE_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_key_map(cache_dir: str, key_map: dict[str, str]):
+    """Write a map from lookup keys to the keys of the entries in the cache in `cache_dir`. If a key map exists,
+    `open_tensor_cache()` returns a `KeyMappedTensorCache` that resolves lookups through it.
+    """
+    _write_json(os.path.join(cache_dir, KEY_MAP_FILE_NAME), key_map)
+
+
+def read_key_map(cache_dir: str) -> dict[str, str] | None:
+    """Read the key map written by `write_key_map()`. Returns None if there is no key map."""
+    path = os.path.join(cache_dir, KEY_MAP_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def open_tensor_cache(
+    cache_dir: str,
+    cache_format: typing.Literal["pt", "sharded"] | None = None,
+    storage_dtype: torch.dtype | None = None,
+    max_shard_size_bytes: int = 2**30,
+    writer_id: int = 0,
+    use_key_map: bool = True,
+    memory_cache_size_bytes: int = 0,
+    read_only: bool = False,
+) -> TensorCache:
+    """Open a tensor cache in `cache_dir`.
+
+    Args:
+        cache_dir (str): The cache directory.
+        cache_format (typing.Literal["pt", "sharded"] | None, optional): The cache format. If None, the format is
+            detected from the contents of `cache_dir` (this is the typical usage when opening a cache for reading).
+        storage_dtype (torch.dtype | None, optional): Passed to `ShardedTensorDiskCache`. Ignored for the "pt" format.
+        max_shard_size_bytes (int, optional): Passed to `ShardedTensorDiskCache`. Ignored for the "pt" format.
+        writer_id (int, optional): Passed to `ShardedTensorDiskCache`. Ignored for the "pt" format.
+        use_key_map (bool, optional): If True and the cache has a key map (see `write_key_map()`), a read-only
+            `KeyMappedTensorCache` is returned. Set to False to access the underlying entries directly (e.g. when
+            populating the cache).
+        memory_cache_size_bytes (int, optional): If greater than 0, a read-only `MemoryTensorCache` with this budget is
+            placed in front of the disk cache, and is filled with as many entries as fit. This should only be used when
+            opening a cache for reading, in the main process.
+        read_only (bool, optional): Passed to `ShardedTensorDiskCache`. Set to True when opening a cache that will not
+            change while it is open (e.g. a populated cache that is read during training). Ignored for the "pt" format.
+
+    Returns:
+        TensorCache: The cache.
+    """
+    if cache_format is None:
+        if os.path.exists(os.path.join(cache_dir, ShardedTensorDiskCache.INDEX_FILE_NAME)):
+            cache_format = "sharded"
+        else:
+            cache_format = "pt"
+
+    if cache_format == "pt":
+        cache = TensorDiskCache(cache_dir)
+    elif cache_format == "sharded":
+        cache = ShardedTensorDiskCache(
+            cache_dir,
+            max_shard_size_bytes=max_shard_size_bytes,
+            storage_dtype=storage_dtype,
+            writer_id=writer_id,
+            read_only=read_only,
+        )
+    else:
+        raise ValueError(f"Unsupported cache format: '{cache_format}'.")
+
+    if memory_cache_size_bytes > 0:
+        # The memory tier is placed beneath the key map, so that entries that are shared by many keys are only held in
+        # memory once.
+        cache = MemoryTensorCache(cache, max_size_bytes=memory_cache_size_bytes)
+        cache.warm()
+
+    if use_key_map:
+        key_map = read_key_map(cache_dir)
+        if key_map is not None:
+            return KeyMappedTensorCache(cache, key_map)
+    return cache
+
+
+def open_tensor_cache_from_config(
+    cache_dir: str, config: OutputCacheConfig | None = None, writer_id: int = 0
+) -> TensorCache:
+    """Open a tensor cache in `cache_dir` with the format and storage options from `config`. This is the typical usage
+    when opening a cache to populate it, so the cache's key map (if any) is not applied. Processes that populate the
+    same cache concurrently must use different `writer_id`s.
+    """
+    config = config or OutputCacheConfig()
+    storage_dtype = None
+    if config.storage_dtype is not None:
+        storage_dtype = {"float32": torch.float32, "float16": torch.float16, "bfloat16": torch.bfloat16}[
+            config.storage_dtype
+        ]
+    return open_tensor_cache(
+        cache_dir,
+        cache_format=config.cache_format,
+        storage_dtype=storage_dtype,
+        max_shard_size_bytes=config.max_shard_size_mb * 2**20,
+        writer_id=writer_id,
+        use_key_map=False,
+    )
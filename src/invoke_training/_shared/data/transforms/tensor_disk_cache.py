@@ -22,21 +22,31 @@ class TensorDiskCache:
         """
         return os.path.join(self._cache_dir, f"{key}.pt")
 
-    def save(self, key: int, data: typing.Dict[str, torch.Tensor]):
+    def save(self, key: int, data: typing.Dict[str, torch.Tensor], overwrite: bool = False):
         """Save data in the cache.
         Raises:
-            AssertionError: If an entry already exists in the cache for this `key`.
+            AssertionError: If an entry already exists in the cache for this `key` and `overwrite` is False.
         Args:
             key (int): The cache key.
             data (typing.Dict[str, torch.Tensor]): The data to save.
+            overwrite (bool, optional): If True, an existing entry for this `key` will be replaced.
         """
         # torch.save() supports a range of different data types, but it is cleaner if we force everyone to use a dict.
         # This allows for more reusable cache loading code.
         assert isinstance(data, dict)
 
         save_path = self._get_path(key)
-        assert not os.path.exists(save_path)
-        torch.save(data, save_path)
+        assert overwrite or not os.path.exists(save_path)
+
+        # Write to a temporary file and then rename it so that an interrupted write never leaves a partial entry behind.
+        # The temporary file is process-specific, so that multiple processes can safely write the same entry.
+        tmp_save_path = f"{save_path}.{os.getpid()}.tmp"
+        torch.save(data, tmp_save_path)
+        os.replace(tmp_save_path, save_path)
+
+    def keys(self) -> list[str]:
+        """Get the keys of all entries in the cache."""
+        return [f.removesuffix(".pt") for f in sorted(os.listdir(self._cache_dir)) if f.endswith(".pt")]
 
     def load(self, key: int) -> typing.Dict[str, torch.Tensor]:
         """Load data from the cache.
@@ -1,3 +1,7 @@
+import bisect
+
+import numpy as np
+
 from invoke_training._shared.data.utils.resolution import Resolution
 
 
@@ -5,6 +9,19 @@ class AspectRatioBucketManager:
     def __init__(self, buckets: set[Resolution]):
         self.buckets = buckets
 
+        # Precompute a table of the unique bucket aspect ratios, sorted in ascending order, for fast lookups.
+        # When multiple buckets share an aspect ratio, the one that comes first in the iteration order of `buckets` is
+        # used, and ties between aspect ratios are broken by the same order. This matches the result of
+        # `min(self.buckets, key=...)` over the unsorted buckets.
+        ratio_to_bucket_idx: dict[float, int] = {}
+        self._bucket_list = list(buckets)
+        for bucket_idx, bucket in enumerate(self._bucket_list):
+            ratio_to_bucket_idx.setdefault(bucket.aspect_ratio(), bucket_idx)
+        self._ratios = sorted(ratio_to_bucket_idx.keys())
+        self._ratio_bucket_idxs = [ratio_to_bucket_idx[ratio] for ratio in self._ratios]
+        self._ratios_np = np.array(self._ratios, dtype=np.float64)
+        self._ratio_bucket_idxs_np = np.array(self._ratio_bucket_idxs, dtype=np.int64)
+
     @classmethod
     def from_constraints(cls, target_resolution: int, start_dim: int, end_dim: int, divisible_by: int) -> None:
         buckets = cls.build_aspect_ratio_buckets(
@@ -53,7 +70,69 @@ class AspectRatioBucketManager:
 
         return buckets
 
-    def get_aspect_ratio_bucket(self, resolution: Resolution):
+    def _get_ratio_idx(self, aspect_ratio: float) -> int:
+        """Get the index in `self._ratios` of the closest aspect ratio to `aspect_ratio`."""
+        idx = bisect.bisect_left(self._ratios, aspect_ratio)
+        # The closest aspect ratio is one of the neighbours of the insertion point. Further aspect ratios are only
+        # considered if floating point rounding makes their distance equal to that of the neighbours.
+        best_idx = None
+        best_distance = None
+        for step, start in [(-1, idx - 1), (1, idx)]:
+            candidate_idx = start
+            while 0 <= candidate_idx < len(self._ratios):
+                distance = abs(self._ratios[candidate_idx] - aspect_ratio)
+                if best_distance is not None and distance > best_distance:
+                    break
+                if (
+                    best_distance is None
+                    or distance < best_distance
+                    or self._ratio_bucket_idxs[candidate_idx] < self._ratio_bucket_idxs[best_idx]
+                ):
+                    best_idx = candidate_idx
+                    best_distance = distance
+                candidate_idx += step
+        return best_idx
+
+    def get_aspect_ratio_bucket(self, resolution: Resolution) -> Resolution:
         """Get the bucket with the closest aspect ratio to 'resolution'."""
-        # Note: If this is ever found to be a bottleneck, there is a clearly-more-efficient implementation using bisect.
-        return min(self.buckets, key=lambda x: abs(x.aspect_ratio() - resolution.aspect_ratio()))
+        ratio_idx = self._get_ratio_idx(resolution.aspect_ratio())
+        return self._bucket_list[self._ratio_bucket_idxs[ratio_idx]]
+
+    def get_aspect_ratio_buckets(self, resolutions: list[Resolution]) -> list[Resolution]:
+        """Get the bucket with the closest aspect ratio for each resolution in `resolutions`. Equivalent to calling
+        `get_aspect_ratio_bucket(...)` on each resolution, but vectorized with NumPy, so it is much faster for large
+        datasets.
+        """
+        if len(resolutions) == 0:
+            return []
+        heights = np.array([resolution.height for resolution in resolutions], dtype=np.float64)
+        widths = np.array([resolution.width for resolution in resolutions], dtype=np.float64)
+        aspect_ratios = heights / widths
+
+        ratios = self._ratios_np
+        num_ratios = len(ratios)
+        idxs = np.searchsorted(ratios, aspect_ratios, side="left")
+        left_idxs = np.clip(idxs - 1, 0, num_ratios - 1)
+        right_idxs = np.clip(idxs, 0, num_ratios - 1)
+        left_distances = np.abs(ratios[left_idxs] - aspect_ratios)
+        right_distances = np.abs(ratios[right_idxs] - aspect_ratios)
+        # Pick the closer neighbour. On a tie, pick the neighbour that comes first in the bucket order.
+        use_left = (left_distances < right_distances) | (
+            (left_distances == right_distances)
+            & (self._ratio_bucket_idxs_np[left_idxs] <= self._ratio_bucket_idxs_np[right_idxs])
+        )
+        ratio_idxs = np.where(use_left, left_idxs, right_idxs)
+
+        # In rare cases, floating point rounding can make a non-neighbouring aspect ratio exactly as close as a
+        # neighbour. Fall back to the scalar implementation, which handles this, for those resolutions.
+        best_distances = np.minimum(left_distances, right_distances)
+        outer_left_distances = np.abs(ratios[np.clip(idxs - 2, 0, num_ratios - 1)] - aspect_ratios)
+        outer_right_distances = np.abs(ratios[np.clip(idxs + 1, 0, num_ratios - 1)] - aspect_ratios)
+        needs_fallback = ((idxs >= 2) & (outer_left_distances == best_distances)) | (
+            (idxs + 1 < num_ratios) & (outer_right_distances == best_distances)
+        )
+        for i in np.nonzero(needs_fallback)[0]:
+            ratio_idxs[i] = self._get_ratio_idx(float(aspect_ratios[i]))
+
+        bucket_idxs = self._ratio_bucket_idxs_np[ratio_idxs]
+        return [self._bucket_list[bucket_idx] for bucket_idx in bucket_idxs]
@@ -0,0 +1,110 @@
+import queue
+import threading
+import typing
+
+
+class AsyncCacheWriter:
+    """Runs cache write jobs on background threads, so that writing to disk overlaps with computing the next batch.
+
+    Jobs are held in a bounded queue. When `max_pending_jobs` jobs are waiting, `submit()` blocks until a writer thread
+    frees up a slot. This applies backpressure to the producer, and bounds the amount of host memory held by pending
+    jobs.
+
+    If a job raises an exception, all remaining jobs are discarded and the exception is re-raised in the producer
+    thread by the next call to `submit()`, `flush()` or `close()`.
+
+    Example:
+    ```
+    with AsyncCacheWriter(num_threads=2, max_pending_jobs=4) as writer:
+        for batch in data_loader:
+            outputs = model(batch).cpu()
+            writer.submit(lambda outputs=outputs: save(outputs))
+    # All jobs have completed here.
+    ```
+    """
+
+    def __init__(self, num_threads: int = 1, max_pending_jobs: int = 4):
+        """Initialize an AsyncCacheWriter and start its writer threads.
+
+        Args:
+            num_threads (int, optional): The number of writer threads.
+            max_pending_jobs (int, optional): The maximum number of jobs that can be waiting in the queue.
+        """
+        if num_threads < 1:
+            raise ValueError(f"num_threads must be >= 1, but got {num_threads}.")
+        if max_pending_jobs < 1:
+            raise ValueError(f"max_pending_jobs must be >= 1, but got {max_pending_jobs}.")
+
+        self._queue: queue.Queue[typing.Callable[[], None] | None] = queue.Queue(maxsize=max_pending_jobs)
+        self._error: BaseException | None = None
+        self._error_lock = threading.Lock()
+        self._closed = False
+
+        self._threads = [
+            threading.Thread(target=self._run, name=f"AsyncCacheWriter-{i}", daemon=True) for i in range(num_threads)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                # Once a job has failed, skip the remaining jobs. They are still consumed so that the producer never
+                # blocks on a full queue.
+                if self._error is None:
+                    job()
+            except BaseException as e:
+                with self._error_lock:
+                    if self._error is None:
+                        self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RuntimeError("A background cache write failed.") from self._error
+
+    def submit(self, job: typing.Callable[[], None]):
+        """Queue a job to be run on a writer thread. Blocks while the queue is full.
+
+        Args:
+            job (typing.Callable[[], None]): The job to run. Any data that the job uses must not be modified by the
+                caller after the job is submitted.
+        """
+        if self._closed:
+            raise RuntimeError("Cannot submit a job to an AsyncCacheWriter that has been closed.")
+        self._raise_if_failed()
+        self._queue.put(job)
+
+    def flush(self):
+        """Block until all submitted jobs have completed. Re-raises the first error raised by a job, if any."""
+        self._queue.join()
+        self._raise_if_failed()
+
+    def close(self):
+        """Wait for all submitted jobs to complete and stop the writer threads. Re-raises the first error raised by a
+        job, if any.
+        """
+        if not self._closed:
+            self._closed = True
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+        self._raise_if_failed()
+
+    def __enter__(self) -> "AsyncCacheWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't mask the original exception with an error from a background job.
+            try:
+                self.close()
+            except RuntimeError:
+                pass
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import typing
+
+import torch
+
+
+def fingerprint_str(value: str) -> str:
+    """Compute a fingerprint of a string."""
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def fingerprint_params(params: dict[str, typing.Any]) -> str:
+    """Compute a fingerprint of a dict of JSON-serializable parameters. The fingerprint does not depend on key order.
+    Values that are not JSON-serializable are fingerprinted by their `str()` representation.
+    """
+    return fingerprint_str(json.dumps(params, sort_keys=True, default=str))
+
+
+def fingerprint_tensors(tensors: typing.Iterable[torch.Tensor]) -> str:
+    """Compute a fingerprint of the shape, dtype and contents of a sequence of tensors."""
+    hasher = hashlib.sha256()
+    for tensor in tensors:
+        tensor = tensor.detach().cpu().contiguous()
+        hasher.update(f"{tensor.dtype}{tuple(tensor.shape)}".encode("utf-8"))
+        # Hash the raw bytes of the tensor. Viewing the data as uint8 works for all dtypes (including bfloat16, which
+        # numpy does not support).
+        hasher.update(tensor.reshape(-1).view(torch.uint8).numpy())
+    return hasher.hexdigest()
+
+
+def fingerprint_files(paths: typing.Iterable[str | os.PathLike]) -> str:
+    """Compute a fingerprint of the identity of a sequence of files: their absolute paths, sizes and modification times.
+    The file contents are not read. Like `ImageDimensionIndex`, a file is assumed to be unchanged if its size and
+    modification time are unchanged.
+    """
+    files = []
+    for path in paths:
+        stat = os.stat(path)
+        files.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+    return fingerprint_params({"files": files})
+
+
+def get_persistent_cache_dir(base_cache_dir: str, cache_name: str, cache_params: dict[str, typing.Any]) -> str:
+    """Get the persistent cache directory for a cache with the given params, creating it if it does not exist.
+
+    Caches that were built with the same `cache_name` and `cache_params` share a directory, so they can be re-used
+    across training runs. Any change to the `cache_params` (e.g. the model, dtype or image transform params) results in
+    a new directory. A copy of the `cache_params` is written to the directory to make it easy to identify.
+
+    Args:
+        base_cache_dir (str): The base directory under which all persistent caches are stored.
+        cache_name (str): The name of the cache (e.g. "vae_outputs").
+        cache_params (dict[str, typing.Any]): The parameters that determine the cache contents.
+
+    Returns:
+        str: The cache directory.
+    """
+    cache_dir = os.path.join(base_cache_dir, f"{cache_name}-{fingerprint_params(cache_params)[:16]}")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    params_path = os.path.join(cache_dir, "cache_params.json")
+    if not os.path.exists(params_path):
+        # Multiple processes may get the same cache directory concurrently, so we write to a process-specific temporary
+        # file and then rename it.
+        tmp_params_path = f"{params_path}.{os.getpid()}.tmp"
+        with open(tmp_params_path, "w") as f:
+            json.dump(cache_params, f, indent=2, sort_keys=True, default=str)
+        os.replace(tmp_params_path, params_path)
+
+    return cache_dir
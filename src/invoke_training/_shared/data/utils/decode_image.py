@@ -0,0 +1,29 @@
+from pathlib import Path
+from typing import Literal
+
+import torch
+from torchvision.io import ImageReadMode, decode_image, read_file
+
+
+def decode_image_bytes_to_tensor(data: bytes | torch.Tensor, mode: Literal["RGB", "L"] = "RGB") -> torch.Tensor:
+    """Decode encoded image data directly to a uint8 CxHxW tensor with `torchvision.io`, without going through PIL.
+
+    Only JPEG and PNG images are supported.
+
+    Args:
+        data (bytes | torch.Tensor): The encoded image data, either as bytes or as a 1D uint8 tensor.
+        mode (Literal["RGB", "L"], optional): "RGB" to decode to 3 channels (alpha channels are dropped and greyscale
+            images are repeated, like PIL's `convert("RGB")`), or "L" to decode to a single greyscale channel.
+
+    Returns:
+        torch.Tensor: The decoded image, with dtype uint8 and shape (C, H, W).
+    """
+    if isinstance(data, bytes):
+        data = torch.frombuffer(bytearray(data), dtype=torch.uint8)
+    read_mode = ImageReadMode.RGB if mode == "RGB" else ImageReadMode.GRAY
+    return decode_image(data, mode=read_mode)
+
+
+def decode_image_to_tensor(image_path: str | Path, mode: Literal["RGB", "L"] = "RGB") -> torch.Tensor:
+    """Decode an image file directly to a uint8 CxHxW tensor. See `decode_image_bytes_to_tensor(...)`."""
+    return decode_image_bytes_to_tensor(read_file(str(image_path)), mode=mode)
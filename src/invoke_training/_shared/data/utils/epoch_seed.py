@@ -0,0 +1,17 @@
+import torch
+from torch.utils.data import get_worker_info
+
+
+def get_epoch_seed() -> int:
+    """Get a seed for shuffling an IterableDataset that is shared by all DataLoader workers in the current epoch, and
+    changes every epoch.
+
+    All workers must shuffle their shared inputs (e.g. the list of shards) identically, so that the inputs do not
+    overlap after they are split between the workers.
+    """
+    worker_info = get_worker_info()
+    if worker_info is not None:
+        # The DataLoader draws a new base seed for every epoch, and seeds worker `i` with `base_seed + i`.
+        return worker_info.seed - worker_info.id
+    # In the main process, draw from the global RNG in the same way that the DataLoader draws its base seed.
+    return int(torch.empty((), dtype=torch.int64).random_().item())
@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from tqdm.auto import tqdm
+
+from invoke_training._shared.data.utils.resolution import Resolution
+
+IMAGE_DIMENSION_INDEX_FILE_NAME = ".image_dimensions.jsonl"
+
+logger = logging.getLogger(__name__)
+
+
+def read_image_dimensions(image_path: str) -> Resolution:
+    """Read the dimensions of an image. Only the image header is read, the image data is not decoded."""
+    with Image.open(image_path) as image:
+        return Resolution(image.height, image.width)
+
+
+class ImageDimensionIndex:
+    """A persistent record of the dimensions of image files, so that they do not have to be re-read on every run.
+
+    Records are keyed by the absolute path of each image, and are only considered valid if the image's size and
+    modification time have not changed since the record was written. Like `CacheManifest`, the index is stored as an
+    append-only JSON Lines file, and when a path is recorded multiple times the most recent record wins.
+    """
+
+    def __init__(self, index_path: str):
+        """Initialize an ImageDimensionIndex, loading any existing records from `index_path`.
+
+        Args:
+            index_path (str): The path of the index file. The file is created on the first call to `record()`.
+        """
+        self._index_path = index_path
+        self._records: dict[str, tuple[int, int, int, int]] = {}
+        self._needs_newline = False
+        # Set to False if the index file can not be written (e.g. a read-only dataset directory). The index then only
+        # lives in memory.
+        self._writable = True
+
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                content = f.read()
+
+            for line in content.splitlines():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Skip blank lines and the partially-written final line of an interrupted write.
+                    continue
+                self._records[record["path"]] = (
+                    record["size"],
+                    record["mtime_ns"],
+                    record["height"],
+                    record["width"],
+                )
+
+            # If the last write was interrupted mid-line, terminate that line before appending new records.
+            self._needs_newline = len(content) > 0 and not content.endswith("\n")
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, image_path: str, stat: os.stat_result | None = None) -> Resolution | None:
+        """Get the recorded dimensions of the image at `image_path`, or None if there is no valid record.
+
+        Args:
+            image_path (str): The image path.
+            stat (os.stat_result | None, optional): The result of `os.stat(image_path)`, if it is already available.
+        """
+        image_path = os.path.abspath(image_path)
+        record = self._records.get(image_path)
+        if record is None:
+            return None
+        stat = stat or os.stat(image_path)
+        size, mtime_ns, height, width = record
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            return None
+        return Resolution(height, width)
+
+    def record(self, image_path: str, resolution: Resolution, stat: os.stat_result | None = None):
+        """Record the dimensions of the image at `image_path`.
+
+        Args:
+            image_path (str): The image path.
+            resolution (Resolution): The image dimensions.
+            stat (os.stat_result | None, optional): The result of `os.stat(image_path)` from before the dimensions were
+                read.
+        """
+        self.record_many([(image_path, resolution, stat)])
+
+    def record_many(self, records: list[tuple[str, Resolution, os.stat_result | None]]):
+        """Record the dimensions of multiple images. This is equivalent to calling `record()` for each image, but the
+        records are appended to the index file with a single write.
+
+        Args:
+            records (list[tuple[str, Resolution, os.stat_result | None]]): (image_path, resolution, stat) tuples. See
+                `record()`.
+        """
+        lines: list[str] = []
+        for image_path, resolution, stat in records:
+            image_path = os.path.abspath(image_path)
+            stat = stat or os.stat(image_path)
+            self._records[image_path] = (stat.st_size, stat.st_mtime_ns, resolution.height, resolution.width)
+            record = {
+                "path": image_path,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "height": resolution.height,
+                "width": resolution.width,
+            }
+            lines.append(json.dumps(record) + "\n")
+        self._append("".join(lines))
+
+    def _append(self, content: str):
+        if not self._writable or len(content) == 0:
+            return
+
+        if self._needs_newline:
+            content = "\n" + content
+        try:
+            # The records are appended with a single write, so that records from multiple processes writing to the same
+            # index are not interleaved.
+            with open(self._index_path, "ab", buffering=0) as f:
+                f.write(content.encode("utf-8"))
+        except OSError as e:
+            logger.warning(f"Failed to write the image dimension index '{self._index_path}': {e}")
+            self._writable = False
+            return
+        self._needs_newline = False
+
+
+def _scan_image_dimensions(
+    image_paths: list[str], index: ImageDimensionIndex | None
+) -> list[tuple[Resolution, os.stat_result | None, bool]]:
+    """Get the dimensions of a chunk of images, using `index` where possible.
+
+    Returns:
+        list[tuple[Resolution, os.stat_result | None, bool]]: A (resolution, stat, was_read) tuple for each image.
+            `was_read` is True if the dimensions were read from the image file rather than from the index.
+    """
+    results = []
+    for image_path in image_paths:
+        stat = None
+        resolution = None
+        if index is not None:
+            stat = os.stat(image_path)
+            resolution = index.get(image_path, stat)
+        was_read = resolution is None
+        if was_read:
+            resolution = read_image_dimensions(image_path)
+        results.append((resolution, stat, was_read))
+    return results
+
+
+def get_image_dimensions(
+    image_paths: list[str],
+    index_path: str | None = None,
+    num_workers: int | None = None,
+    chunk_size: int = 256,
+) -> list[Resolution]:
+    """Get the dimensions of a list of images.
+
+    Only the image headers are read. The images are scanned in chunks on a thread pool, because the scan is dominated by
+    per-file I/O latency (particularly on network filesystems) rather than by compute.
+
+    Args:
+        image_paths (list[str]): The image paths.
+        index_path (str | None, optional): The path of an `ImageDimensionIndex`. Dimensions are read from the index
+            where possible, and the index is updated with the dimensions of any images that had to be read. If None,
+            the dimensions of every image are read.
+        num_workers (int | None, optional): The number of scanning threads. If None, the `ThreadPoolExecutor` default
+            is used.
+        chunk_size (int, optional): The number of images per unit of work.
+
+    Returns:
+        list[Resolution]: The dimensions of each image in `image_paths`.
+    """
+    index = ImageDimensionIndex(index_path) if index_path is not None else None
+
+    start_time = time.perf_counter()
+    chunks = [image_paths[i : i + chunk_size] for i in range(0, len(image_paths), chunk_size)]
+    image_dims: list[Resolution] = []
+    num_read = 0
+    with (
+        ThreadPoolExecutor(max_workers=num_workers) as executor,
+        tqdm(total=len(image_paths), desc="Scanning image dimensions", disable=len(chunks) <= 1) as progress_bar,
+    ):
+        chunk_results = executor.map(_scan_image_dimensions, chunks, [index] * len(chunks))
+        # Results are consumed in order, and new records are written from this thread only.
+        for chunk, results in zip(chunks, chunk_results, strict=True):
+            new_records = [
+                (image_path, resolution, stat)
+                for image_path, (resolution, stat, was_read) in zip(chunk, results, strict=True)
+                if was_read
+            ]
+            if index is not None:
+                index.record_many(new_records)
+            num_read += len(new_records)
+            image_dims.extend(resolution for resolution, _, _ in results)
+            progress_bar.update(len(chunk))
+
+    elapsed = time.perf_counter() - start_time
+    logger.info(
+        f"Got the dimensions of {len(image_paths)} images in {elapsed:.2f}s ({num_read} read from image files, "
+        f"{len(image_paths) - num_read} from the index)."
+    )
+    return image_dims
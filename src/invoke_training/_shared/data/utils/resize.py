@@ -1,12 +1,37 @@
 import math
 
+import torch
 from PIL.Image import Image
 from torchvision import transforms
 
 from invoke_training._shared.data.utils.resolution import Resolution
 
 
-def resize_to_cover(image: Image, size_to_cover: Resolution) -> Image:
+def get_image_size(image: Image | torch.Tensor) -> Resolution:
+    """Get the size of a PIL image, or of a CxHxW image tensor."""
+    if isinstance(image, torch.Tensor):
+        return Resolution(image.shape[-2], image.shape[-1])
+    return Resolution(image.height, image.width)
+
+
+def get_cover_size(image_size: Resolution, size_to_cover: Resolution) -> Resolution:
+    """Get the size that `resize_to_cover(...)` resizes an image of size `image_size` to."""
+    scale_to_height = size_to_cover.height / image_size.height
+    scale_to_width = size_to_cover.width / image_size.width
+
+    if scale_to_height > scale_to_width:
+        resize_height = size_to_cover.height
+        resize_width = math.ceil(image_size.width * scale_to_height)
+    else:
+        resize_width = size_to_cover.width
+        resize_height = math.ceil(image_size.height * scale_to_width)
+
+    return Resolution(resize_height, resize_width)
+
+
+def resize_to_cover(
+    image: Image | torch.Tensor, size_to_cover: Resolution, original_size: Resolution | None = None
+) -> Image | torch.Tensor:
     """Resize image to the smallest size that covers 'size_to_cover' while preserving its aspect ratio.
 
     In other words, achieve the following:
@@ -14,20 +39,23 @@ def resize_to_cover(image: Image, size_to_cover: Resolution) -> Image:
     - resized_width >= size_to_cover.width
     - resized_height == size_to_cover.height or resized_width == size_to_cover.width
     - 'image' aspect ratio is preserved.
-    """
 
-    scale_to_height = size_to_cover.height / image.height
-    scale_to_width = size_to_cover.width / image.width
-
-    if scale_to_height > scale_to_width:
-        resize_height = size_to_cover.height
-        resize_width = math.ceil(image.width * scale_to_height)
-    else:
-        resize_width = size_to_cover.width
-        resize_height = math.ceil(image.height * scale_to_width)
+    Args:
+        image (Image | torch.Tensor): The image to resize. Either a PIL image, or a CxHxW image tensor.
+        size_to_cover (Resolution): The size to cover.
+        original_size (Resolution | None, optional): If `image` is a reduced-resolution version of a larger image (e.g.
+            a JPEG draft decode), the size of the larger image. The output size is calculated from `original_size`, so
+            that it matches the output size for the full-resolution image exactly.
+    """
+    original_size = original_size or get_image_size(image)
+    resize_size = get_cover_size(original_size, size_to_cover)
+    if resize_size == get_image_size(image):
+        # The image is already at the target size (e.g. it was resized ahead of time).
+        return image
 
+    # PIL always applies antialiasing when downscaling. Set `antialias=True` so that tensors are resized the same way.
     resize_transform = transforms.Resize(
-        (resize_height, resize_width), interpolation=transforms.InterpolationMode.BILINEAR
+        resize_size.to_tuple(), interpolation=transforms.InterpolationMode.BILINEAR, antialias=True
     )
 
     return resize_transform(image)
@@ -0,0 +1,148 @@
+import io
+import logging
+import os
+import typing
+
+import numpy as np
+import torch
+from PIL import Image
+
+from invoke_training._shared.data.utils.decode_image import decode_image_bytes_to_tensor
+from invoke_training._shared.data.utils.image_dimension_index import read_image_dimensions
+
+logger = logging.getLogger(__name__)
+
+ImageStoreFormat = typing.Literal["decoded", "encoded"]
+
+
+class SharedMemoryImageStore:
+    """An in-memory store of images, for datasets with `keep_in_memory=True`.
+
+    All images are packed into a single uint8 arena in shared memory, with an offset table that records where each
+    image is stored. Since the arena is one shared-memory tensor (rather than many Python objects), DataLoader worker
+    processes access the same physical memory without it being duplicated: forked workers do not trigger copy-on-write
+    through reference counting, and spawned workers receive a handle to the shared memory rather than a copy.
+
+    Images can be stored in one of two formats:
+    - "decoded": Decoded uint8 HxWxC pixel data. Accessing an image is just a copy, but the store is large.
+    - "encoded": The original encoded file contents. The store is much smaller, but images are decoded on every access.
+
+    If `max_bytes` is set, images are added in order, and any image that would take the store over the cap is skipped
+    (later, smaller images may still be stored). `load()` returns None for the skipped images, so that the caller falls
+    back to loading them from disk.
+    """
+
+    def __init__(
+        self,
+        image_paths: list[str | None],
+        mode: typing.Literal["RGB", "L"] = "RGB",
+        store_format: ImageStoreFormat = "decoded",
+        max_bytes: int | None = None,
+    ):
+        """Initialize a SharedMemoryImageStore, loading all images.
+
+        Args:
+            image_paths (list[str | None]): The image paths. None entries (e.g. examples without a mask) are skipped.
+            mode (typing.Literal["RGB", "L"], optional): The mode that images are converted to.
+            store_format (ImageStoreFormat, optional): The format that images are stored in.
+            max_bytes (int | None, optional): The maximum size of the arena. If None, all images are stored.
+        """
+        self._mode = mode
+        self._store_format = store_format
+
+        # Determine the size of every image first, so that the arena can be allocated once.
+        num_channels = 3 if mode == "RGB" else 1
+        # Each row of the table is (offset, height, width, num_channels) for decoded images, or (offset, num_bytes, 0,
+        # 0) for encoded images. An offset of -1 means that the image is not stored.
+        table = np.full((len(image_paths), 4), -1, dtype=np.int64)
+        num_bytes = 0
+        num_skipped = 0
+        for idx, image_path in enumerate(image_paths):
+            if image_path is None:
+                continue
+            if store_format == "encoded":
+                shape = (os.path.getsize(image_path), 0, 0)
+                image_num_bytes = shape[0]
+            else:
+                resolution = read_image_dimensions(image_path)
+                shape = (resolution.height, resolution.width, num_channels)
+                image_num_bytes = resolution.height * resolution.width * num_channels
+            if max_bytes is not None and num_bytes + image_num_bytes > max_bytes:
+                num_skipped += 1
+                continue
+            table[idx] = (num_bytes, *shape)
+            num_bytes += image_num_bytes
+
+        if num_skipped > 0:
+            logger.warning(
+                f"{num_skipped} images did not fit in the in-memory image store ({max_bytes / 2**20:.1f} MB). They "
+                "will be loaded from disk on every access."
+            )
+
+        # The arena is allocated in shared memory before it is populated, so that it is never copied.
+        self._arena = torch.empty(num_bytes, dtype=torch.uint8)
+        if num_bytes > 0:
+            self._arena.share_memory_()
+        arena = self._arena.numpy()
+        for idx, image_path in enumerate(image_paths):
+            offset = table[idx, 0]
+            if offset < 0:
+                continue
+            if store_format == "encoded":
+                with open(image_path, "rb") as f:
+                    data = np.frombuffer(f.read(), dtype=np.uint8)
+            else:
+                data = np.asarray(Image.open(image_path).convert(mode), dtype=np.uint8).reshape(-1)
+            arena[offset : offset + len(data)] = data
+
+        self._table = torch.from_numpy(table).share_memory_()
+
+    @property
+    def num_bytes(self) -> int:
+        """The size of the arena in bytes."""
+        return self._arena.numel()
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __contains__(self, idx: int) -> bool:
+        return int(self._table[idx, 0]) >= 0
+
+    def load(
+        self, idx: int, decode_to_tensor: bool = False, lazy_image_decode: bool = False
+    ) -> Image.Image | torch.Tensor | None:
+        """Load the image at `idx`.
+
+        Args:
+            idx (int): The image index.
+            decode_to_tensor (bool, optional): If True, the image is returned as a uint8 CxHxW tensor. Otherwise, it
+                is returned as a PIL image.
+            lazy_image_decode (bool, optional): If True, and the store format is "encoded", the PIL image is opened but
+                not decoded (see `ImageDirDataset`).
+
+        Returns:
+            Image.Image | torch.Tensor | None: The image, or None if the image is not in the store.
+        """
+        offset, *shape = (int(x) for x in self._table[idx])
+        if offset < 0:
+            return None
+
+        if self._store_format == "encoded":
+            data = self._arena[offset : offset + shape[0]]
+            if decode_to_tensor:
+                return decode_image_bytes_to_tensor(data, mode=self._mode)
+            image = Image.open(io.BytesIO(data.numpy().tobytes()))
+            if lazy_image_decode and self._mode == "RGB":
+                return image
+            return image.convert(self._mode)
+
+        height, width, num_channels = shape
+        data = self._arena[offset : offset + height * width * num_channels].view(height, width, num_channels)
+        if decode_to_tensor:
+            # Copy the data out of the arena, so that the caller can not modify the store.
+            return data.permute(2, 0, 1).clone(memory_format=torch.contiguous_format)
+        array = data.numpy()
+        if num_channels == 1:
+            # PIL can share memory with greyscale arrays, so copy the data out of the arena.
+            array = array[..., 0].copy()
+        return Image.fromarray(array)
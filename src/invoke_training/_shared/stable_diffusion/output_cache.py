@@ -0,0 +1,667 @@
+import contextlib
+import json
+import os
+import threading
+import typing
+
+import torch
+from diffusers import AutoencoderKL
+from diffusers.models.autoencoders.vae import DiagonalGaussianDistribution
+from torch.utils.data import DataLoader
+from tqdm.auto import tqdm
+from transformers import PreTrainedTokenizerBase
+
+from invoke_training._shared.data.datasets.transform_dataset import TransformDataset
+from invoke_training._shared.data.samplers.sharded_batch_sampler import ShardedBatchSampler
+from invoke_training._shared.data.transforms.cache_manifest import CacheManifest
+from invoke_training._shared.data.transforms.sharded_tensor_disk_cache import ShardedTensorDiskCache
+from invoke_training._shared.data.transforms.tensor_cache import (
+    TensorCache,
+    get_variant_cache_key,
+    open_tensor_cache_from_config,
+    write_cache_info,
+    write_key_map,
+)
+from invoke_training._shared.data.utils.async_cache_writer import AsyncCacheWriter
+from invoke_training._shared.data.utils.cache_fingerprint import fingerprint_str, fingerprint_tensors
+from invoke_training.config.data.data_loader_config import DreamboothSDDataLoaderConfig, ImageCaptionSDDataLoaderConfig
+from invoke_training.config.data.output_cache_config import OutputCacheConfig
+
+MANIFEST_FILE_NAME = "manifest.jsonl"
+COMPLETION_RECORD_DIR_NAME = "completion_records"
+
+
+def get_vae_input_fingerprint(data_batch: dict, idx: int) -> str:
+    """Get a fingerprint of all of the inputs that determine the cached VAE output for the example at `idx` in
+    `data_batch`. The image is fingerprinted after it has been transformed, so the fingerprint reflects both the source
+    image and the resize/crop/flip that was applied to it.
+
+    This requires every image to be loaded and transformed. It is only used for datasets that can not fingerprint their
+    source images without loading them (see `_filter_stale_vae_examples()`).
+    """
+    tensors = [
+        data_batch["image"][idx],
+        torch.tensor(data_batch["original_size_hw"][idx]),
+        torch.tensor(data_batch["crop_top_left_yx"][idx]),
+    ]
+    if "mask" in data_batch:
+        tensors.append(data_batch["mask"][idx])
+    return fingerprint_tensors(tensors)
+
+
+def get_caption_source_params(
+    data_loader_config: ImageCaptionSDDataLoaderConfig | DreamboothSDDataLoaderConfig,
+) -> dict[str, typing.Any]:
+    """Get the data loader params that determine the captions of the training examples: the dataset source(s) and the
+    caption settings. These are the only data loader params that affect the contents of a text encoder output cache.
+    Image settings (e.g. resolution, cropping and bucketing) are excluded.
+    """
+    return data_loader_config.model_dump(
+        include={
+            "type",
+            "dataset",
+            "caption_prefix",
+            "instance_dataset",
+            "instance_caption",
+            "class_dataset",
+            "class_caption",
+        }
+    )
+
+
+def get_tokenizer_params(tokenizer: PreTrainedTokenizerBase) -> dict[str, typing.Any]:
+    """Get params that identify a tokenizer for a persistent cache fingerprint. The vocabulary size changes when tokens
+    are added (e.g. for textual inversion embeddings).
+    """
+    return {
+        "name_or_path": tokenizer.name_or_path,
+        "vocab_size": len(tokenizer),
+        "model_max_length": tokenizer.model_max_length,
+    }
+
+
+def sample_cached_latent_dist(latent_dist_params: torch.Tensor, scaling_factor: float) -> torch.Tensor:
+    """Sample scaled latents from cached VAE latent distribution parameters (the "vae_latent_dist" cache field).
+
+    Args:
+        latent_dist_params (torch.Tensor): The concatenated mean and log-variance of the latent distribution, with shape
+            (batch_size, 2 * latent_channels, height, width).
+        scaling_factor (float): The VAE's latent scaling factor (`vae.config.scaling_factor`).
+
+    Returns:
+        torch.Tensor: The sampled latents, with shape (batch_size, latent_channels, height, width).
+    """
+    return DiagonalGaussianDistribution(latent_dist_params).sample() * scaling_factor
+
+
+def _get_completion_record_path(cache_dir: str, process_index: int, num_processes: int) -> str:
+    return os.path.join(cache_dir, COMPLETION_RECORD_DIR_NAME, f"{process_index:05d}-of-{num_processes:05d}.json")
+
+
+class _OutputCacheWriter:
+    """Helper that tracks a single output cache and its manifest during cache population.
+
+    `save()` may be called concurrently from multiple writer threads.
+    """
+
+    def __init__(self, cache_dir: str, output_cache_config: OutputCacheConfig | None, writer_id: int = 0):
+        self.cache_dir = cache_dir
+        self.cache: TensorCache = open_tensor_cache_from_config(cache_dir, output_cache_config, writer_id=writer_id)
+        self.manifest = CacheManifest(os.path.join(cache_dir, MANIFEST_FILE_NAME))
+        # Each TensorDiskCache entry is written to its own file, so entries can be written in parallel. The shards of a
+        # ShardedTensorDiskCache and the manifest are shared by all entries, so writes to them must be serialized.
+        self._serialize_cache_writes = isinstance(self.cache, ShardedTensorDiskCache)
+        self._cache_lock = threading.Lock()
+        self._manifest_lock = threading.Lock()
+        # For de-duplicated caches: a map from each example id to the key of the entry that holds its data, and the keys
+        # of the entries that have already been submitted for writing during this pass.
+        self.key_map: dict[str, str] = {}
+        self.submitted_keys: set[str] = set()
+        # The fingerprint of every entry that this writer is responsible for, whether or not it had to be re-computed.
+        self.expected_fingerprints: dict[str, str] = {}
+
+    def get_stale_idxs(self, ids: list, fingerprints: list[str]) -> list[int]:
+        """Get the indices of the examples that do not already have a valid cache entry."""
+        for example_id, fingerprint in zip(ids, fingerprints, strict=True):
+            self.expected_fingerprints[str(example_id)] = fingerprint
+        return [i for i in range(len(ids)) if not self.manifest.is_valid(ids[i], fingerprints[i])]
+
+    def clear_completion_record(self, process_index: int, num_processes: int):
+        """Delete this process's completion record from a previous cache build, if it exists."""
+        record_path = _get_completion_record_path(self.cache_dir, process_index, num_processes)
+        if os.path.exists(record_path):
+            os.remove(record_path)
+
+    def write_completion_record(self, process_index: int, num_processes: int):
+        """Record the entries that this process is responsible for. Must be called after all entries have been
+        written. The records of all processes are checked by `finalize_output_caches()`.
+        """
+        record_path = _get_completion_record_path(self.cache_dir, process_index, num_processes)
+        os.makedirs(os.path.dirname(record_path), exist_ok=True)
+        tmp_record_path = f"{record_path}.{os.getpid()}.tmp"
+        with open(tmp_record_path, "w") as f:
+            json.dump({"fingerprints": self.expected_fingerprints, "key_map": self.key_map}, f)
+        os.replace(tmp_record_path, record_path)
+
+    def save(self, key: int | str, data: dict[str, typing.Any], fingerprint: str):
+        if self._serialize_cache_writes:
+            with self._cache_lock:
+                self.cache.save(key, data, overwrite=True)
+        else:
+            self.cache.save(key, data, overwrite=True)
+        with self._manifest_lock:
+            self.manifest.record(key, fingerprint)
+
+    def save_batch(
+        self,
+        keys: list[int | str],
+        tensors: dict[str, torch.Tensor],
+        values: dict[str, list[typing.Any]],
+        fingerprints: list[str],
+    ):
+        """Split a batch of outputs into per-example entries and save them.
+
+        Args:
+            keys (list[int | str]): The cache key of each example in the batch.
+            tensors (dict[str, torch.Tensor]): Batched CPU tensors. Each is split along the batch dimension.
+            values (dict[str, list[typing.Any]]): Per-example non-tensor values.
+            fingerprints (list[str]): The input fingerprint of each example in the batch.
+        """
+        for batch_idx, key in enumerate(keys):
+            # Clone each example's slice so that only that example's data is serialized, rather than the storage of the
+            # whole batch.
+            data = {field: tensor[batch_idx].clone() for field, tensor in tensors.items()}
+            for field, field_values in values.items():
+                data[field] = field_values[batch_idx]
+            self.save(key, data, fingerprints[batch_idx])
+
+
+def _flip_data_batch(data_batch: dict) -> dict:
+    """Horizontally flip the images in a transformed data batch, and update the crop positions accordingly. This
+    produces the same result as `SDImageTransform` with a random flip applied to every example.
+    """
+    flipped_batch = dict(data_batch)
+    flipped_batch["image"] = torch.flip(data_batch["image"], dims=[-1])
+    if "mask" in data_batch:
+        flipped_batch["mask"] = torch.flip(data_batch["mask"], dims=[-1])
+    width = data_batch["image"].shape[-1]
+    flipped_batch["crop_top_left_yx"] = [
+        (top_left_y, original_size_hw[1] - width - top_left_x)
+        for (top_left_y, top_left_x), original_size_hw in zip(
+            data_batch["crop_top_left_yx"], data_batch["original_size_hw"], strict=True
+        )
+    ]
+    return flipped_batch
+
+
+def _cache_vae_outputs_for_batch(
+    data_batch: dict,
+    vae: AutoencoderKL,
+    writer: _OutputCacheWriter,
+    async_writer: AsyncCacheWriter,
+    variant: int = 0,
+    num_variants: int = 1,
+    cache_latent_distribution: bool = False,
+    source_fingerprints: dict[str, str] | None = None,
+):
+    ids = [get_variant_cache_key(example_id, variant, num_variants) for example_id in data_batch["id"]]
+    if source_fingerprints is not None:
+        fingerprints = [source_fingerprints[str(example_id)] for example_id in data_batch["id"]]
+    else:
+        fingerprints = [get_vae_input_fingerprint(data_batch, i) for i in range(len(ids))]
+    # Only run the VAE on the examples that do not already have a valid cache entry.
+    idxs = writer.get_stale_idxs(ids, fingerprints)
+    if len(idxs) == 0:
+        return
+
+    images = data_batch["image"][idxs]
+    latent_dist = vae.encode(images.to(device=vae.device, dtype=vae.dtype)).latent_dist
+
+    # Copy the whole batch to the host in one transfer, then hand it off to be split and written in the background.
+    if cache_latent_distribution:
+        # The concatenated mean and log-variance. Latents are sampled from it at training time.
+        tensors = {"vae_latent_dist": latent_dist.parameters.cpu()}
+    else:
+        tensors = {"vae_output": (latent_dist.sample() * vae.config.scaling_factor).cpu()}
+    if "mask" in data_batch:
+        tensors["mask"] = data_batch["mask"][idxs]
+    values = {
+        "original_size_hw": [data_batch["original_size_hw"][i] for i in idxs],
+        "crop_top_left_yx": [data_batch["crop_top_left_yx"][i] for i in idxs],
+    }
+    keys = [ids[i] for i in idxs]
+    stale_fingerprints = [fingerprints[i] for i in idxs]
+    async_writer.submit(lambda: writer.save_batch(keys, tensors, values, stale_fingerprints))
+
+
+def _cache_text_encoder_outputs_for_batch(
+    data_batch: dict,
+    encode_captions: typing.Callable[[list[str]], dict[str, torch.Tensor]],
+    writer: _OutputCacheWriter,
+    async_writer: AsyncCacheWriter,
+):
+    # The cache is keyed by caption content, so each unique caption is encoded and stored only once. Each example id is
+    # mapped to the key of its caption's entry. An entry's key is a fingerprint of its caption, so any existing entry
+    # with that key is valid.
+    captions = data_batch["caption"]
+    caption_keys = [fingerprint_str(caption) for caption in captions]
+    for example_id, caption_key in zip(data_batch["id"], caption_keys, strict=True):
+        writer.key_map[str(example_id)] = caption_key
+
+    idxs = []
+    for i in writer.get_stale_idxs(caption_keys, caption_keys):
+        if caption_keys[i] not in writer.submitted_keys:
+            writer.submitted_keys.add(caption_keys[i])
+            idxs.append(i)
+    if len(idxs) == 0:
+        return
+
+    outputs = encode_captions([captions[i] for i in idxs])
+
+    # Copy the whole batch to the host in one transfer, then hand it off to be split and written in the background.
+    tensors = {field: output.cpu() for field, output in outputs.items()}
+    keys = [caption_keys[i] for i in idxs]
+    async_writer.submit(lambda: writer.save_batch(keys, tensors, {}, keys))
+
+
+def get_cache_batch_size(output_cache_config: OutputCacheConfig | None, train_batch_size: int) -> int:
+    """Get the batch size to use when populating the output caches."""
+    if output_cache_config is None or output_cache_config.cache_batch_size is None:
+        return train_batch_size
+    return output_cache_config.cache_batch_size
+
+
+@contextlib.contextmanager
+def _vae_memory_options(vae: AutoencoderKL | None, slicing: bool, tiling: bool):
+    """Context manager that enables VAE slicing and/or tiling, and disables them again on exit."""
+    if vae is not None and slicing:
+        vae.enable_slicing()
+    if vae is not None and tiling:
+        vae.enable_tiling()
+    try:
+        yield
+    finally:
+        if vae is not None and slicing:
+            vae.disable_slicing()
+        if vae is not None and tiling:
+            vae.disable_tiling()
+
+
+def _populate_output_caches_pass(
+    data_loader: DataLoader,
+    vae: AutoencoderKL | None,
+    vae_writer: _OutputCacheWriter | None,
+    encode_captions: typing.Callable[[list[str]], dict[str, torch.Tensor]] | None,
+    text_encoder_writer: _OutputCacheWriter | None,
+    output_cache_config: OutputCacheConfig,
+    vae_crop_variant: int = 0,
+    vae_flip_variants: bool = False,
+    num_vae_variants: int = 1,
+    vae_source_fingerprints: dict[str, str] | None = None,
+):
+    """Run a single pass over `data_loader`, writing outputs to the VAE and/or text encoder output caches.
+
+    If `vae_source_fingerprints` is set, the VAE output cache entries are validated against the source fingerprint of
+    each example (by id) rather than against the transformed images (see `_filter_stale_vae_examples()`).
+    """
+    cache_latent_distribution = output_cache_config.cache_latent_distribution
+    with (
+        torch.inference_mode(),
+        _vae_memory_options(vae, output_cache_config.vae_slicing, output_cache_config.vae_tiling),
+        AsyncCacheWriter(
+            num_threads=output_cache_config.num_writer_threads,
+            max_pending_jobs=output_cache_config.max_pending_writes,
+        ) as async_writer,
+    ):
+        for data_batch in tqdm(data_loader):
+            if vae_writer is not None:
+                num_flip_variants = 2 if vae_flip_variants else 1
+                variant = vae_crop_variant * num_flip_variants
+                _cache_vae_outputs_for_batch(
+                    data_batch,
+                    vae,
+                    vae_writer,
+                    async_writer,
+                    variant,
+                    num_vae_variants,
+                    cache_latent_distribution,
+                    vae_source_fingerprints,
+                )
+                if vae_flip_variants:
+                    _cache_vae_outputs_for_batch(
+                        _flip_data_batch(data_batch),
+                        vae,
+                        vae_writer,
+                        async_writer,
+                        variant + 1,
+                        num_vae_variants,
+                        cache_latent_distribution,
+                        vae_source_fingerprints,
+                    )
+            if text_encoder_writer is not None:
+                _cache_text_encoder_outputs_for_batch(data_batch, encode_captions, text_encoder_writer, async_writer)
+
+
+def populate_output_caches(
+    data_loader: DataLoader,
+    vae: AutoencoderKL | None = None,
+    vae_output_cache_dir: str | None = None,
+    encode_captions: typing.Callable[[list[str]], dict[str, torch.Tensor]] | None = None,
+    text_encoder_output_cache_dir: str | None = None,
+    output_cache_config: OutputCacheConfig | None = None,
+):
+    """Populate the VAE output cache and/or the text encoder output cache in a single pass over `data_loader`.
+
+    Examples that already have a valid entry in a cache (e.g. from a previous training run, or from an interrupted
+    cache build) are skipped. Stale entries are overwritten.
+
+    Outputs are copied to the host once per batch and written to disk by background writer threads (see
+    `OutputCacheConfig.num_writer_threads`), so that the models are kept busy while the previous batches are being
+    written. This function returns after all entries have been written. The models are run under
+    `torch.inference_mode()`, with VAE slicing and tiling applied as configured in `output_cache_config`.
+
+    The text encoder output cache holds one entry per unique caption, so each caption is only encoded once no matter how
+    many examples share it. A key map from example id to caption entry is written with the cache, and is applied
+    transparently by `open_tensor_cache()`.
+
+    By default, a scaled latent sample is cached in the "vae_output" field. If
+    `output_cache_config.cache_latent_distribution` is True, the latent distribution parameters are cached in the
+    "vae_latent_dist" field instead (see `sample_cached_latent_dist()`).
+
+    If only the text encoder output cache is being populated, then `data_loader` should be built with
+    `load_images=False` so that no images are decoded.
+
+    This function populates the caches from a single process. See `populate_augmented_output_caches()` for populating
+    caches from multiple processes.
+
+    Args:
+        data_loader (DataLoader): A sequential, non-shuffled DataLoader over the full dataset. If the VAE output cache
+            is being populated, it must produce transformed "image" tensors, "original_size_hw", "crop_top_left_yx" and
+            optionally "mask". If the text encoder output cache is being populated, it must produce "caption".
+        vae (AutoencoderKL, optional): The VAE. Required if `vae_output_cache_dir` is set.
+        vae_output_cache_dir (str, optional): The VAE output cache directory. If None, the VAE output cache is not
+            populated.
+        encode_captions (Callable[[list[str]], dict[str, torch.Tensor]], optional): A function that encodes a list of
+            captions and returns a dict of batched output tensors. Each entry is split along the batch dimension and
+            cached under the same field name. Required if `text_encoder_output_cache_dir` is set.
+        text_encoder_output_cache_dir (str, optional): The text encoder output cache directory. If None, the text
+            encoder output cache is not populated.
+        output_cache_config (OutputCacheConfig, optional): The cache format options.
+    """
+    vae_writer = None
+    if vae_output_cache_dir is not None:
+        assert vae is not None
+        vae_writer = _OutputCacheWriter(vae_output_cache_dir, output_cache_config)
+
+    text_encoder_writer = None
+    if text_encoder_output_cache_dir is not None:
+        assert encode_captions is not None
+        text_encoder_writer = _OutputCacheWriter(text_encoder_output_cache_dir, output_cache_config)
+
+    if vae_writer is None and text_encoder_writer is None:
+        return
+
+    output_cache_config = output_cache_config or OutputCacheConfig()
+    _populate_output_caches_pass(
+        data_loader, vae, vae_writer, encode_captions, text_encoder_writer, output_cache_config
+    )
+
+    if text_encoder_writer is not None:
+        write_key_map(text_encoder_output_cache_dir, text_encoder_writer.key_map)
+
+    if vae_writer is not None:
+        # Record how the VAE output cache should be read (see `build_vae_output_cache_transform()`).
+        write_cache_info(
+            vae_output_cache_dir,
+            {"num_variants": 1, "latent_distribution": output_cache_config.cache_latent_distribution},
+        )
+
+
+def get_num_vae_output_variants(center_crop: bool, random_flip: bool, output_cache_config: OutputCacheConfig) -> int:
+    """Get the number of augmentation variants that are cached per image in the VAE output cache."""
+    num_crop_variants = 1 if center_crop else output_cache_config.num_crop_variants
+    num_flip_variants = 2 if random_flip else 1
+    return num_crop_variants * num_flip_variants
+
+
+def _shard_data_loader(data_loader: DataLoader, process_index: int, num_processes: int) -> DataLoader:
+    """Get a DataLoader that only produces the batches of `data_loader` that process `process_index` is responsible
+    for. Batches are assigned to processes in a round-robin fashion.
+    """
+    if num_processes == 1:
+        return data_loader
+    if isinstance(data_loader.dataset, torch.utils.data.IterableDataset):
+        raise ValueError(
+            "Output caches can not be populated from multiple processes for iterable datasets (e.g. "
+            "IMAGE_CAPTION_TAR_SHARD_DATASET). Populate the caches with a single process, or disable output caching."
+        )
+    return DataLoader(
+        data_loader.dataset,
+        batch_sampler=ShardedBatchSampler(data_loader.batch_sampler, num_shards=num_processes, shard_idx=process_index),
+        collate_fn=data_loader.collate_fn,
+        num_workers=data_loader.num_workers,
+    )
+
+
+def _filter_stale_vae_examples(
+    data_loader: DataLoader, vae_writer: _OutputCacheWriter, variants: list[int], num_variants: int
+) -> tuple[DataLoader, dict[str, str]] | None:
+    """Check the VAE output cache entries of the examples in `data_loader` without loading any images, and get a
+    DataLoader over only the examples that have a missing or stale entry for any of `variants`.
+
+    Entries are validated against a fingerprint of each example's source image files (see
+    `ImageCaptionDirDataset.get_image_source_fingerprint()`). The resize/crop/flip that is applied to an image is fully
+    determined by its source image, its id, its variant and the data loader config, and the config is already part of
+    the persistent cache directory's fingerprint. So, a warm cache can be validated without decoding a single image.
+
+    Returns:
+        tuple[DataLoader, dict[str, str]] | None: The filtered DataLoader, and the source fingerprint of every example
+            in `data_loader` by id. None if the dataset can not fingerprint its source images, in which case the caller
+            must fall back to `get_vae_input_fingerprint()`.
+    """
+    dataset = data_loader.dataset
+    base_dataset = dataset.base_dataset if isinstance(dataset, TransformDataset) else dataset
+    if data_loader.batch_sampler is None or not hasattr(base_dataset, "get_image_source_fingerprint"):
+        return None
+
+    source_fingerprints: dict[str, str] = {}
+    stale_batches: list[list[int]] = []
+    for batch in data_loader.batch_sampler:
+        # Filtering a batch keeps its examples in the same aspect ratio bucket.
+        stale_batch = []
+        for idx in batch:
+            example_id = str(base_dataset.load_example_without_images(idx)["id"])
+            fingerprint = base_dataset.get_image_source_fingerprint(idx)
+            source_fingerprints[example_id] = fingerprint
+            keys = [get_variant_cache_key(example_id, variant, num_variants) for variant in variants]
+            if len(vae_writer.get_stale_idxs(keys, [fingerprint] * len(keys))) > 0:
+                stale_batch.append(idx)
+        if len(stale_batch) > 0:
+            stale_batches.append(stale_batch)
+
+    filtered_data_loader = DataLoader(
+        dataset,
+        batch_sampler=stale_batches,
+        collate_fn=data_loader.collate_fn,
+        num_workers=data_loader.num_workers,
+    )
+    return filtered_data_loader, source_fingerprints
+
+
+def populate_augmented_output_caches(
+    build_data_loader: typing.Callable[[bool, int | None], DataLoader],
+    center_crop: bool,
+    random_flip: bool,
+    vae: AutoencoderKL | None = None,
+    vae_output_cache_dir: str | None = None,
+    encode_captions: typing.Callable[[list[str]], dict[str, torch.Tensor]] | None = None,
+    text_encoder_output_cache_dir: str | None = None,
+    output_cache_config: OutputCacheConfig | None = None,
+    process_index: int = 0,
+    num_processes: int = 1,
+):
+    """Populate the VAE output cache and/or the text encoder output cache, caching several augmentation variants of each
+    image in the VAE output cache if the data loader applies random augmentations.
+
+    The VAE output cache holds one variant for every combination of:
+    - Crop position: `output_cache_config.num_crop_variants` seeded random crops if `center_crop` is False, otherwise
+      only the center crop.
+    - Flip: flipped and unflipped if `random_flip` is True, otherwise only unflipped.
+
+    The number of variants is recorded in the cache's metadata (see `write_cache_info()`), and `LoadCacheTransform`
+    selects one variant at random each time an example is loaded.
+
+    If the dataset can fingerprint its source images without loading them (see `_filter_stale_vae_examples()`), the VAE
+    output cache entries are validated before each pass, and only the images with stale entries are loaded. In this
+    case, the text encoder output cache is populated in a separate pass that does not load any images. Otherwise, every
+    image is loaded and transformed to validate its entries, and the text encoder output cache is populated in the same
+    pass as the first crop variant.
+
+    The work can be split between multiple processes that share the cache directories. Each process must call this
+    function with its own `process_index`, and is responsible for every `num_processes`-th batch of the data loader.
+    Each process writes a completion record listing its share of the entries. Once all processes have returned,
+    `finalize_output_caches()` must be called to verify that the caches are complete, before they are used.
+
+    Args:
+        build_data_loader (Callable[[bool, int | None], DataLoader]): A function that builds a sequential, non-shuffled
+            DataLoader over the full dataset with random flipping disabled. It is called with
+            `(load_images, random_crop_seed)`.
+        center_crop (bool): The `center_crop` setting of the training data loader.
+        random_flip (bool): The `random_flip` setting of the training data loader.
+        vae (AutoencoderKL, optional): The VAE. Required if `vae_output_cache_dir` is set.
+        vae_output_cache_dir (str, optional): The VAE output cache directory. If None, the VAE output cache is not
+            populated.
+        encode_captions (Callable[[list[str]], dict[str, torch.Tensor]], optional): See `populate_output_caches()`.
+        text_encoder_output_cache_dir (str, optional): The text encoder output cache directory. If None, the text
+            encoder output cache is not populated.
+        output_cache_config (OutputCacheConfig, optional): The cache format options.
+        process_index (int, optional): The index of this process, in the range [0, num_processes).
+        num_processes (int, optional): The number of processes that are populating the caches.
+    """
+    output_cache_config = output_cache_config or OutputCacheConfig()
+
+    vae_writer = None
+    if vae_output_cache_dir is not None:
+        assert vae is not None
+        vae_writer = _OutputCacheWriter(vae_output_cache_dir, output_cache_config, writer_id=process_index)
+
+    text_encoder_writer = None
+    if text_encoder_output_cache_dir is not None:
+        assert encode_captions is not None
+        text_encoder_writer = _OutputCacheWriter(
+            text_encoder_output_cache_dir, output_cache_config, writer_id=process_index
+        )
+
+    writers = [writer for writer in (vae_writer, text_encoder_writer) if writer is not None]
+    for writer in writers:
+        writer.clear_completion_record(process_index, num_processes)
+
+    if vae_writer is None:
+        _populate_output_caches_pass(
+            _shard_data_loader(build_data_loader(False, None), process_index, num_processes),
+            vae=None,
+            vae_writer=None,
+            encode_captions=encode_captions,
+            text_encoder_writer=text_encoder_writer,
+            output_cache_config=output_cache_config,
+        )
+    else:
+        num_crop_variants = 1 if center_crop else output_cache_config.num_crop_variants
+        num_flip_variants = 2 if random_flip else 1
+        num_variants = get_num_vae_output_variants(center_crop, random_flip, output_cache_config)
+        for crop_variant in range(num_crop_variants):
+            populate_text_encoder_outputs = crop_variant == 0 and text_encoder_writer is not None
+            data_loader = _shard_data_loader(
+                build_data_loader(True, None if center_crop else crop_variant), process_index, num_processes
+            )
+            first_variant = crop_variant * num_flip_variants
+            filtered = _filter_stale_vae_examples(
+                data_loader, vae_writer, list(range(first_variant, first_variant + num_flip_variants)), num_variants
+            )
+            source_fingerprints = None
+            if filtered is not None:
+                data_loader, source_fingerprints = filtered
+                if populate_text_encoder_outputs:
+                    # Only the examples with stale VAE outputs are loaded below, so the text encoder outputs are
+                    # populated in a separate pass that does not load any images.
+                    _populate_output_caches_pass(
+                        _shard_data_loader(build_data_loader(False, None), process_index, num_processes),
+                        vae=None,
+                        vae_writer=None,
+                        encode_captions=encode_captions,
+                        text_encoder_writer=text_encoder_writer,
+                        output_cache_config=output_cache_config,
+                    )
+                    populate_text_encoder_outputs = False
+            _populate_output_caches_pass(
+                data_loader,
+                vae=vae,
+                vae_writer=vae_writer,
+                encode_captions=encode_captions if populate_text_encoder_outputs else None,
+                text_encoder_writer=text_encoder_writer if populate_text_encoder_outputs else None,
+                output_cache_config=output_cache_config,
+                vae_crop_variant=crop_variant,
+                vae_flip_variants=random_flip,
+                num_vae_variants=num_variants,
+                vae_source_fingerprints=source_fingerprints,
+            )
+        # Record how the VAE output cache should be read (see `build_vae_output_cache_transform()`). Every process
+        # writes identical metadata.
+        write_cache_info(
+            vae_output_cache_dir,
+            {"num_variants": num_variants, "latent_distribution": output_cache_config.cache_latent_distribution},
+        )
+
+    for writer in writers:
+        writer.write_completion_record(process_index, num_processes)
+
+
+def _finalize_output_cache(cache_dir: str, num_processes: int):
+    manifest = CacheManifest(os.path.join(cache_dir, MANIFEST_FILE_NAME))
+    key_map: dict[str, str] = {}
+    for process_index in range(num_processes):
+        record_path = _get_completion_record_path(cache_dir, process_index, num_processes)
+        if not os.path.exists(record_path):
+            raise RuntimeError(
+                f"The output cache '{cache_dir}' is incomplete: process {process_index} of {num_processes} did not "
+                "finish populating it. If the processes are on multiple nodes, the cache directory must be on storage "
+                "that is shared by all nodes."
+            )
+        with open(record_path) as f:
+            record = json.load(f)
+
+        num_missing = sum(
+            not manifest.is_valid(key, fingerprint) for key, fingerprint in record["fingerprints"].items()
+        )
+        if num_missing > 0:
+            raise RuntimeError(
+                f"The output cache '{cache_dir}' is incomplete: {num_missing} entries written by process "
+                f"{process_index} of {num_processes} are missing or stale."
+            )
+        key_map.update(record["key_map"])
+
+    if len(key_map) > 0:
+        write_key_map(cache_dir, key_map)
+
+
+def finalize_output_caches(
+    vae_output_cache_dir: str | None = None,
+    text_encoder_output_cache_dir: str | None = None,
+    num_processes: int = 1,
+):
+    """Verify that caches populated by `populate_augmented_output_caches()` are complete, and prepare them for reading.
+
+    This must be called after all processes have returned from `populate_augmented_output_caches()`. It can safely be
+    called from every process, so that each process verifies the caches before training starts.
+
+    Args:
+        vae_output_cache_dir (str, optional): The VAE output cache directory, if it was populated.
+        text_encoder_output_cache_dir (str, optional): The text encoder output cache directory, if it was populated.
+        num_processes (int, optional): The number of processes that populated the caches.
+
+    Raises:
+        RuntimeError: If any process did not finish populating its share of a cache.
+    """
+    for cache_dir in (vae_output_cache_dir, text_encoder_output_cache_dir):
+        if cache_dir is not None:
+            _finalize_output_cache(cache_dir, num_processes)
@@ -1,14 +1,22 @@
 import json
+import logging
+import os
 from pathlib import Path
 from typing import Any
 
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
 
 def load_jsonl(jsonl_path: Path | str) -> list[Any]:
-    """Load a JSONL file."""
+    """Load a JSONL file. Blank lines are skipped."""
     data = []
     with open(jsonl_path) as f:
-        while (line := f.readline().strip()) != "":
-            data.append(json.loads(line))
+        for line in f:
+            line = line.strip()
+            if line != "":
+                data.append(json.loads(line))
     return data
 
 
@@ -17,3 +25,119 @@ def save_jsonl(data: list[Any], jsonl_path: Path | str) -> None:
     with open(jsonl_path, "w") as f:
         for line in data:
             f.write(json.dumps(line) + "\n")
+
+
+def get_jsonl_offset_index_path(jsonl_path: Path | str) -> Path:
+    """Get the path of the persisted offset index of a JSONL file (see `IndexedJsonlReader`)."""
+    jsonl_path = Path(jsonl_path)
+    return jsonl_path.parent / f".{jsonl_path.name}.offsets.npy"
+
+
+class IndexedJsonlReader:
+    """Random access to the lines of a JSONL file, without loading the whole file into memory.
+
+    On initialization, the byte offset of every non-blank line is recorded in a compact int64 array. Lines are only read
+    and parsed when they are accessed.
+
+    The offset array is persisted next to the JSONL file (see `get_jsonl_offset_index_path()`), along with the size
+    and modification time of the JSONL file, so that it only has to be rebuilt when the file changes. The persisted
+    index is memory-mapped, so DataLoader worker processes share a single copy of it through the OS page cache.
+    """
+
+    def __init__(self, jsonl_path: Path | str):
+        self._jsonl_path = str(jsonl_path)
+        self._index_path = str(get_jsonl_offset_index_path(jsonl_path))
+
+        # The first two elements of the index array hold the size and modification time of the JSONL file when the
+        # index was built. The line offsets follow.
+        self._fingerprint = self._get_fingerprint()
+        self._index = self._load_index()
+        self._index_is_persisted = self._index is not None
+        if self._index is None:
+            self._index = self._build_index()
+            self._index_is_persisted = self._save_index(self._index)
+
+        # The file handle is opened lazily, so that each DataLoader worker process opens its own handle.
+        self._file = None
+
+    def _load_index(self) -> np.ndarray | None:
+        if not os.path.exists(self._index_path):
+            return None
+        try:
+            index = np.load(self._index_path, mmap_mode="r")
+        except (OSError, ValueError):
+            logger.warning(f"Failed to load the JSONL offset index '{self._index_path}'. It will be rebuilt.")
+            return None
+        if index.dtype != np.int64 or len(index) < 2 or tuple(index[:2]) != self._fingerprint:
+            return None
+        return index
+
+    def _build_index(self) -> np.ndarray:
+        offsets = list(self._fingerprint)
+        with open(self._jsonl_path, "rb") as f:
+            offset = 0
+            for line in f:
+                if line.strip() != b"":
+                    offsets.append(offset)
+                offset += len(line)
+        return np.array(offsets, dtype=np.int64)
+
+    def _save_index(self, index: np.ndarray) -> bool:
+        """Persist the index. Returns False if the index file could not be written (e.g. a read-only directory)."""
+        # The temporary file is process-specific, so that processes that build the index concurrently do not write to
+        # the same file. It must end in ".npy", otherwise np.save(...) appends the extension.
+        tmp_index_path = f"{self._index_path}.{os.getpid()}.tmp.npy"
+        try:
+            np.save(tmp_index_path, index)
+            # Write-then-rename, so that a concurrent reader never sees a partially-written index.
+            os.replace(tmp_index_path, self._index_path)
+        except OSError as e:
+            logger.warning(f"Failed to write the JSONL offset index '{self._index_path}': {e}")
+            if os.path.exists(tmp_index_path):
+                os.remove(tmp_index_path)
+            return False
+        return True
+
+    def _get_fingerprint(self) -> tuple[int, int]:
+        stat = os.stat(self._jsonl_path)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_file"] = None
+        if self._index_is_persisted:
+            # Each process memory-maps the persisted index, rather than receiving a copy of it.
+            state["_index"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._index is not None:
+            return
+
+        if self._get_fingerprint() != self._fingerprint:
+            raise RuntimeError(
+                f"The JSONL file '{self._jsonl_path}' was modified after it was indexed. Its lines no longer match the "
+                "lines of the original reader."
+            )
+        # The persisted index may have been removed or overwritten since it was written (e.g. by a reader of a later
+        # version of the JSONL file), so it is validated against the JSONL file rather than trusted.
+        self._index = self._load_index()
+        if self._index is None:
+            logger.warning(f"The JSONL offset index '{self._index_path}' is missing or stale. It will be rebuilt.")
+            self._index = self._build_index()
+            self._index_is_persisted = False
+
+    def __len__(self) -> int:
+        return len(self._index) - 2
+
+    def __getitem__(self, idx: int) -> Any:
+        """Read and parse the line at `idx` (counting only non-blank lines)."""
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Index {idx} is out of range for '{self._jsonl_path}' with {len(self)} lines.")
+        if self._file is None:
+            self._file = open(self._jsonl_path, "rb")
+        self._file.seek(int(self._index[idx + 2]))
+        return json.loads(self._file.readline())
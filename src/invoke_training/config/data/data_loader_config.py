@@ -2,6 +2,7 @@ from typing import Literal, Optional
 
 from invoke_training.config.config_base_model import ConfigBaseModel
 from invoke_training.config.data.dataset_config import (
+    CompiledDatasetConfig,
     ImageCaptionDatasetConfig,
     ImageDirDatasetConfig,
 )
@@ -26,7 +27,7 @@ class AspectRatioBucketConfig(ConfigBaseModel):
         bucket. Review these logs to make sure that images are being split into buckets as expected.
 
         Highly fragmented splits (i.e. many buckets with few examples in each) can 1) limit the extent to which examples
-        can be shuffled, and 2) slow down training if there are many partial batches.
+        can be shuffled, and 2) slow down training if there are many partial batches (see `partial_batch_policy`).
     """
     end_dim: int
     """See explanation under
@@ -38,6 +39,39 @@ class AspectRatioBucketConfig(ConfigBaseModel):
     [`start_dim`][invoke_training.config.data.data_loader_config.AspectRatioBucketConfig.start_dim].
     """
 
+    max_pixels_per_batch: int | None = None
+    """If set, the batch size of each bucket is chosen so that a batch holds at most this many pixels (i.e. the batch
+    size of a bucket with resolution `(height, width)` is `max(1, max_pixels_per_batch // (height * width))`), rather
+    than using `train_batch_size` for all buckets. This keeps the memory usage of every step roughly constant, which
+    is useful when the buckets span a wide range of resolutions.
+
+    With variable batch sizes, the loss of each batch is summed over its examples and divided by `train_batch_size`
+    (rather than averaged over the batch), so that every example has the same weight in the accumulated gradient. Set
+    `train_batch_size` to the batch size of a typical bucket (e.g. `max_pixels_per_batch // target_resolution**2`) to
+    keep the effective batch size, and so the learning rate, comparable to fixed-batch-size training.
+    """
+
+    partial_batch_policy: Literal["keep", "drop", "fill", "merge"] = "keep"
+    """How the last, partial batch of each aspect ratio bucket is handled. Many small buckets produce many partial
+    batches, which slow down training.
+
+    - `keep`: Keep the partial batches.
+    - `drop`: Drop the partial batches. A different subset of each bucket is dropped on every epoch when shuffling.
+    - `fill`: Fill the partial batches with examples resampled from the same bucket.
+    - `merge`: Merge buckets with fewer images than a full batch into the neighbouring aspect ratio buckets. Any
+    remaining partial batches are kept.
+
+    The number of partial batches that are affected is logged at the start of training. Only `keep` is supported for
+    streaming datasets.
+    """
+
+    stream_buffer_size: int = 256
+    """Only used for streaming datasets (`IMAGE_CAPTION_TAR_SHARD_DATASET`, and `HF_HUB_IMAGE_CAPTION_DATASET` with
+    `streaming: True`), whose image dimensions are not known up front. Examples are buffered per bucket, and a batch is
+    emitted as soon as its bucket is full. When this many examples are buffered across all buckets, the fullest bucket
+    is emitted as a partial batch. Larger buffers produce fewer partial batches, at the cost of memory.
+    """
+
 
 class ImageCaptionSDDataLoaderConfig(ConfigBaseModel):
     type: Literal["IMAGE_CAPTION_SD_DATA_LOADER"] = "IMAGE_CAPTION_SD_DATA_LOADER"
@@ -61,6 +95,22 @@ class ImageCaptionSDDataLoaderConfig(ConfigBaseModel):
     """Whether random flip augmentations should be applied to input images.
     """
 
+    jpeg_draft_decode: bool = False
+    """If True, large JPEG images are decoded at a reduced resolution (using JPEG DCT scaling) that is still at least as
+    large as the size that they will be resized to. This can dramatically reduce the CPU time spent loading images when
+    the source images are much larger than the training resolution, with a negligible effect on the resulting images.
+    Has no effect on other image formats, on images kept in memory with `keep_in_memory_format: decoded`, or when masks
+    are used.
+    """
+
+    image_decode_backend: Literal["pil", "torchvision"] = "pil"
+    """The library used to decode and transform image files. "torchvision" decodes image files directly to tensors
+    (with `torchvision.io`) and resizes, crops, flips and normalizes them as tensors, avoiding the per-image conversions
+    to and from PIL. The results are identical to "pil" up to small resize rounding differences. "torchvision" only
+    supports JPEG and PNG files, and takes precedence over `jpeg_draft_decode`. Has no effect on Hugging Face Hub
+    datasets.
+    """
+
     caption_prefix: str | None = None
     """A prefix that will be prepended to all captions. If None, no prefix will be added.
     """
@@ -76,8 +126,8 @@ class DreamboothSDDataLoaderConfig(ConfigBaseModel):
     instance_caption: str
     class_caption: Optional[str] = None
 
-    instance_dataset: ImageDirDatasetConfig
-    class_dataset: Optional[ImageDirDatasetConfig] = None
+    instance_dataset: ImageDirDatasetConfig | CompiledDatasetConfig
+    class_dataset: Optional[ImageDirDatasetConfig | CompiledDatasetConfig] = None
 
     class_data_loss_weight: float = 1.0
     """The loss weight applied to class dataset examples. Instance dataset examples have an implicit loss weight of 1.0.
@@ -103,6 +153,21 @@ class DreamboothSDDataLoaderConfig(ConfigBaseModel):
     """Whether random flip augmentations should be applied to input images.
     """
 
+    jpeg_draft_decode: bool = False
+    """If True, large JPEG images are decoded at a reduced resolution (using JPEG DCT scaling) that is still at least as
+    large as the size that they will be resized to. This can dramatically reduce the CPU time spent loading images when
+    the source images are much larger than the training resolution, with a negligible effect on the resulting images.
+    Has no effect on other image formats, on images kept in memory with `keep_in_memory_format: decoded`, or when masks
+    are used.
+    """
+
+    image_decode_backend: Literal["pil", "torchvision"] = "pil"
+    """The library used to decode and transform image files. "torchvision" decodes image files directly to tensors
+    (with `torchvision.io`) and resizes, crops, flips and normalizes them as tensors, avoiding the per-image conversions
+    to and from PIL. The results are identical to "pil" up to small resize rounding differences. "torchvision" only
+    supports JPEG and PNG files, and takes precedence over `jpeg_draft_decode`.
+    """
+
     dataloader_num_workers: int = 0
     """Number of subprocesses to use for data loading. 0 means that the data will be loaded in the main process.
     """
@@ -149,6 +214,22 @@ class TextualInversionSDDataLoaderConfig(ConfigBaseModel):
     """Whether random flip augmentations should be applied to input images.
     """
 
+    jpeg_draft_decode: bool = False
+    """If True, large JPEG images are decoded at a reduced resolution (using JPEG DCT scaling) that is still at least as
+    large as the size that they will be resized to. This can dramatically reduce the CPU time spent loading images when
+    the source images are much larger than the training resolution, with a negligible effect on the resulting images.
+    Has no effect on other image formats, on images kept in memory with `keep_in_memory_format: decoded`, or when masks
+    are used.
+    """
+
+    image_decode_backend: Literal["pil", "torchvision"] = "pil"
+    """The library used to decode and transform image files. "torchvision" decodes image files directly to tensors
+    (with `torchvision.io`) and resizes, crops, flips and normalizes them as tensors, avoiding the per-image conversions
+    to and from PIL. The results are identical to "pil" up to small resize rounding differences. "torchvision" only
+    supports JPEG and PNG files, and takes precedence over `jpeg_draft_decode`. Has no effect on Hugging Face Hub
+    datasets.
+    """
+
     shuffle_caption_delimiter: str | None = None
     """If `None`, then no caption shuffling is applied. If set, then captions are split on this delimiter and shuffled.
     """
@@ -29,6 +29,22 @@ class HFHubImageCaptionDatasetConfig(ConfigBaseModel):
     """The name of the dataset column that contains captions.
     """
 
+    streaming: bool = False
+    """If `True`, stream the dataset from the Hugging Face Hub rather than downloading and preparing the whole dataset
+    before training starts. This lets training start within seconds on very large datasets. Streaming datasets do not
+    support output caching.
+    """
+
+    shuffle_buffer_size: int = 1000
+    """Only used if `streaming` is `True`. The number of examples held in the shuffle buffer. The shard order is
+    shuffled on every epoch, and examples are then drawn at random from a buffer of this size.
+    """
+
+    num_examples: Optional[int] = None
+    """Only used if `streaming` is `True`. The number of examples in the 'train' split. If None, it is read from the
+    dataset info on the Hugging Face Hub (which is not available for all datasets).
+    """
+
 
 class ImageCaptionJsonlDatasetConfig(ConfigBaseModel):
     type: Literal["IMAGE_CAPTION_JSONL_DATASET"] = "IMAGE_CAPTION_JSONL_DATASET"
@@ -47,7 +63,21 @@ class ImageCaptionJsonlDatasetConfig(ConfigBaseModel):
     keep_in_memory: bool = False
     """If `True`, load all images into memory on initialization so that they can be accessed quickly. If `False`, images
     are loaded from disk each time they are accessed. Setting to `True` improves performance for datasets that are small
-    enough to be kept in memory.
+    enough to be kept in memory. The images are stored once in shared memory, and are not duplicated across data loader
+    workers.
+    """
+
+    keep_in_memory_format: Literal["decoded", "encoded"] = "decoded"
+    """Only used if `keep_in_memory` is `True`. The format that images are kept in memory in:
+
+    - `decoded`: The decoded pixel data. This is fastest, but uses `height * width * 3` bytes per image.
+    - `encoded`: The original image file contents (e.g. JPEG data). This uses much less memory, but images are decoded
+    on every access.
+    """
+
+    keep_in_memory_max_mb: Optional[int] = None
+    """Only used if `keep_in_memory` is `True`. The maximum amount of memory (in MB) used to keep images in memory.
+    Images that do not fit are loaded from disk each time they are accessed. If None, there is no limit.
     """
 
 
@@ -60,7 +90,21 @@ class ImageDirDatasetConfig(ConfigBaseModel):
     keep_in_memory: bool = False
     """If `True`, load all images into memory on initialization so that they can be accessed quickly. If `False`, images
     are loaded from disk each time they are accessed. Setting to `True` improves performance for datasets that are small
-    enough to be kept in memory.
+    enough to be kept in memory. The images are stored once in shared memory, and are not duplicated across data loader
+    workers.
+    """
+
+    keep_in_memory_format: Literal["decoded", "encoded"] = "decoded"
+    """Only used if `keep_in_memory` is `True`. The format that images are kept in memory in:
+
+    - `decoded`: The decoded pixel data. This is fastest, but uses `height * width * 3` bytes per image.
+    - `encoded`: The original image file contents (e.g. JPEG data). This uses much less memory, but images are decoded
+    on every access.
+    """
+
+    keep_in_memory_max_mb: Optional[int] = None
+    """Only used if `keep_in_memory` is `True`. The maximum amount of memory (in MB) used to keep images in memory.
+    Images that do not fit are loaded from disk each time they are accessed. If None, there is no limit.
     """
 
 
@@ -73,12 +117,71 @@ class ImageCaptionDirDatasetConfig(ConfigBaseModel):
     keep_in_memory: bool = False
     """If `True`, load all images into memory on initialization so that they can be accessed quickly. If `False`, images
     are loaded from disk each time they are accessed. Setting to `True` improves performance for datasets that are small
-    enough to be kept in memory.
+    enough to be kept in memory. The images are stored once in shared memory, and are not duplicated across data loader
+    workers.
+    """
+
+    keep_in_memory_format: Literal["decoded", "encoded"] = "decoded"
+    """Only used if `keep_in_memory` is `True`. The format that images are kept in memory in:
+
+    - `decoded`: The decoded pixel data. This is fastest, but uses `height * width * 3` bytes per image.
+    - `encoded`: The original image file contents (e.g. JPEG data). This uses much less memory, but images are decoded
+    on every access.
+    """
+
+    keep_in_memory_max_mb: Optional[int] = None
+    """Only used if `keep_in_memory` is `True`. The maximum amount of memory (in MB) used to keep images in memory.
+    Images that do not fit are loaded from disk each time they are accessed. If None, there is no limit.
+    """
+
+
+class CompiledDatasetConfig(ConfigBaseModel):
+    type: Literal["COMPILED_DATASET"] = "COMPILED_DATASET"
+
+    dataset_dir: str
+    """The directory of a compiled dataset, produced by `invoke-compile-dataset`. A compiled dataset contains images
+    that have already been resized to their training resolution, so images do not have to be decoded and resized on
+    every epoch.
+    """
+
+
+class ImageCaptionTarShardDatasetConfig(ConfigBaseModel):
+    type: Literal["IMAGE_CAPTION_TAR_SHARD_DATASET"] = "IMAGE_CAPTION_TAR_SHARD_DATASET"
+
+    shards: str | list[str]
+    """The paths of the WebDataset-style `.tar` shards that make up the dataset. Each path can be a glob pattern (e.g.
+    `/data/my_dataset/*.tar`). The shards are read sequentially, so this dataset type is suitable for very large
+    datasets on storage with slow random access (e.g. network filesystems or mounted object storage).
+    """
+
+    image_extension: str = "jpg"
+    """The extension of the image file in each example (e.g. the `0001.jpg` in `0001.jpg`, `0001.txt`)."""
+
+    caption_extension: str = "txt"
+    """The extension of the caption file in each example."""
+
+    mask_extension: str | None = "png"
+    """The extension of the optional mask file in each example. Examples without a mask file are allowed."""
+
+    shuffle_buffer_size: int = 1000
+    """The number of examples held in the shuffle buffer. The shard order is shuffled on every epoch, and examples are
+    then drawn at random from a buffer of this size. Larger buffers give a more uniform shuffle, at the cost of memory.
+    """
+
+    num_examples: int | None = None
+    """The total number of examples in the dataset, if known. If None, the number of examples is counted by reading the
+    headers of every shard on startup.
     """
 
 
 # Datasets that produce image-caption pairs.
 ImageCaptionDatasetConfig = Annotated[
-    Union[HFHubImageCaptionDatasetConfig, ImageCaptionJsonlDatasetConfig, ImageCaptionDirDatasetConfig],
+    Union[
+        HFHubImageCaptionDatasetConfig,
+        ImageCaptionJsonlDatasetConfig,
+        ImageCaptionDirDatasetConfig,
+        CompiledDatasetConfig,
+        ImageCaptionTarShardDatasetConfig,
+    ],
     Field(discriminator="type"),
 ]
@@ -0,0 +1,92 @@
+from typing import Literal
+
+from invoke_training.config.config_base_model import ConfigBaseModel
+
+
+class OutputCacheConfig(ConfigBaseModel):
+    """Options that control how model outputs are cached when `cache_vae_outputs` or `cache_text_encoder_outputs` is
+    enabled.
+    """
+
+    cache_dir: str | None = None
+    """The directory where VAE and text encoder output caches are stored. If None, the caches are written to a temporary
+    directory that is deleted at the end of training.
+
+    If set, the caches persist across training runs. Each cache is stored in a sub-directory identified by a
+    fingerprint of the model, the `weight_dtype`, the options below that change the cached values (e.g.
+    `storage_dtype`, `num_crop_variants` and `vae_tiling`) and the data loader config (e.g. dataset, resolution, aspect
+    ratio buckets, cropping and flipping), so that runs with the same settings share a cache. Every cache entry also
+    records a fingerprint of the data that it was computed from (the transformed image, or the caption). Valid entries
+    are re-used, stale entries are re-computed, and an interrupted cache build resumes where it left off.
+
+    Temporary caches are populated separately on each node. A persistent cache is populated once by all processes, so
+    for multi-node training `cache_dir` must be on storage that is shared by all nodes.
+    """
+
+    cache_format: Literal["pt", "sharded"] = "pt"
+    """The on-disk format of the caches.
+
+    - `"pt"`: Each cache entry is saved to its own file with `torch.save()`.
+    - `"sharded"`: Cache entries are packed into large shard files with an offset index. Tensors are loaded via
+    memory-mapping, without unpickling or copying. This is recommended for large datasets, where the `"pt"` format
+    results in a very large number of small files.
+    """
+
+    storage_dtype: Literal["float32", "float16", "bfloat16"] | None = None
+    """If set, floating point tensors are stored in this precision to reduce the size of the caches. Tensors are cast
+    back to their original dtype when they are loaded. If None, tensors are stored in their original precision. Only
+    applies when `cache_format` is `"sharded"`.
+    """
+
+    max_shard_size_mb: int = 1024
+    """The maximum size of each shard file in megabytes. Only applies when `cache_format` is `"sharded"`.
+    """
+
+    cache_latent_distribution: bool = False
+    """If True, the VAE output cache stores the parameters of the VAE's latent distribution (the diagonal Gaussian mean
+    and log-variance) rather than a single sample from it. A new latent is sampled from the cached distribution at every
+    training step, which restores the sampling noise that is lost when a single latent sample is cached. This doubles
+    the size of the VAE output cache. To reduce the size of the cache, combine with `cache_format: "sharded"` and
+    `storage_dtype: "float16"`.
+    """
+
+    num_crop_variants: int = 1
+    """The number of random crop positions that are cached per image when `cache_vae_outputs` is enabled and the data
+    loader's `center_crop` is False. Each crop position is fixed for the life of the cache, and one cached variant is
+    selected at random each time an image is loaded. If the data loader's `random_flip` is True, a flipped variant of
+    each crop is also cached. More variants preserve more augmentation diversity, at the cost of a proportionally
+    larger cache and longer cache population.
+    """
+
+    cache_batch_size: int | None = None
+    """The batch size used when populating the caches. If None, `train_batch_size` is used. Populating the caches only
+    runs inference, so a much larger batch size than `train_batch_size` is typically possible. When aspect ratio
+    bucketing is enabled, each batch only contains images from a single bucket.
+    """
+
+    vae_slicing: bool = False
+    """If True, VAE slicing is enabled while populating the VAE output cache, so that the images in a batch are encoded
+    one at a time. This reduces the peak memory used by large values of `cache_batch_size`.
+    """
+
+    vae_tiling: bool = False
+    """If True, VAE tiling is enabled while populating the VAE output cache, so that each image is encoded in
+    overlapping tiles. This reduces the peak memory used at high resolutions, but may cause subtle tiling artifacts in
+    the cached latents.
+    """
+
+    num_writer_threads: int = 2
+    """The number of background threads that write cache entries to disk while the next batch is being encoded.
+    """
+
+    max_pending_writes: int = 4
+    """The maximum number of encoded batches that can be waiting to be written to disk. When this limit is reached,
+    encoding pauses until the writer threads catch up. This bounds the host memory used while populating the caches.
+    """
+
+    memory_cache_size_mb: int = 0
+    """If greater than 0, each output cache is read through an in-memory tier with this size budget (in megabytes).
+    Before training starts, the in-memory tier is filled with as many cache entries as fit in the budget. These entries
+    are held in shared memory, so a single copy is shared by all data loader workers. When there are no data loader
+    workers, entries are loaded on demand and the least-recently-used entries are evicted once the budget is reached.
+    """
@@ -3,10 +3,9 @@ import json
 import logging
 import math
 import os
-import tempfile
 import time
 from pathlib import Path
-from typing import Literal, Optional, Union
+from typing import Callable, Literal, Optional, Union
 
 import peft
 import torch
@@ -19,15 +18,22 @@ from tqdm.auto import tqdm
 from transformers import CLIPTextModel, CLIPTokenizer
 
 from invoke_training._shared.accelerator.accelerator_utils import (
+    create_shared_temp_dir,
+    get_cache_process_info,
     get_dtype_from_str,
     initialize_accelerator,
     initialize_logging,
+    prepare_data_loader,
 )
 from invoke_training._shared.checkpoints.checkpoint_tracker import CheckpointTracker
 from invoke_training._shared.data.data_loaders.dreambooth_sd_dataloader import build_dreambooth_sd_dataloader
-from invoke_training._shared.data.data_loaders.image_caption_sd_dataloader import build_image_caption_sd_dataloader
+from invoke_training._shared.data.data_loaders.image_caption_sd_dataloader import (
+    build_image_caption_sd_dataloader,
+    get_loss_normalization_batch_size,
+)
 from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import log_aspect_ratio_buckets
-from invoke_training._shared.data.transforms.tensor_disk_cache import TensorDiskCache
+from invoke_training._shared.data.samplers.sampler_state import set_sampler_epoch
+from invoke_training._shared.data.utils.cache_fingerprint import get_persistent_cache_dir
 from invoke_training._shared.optimizer.optimizer_utils import initialize_optimizer
 from invoke_training._shared.stable_diffusion.lora_checkpoint_utils import (
     save_sd_kohya_checkpoint,
@@ -35,10 +41,20 @@ from invoke_training._shared.stable_diffusion.lora_checkpoint_utils import (
 )
 from invoke_training._shared.stable_diffusion.min_snr_weighting import compute_snr
 from invoke_training._shared.stable_diffusion.model_loading_utils import load_models_sd
+from invoke_training._shared.stable_diffusion.output_cache import (
+    finalize_output_caches,
+    get_cache_batch_size,
+    get_caption_source_params,
+    get_tokenizer_params,
+    populate_augmented_output_caches,
+    populate_output_caches,
+    sample_cached_latent_dist,
+)
 from invoke_training._shared.stable_diffusion.tokenize_captions import tokenize_captions
 from invoke_training._shared.stable_diffusion.validation import generate_validation_images_sd
 from invoke_training._shared.utils.import_xformers import import_xformers
 from invoke_training.config.data.data_loader_config import DreamboothSDDataLoaderConfig, ImageCaptionSDDataLoaderConfig
+from invoke_training.config.data.output_cache_config import OutputCacheConfig
 from invoke_training.pipelines.callbacks import ModelCheckpoint, ModelType, PipelineCallbacks, TrainingCheckpoint
 from invoke_training.pipelines.stable_diffusion.lora.config import SdLoraConfig
 
@@ -85,6 +101,12 @@ def _build_data_loader(
     vae_output_cache_dir: Optional[str] = None,
     shuffle: bool = True,
     sequential_batching: bool = False,
+    load_images: bool = True,
+    random_crop_seed: Optional[int] = None,
+    memory_cache_size_mb: int = 0,
+    seed: Optional[int] = None,
+    num_processes: int = 1,
+    process_index: int = 0,
 ) -> DataLoader:
     if data_loader_config.type == "IMAGE_CAPTION_SD_DATA_LOADER":
         return build_image_caption_sd_dataloader(
@@ -95,6 +117,12 @@ def _build_data_loader(
             text_encoder_cache_field_to_output_field={"text_encoder_output": "text_encoder_output"},
             vae_output_cache_dir=vae_output_cache_dir,
             shuffle=shuffle,
+            load_images=load_images,
+            random_crop_seed=random_crop_seed,
+            memory_cache_size_mb=memory_cache_size_mb,
+            seed=seed,
+            num_processes=num_processes,
+            process_index=process_index,
         )
     elif data_loader_config.type == "DREAMBOOTH_SD_DATA_LOADER":
         if use_masks:
@@ -107,56 +135,120 @@ def _build_data_loader(
             vae_output_cache_dir=vae_output_cache_dir,
             shuffle=shuffle,
             sequential_batching=sequential_batching,
+            load_images=load_images,
+            random_crop_seed=random_crop_seed,
+            memory_cache_size_mb=memory_cache_size_mb,
+            seed=seed,
+            num_processes=num_processes,
+            process_index=process_index,
         )
     else:
         raise ValueError(f"Unsupported data loader config type: '{data_loader_config.type}'.")
 
 
+def _build_caption_encoder(
+    tokenizer: CLIPTokenizer, text_encoder: CLIPTextModel
+) -> Callable[[list[str]], dict[str, torch.Tensor]]:
+    """Build a function that encodes a batch of captions into the fields that are stored in the text encoder output
+    cache.
+    """
+
+    def encode_captions(captions: list[str]) -> dict[str, torch.Tensor]:
+        caption_token_ids = tokenize_captions(tokenizer, captions).to(text_encoder.device)
+        return {"text_encoder_output": text_encoder(caption_token_ids)[0]}
+
+    return encode_captions
+
+
+def cache_outputs(
+    config: SdLoraConfig,
+    tokenizer: CLIPTokenizer,
+    text_encoder: CLIPTextModel,
+    vae: AutoencoderKL,
+    text_encoder_output_cache_dir: str | None = None,
+    vae_output_cache_dir: str | None = None,
+    output_cache_config: OutputCacheConfig | None = None,
+    process_index: int = 0,
+    num_processes: int = 1,
+):
+    """Populate the text encoder output cache and/or the VAE output cache in a single pass over the dataset.
+
+    If only the text encoder output cache is being populated, the images are never loaded. If the data loader applies
+    random crops or flips, several augmentation variants of each image are cached (see
+    `populate_augmented_output_caches()`).
+
+    Args:
+        config (SdLoraConfig): Training config.
+        tokenizer (CLIPTokenizer): The tokenizer.
+        text_encoder (CLIPTextModel): The text_encoder.
+        vae (AutoencoderKL): The VAE.
+        text_encoder_output_cache_dir (str, optional): The text encoder output cache directory. If None, the text
+            encoder outputs are not cached.
+        vae_output_cache_dir (str, optional): The VAE output cache directory. If None, the VAE outputs are not cached.
+        output_cache_config (OutputCacheConfig, optional): The cache format options.
+        process_index (int, optional): The index of this process, when the caches are populated by multiple processes.
+        num_processes (int, optional): The number of processes that are populating the caches. When all processes have
+            returned, `finalize_output_caches()` must be called before the caches are used.
+    """
+
+    def build_data_loader(load_images: bool, random_crop_seed: int | None) -> DataLoader:
+        # Flipped variants are produced by populate_augmented_output_caches(), so random flipping is disabled here.
+        return _build_data_loader(
+            data_loader_config=config.data_loader.model_copy(update={"random_flip": False}),
+            batch_size=get_cache_batch_size(output_cache_config, config.train_batch_size),
+            use_masks=config.use_masks and load_images,
+            shuffle=False,
+            sequential_batching=True,
+            load_images=load_images,
+            random_crop_seed=random_crop_seed,
+        )
+
+    populate_augmented_output_caches(
+        build_data_loader,
+        center_crop=config.data_loader.center_crop,
+        random_flip=config.data_loader.random_flip,
+        vae=vae,
+        vae_output_cache_dir=vae_output_cache_dir,
+        encode_captions=_build_caption_encoder(tokenizer, text_encoder),
+        text_encoder_output_cache_dir=text_encoder_output_cache_dir,
+        output_cache_config=output_cache_config,
+        process_index=process_index,
+        num_processes=num_processes,
+    )
+
+
 def cache_text_encoder_outputs(
-    cache_dir: str, config: SdLoraConfig, tokenizer: CLIPTokenizer, text_encoder: CLIPTextModel
+    cache_dir: str,
+    config: SdLoraConfig,
+    tokenizer: CLIPTokenizer,
+    text_encoder: CLIPTextModel,
+    output_cache_config: OutputCacheConfig | None = None,
 ):
-    """Run the text encoder on all captions in the dataset and cache the results to disk.
+    """Run the text encoder on all captions in the dataset and cache the results to disk. The images are never loaded.
+
+    Examples that already have a valid entry in the cache (e.g. from a previous training run, or from an interrupted
+    cache build) are skipped. Stale entries are overwritten.
 
     Args:
         cache_dir (str): The directory where the results will be cached.
         config (SdLoraConfig): Training config.
         tokenizer (CLIPTokenizer): The tokenizer.
         text_encoder (CLIPTextModel): The text_encoder.
+        output_cache_config (OutputCacheConfig, optional): The cache format options.
     """
     data_loader = _build_data_loader(
         data_loader_config=config.data_loader,
-        batch_size=config.train_batch_size,
+        batch_size=get_cache_batch_size(output_cache_config, config.train_batch_size),
         shuffle=False,
         sequential_batching=True,
+        load_images=False,
+    )
+    populate_output_caches(
+        data_loader,
+        encode_captions=_build_caption_encoder(tokenizer, text_encoder),
+        text_encoder_output_cache_dir=cache_dir,
+        output_cache_config=output_cache_config,
     )
-
-    cache = TensorDiskCache(cache_dir)
-
-    for data_batch in tqdm(data_loader):
-        caption_token_ids = tokenize_captions(tokenizer, data_batch["caption"]).to(text_encoder.device)
-        text_encoder_output_batch = text_encoder(caption_token_ids)[0]
-        # Split batch before caching.
-        for i in range(len(data_batch["id"])):
-            cache.save(data_batch["id"][i], {"text_encoder_output": text_encoder_output_batch[i]})
-
-
-def cache_vae_outputs(cache_dir: str, data_loader: DataLoader, vae: AutoencoderKL):
-    """Run the VAE on all images in the dataset and cache the results to disk."""
-    cache = TensorDiskCache(cache_dir)
-
-    for data_batch in tqdm(data_loader):
-        latents = vae.encode(data_batch["image"].to(device=vae.device, dtype=vae.dtype)).latent_dist.sample()
-        latents = latents * vae.config.scaling_factor
-        # Split batch before caching.
-        for i in range(len(data_batch["id"])):
-            data = {
-                "vae_output": latents[i],
-                "original_size_hw": data_batch["original_size_hw"][i],
-                "crop_top_left_yx": data_batch["crop_top_left_yx"][i],
-            }
-            if "mask" in data_batch:
-                data["mask"] = data_batch["mask"][i]
-            cache.save(data_batch["id"][i], data)
 
 
 def train_forward(  # noqa: C901
@@ -170,6 +262,7 @@ def train_forward(  # noqa: C901
     weight_dtype: torch.dtype,
     use_masks: bool = False,
     min_snr_gamma: float | None = None,
+    loss_normalization_batch_size: int | None = None,
 ) -> torch.Tensor:
     """Run the forward training pass for a single data_batch.
 
@@ -177,8 +270,11 @@ def train_forward(  # noqa: C901
         torch.Tensor: Loss
     """
     # Convert images to latent space.
-    # The VAE output may have been cached and included in the data_batch. If not, we calculate it here.
+    # The VAE output may have been cached and included in the data_batch, either as a latent sample or as the parameters
+    # of the latent distribution to sample from. If not, we calculate it here.
     latents = data_batch.get("vae_output", None)
+    if latents is None and "vae_latent_dist" in data_batch:
+        latents = sample_cached_latent_dist(data_batch["vae_latent_dist"], vae.config.scaling_factor)
     if latents is None:
         latents = vae.encode(data_batch["image"].to(dtype=weight_dtype)).latent_dist.sample()
         latents = latents * vae.config.scaling_factor
@@ -261,6 +357,11 @@ def train_forward(  # noqa: C901
     if "loss_weight" in data_batch:
         loss = loss * data_batch["loss_weight"]
 
+    if loss_normalization_batch_size is not None:
+        # The batch size varies between batches (e.g. between aspect ratio buckets). Normalize by a fixed batch size
+        # rather than the actual batch size, so that every example has the same weight in the (accumulated) gradient.
+        return loss.sum() / loss_normalization_batch_size
+
     return loss.mean()
 
 
@@ -326,48 +427,93 @@ def train(config: SdLoraConfig, callbacks: list[PipelineCallbacks] | None = None
         if config.train_text_encoder:
             raise ValueError("'cache_text_encoder_outputs' and 'train_text_encoder' cannot both be True.")
 
-        # We use a temporary directory for the cache. The directory will automatically be cleaned up when
-        # tmp_text_encoder_output_cache_dir is destroyed.
-        tmp_text_encoder_output_cache_dir = tempfile.TemporaryDirectory()
-        text_encoder_output_cache_dir_name = tmp_text_encoder_output_cache_dir.name
-        if accelerator.is_local_main_process:
-            # Only the main process should populate the cache.
-            logger.info(f"Generating text encoder output cache ('{text_encoder_output_cache_dir_name}').")
-            text_encoder.to(accelerator.device, dtype=weight_dtype)
-            cache_text_encoder_outputs(text_encoder_output_cache_dir_name, config, tokenizer, text_encoder)
-        # Move the text_encoder back to the CPU, because it is not needed for training.
-        text_encoder.to("cpu")
-        accelerator.wait_for_everyone()
-    else:
-        text_encoder.to(accelerator.device, dtype=weight_dtype)
+        if config.output_cache.cache_dir is None:
+            # We use a temporary directory for the cache, shared by the processes on this node. The directory will
+            # automatically be cleaned up when tmp_text_encoder_output_cache_dir is destroyed.
+            tmp_text_encoder_output_cache_dir, text_encoder_output_cache_dir_name = create_shared_temp_dir(accelerator)
+        else:
+            text_encoder_output_cache_dir_name = get_persistent_cache_dir(
+                base_cache_dir=config.output_cache.cache_dir,
+                cache_name="text_encoder_outputs",
+                cache_params={
+                    "model": config.model,
+                    "hf_variant": config.hf_variant,
+                    "base_embeddings": config.base_embeddings,
+                    "text_encoder": text_encoder.config.to_dict(),
+                    "tokenizer": get_tokenizer_params(tokenizer),
+                    "weight_dtype": config.weight_dtype,
+                    "cache_format": config.output_cache.cache_format,
+                    "storage_dtype": config.output_cache.storage_dtype,
+                    "captions": get_caption_source_params(config.data_loader),
+                },
+            )
 
     # Prepare VAE output cache.
     vae_output_cache_dir_name = None
     if config.cache_vae_outputs:
-        if config.data_loader.random_flip:
-            raise ValueError("'cache_vae_outputs' cannot be True if 'random_flip' is True.")
-        if not config.data_loader.center_crop:
-            raise ValueError("'cache_vae_outputs' cannot be True if 'center_crop' is False.")
-
-        # We use a temporary directory for the cache. The directory will automatically be cleaned up when
-        # tmp_vae_output_cache_dir is destroyed.
-        tmp_vae_output_cache_dir = tempfile.TemporaryDirectory()
-        vae_output_cache_dir_name = tmp_vae_output_cache_dir.name
-        if accelerator.is_local_main_process:
-            # Only the main process should populate the cache.
+        if config.output_cache.cache_dir is None:
+            # We use a temporary directory for the cache, shared by the processes on this node. The directory will
+            # automatically be cleaned up when tmp_vae_output_cache_dir is destroyed.
+            tmp_vae_output_cache_dir, vae_output_cache_dir_name = create_shared_temp_dir(accelerator)
+        else:
+            vae_output_cache_dir_name = get_persistent_cache_dir(
+                base_cache_dir=config.output_cache.cache_dir,
+                cache_name="vae_outputs",
+                cache_params={
+                    "model": config.model,
+                    "hf_variant": config.hf_variant,
+                    "vae": dict(vae.config),
+                    "weight_dtype": config.weight_dtype,
+                    "cache_format": config.output_cache.cache_format,
+                    "storage_dtype": config.output_cache.storage_dtype,
+                    "cache_latent_distribution": config.output_cache.cache_latent_distribution,
+                    "num_crop_variants": config.output_cache.num_crop_variants,
+                    "vae_tiling": config.output_cache.vae_tiling,
+                    "use_masks": config.use_masks,
+                    "data_loader": config.data_loader.model_dump(exclude={"dataloader_num_workers"}),
+                },
+            )
+
+    # Populate the output caches. If both caches are enabled, they are populated in a single pass over the dataset.
+    if text_encoder_output_cache_dir_name is not None or vae_output_cache_dir_name is not None:
+        # The work of populating the caches is split between the processes on this node for a temporary
+        # cache, or between all processes for a persistent cache.
+        cache_process_index, cache_num_processes = get_cache_process_info(
+            accelerator, node_local=config.output_cache.cache_dir is None
+        )
+        if text_encoder_output_cache_dir_name is not None:
+            logger.info(f"Generating text encoder output cache ('{text_encoder_output_cache_dir_name}').")
+            text_encoder.to(accelerator.device, dtype=weight_dtype)
+        if vae_output_cache_dir_name is not None:
             logger.info(f"Generating VAE output cache ('{vae_output_cache_dir_name}').")
             vae.to(accelerator.device, dtype=weight_dtype)
-            data_loader = _build_data_loader(
-                data_loader_config=config.data_loader,
-                batch_size=config.train_batch_size,
-                use_masks=config.use_masks,
-                shuffle=False,
-                sequential_batching=True,
-            )
-            cache_vae_outputs(vae_output_cache_dir_name, data_loader, vae)
-        # Move the VAE back to the CPU, because it is not needed for training.
-        vae.to("cpu")
+        cache_outputs(
+            config,
+            tokenizer,
+            text_encoder,
+            vae,
+            text_encoder_output_cache_dir=text_encoder_output_cache_dir_name,
+            vae_output_cache_dir=vae_output_cache_dir_name,
+            output_cache_config=config.output_cache,
+            process_index=cache_process_index,
+            num_processes=cache_num_processes,
+        )
+        # Wait for all processes to finish their share of the caches, then check that the caches are complete.
         accelerator.wait_for_everyone()
+        finalize_output_caches(
+            vae_output_cache_dir=vae_output_cache_dir_name,
+            text_encoder_output_cache_dir=text_encoder_output_cache_dir_name,
+            num_processes=cache_num_processes,
+        )
+
+    # Move the text_encoder and VAE to the device if they are needed for training, or back to the CPU if their outputs
+    # were cached.
+    if config.cache_text_encoder_outputs:
+        text_encoder.to("cpu")
+    else:
+        text_encoder.to(accelerator.device, dtype=weight_dtype)
+    if config.cache_vae_outputs:
+        vae.to("cpu")
     else:
         vae.to(accelerator.device, dtype=weight_dtype)
 
@@ -450,9 +596,15 @@ def train(config: SdLoraConfig, callbacks: list[PipelineCallbacks] | None = None
         use_masks=config.use_masks,
         text_encoder_output_cache_dir=text_encoder_output_cache_dir_name,
         vae_output_cache_dir=vae_output_cache_dir_name,
+        memory_cache_size_mb=config.output_cache.memory_cache_size_mb,
+        seed=config.seed,
+        num_processes=accelerator.num_processes,
+        process_index=accelerator.process_index,
     )
+    # Keep a reference to the batch sampler, so that its epoch can be set at the start of every epoch.
+    batch_sampler = data_loader.batch_sampler
 
-    log_aspect_ratio_buckets(logger=logger, batch_sampler=data_loader.batch_sampler)
+    log_aspect_ratio_buckets(logger=logger, batch_sampler=batch_sampler)
 
     assert sum([config.max_train_steps is not None, config.max_train_epochs is not None]) == 1
     assert sum([config.save_every_n_steps is not None, config.save_every_n_epochs is not None]) == 1
@@ -481,18 +633,17 @@ def train(config: SdLoraConfig, callbacks: list[PipelineCallbacks] | None = None
         UNet2DConditionModel,
         CLIPTextModel,
         torch.optim.Optimizer,
-        torch.utils.data.DataLoader,
         torch.optim.lr_scheduler.LRScheduler,
     ] = accelerator.prepare(
         unet,
         text_encoder,
         optimizer,
-        data_loader,
         lr_scheduler,
         # Disable automatic device placement for text_encoder if the text encoder outputs were cached.
-        device_placement=[True, not config.cache_text_encoder_outputs, True, True, True],
+        device_placement=[True, not config.cache_text_encoder_outputs, True, True],
     )
-    unet, text_encoder, optimizer, data_loader, lr_scheduler = prepared_result
+    unet, text_encoder, optimizer, lr_scheduler = prepared_result
+    data_loader = prepare_data_loader(accelerator, data_loader)
 
     if accelerator.is_main_process:
         accelerator.init_trackers("lora_training")
@@ -563,6 +714,7 @@ def train(config: SdLoraConfig, callbacks: list[PipelineCallbacks] | None = None
         accelerator.wait_for_everyone()
 
     for epoch in range(first_epoch, num_train_epochs):
+        set_sampler_epoch(batch_sampler, epoch)
         train_loss = 0.0
         for data_batch_idx, data_batch in enumerate(data_loader):
             with accelerator.accumulate(unet, text_encoder):
@@ -577,6 +729,9 @@ def train(config: SdLoraConfig, callbacks: list[PipelineCallbacks] | None = None
                     weight_dtype=weight_dtype,
                     use_masks=config.use_masks,
                     min_snr_gamma=config.min_snr_gamma,
+                    loss_normalization_batch_size=get_loss_normalization_batch_size(
+                        config.data_loader.aspect_ratio_buckets, config.train_batch_size
+                    ),
                 )
 
                 # Gather the losses across all processes for logging (if we use distributed training).
@@ -2,29 +2,40 @@ import json
 import logging
 import math
 import os
-import tempfile
 import time
 
 import torch
 from accelerate import Accelerator
 from accelerate.utils import set_seed
 from diffusers.optimization import get_scheduler
+from torch.utils.data import DataLoader
 from tqdm.auto import tqdm
 from transformers import CLIPTextModel, CLIPTokenizer, PreTrainedTokenizer
 
 from invoke_training._shared.accelerator.accelerator_utils import (
+    create_shared_temp_dir,
+    get_cache_process_info,
     get_dtype_from_str,
     initialize_accelerator,
     initialize_logging,
+    prepare_data_loader,
 )
 from invoke_training._shared.checkpoints.checkpoint_tracker import CheckpointTracker
 from invoke_training._shared.checkpoints.serialization import save_state_dict
+from invoke_training._shared.data.data_loaders.image_caption_sd_dataloader import get_loss_normalization_batch_size
 from invoke_training._shared.data.data_loaders.textual_inversion_sd_dataloader import (
     build_textual_inversion_sd_dataloader,
 )
 from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import log_aspect_ratio_buckets
+from invoke_training._shared.data.samplers.sampler_state import set_sampler_epoch
+from invoke_training._shared.data.utils.cache_fingerprint import get_persistent_cache_dir
 from invoke_training._shared.optimizer.optimizer_utils import initialize_optimizer
 from invoke_training._shared.stable_diffusion.model_loading_utils import load_models_sd
+from invoke_training._shared.stable_diffusion.output_cache import (
+    finalize_output_caches,
+    get_cache_batch_size,
+    populate_augmented_output_caches,
+)
 from invoke_training._shared.stable_diffusion.textual_inversion import (
     initialize_placeholder_tokens_from_initial_embedding,
     initialize_placeholder_tokens_from_initial_phrase,
@@ -34,7 +45,7 @@ from invoke_training._shared.stable_diffusion.textual_inversion import (
 from invoke_training._shared.stable_diffusion.validation import generate_validation_images_sd
 from invoke_training._shared.utils.import_xformers import import_xformers
 from invoke_training.pipelines.callbacks import ModelCheckpoint, ModelType, PipelineCallbacks, TrainingCheckpoint
-from invoke_training.pipelines.stable_diffusion.lora.train import cache_vae_outputs, train_forward
+from invoke_training.pipelines.stable_diffusion.lora.train import train_forward
 from invoke_training.pipelines.stable_diffusion.textual_inversion.config import SdTextualInversionConfig
 
 
@@ -200,30 +211,62 @@ def train(config: SdTextualInversionConfig, callbacks: list[PipelineCallbacks] |
     # Prepare VAE output cache.
     vae_output_cache_dir_name = None
     if config.cache_vae_outputs:
-        if config.data_loader.random_flip:
-            raise ValueError("'cache_vae_outputs' cannot be True if 'random_flip' is True.")
-        if not config.data_loader.center_crop:
-            raise ValueError("'cache_vae_outputs' cannot be True if 'center_crop' is False.")
-
-        # We use a temporary directory for the cache. The directory will automatically be cleaned up when
-        # tmp_vae_output_cache_dir is destroyed.
-        tmp_vae_output_cache_dir = tempfile.TemporaryDirectory()
-        vae_output_cache_dir_name = tmp_vae_output_cache_dir.name
-        if accelerator.is_local_main_process:
-            # Only the main process should populate the cache.
-            logger.info(f"Generating VAE output cache ('{vae_output_cache_dir_name}').")
-            vae.to(accelerator.device, dtype=weight_dtype)
-            data_loader = build_textual_inversion_sd_dataloader(
-                config=config.data_loader,
+        if config.output_cache.cache_dir is None:
+            # We use a temporary directory for the cache, shared by the processes on this node. The directory will
+            # automatically be cleaned up when tmp_vae_output_cache_dir is destroyed.
+            tmp_vae_output_cache_dir, vae_output_cache_dir_name = create_shared_temp_dir(accelerator)
+        else:
+            vae_output_cache_dir_name = get_persistent_cache_dir(
+                base_cache_dir=config.output_cache.cache_dir,
+                cache_name="vae_outputs",
+                cache_params={
+                    "model": config.model,
+                    "hf_variant": config.hf_variant,
+                    "vae": dict(vae.config),
+                    "weight_dtype": config.weight_dtype,
+                    "cache_format": config.output_cache.cache_format,
+                    "storage_dtype": config.output_cache.storage_dtype,
+                    "cache_latent_distribution": config.output_cache.cache_latent_distribution,
+                    "num_crop_variants": config.output_cache.num_crop_variants,
+                    "vae_tiling": config.output_cache.vae_tiling,
+                    "use_masks": config.use_masks,
+                    "data_loader": config.data_loader.model_dump(exclude={"dataloader_num_workers"}),
+                },
+            )
+        # The work of populating the cache is split between the processes on this node for a temporary
+        # cache, or between all processes for a persistent cache.
+        cache_process_index, cache_num_processes = get_cache_process_info(
+            accelerator, node_local=config.output_cache.cache_dir is None
+        )
+        logger.info(f"Generating VAE output cache ('{vae_output_cache_dir_name}').")
+        vae.to(accelerator.device, dtype=weight_dtype)
+
+        def build_data_loader(load_images: bool, random_crop_seed: int | None) -> DataLoader:
+            # Flipped variants are produced by populate_augmented_output_caches(), so random flipping is disabled here.
+            return build_textual_inversion_sd_dataloader(
+                config=config.data_loader.model_copy(update={"random_flip": False}),
                 placeholder_token=config.placeholder_token,
-                batch_size=config.train_batch_size,
+                batch_size=get_cache_batch_size(config.output_cache, config.train_batch_size),
                 use_masks=config.use_masks,
                 shuffle=False,
+                random_crop_seed=random_crop_seed,
             )
-            cache_vae_outputs(vae_output_cache_dir_name, data_loader, vae)
+
+        populate_augmented_output_caches(
+            build_data_loader,
+            center_crop=config.data_loader.center_crop,
+            random_flip=config.data_loader.random_flip,
+            vae=vae,
+            vae_output_cache_dir=vae_output_cache_dir_name,
+            output_cache_config=config.output_cache,
+            process_index=cache_process_index,
+            num_processes=cache_num_processes,
+        )
         # Move the VAE back to the CPU, because it is not needed for training.
         vae.to("cpu")
+        # Wait for all processes to finish their share of the cache, then check that the cache is complete.
         accelerator.wait_for_everyone()
+        finalize_output_caches(vae_output_cache_dir=vae_output_cache_dir_name, num_processes=cache_num_processes)
     else:
         vae.to(accelerator.device, dtype=weight_dtype)
 
@@ -239,9 +282,15 @@ def train(config: SdTextualInversionConfig, callbacks: list[PipelineCallbacks] |
         batch_size=config.train_batch_size,
         use_masks=config.use_masks,
         vae_output_cache_dir=vae_output_cache_dir_name,
+        memory_cache_size_mb=config.output_cache.memory_cache_size_mb,
+        seed=config.seed,
+        num_processes=accelerator.num_processes,
+        process_index=accelerator.process_index,
     )
+    # Keep a reference to the batch sampler, so that its epoch can be set at the start of every epoch.
+    batch_sampler = data_loader.batch_sampler
 
-    log_aspect_ratio_buckets(logger=logger, batch_sampler=data_loader.batch_sampler)
+    log_aspect_ratio_buckets(logger=logger, batch_sampler=batch_sampler)
 
     assert sum([config.max_train_steps is not None, config.max_train_epochs is not None]) == 1
     assert sum([config.save_every_n_steps is not None, config.save_every_n_epochs is not None]) == 1
@@ -266,15 +315,11 @@ def train(config: SdTextualInversionConfig, callbacks: list[PipelineCallbacks] |
         num_training_steps=num_train_steps * accelerator.num_processes,
     )
 
-    # Prepare everything with our `accelerator`.
-    text_encoder, optimizer, data_loader, lr_scheduler = accelerator.prepare(
-        text_encoder, optimizer, data_loader, lr_scheduler
-    )
-
     prepared_result: tuple[
-        CLIPTextModel, torch.optim.Optimizer, torch.utils.data.DataLoader, torch.optim.lr_scheduler.LRScheduler
-    ] = accelerator.prepare(text_encoder, optimizer, data_loader, lr_scheduler)
-    text_encoder, optimizer, data_loader, lr_scheduler = prepared_result
+        CLIPTextModel, torch.optim.Optimizer, torch.optim.lr_scheduler.LRScheduler
+    ] = accelerator.prepare(text_encoder, optimizer, lr_scheduler)
+    text_encoder, optimizer, lr_scheduler = prepared_result
+    data_loader = prepare_data_loader(accelerator, data_loader)
 
     if accelerator.is_main_process:
         accelerator.init_trackers("textual_inversion_training")
@@ -348,6 +393,7 @@ def train(config: SdTextualInversionConfig, callbacks: list[PipelineCallbacks] |
         accelerator.wait_for_everyone()
 
     for epoch in range(first_epoch, num_train_epochs):
+        set_sampler_epoch(batch_sampler, epoch)
         text_encoder.train()
 
         train_loss = 0.0
@@ -364,6 +410,9 @@ def train(config: SdTextualInversionConfig, callbacks: list[PipelineCallbacks] |
                     weight_dtype=weight_dtype,
                     use_masks=config.use_masks,
                     min_snr_gamma=config.min_snr_gamma,
+                    loss_normalization_batch_size=get_loss_normalization_batch_size(
+                        config.data_loader.aspect_ratio_buckets, config.train_batch_size
+                    ),
                 )
 
                 # Gather the losses across all processes for logging (if we use distributed training).
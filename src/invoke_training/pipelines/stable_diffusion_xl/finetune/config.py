@@ -4,6 +4,7 @@ from pydantic import Field, model_validator
 
 from invoke_training.config.base_pipeline_config import BasePipelineConfig
 from invoke_training.config.data.data_loader_config import DreamboothSDDataLoaderConfig, ImageCaptionSDDataLoaderConfig
+from invoke_training.config.data.output_cache_config import OutputCacheConfig
 from invoke_training.config.optimizer.optimizer_config import AdamOptimizerConfig, ProdigyOptimizerConfig
 
 
@@ -67,8 +68,13 @@ class SdxlFinetuneConfig(BasePipelineConfig):
     cache_vae_outputs: bool = False
     """If True, the VAE will be applied to all of the images in the dataset before starting training and the results
     will be cached to disk. This reduces the VRAM requirements during training (don't have to keep the VAE in VRAM), and
-    speeds up training (don't have to run the VAE encoding step). This option can only be enabled if all
-    non-deterministic image augmentations are disabled (i.e. center_crop=True, random_flip=False).
+    speeds up training (don't have to run the VAE encoding step). If random image augmentations are enabled (i.e.
+    center_crop=False or random_flip=True), several augmentation variants of each image are cached and one is selected
+    at random for each training step (see `output_cache.num_crop_variants`).
+    """
+
+    output_cache: OutputCacheConfig = OutputCacheConfig()
+    """Options for the VAE and text encoder output caches (see `cache_vae_outputs` and `cache_text_encoder_outputs`).
     """
 
     enable_cpu_offload_during_validation: bool = False
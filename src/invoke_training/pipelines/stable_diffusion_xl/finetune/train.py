@@ -3,7 +3,6 @@ import json
 import logging
 import math
 import os
-import tempfile
 import time
 from typing import Literal
 
@@ -17,26 +16,36 @@ from tqdm.auto import tqdm
 from transformers import CLIPTextModel, CLIPTokenizer
 
 from invoke_training._shared.accelerator.accelerator_utils import (
+    create_shared_temp_dir,
+    get_cache_process_info,
     get_dtype_from_str,
     initialize_accelerator,
     initialize_logging,
+    prepare_data_loader,
 )
 from invoke_training._shared.checkpoints.checkpoint_tracker import CheckpointTracker
+from invoke_training._shared.data.data_loaders.image_caption_sd_dataloader import get_loss_normalization_batch_size
 from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import log_aspect_ratio_buckets
+from invoke_training._shared.data.samplers.sampler_state import set_sampler_epoch
+from invoke_training._shared.data.utils.cache_fingerprint import get_persistent_cache_dir
 from invoke_training._shared.optimizer.optimizer_utils import initialize_optimizer
 from invoke_training._shared.stable_diffusion.checkpoint_utils import (
     save_sdxl_diffusers_checkpoint,
     save_sdxl_diffusers_unet_checkpoint,
 )
 from invoke_training._shared.stable_diffusion.model_loading_utils import load_models_sdxl
+from invoke_training._shared.stable_diffusion.output_cache import (
+    finalize_output_caches,
+    get_caption_source_params,
+    get_tokenizer_params,
+)
 from invoke_training._shared.stable_diffusion.validation import generate_validation_images_sdxl
 from invoke_training._shared.utils.import_xformers import import_xformers
 from invoke_training.pipelines.callbacks import ModelCheckpoint, ModelType, PipelineCallbacks, TrainingCheckpoint
-from invoke_training.pipelines.stable_diffusion.lora.train import cache_vae_outputs
 from invoke_training.pipelines.stable_diffusion_xl.finetune.config import SdxlFinetuneConfig
 from invoke_training.pipelines.stable_diffusion_xl.lora.train import (
     _build_data_loader,
-    cache_text_encoder_outputs,
+    cache_outputs,
     train_forward,
 )
 
@@ -154,57 +163,101 @@ def train(config: SdxlFinetuneConfig, callbacks: list[PipelineCallbacks] | None
         # are a number of configurations that would cause variation in the text encoder outputs and should not be used
         # with caching.
 
-        # We use a temporary directory for the cache. The directory will automatically be cleaned up when
-        # tmp_text_encoder_output_cache_dir is destroyed.
-        tmp_text_encoder_output_cache_dir = tempfile.TemporaryDirectory()
-        text_encoder_output_cache_dir_name = tmp_text_encoder_output_cache_dir.name
-        if accelerator.is_local_main_process:
-            # Only the main process should populate the cache.
+        if config.output_cache.cache_dir is None:
+            # We use a temporary directory for the cache, shared by the processes on this node. The directory will
+            # automatically be cleaned up when tmp_text_encoder_output_cache_dir is destroyed.
+            tmp_text_encoder_output_cache_dir, text_encoder_output_cache_dir_name = create_shared_temp_dir(accelerator)
+        else:
+            text_encoder_output_cache_dir_name = get_persistent_cache_dir(
+                base_cache_dir=config.output_cache.cache_dir,
+                cache_name="text_encoder_outputs",
+                cache_params={
+                    "model": config.model,
+                    "hf_variant": config.hf_variant,
+                    "text_encoder_1": text_encoder_1.config.to_dict(),
+                    "text_encoder_2": text_encoder_2.config.to_dict(),
+                    "tokenizer_1": get_tokenizer_params(tokenizer_1),
+                    "tokenizer_2": get_tokenizer_params(tokenizer_2),
+                    "weight_dtype": config.weight_dtype,
+                    "cache_format": config.output_cache.cache_format,
+                    "storage_dtype": config.output_cache.storage_dtype,
+                    "captions": get_caption_source_params(config.data_loader),
+                },
+            )
+
+    # Prepare VAE output cache.
+    vae_output_cache_dir_name = None
+    if config.cache_vae_outputs:
+        if config.output_cache.cache_dir is None:
+            # We use a temporary directory for the cache, shared by the processes on this node. The directory will
+            # automatically be cleaned up when tmp_vae_output_cache_dir is destroyed.
+            tmp_vae_output_cache_dir, vae_output_cache_dir_name = create_shared_temp_dir(accelerator)
+        else:
+            vae_output_cache_dir_name = get_persistent_cache_dir(
+                base_cache_dir=config.output_cache.cache_dir,
+                cache_name="vae_outputs",
+                cache_params={
+                    "model": config.model,
+                    "hf_variant": config.hf_variant,
+                    "vae_model": config.vae_model,
+                    "vae": dict(vae.config),
+                    "weight_dtype": config.weight_dtype,
+                    "cache_format": config.output_cache.cache_format,
+                    "storage_dtype": config.output_cache.storage_dtype,
+                    "cache_latent_distribution": config.output_cache.cache_latent_distribution,
+                    "num_crop_variants": config.output_cache.num_crop_variants,
+                    "vae_tiling": config.output_cache.vae_tiling,
+                    "use_masks": config.use_masks,
+                    "data_loader": config.data_loader.model_dump(exclude={"dataloader_num_workers"}),
+                },
+            )
+
+    # Populate the output caches. If both caches are enabled, they are populated in a single pass over the dataset.
+    if text_encoder_output_cache_dir_name is not None or vae_output_cache_dir_name is not None:
+        # The work of populating the caches is split between the processes on this node for a temporary
+        # cache, or between all processes for a persistent cache.
+        cache_process_index, cache_num_processes = get_cache_process_info(
+            accelerator, node_local=config.output_cache.cache_dir is None
+        )
+        if text_encoder_output_cache_dir_name is not None:
             logger.info(f"Generating text encoder output cache ('{text_encoder_output_cache_dir_name}').")
             text_encoder_1.to(accelerator.device, dtype=weight_dtype)
             text_encoder_2.to(accelerator.device, dtype=weight_dtype)
-            # TODO(ryan): Move cache_text_encoder_outputs to a shared location so that it is not imported from another
-            # pipeline.
-            cache_text_encoder_outputs(
-                text_encoder_output_cache_dir_name, config, tokenizer_1, tokenizer_2, text_encoder_1, text_encoder_2
-            )
-        # Move the text_encoders back to the CPU, because they are not needed for training.
+        if vae_output_cache_dir_name is not None:
+            logger.info(f"Generating VAE output cache ('{vae_output_cache_dir_name}').")
+            vae.to(accelerator.device, dtype=weight_dtype)
+        # TODO(ryan): Move cache_outputs to a shared location so that it is not imported from another pipeline.
+        cache_outputs(
+            config,
+            tokenizer_1,
+            tokenizer_2,
+            text_encoder_1,
+            text_encoder_2,
+            vae,
+            text_encoder_output_cache_dir=text_encoder_output_cache_dir_name,
+            vae_output_cache_dir=vae_output_cache_dir_name,
+            output_cache_config=config.output_cache,
+            process_index=cache_process_index,
+            num_processes=cache_num_processes,
+        )
+        # Wait for all processes to finish their share of the caches, then check that the caches are complete.
+        accelerator.wait_for_everyone()
+        finalize_output_caches(
+            vae_output_cache_dir=vae_output_cache_dir_name,
+            text_encoder_output_cache_dir=text_encoder_output_cache_dir_name,
+            num_processes=cache_num_processes,
+        )
+
+    # Move the text_encoders and VAE to the device if they are needed for training, or back to the CPU if their outputs
+    # were cached.
+    if config.cache_text_encoder_outputs:
         text_encoder_1.to("cpu")
         text_encoder_2.to("cpu")
-        accelerator.wait_for_everyone()
     else:
         text_encoder_1.to(accelerator.device, dtype=weight_dtype)
         text_encoder_2.to(accelerator.device, dtype=weight_dtype)
-
-    # Prepare VAE output cache.
-    vae_output_cache_dir_name = None
     if config.cache_vae_outputs:
-        if config.data_loader.random_flip:
-            raise ValueError("'cache_vae_outputs' cannot be True if 'random_flip' is True.")
-        if not config.data_loader.center_crop:
-            raise ValueError("'cache_vae_outputs' cannot be True if 'center_crop' is False.")
-
-        # We use a temporary directory for the cache. The directory will automatically be cleaned up when
-        # tmp_vae_output_cache_dir is destroyed.
-        tmp_vae_output_cache_dir = tempfile.TemporaryDirectory()
-        vae_output_cache_dir_name = tmp_vae_output_cache_dir.name
-        if accelerator.is_local_main_process:
-            # Only the main process should to populate the cache.
-            logger.info(f"Generating VAE output cache ('{vae_output_cache_dir_name}').")
-            vae.to(accelerator.device, dtype=weight_dtype)
-            # TODO(ryan): Move cache_text_encoder_outputs to a shared location so that it is not imported from another
-            # pipeline.
-            data_loader = _build_data_loader(
-                data_loader_config=config.data_loader,
-                batch_size=config.train_batch_size,
-                use_masks=config.use_masks,
-                shuffle=False,
-                sequential_batching=True,
-            )
-            cache_vae_outputs(vae_output_cache_dir_name, data_loader, vae)
-        # Move the VAE back to the CPU, because it is not needed for training.
         vae.to("cpu")
-        accelerator.wait_for_everyone()
     else:
         vae.to(accelerator.device, dtype=weight_dtype)
 
@@ -238,9 +291,15 @@ def train(config: SdxlFinetuneConfig, callbacks: list[PipelineCallbacks] | None
         use_masks=config.use_masks,
         text_encoder_output_cache_dir=text_encoder_output_cache_dir_name,
         vae_output_cache_dir=vae_output_cache_dir_name,
+        memory_cache_size_mb=config.output_cache.memory_cache_size_mb,
+        seed=config.seed,
+        num_processes=accelerator.num_processes,
+        process_index=accelerator.process_index,
     )
+    # Keep a reference to the batch sampler, so that its epoch can be set at the start of every epoch.
+    batch_sampler = data_loader.batch_sampler
 
-    log_aspect_ratio_buckets(logger=logger, batch_sampler=data_loader.batch_sampler)
+    log_aspect_ratio_buckets(logger=logger, batch_sampler=batch_sampler)
 
     assert sum([config.max_train_steps is not None, config.max_train_epochs is not None]) == 1
     assert sum([config.save_every_n_steps is not None, config.save_every_n_epochs is not None]) == 1
@@ -270,14 +329,12 @@ def train(config: SdxlFinetuneConfig, callbacks: list[PipelineCallbacks] | None
         peft.PeftModel | CLIPTextModel,
         peft.PeftModel | CLIPTextModel,
         torch.optim.Optimizer,
-        torch.utils.data.DataLoader,
         torch.optim.lr_scheduler.LRScheduler,
     ] = accelerator.prepare(
         unet,
         text_encoder_1,
         text_encoder_2,
         optimizer,
-        data_loader,
         lr_scheduler,
         # Disable automatic device placement for text_encoder if the text encoder outputs were cached.
         device_placement=[
@@ -286,10 +343,10 @@ def train(config: SdxlFinetuneConfig, callbacks: list[PipelineCallbacks] | None
             not config.cache_text_encoder_outputs,
             True,
             True,
-            True,
         ],
     )
-    unet, text_encoder_1, text_encoder_2, optimizer, data_loader, lr_scheduler = prepared_result
+    unet, text_encoder_1, text_encoder_2, optimizer, lr_scheduler = prepared_result
+    data_loader = prepare_data_loader(accelerator, data_loader)
 
     if accelerator.is_main_process:
         accelerator.init_trackers("finetune")
@@ -365,6 +422,7 @@ def train(config: SdxlFinetuneConfig, callbacks: list[PipelineCallbacks] | None
         accelerator.wait_for_everyone()
 
     for epoch in range(first_epoch, num_train_epochs):
+        set_sampler_epoch(batch_sampler, epoch)
         train_loss = 0.0
         for data_batch_idx, data_batch in enumerate(data_loader):
             with accelerator.accumulate(unet, text_encoder_1, text_encoder_2):
@@ -383,6 +441,9 @@ def train(config: SdxlFinetuneConfig, callbacks: list[PipelineCallbacks] | None
                     use_masks=config.use_masks,
                     prediction_type=config.prediction_type,
                     min_snr_gamma=config.min_snr_gamma,
+                    loss_normalization_batch_size=get_loss_normalization_batch_size(
+                        config.data_loader.aspect_ratio_buckets, config.train_batch_size
+                    ),
                 )
 
                 # Gather the losses across all processes for logging (if we use distributed training).
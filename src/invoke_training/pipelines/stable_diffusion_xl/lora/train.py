@@ -3,10 +3,9 @@ import json
 import logging
 import math
 import os
-import tempfile
 import time
 from pathlib import Path
-from typing import Literal, Optional, Union
+from typing import Callable, Literal, Optional, Union
 
 import peft
 import torch
@@ -20,15 +19,22 @@ from tqdm.auto import tqdm
 from transformers import CLIPPreTrainedModel, CLIPTextModel, PreTrainedTokenizer
 
 from invoke_training._shared.accelerator.accelerator_utils import (
+    create_shared_temp_dir,
+    get_cache_process_info,
     get_dtype_from_str,
     initialize_accelerator,
     initialize_logging,
+    prepare_data_loader,
 )
 from invoke_training._shared.checkpoints.checkpoint_tracker import CheckpointTracker
 from invoke_training._shared.data.data_loaders.dreambooth_sd_dataloader import build_dreambooth_sd_dataloader
-from invoke_training._shared.data.data_loaders.image_caption_sd_dataloader import build_image_caption_sd_dataloader
+from invoke_training._shared.data.data_loaders.image_caption_sd_dataloader import (
+    build_image_caption_sd_dataloader,
+    get_loss_normalization_batch_size,
+)
 from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import log_aspect_ratio_buckets
-from invoke_training._shared.data.transforms.tensor_disk_cache import TensorDiskCache
+from invoke_training._shared.data.samplers.sampler_state import set_sampler_epoch
+from invoke_training._shared.data.utils.cache_fingerprint import get_persistent_cache_dir
 from invoke_training._shared.data.utils.resolution import Resolution
 from invoke_training._shared.optimizer.optimizer_utils import initialize_optimizer
 from invoke_training._shared.stable_diffusion.lora_checkpoint_utils import (
@@ -37,12 +43,20 @@ from invoke_training._shared.stable_diffusion.lora_checkpoint_utils import (
 )
 from invoke_training._shared.stable_diffusion.min_snr_weighting import compute_snr
 from invoke_training._shared.stable_diffusion.model_loading_utils import load_models_sdxl
+from invoke_training._shared.stable_diffusion.output_cache import (
+    finalize_output_caches,
+    get_cache_batch_size,
+    get_caption_source_params,
+    get_tokenizer_params,
+    populate_augmented_output_caches,
+    sample_cached_latent_dist,
+)
 from invoke_training._shared.stable_diffusion.tokenize_captions import tokenize_captions
 from invoke_training._shared.stable_diffusion.validation import generate_validation_images_sdxl
 from invoke_training._shared.utils.import_xformers import import_xformers
 from invoke_training.config.data.data_loader_config import DreamboothSDDataLoaderConfig, ImageCaptionSDDataLoaderConfig
+from invoke_training.config.data.output_cache_config import OutputCacheConfig
 from invoke_training.pipelines.callbacks import ModelCheckpoint, ModelType, PipelineCallbacks, TrainingCheckpoint
-from invoke_training.pipelines.stable_diffusion.lora.train import cache_vae_outputs
 from invoke_training.pipelines.stable_diffusion_xl.lora.config import SdxlLoraConfig
 
 
@@ -93,6 +107,12 @@ def _build_data_loader(
     vae_output_cache_dir: Optional[str] = None,
     shuffle: bool = True,
     sequential_batching: bool = False,
+    load_images: bool = True,
+    random_crop_seed: Optional[int] = None,
+    memory_cache_size_mb: int = 0,
+    seed: Optional[int] = None,
+    num_processes: int = 1,
+    process_index: int = 0,
 ) -> DataLoader:
     if data_loader_config.type == "IMAGE_CAPTION_SD_DATA_LOADER":
         return build_image_caption_sd_dataloader(
@@ -106,6 +126,12 @@ def _build_data_loader(
             },
             vae_output_cache_dir=vae_output_cache_dir,
             shuffle=shuffle,
+            load_images=load_images,
+            random_crop_seed=random_crop_seed,
+            memory_cache_size_mb=memory_cache_size_mb,
+            seed=seed,
+            num_processes=num_processes,
+            process_index=process_index,
         )
     elif data_loader_config.type == "DREAMBOOTH_SD_DATA_LOADER":
         if use_masks:
@@ -121,6 +147,12 @@ def _build_data_loader(
             vae_output_cache_dir=vae_output_cache_dir,
             shuffle=shuffle,
             sequential_batching=sequential_batching,
+            load_images=load_images,
+            random_crop_seed=random_crop_seed,
+            memory_cache_size_mb=memory_cache_size_mb,
+            seed=seed,
+            num_processes=num_processes,
+            process_index=process_index,
         )
     else:
         raise ValueError(f"Unsupported data loader config type: '{data_loader_config.type}'.")
@@ -152,49 +184,86 @@ def _encode_prompt(text_encoders: list[CLIPPreTrainedModel], prompt_token_ids_li
     return prompt_embeds, pooled_prompt_embeds
 
 
-# TODO(ryand): Cache VAE outputs and text encoder outputs at the same time in a single pass over the dataset.
+def _build_caption_encoder(
+    tokenizer_1: PreTrainedTokenizer,
+    tokenizer_2: PreTrainedTokenizer,
+    text_encoder_1: CLIPPreTrainedModel,
+    text_encoder_2: CLIPPreTrainedModel,
+) -> Callable[[list[str]], dict[str, torch.Tensor]]:
+    """Build a function that encodes a batch of captions into the fields that are stored in the text encoder output
+    cache.
+    """
+
+    def encode_captions(captions: list[str]) -> dict[str, torch.Tensor]:
+        caption_token_ids_1 = tokenize_captions(tokenizer_1, captions)
+        caption_token_ids_2 = tokenize_captions(tokenizer_2, captions)
+        prompt_embeds, pooled_prompt_embeds = _encode_prompt(
+            [text_encoder_1, text_encoder_2], [caption_token_ids_1, caption_token_ids_2]
+        )
+        return {"prompt_embeds": prompt_embeds, "pooled_prompt_embeds": pooled_prompt_embeds}
+
+    return encode_captions
 
 
-def cache_text_encoder_outputs(
-    cache_dir: str,
+def cache_outputs(
     config: SdxlLoraConfig,
     tokenizer_1: PreTrainedTokenizer,
     tokenizer_2: PreTrainedTokenizer,
     text_encoder_1: CLIPPreTrainedModel,
     text_encoder_2: CLIPPreTrainedModel,
+    vae: AutoencoderKL,
+    text_encoder_output_cache_dir: str | None = None,
+    vae_output_cache_dir: str | None = None,
+    output_cache_config: OutputCacheConfig | None = None,
+    process_index: int = 0,
+    num_processes: int = 1,
 ):
-    """Run the text encoder on all captions in the dataset and cache the results to disk.
+    """Populate the text encoder output cache and/or the VAE output cache in a single pass over the dataset.
+
+    If only the text encoder output cache is being populated, the images are never loaded. If the data loader applies
+    random crops or flips, several augmentation variants of each image are cached (see
+    `populate_augmented_output_caches()`).
+
     Args:
-        cache_dir (str): The directory where the results will be cached.
-        config (FinetuneLoRAConfig): Training config.
+        config (SdxlLoraConfig): Training config.
         tokenizer_1 (PreTrainedTokenizer):
         tokenizer_2 (PreTrainedTokenizer):
         text_encoder_1 (CLIPPreTrainedModel):
         text_encoder_2 (CLIPPreTrainedModel):
+        vae (AutoencoderKL): The VAE.
+        text_encoder_output_cache_dir (str, optional): The text encoder output cache directory. If None, the text
+            encoder outputs are not cached.
+        vae_output_cache_dir (str, optional): The VAE output cache directory. If None, the VAE outputs are not cached.
+        output_cache_config (OutputCacheConfig, optional): The cache format options.
+        process_index (int, optional): The index of this process, when the caches are populated by multiple processes.
+        num_processes (int, optional): The number of processes that are populating the caches. When all processes have
+            returned, `finalize_output_caches()` must be called before the caches are used.
     """
-    data_loader = _build_data_loader(
-        data_loader_config=config.data_loader,
-        batch_size=config.train_batch_size,
-        shuffle=False,
-        sequential_batching=True,
-    )
-
-    cache = TensorDiskCache(cache_dir)
 
-    for data_batch in tqdm(data_loader):
-        caption_token_ids_1 = tokenize_captions(tokenizer_1, data_batch["caption"])
-        caption_token_ids_2 = tokenize_captions(tokenizer_2, data_batch["caption"])
-        prompt_embeds, pooled_prompt_embeds = _encode_prompt(
-            [text_encoder_1, text_encoder_2], [caption_token_ids_1, caption_token_ids_2]
+    def build_data_loader(load_images: bool, random_crop_seed: int | None) -> DataLoader:
+        # Flipped variants are produced by populate_augmented_output_caches(), so random flipping is disabled here.
+        return _build_data_loader(
+            data_loader_config=config.data_loader.model_copy(update={"random_flip": False}),
+            batch_size=get_cache_batch_size(output_cache_config, config.train_batch_size),
+            use_masks=config.use_masks and load_images,
+            shuffle=False,
+            sequential_batching=True,
+            load_images=load_images,
+            random_crop_seed=random_crop_seed,
         )
 
-        # Split batch before caching.
-        for i in range(len(data_batch["id"])):
-            embeds = {
-                "prompt_embeds": prompt_embeds[i],
-                "pooled_prompt_embeds": pooled_prompt_embeds[i],
-            }
-            cache.save(data_batch["id"][i], embeds)
+    populate_augmented_output_caches(
+        build_data_loader,
+        center_crop=config.data_loader.center_crop,
+        random_flip=config.data_loader.random_flip,
+        vae=vae,
+        vae_output_cache_dir=vae_output_cache_dir,
+        encode_captions=_build_caption_encoder(tokenizer_1, tokenizer_2, text_encoder_1, text_encoder_2),
+        text_encoder_output_cache_dir=text_encoder_output_cache_dir,
+        output_cache_config=output_cache_config,
+        process_index=process_index,
+        num_processes=num_processes,
+    )
 
 
 def train_forward(  # noqa: C901
@@ -212,6 +281,7 @@ def train_forward(  # noqa: C901
     use_masks: bool = False,
     prediction_type=None,
     min_snr_gamma: float | None = None,
+    loss_normalization_batch_size: int | None = None,
 ):
     """Run the forward training pass for a single data_batch.
 
@@ -219,8 +289,11 @@ def train_forward(  # noqa: C901
         torch.Tensor: Loss
     """
     # Convert images to latent space.
-    # The VAE output may have been cached and included in the data_batch. If not, we calculate it here.
+    # The VAE output may have been cached and included in the data_batch, either as a latent sample or as the parameters
+    # of the latent distribution to sample from. If not, we calculate it here.
     latents = data_batch.get("vae_output", None)
+    if latents is None and "vae_latent_dist" in data_batch:
+        latents = sample_cached_latent_dist(data_batch["vae_latent_dist"], vae.config.scaling_factor)
     if latents is None:
         latents = vae.encode(data_batch["image"].to(dtype=weight_dtype)).latent_dist.sample()
         latents = latents * vae.config.scaling_factor
@@ -329,6 +402,11 @@ def train_forward(  # noqa: C901
     if "loss_weight" in data_batch:
         loss = loss * data_batch["loss_weight"]
 
+    if loss_normalization_batch_size is not None:
+        # The batch size varies between batches (e.g. between aspect ratio buckets). Normalize by a fixed batch size
+        # rather than the actual batch size, so that every example has the same weight in the (accumulated) gradient.
+        return loss.sum() / loss_normalization_batch_size
+
     return loss.mean()
 
 
@@ -396,53 +474,101 @@ def train(config: SdxlLoraConfig, callbacks: list[PipelineCallbacks] | None = No
         if config.train_text_encoder:
             raise ValueError("'cache_text_encoder_outputs' and 'train_text_encoder' cannot both be True.")
 
-        # We use a temporary directory for the cache. The directory will automatically be cleaned up when
-        # tmp_text_encoder_output_cache_dir is destroyed.
-        tmp_text_encoder_output_cache_dir = tempfile.TemporaryDirectory()
-        text_encoder_output_cache_dir_name = tmp_text_encoder_output_cache_dir.name
-        if accelerator.is_local_main_process:
-            # Only the main process should populate the cache.
+        if config.output_cache.cache_dir is None:
+            # We use a temporary directory for the cache, shared by the processes on this node. The directory will
+            # automatically be cleaned up when tmp_text_encoder_output_cache_dir is destroyed.
+            tmp_text_encoder_output_cache_dir, text_encoder_output_cache_dir_name = create_shared_temp_dir(accelerator)
+        else:
+            text_encoder_output_cache_dir_name = get_persistent_cache_dir(
+                base_cache_dir=config.output_cache.cache_dir,
+                cache_name="text_encoder_outputs",
+                cache_params={
+                    "model": config.model,
+                    "hf_variant": config.hf_variant,
+                    "base_embeddings": config.base_embeddings,
+                    "text_encoder_1": text_encoder_1.config.to_dict(),
+                    "text_encoder_2": text_encoder_2.config.to_dict(),
+                    "tokenizer_1": get_tokenizer_params(tokenizer_1),
+                    "tokenizer_2": get_tokenizer_params(tokenizer_2),
+                    "weight_dtype": config.weight_dtype,
+                    "cache_format": config.output_cache.cache_format,
+                    "storage_dtype": config.output_cache.storage_dtype,
+                    "captions": get_caption_source_params(config.data_loader),
+                },
+            )
+
+    # Prepare VAE output cache.
+    vae_output_cache_dir_name = None
+    if config.cache_vae_outputs:
+        if config.output_cache.cache_dir is None:
+            # We use a temporary directory for the cache, shared by the processes on this node. The directory will
+            # automatically be cleaned up when tmp_vae_output_cache_dir is destroyed.
+            tmp_vae_output_cache_dir, vae_output_cache_dir_name = create_shared_temp_dir(accelerator)
+        else:
+            vae_output_cache_dir_name = get_persistent_cache_dir(
+                base_cache_dir=config.output_cache.cache_dir,
+                cache_name="vae_outputs",
+                cache_params={
+                    "model": config.model,
+                    "hf_variant": config.hf_variant,
+                    "vae_model": config.vae_model,
+                    "vae": dict(vae.config),
+                    "weight_dtype": config.weight_dtype,
+                    "cache_format": config.output_cache.cache_format,
+                    "storage_dtype": config.output_cache.storage_dtype,
+                    "cache_latent_distribution": config.output_cache.cache_latent_distribution,
+                    "num_crop_variants": config.output_cache.num_crop_variants,
+                    "vae_tiling": config.output_cache.vae_tiling,
+                    "use_masks": config.use_masks,
+                    "data_loader": config.data_loader.model_dump(exclude={"dataloader_num_workers"}),
+                },
+            )
+
+    # Populate the output caches. If both caches are enabled, they are populated in a single pass over the dataset.
+    if text_encoder_output_cache_dir_name is not None or vae_output_cache_dir_name is not None:
+        # The work of populating the caches is split between the processes on this node for a temporary
+        # cache, or between all processes for a persistent cache.
+        cache_process_index, cache_num_processes = get_cache_process_info(
+            accelerator, node_local=config.output_cache.cache_dir is None
+        )
+        if text_encoder_output_cache_dir_name is not None:
             logger.info(f"Generating text encoder output cache ('{text_encoder_output_cache_dir_name}').")
             text_encoder_1.to(accelerator.device, dtype=weight_dtype)
             text_encoder_2.to(accelerator.device, dtype=weight_dtype)
-            cache_text_encoder_outputs(
-                text_encoder_output_cache_dir_name, config, tokenizer_1, tokenizer_2, text_encoder_1, text_encoder_2
-            )
-        # Move the text_encoders back to the CPU, because they are not needed for training.
+        if vae_output_cache_dir_name is not None:
+            logger.info(f"Generating VAE output cache ('{vae_output_cache_dir_name}').")
+            vae.to(accelerator.device, dtype=weight_dtype)
+        cache_outputs(
+            config,
+            tokenizer_1,
+            tokenizer_2,
+            text_encoder_1,
+            text_encoder_2,
+            vae,
+            text_encoder_output_cache_dir=text_encoder_output_cache_dir_name,
+            vae_output_cache_dir=vae_output_cache_dir_name,
+            output_cache_config=config.output_cache,
+            process_index=cache_process_index,
+            num_processes=cache_num_processes,
+        )
+        # Wait for all processes to finish their share of the caches, then check that the caches are complete.
+        accelerator.wait_for_everyone()
+        finalize_output_caches(
+            vae_output_cache_dir=vae_output_cache_dir_name,
+            text_encoder_output_cache_dir=text_encoder_output_cache_dir_name,
+            num_processes=cache_num_processes,
+        )
+
+    # Move the text_encoders and VAE to the device if they are needed for training, or back to the CPU if their outputs
+    # were cached.
+    if config.cache_text_encoder_outputs:
         text_encoder_1.to("cpu")
         text_encoder_2.to("cpu")
-        accelerator.wait_for_everyone()
     else:
         text_encoder_1.to(accelerator.device, dtype=weight_dtype)
         text_encoder_2.to(accelerator.device, dtype=weight_dtype)
-
-    # Prepare VAE output cache.
-    vae_output_cache_dir_name = None
     if config.cache_vae_outputs:
-        if config.data_loader.random_flip:
-            raise ValueError("'cache_vae_outputs' cannot be True if 'random_flip' is True.")
-        if not config.data_loader.center_crop:
-            raise ValueError("'cache_vae_outputs' cannot be True if 'center_crop' is False.")
-
-        # We use a temporary directory for the cache. The directory will automatically be cleaned up when
-        # tmp_vae_output_cache_dir is destroyed.
-        tmp_vae_output_cache_dir = tempfile.TemporaryDirectory()
-        vae_output_cache_dir_name = tmp_vae_output_cache_dir.name
-        if accelerator.is_local_main_process:
-            # Only the main process should to populate the cache.
-            logger.info(f"Generating VAE output cache ('{vae_output_cache_dir_name}').")
-            vae.to(accelerator.device, dtype=weight_dtype)
-            data_loader = _build_data_loader(
-                data_loader_config=config.data_loader,
-                batch_size=config.train_batch_size,
-                use_masks=config.use_masks,
-                shuffle=False,
-                sequential_batching=True,
-            )
-            cache_vae_outputs(vae_output_cache_dir_name, data_loader, vae)
-        # Move the VAE back to the CPU, because it is not needed for training.
         vae.to("cpu")
-        accelerator.wait_for_everyone()
     else:
         vae.to(accelerator.device, dtype=weight_dtype)
 
@@ -530,9 +656,15 @@ def train(config: SdxlLoraConfig, callbacks: list[PipelineCallbacks] | None = No
         use_masks=config.use_masks,
         text_encoder_output_cache_dir=text_encoder_output_cache_dir_name,
         vae_output_cache_dir=vae_output_cache_dir_name,
+        memory_cache_size_mb=config.output_cache.memory_cache_size_mb,
+        seed=config.seed,
+        num_processes=accelerator.num_processes,
+        process_index=accelerator.process_index,
     )
+    # Keep a reference to the batch sampler, so that its epoch can be set at the start of every epoch.
+    batch_sampler = data_loader.batch_sampler
 
-    log_aspect_ratio_buckets(logger=logger, batch_sampler=data_loader.batch_sampler)
+    log_aspect_ratio_buckets(logger=logger, batch_sampler=batch_sampler)
 
     assert sum([config.max_train_steps is not None, config.max_train_epochs is not None]) == 1
     assert sum([config.save_every_n_steps is not None, config.save_every_n_epochs is not None]) == 1
@@ -562,14 +694,12 @@ def train(config: SdxlLoraConfig, callbacks: list[PipelineCallbacks] | None = No
         peft.PeftModel | CLIPTextModel,
         peft.PeftModel | CLIPTextModel,
         torch.optim.Optimizer,
-        torch.utils.data.DataLoader,
         torch.optim.lr_scheduler.LRScheduler,
     ] = accelerator.prepare(
         unet,
         text_encoder_1,
         text_encoder_2,
         optimizer,
-        data_loader,
         lr_scheduler,
         # Disable automatic device placement for text_encoder if the text encoder outputs were cached.
         device_placement=[
@@ -578,10 +708,10 @@ def train(config: SdxlLoraConfig, callbacks: list[PipelineCallbacks] | None = No
             not config.cache_text_encoder_outputs,
             True,
             True,
-            True,
         ],
     )
-    unet, text_encoder_1, text_encoder_2, optimizer, data_loader, lr_scheduler = prepared_result
+    unet, text_encoder_1, text_encoder_2, optimizer, lr_scheduler = prepared_result
+    data_loader = prepare_data_loader(accelerator, data_loader)
 
     if accelerator.is_main_process:
         accelerator.init_trackers("lora_training")
@@ -655,6 +785,7 @@ def train(config: SdxlLoraConfig, callbacks: list[PipelineCallbacks] | None = No
         accelerator.wait_for_everyone()
 
     for epoch in range(first_epoch, num_train_epochs):
+        set_sampler_epoch(batch_sampler, epoch)
         train_loss = 0.0
         for data_batch_idx, data_batch in enumerate(data_loader):
             with accelerator.accumulate(unet, text_encoder_1, text_encoder_2):
@@ -673,6 +804,9 @@ def train(config: SdxlLoraConfig, callbacks: list[PipelineCallbacks] | None = No
                     use_masks=config.use_masks,
                     prediction_type=config.prediction_type,
                     min_snr_gamma=config.min_snr_gamma,
+                    loss_normalization_batch_size=get_loss_normalization_batch_size(
+                        config.data_loader.aspect_ratio_buckets, config.train_batch_size
+                    ),
                 )
 
                 # Gather the losses across all processes for logging (if we use distributed training).
@@ -4,6 +4,7 @@ from pydantic import model_validator
 
 from invoke_training.config.base_pipeline_config import BasePipelineConfig
 from invoke_training.config.data.data_loader_config import TextualInversionSDDataLoaderConfig
+from invoke_training.config.data.output_cache_config import OutputCacheConfig
 from invoke_training.config.optimizer.optimizer_config import AdamOptimizerConfig, ProdigyOptimizerConfig
 
 
@@ -98,8 +99,13 @@ class SdxlTextualInversionConfig(BasePipelineConfig):
     will be cached to disk. This reduces the VRAM requirements during training (don't have to keep the VAE in VRAM), and
     speeds up training (don't have to run the VAE encoding step).
 
-    This option can only be enabled if all non-deterministic image augmentations are disabled (i.e. `center_crop=True`,
-    `random_flip=False`, etc.).
+    If random image augmentations are enabled (i.e. `center_crop=False` or `random_flip=True`), several augmentation
+    variants of each image are cached and one is selected at random for each training step (see
+    `output_cache.num_crop_variants`).
+    """
+
+    output_cache: OutputCacheConfig = OutputCacheConfig()
+    """Options for the VAE output cache (see `cache_vae_outputs`).
     """
 
     enable_cpu_offload_during_validation: bool = False
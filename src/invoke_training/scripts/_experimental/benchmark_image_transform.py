@@ -0,0 +1,107 @@
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+from invoke_training._shared.data.datasets.image_dir_dataset import ImageDirDataset
+from invoke_training._shared.data.transforms.sd_image_transform import SDImageTransform
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the PIL and torchvision image decode + SDImageTransform paths against each other."
+    )
+    parser.add_argument(
+        "--image-dir",
+        type=Path,
+        default=None,
+        help="A directory of images to benchmark on. If not set, random JPEG images are generated in a temp directory.",
+    )
+    parser.add_argument(
+        "--num-images", type=int, default=64, help="The number of images to generate if --image-dir is not set."
+    )
+    parser.add_argument(
+        "--image-size",
+        type=int,
+        nargs=2,
+        default=[1536, 1024],
+        help="The (height, width) of the images to generate if --image-dir is not set.",
+    )
+    parser.add_argument("--resolution", type=int, default=512, help="The target resolution of the transform.")
+    parser.add_argument("--random-flip", action="store_true", help="Enable random flip augmentations.")
+    parser.add_argument("--num-repeats", type=int, default=3, help="The number of passes over the images per backend.")
+    return parser.parse_args()
+
+
+def generate_images(image_dir: Path, num_images: int, image_size: tuple[int, int]):
+    rng = np.random.default_rng(0)
+    height, width = image_size
+    for i in range(num_images):
+        # Smooth random images compress (and decode) more like real photos than uniform noise does.
+        low_res = rng.integers(0, 256, (height // 32, width // 32, 3), dtype=np.uint8)
+        Image.fromarray(low_res).resize((width, height), Image.BILINEAR).save(image_dir / f"{i}.jpg", quality=90)
+
+
+def benchmark(dataset: ImageDirDataset, transform: SDImageTransform, num_repeats: int) -> float:
+    """Run the dataset + transform over all images `num_repeats` times. Returns the mean time per image in seconds."""
+    # Warm up (e.g. file system cache, lazy library initialization).
+    transform(dataset[0])
+
+    start_time = time.perf_counter()
+    for _ in range(num_repeats):
+        for idx in range(len(dataset)):
+            transform(dataset[idx])
+    return (time.perf_counter() - start_time) / (num_repeats * len(dataset))
+
+
+def compare_outputs(pil_dataset: ImageDirDataset, tensor_dataset: ImageDirDataset, transform: SDImageTransform):
+    """Compare the outputs of both paths on every image. Returns the max absolute difference."""
+    max_diff = 0.0
+    for idx in range(len(pil_dataset)):
+        pil_example = transform(pil_dataset[idx])
+        tensor_example = transform(tensor_dataset[idx])
+        assert pil_example["original_size_hw"] == tensor_example["original_size_hw"]
+        assert pil_example["crop_top_left_yx"] == tensor_example["crop_top_left_yx"]
+        max_diff = max(max_diff, (pil_example["image"] - tensor_example["image"]).abs().max().item())
+    return max_diff
+
+
+def main():
+    args = parse_args()
+
+    # Single-threaded, to match the typical DataLoader worker configuration.
+    torch.set_num_threads(1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_dir = args.image_dir
+        if image_dir is None:
+            image_dir = Path(tmp_dir)
+            print(f"Generating {args.num_images} random {args.image_size[0]}x{args.image_size[1]} JPEG images...")
+            generate_images(image_dir, args.num_images, tuple(args.image_size))
+
+        pil_dataset = ImageDirDataset(str(image_dir))
+        tensor_dataset = ImageDirDataset(str(image_dir), decode_to_tensor=True)
+        transform = SDImageTransform(
+            image_field_names=["image"],
+            fields_to_normalize_to_range_minus_one_to_one=["image"],
+            resolution=args.resolution,
+            random_flip=args.random_flip,
+        )
+
+        print(f"Benchmarking on {len(pil_dataset)} images from '{image_dir}'.")
+        pil_time = benchmark(pil_dataset, transform, args.num_repeats)
+        print(f"pil:         {pil_time * 1000:.2f} ms/image")
+        tensor_time = benchmark(tensor_dataset, transform, args.num_repeats)
+        print(f"torchvision: {tensor_time * 1000:.2f} ms/image ({pil_time / tensor_time:.2f}x speedup)")
+
+        if not args.random_flip:
+            max_diff = compare_outputs(pil_dataset, tensor_dataset, transform)
+            print(f"Max absolute difference between outputs (in range [-1, 1]): {max_diff:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import argparse
+from pathlib import Path
+
+import yaml
+from pydantic import TypeAdapter
+
+from invoke_training._shared.data.datasets.compile_dataset import compile_dataset
+from invoke_training.config.pipeline_config import PipelineConfig
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compile the dataset of a training config into pre-resized image shards, so that images do not "
+        "have to be decoded and resized on every epoch."
+    )
+    parser.add_argument(
+        "-c",
+        "--cfg-file",
+        type=Path,
+        required=True,
+        help="Path to the YAML training config file. The data loader config will be used.",
+    )
+    parser.add_argument(
+        "-o",
+        "--out-dir",
+        type=Path,
+        required=True,
+        help="The output directory for the compiled dataset. Must be empty or not exist.",
+    )
+    parser.add_argument(
+        "--shard-size-mb",
+        type=int,
+        default=1024,
+        help="The approximate size of each shard file, in MB.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # Load YAML config file.
+    with open(args.cfg_file, "r") as f:
+        cfg = yaml.safe_load(f)
+
+    pipeline_adapter: TypeAdapter[PipelineConfig] = TypeAdapter(PipelineConfig)
+    train_config = pipeline_adapter.validate_python(cfg)
+    data_loader_config = train_config.data_loader
+
+    if data_loader_config.type not in ("IMAGE_CAPTION_SD_DATA_LOADER", "DREAMBOOTH_SD_DATA_LOADER"):
+        raise ValueError(f"Compiling is not supported for data loader type: '{data_loader_config.type}'.")
+
+    out_dirs = compile_dataset(data_loader_config, str(args.out_dir), shard_size_mb=args.shard_size_mb)
+
+    print("To train from the compiled dataset, replace the dataset config(s) in the training config with:")
+    for out_dir in out_dirs:
+        print(f"  type: COMPILED_DATASET\n  dataset_dir: {out_dir}")
+    print(
+        "Keep the same resolution / aspect_ratio_buckets config. The images were resized for that config, and would "
+        "otherwise be resized again."
+    )
+
+
+if __name__ == "__main__":
+    main()
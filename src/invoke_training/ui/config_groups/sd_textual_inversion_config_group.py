@@ -107,8 +107,8 @@ class SdTextualInversionConfigGroup(UIConfigElement):
             with gr.Row():
                 self.cache_vae_outputs = gr.Checkbox(
                     label="Cache VAE Outputs",
-                    info="Cache the VAE outputs to increase speed. This should not be used when training the UNet or "
-                    "performing data augmentations that would change the VAE outputs.",
+                    info="Cache the VAE outputs to increase speed. If random crops or flips are enabled, several "
+                    "augmented variants of each image are cached.",
                     interactive=True,
                 )
             with gr.Row():
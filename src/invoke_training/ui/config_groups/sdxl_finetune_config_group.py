@@ -104,8 +104,8 @@ class SdxlFinetuneConfigGroup(UIConfigElement):
                 )
                 self.cache_vae_outputs = gr.Checkbox(
                     label="Cache VAE Outputs",
-                    info="Cache the VAE outputs to increase speed. This should not be used when training the UNet or "
-                    "performing data augmentations that would change the VAE outputs.",
+                    info="Cache the VAE outputs to increase speed. If random crops or flips are enabled, several "
+                    "augmented variants of each image are cached.",
                     interactive=True,
                 )
             with gr.Row():
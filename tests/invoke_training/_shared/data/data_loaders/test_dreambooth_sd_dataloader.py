@@ -1,8 +1,12 @@
+import typing
+
 import torch
 
 from invoke_training._shared.data.data_loaders.dreambooth_sd_dataloader import (
     build_dreambooth_sd_dataloader,
 )
+from invoke_training._shared.data.data_loaders.resumable_data_loader import ResumableDataLoader
+from invoke_training._shared.data.samplers.sampler_state import is_sharded_sampler
 from invoke_training.config.data.data_loader_config import AspectRatioBucketConfig, DreamboothSDDataLoaderConfig
 from invoke_training.config.data.dataset_config import ImageDirDatasetConfig
 
@@ -116,3 +120,87 @@ def test_build_dreambooth_sd_dataloader_with_bucketing(image_dir):  # noqa: F811
     loss_weight = example["loss_weight"]
     assert loss_weight.shape == (2,)
     assert loss_weight.dtype == torch.float32
+
+
+def test_build_dreambooth_sd_dataloader_without_images(image_dir):  # noqa: F811
+    """Test that build_dreambooth_sd_dataloader(...) with load_images=False only produces the non-image fields."""
+    config = DreamboothSDDataLoaderConfig(
+        instance_caption="test instance prompt",
+        instance_dataset=ImageDirDatasetConfig(dataset_dir=str(image_dir)),
+        class_caption="test class prompt",
+        # For testing, we just use the same directory for the instance and class datasets.
+        class_dataset=ImageDirDatasetConfig(dataset_dir=str(image_dir)),
+        aspect_ratio_buckets=AspectRatioBucketConfig(
+            target_resolution=256, start_dim=128, end_dim=512, divisible_by=64
+        ),
+    )
+    data_loader = build_dreambooth_sd_dataloader(
+        config=config, batch_size=2, shuffle=False, sequential_batching=True, load_images=False
+    )
+
+    assert len(data_loader) == 5  # (5 class images + 5 instance images) / batch size 2
+
+    examples = list(data_loader)
+    for example in examples:
+        assert set(example.keys()) == {"id", "caption", "loss_weight"}
+
+    all_ids = [example_id for example in examples for example_id in example["id"]]
+    assert len(all_ids) == 10
+    assert len(set(all_ids)) == 10
+    assert examples[0]["caption"] == ["test instance prompt", "test instance prompt"]
+    assert examples[-1]["caption"] == ["test class prompt", "test class prompt"]
+
+
+def test_build_dreambooth_sd_dataloader_num_processes(image_dir):  # noqa: F811
+    """Test that the instance and class batches are split between processes."""
+    config = DreamboothSDDataLoaderConfig(
+        instance_caption="test instance prompt",
+        instance_dataset=ImageDirDatasetConfig(dataset_dir=str(image_dir)),
+        class_caption="test class prompt",
+        class_dataset=ImageDirDatasetConfig(dataset_dir=str(image_dir)),
+        aspect_ratio_buckets=AspectRatioBucketConfig(
+            target_resolution=256, start_dim=128, end_dim=512, divisible_by=64
+        ),
+    )
+    data_loaders = [
+        build_dreambooth_sd_dataloader(
+            config=config, batch_size=2, shuffle=False, num_processes=2, process_index=process_index
+        )
+        for process_index in range(2)
+    ]
+
+    assert all(is_sharded_sampler(data_loader.batch_sampler) for data_loader in data_loaders)
+    # 5 instance images -> 3 batches -> 2 per process, and the same for the class images.
+    assert [len(data_loader) for data_loader in data_loaders] == [4, 4]
+    example_ids = {example_id for data_loader in data_loaders for batch in data_loader for example_id in batch["id"]}
+    assert example_ids == {f"{prefix}_{i}" for prefix in ["instance", "class"] for i in range(5)}
+
+
+def test_build_dreambooth_sd_dataloader_resumable(image_dir):  # noqa: F811
+    """Test that the shuffled order without aspect ratio buckets is seeded, and can be resumed part way through an
+    epoch.
+    """
+    config = DreamboothSDDataLoaderConfig(
+        instance_caption="test instance prompt",
+        instance_dataset=ImageDirDatasetConfig(dataset_dir=str(image_dir)),
+        class_caption="test class prompt",
+        class_dataset=ImageDirDatasetConfig(dataset_dir=str(image_dir)),
+    )
+
+    def get_ids(data_loader: typing.Iterable[dict]) -> list[list[str]]:
+        return [batch["id"] for batch in data_loader]
+
+    data_loader = ResumableDataLoader(build_dreambooth_sd_dataloader(config=config, batch_size=2, seed=1))
+    data_loader_iter = iter(data_loader)
+    _ = next(data_loader_iter)
+    state_dict = data_loader.state_dict()
+    remaining_ids = get_ids(data_loader_iter)
+
+    # The order is determined by the seed.
+    assert get_ids(build_dreambooth_sd_dataloader(config=config, batch_size=2, seed=1)) == get_ids(
+        build_dreambooth_sd_dataloader(config=config, batch_size=2, seed=1)
+    )
+
+    resumed_data_loader = ResumableDataLoader(build_dreambooth_sd_dataloader(config=config, batch_size=2, seed=1))
+    resumed_data_loader.load_state_dict(state_dict)
+    assert get_ids(resumed_data_loader) == remaining_ids
@@ -2,8 +2,12 @@ import math
 
 import torch
 
-from invoke_training._shared.data.data_loaders.image_caption_sd_dataloader import build_image_caption_sd_dataloader
-from invoke_training.config.data.data_loader_config import ImageCaptionSDDataLoaderConfig
+from invoke_training._shared.data.data_loaders.image_caption_sd_dataloader import (
+    build_image_caption_sd_dataloader,
+    get_loss_normalization_batch_size,
+)
+from invoke_training._shared.data.samplers.sampler_state import is_sharded_sampler
+from invoke_training.config.data.data_loader_config import AspectRatioBucketConfig, ImageCaptionSDDataLoaderConfig
 from invoke_training.config.data.dataset_config import ImageCaptionJsonlDatasetConfig
 
 from ..dataset_fixtures import image_caption_jsonl  # noqa: F401
@@ -69,3 +73,87 @@ def test_build_image_caption_sd_dataloader_with_masks(image_caption_jsonl):  # n
     crop_top_left_yx = example["crop_top_left_yx"]
     assert len(crop_top_left_yx) == 4
     assert len(crop_top_left_yx[0]) == 2
+
+
+def test_build_image_caption_sd_dataloader_without_images(image_caption_jsonl):  # noqa: F811
+    """Test that build_image_caption_sd_dataloader(...) with load_images=False only produces the non-image fields."""
+
+    config = ImageCaptionSDDataLoaderConfig(
+        dataset=ImageCaptionJsonlDatasetConfig(jsonl_path=str(image_caption_jsonl)),
+        aspect_ratio_buckets=AspectRatioBucketConfig(
+            target_resolution=256, start_dim=128, end_dim=512, divisible_by=64
+        ),
+    )
+    data_loader = build_image_caption_sd_dataloader(config, 4, use_masks=True, shuffle=False, load_images=False)
+
+    assert len(data_loader) == math.ceil(5 / 4)
+
+    example = next(iter(data_loader))
+    assert set(example.keys()) == {"id", "caption"}
+    assert example["id"] == ["0", "1", "2", "3"]
+    assert example["caption"] == ["caption 0", "caption 1", "caption 2", "caption 3"]
+
+
+def test_build_image_caption_sd_dataloader_max_pixels_per_batch(image_caption_jsonl):  # noqa: F811
+    """Test that the batch size of each aspect ratio bucket is derived from max_pixels_per_batch."""
+    aspect_ratio_buckets = AspectRatioBucketConfig(
+        target_resolution=256, start_dim=128, end_dim=512, divisible_by=64, max_pixels_per_batch=2 * 256 * 256
+    )
+    config = ImageCaptionSDDataLoaderConfig(
+        dataset=ImageCaptionJsonlDatasetConfig(jsonl_path=str(image_caption_jsonl)),
+        aspect_ratio_buckets=aspect_ratio_buckets,
+    )
+    data_loader = build_image_caption_sd_dataloader(config, 4)
+
+    for batch in data_loader:
+        batch_size, _, height, width = batch["image"].shape
+        assert batch_size <= max(1, aspect_ratio_buckets.max_pixels_per_batch // (height * width))
+
+
+def test_get_loss_normalization_batch_size():
+    aspect_ratio_buckets = AspectRatioBucketConfig(target_resolution=256, start_dim=128, end_dim=512, divisible_by=64)
+
+    assert get_loss_normalization_batch_size(None, 4) is None
+    assert get_loss_normalization_batch_size(aspect_ratio_buckets, 4) is None
+
+    aspect_ratio_buckets.max_pixels_per_batch = 2 * 256 * 256
+    assert get_loss_normalization_batch_size(aspect_ratio_buckets, 4) == 4
+
+
+def test_build_image_caption_sd_dataloader_merge_partial_batches(image_caption_jsonl):  # noqa: F811
+    """Test that every example is still loaded when small aspect ratio buckets are merged."""
+    config = ImageCaptionSDDataLoaderConfig(
+        dataset=ImageCaptionJsonlDatasetConfig(jsonl_path=str(image_caption_jsonl)),
+        aspect_ratio_buckets=AspectRatioBucketConfig(
+            target_resolution=256, start_dim=128, end_dim=512, divisible_by=64, partial_batch_policy="merge"
+        ),
+    )
+    data_loader = build_image_caption_sd_dataloader(config, 2)
+
+    batches = list(data_loader)
+    assert len(batches) == len(data_loader)
+    assert sorted(example_id for batch in batches for example_id in batch["id"]) == sorted(str(i) for i in range(5))
+
+
+def test_build_image_caption_sd_dataloader_num_processes(image_caption_jsonl):  # noqa: F811
+    """Test that the aspect ratio bucket batches are split between processes, in the same shuffled order on every
+    process.
+    """
+    config = ImageCaptionSDDataLoaderConfig(
+        dataset=ImageCaptionJsonlDatasetConfig(jsonl_path=str(image_caption_jsonl)),
+        aspect_ratio_buckets=AspectRatioBucketConfig(
+            target_resolution=256, start_dim=128, end_dim=512, divisible_by=64
+        ),
+    )
+    data_loaders = [
+        build_image_caption_sd_dataloader(config, 1, seed=123, num_processes=2, process_index=process_index)
+        for process_index in range(2)
+    ]
+
+    assert all(is_sharded_sampler(data_loader.batch_sampler) for data_loader in data_loaders)
+    # 5 examples -> 5 batches, padded to 3 batches per process.
+    assert [len(data_loader) for data_loader in data_loaders] == [3, 3]
+    example_ids = [[example_id for batch in data_loader for example_id in batch["id"]] for data_loader in data_loaders]
+    assert sorted(set(example_ids[0] + example_ids[1])) == sorted(str(i) for i in range(5))
+    # The first batch of process 0 is repeated as padding at the end of process 1.
+    assert example_ids[1][-1] == example_ids[0][0]
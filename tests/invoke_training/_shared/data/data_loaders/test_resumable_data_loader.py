@@ -0,0 +1,81 @@
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+from invoke_training._shared.data.data_loaders.resumable_data_loader import ResumableDataLoader
+from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import AspectRatioBucketBatchSampler
+from invoke_training._shared.data.utils.resolution import Resolution
+
+
+class _RecordingDataset(torch.utils.data.Dataset):
+    """A dataset that records the indices of the examples that are loaded."""
+
+    def __init__(self, num_examples: int):
+        self._num_examples = num_examples
+        self.loaded_idxs = []
+
+    def __len__(self) -> int:
+        return self._num_examples
+
+    def __getitem__(self, idx: int) -> int:
+        self.loaded_idxs.append(idx)
+        return idx
+
+
+def _build_data_loader(seed: int) -> tuple[ResumableDataLoader, _RecordingDataset]:
+    dataset = _RecordingDataset(20)
+    batch_sampler = AspectRatioBucketBatchSampler(
+        buckets={Resolution(256, 512): list(range(0, 12)), Resolution(512, 256): list(range(12, 20))},
+        batch_size=4,
+        shuffle=True,
+        seed=seed,
+    )
+    return ResumableDataLoader(DataLoader(dataset, batch_sampler=batch_sampler)), dataset
+
+
+def test_resumable_data_loader():
+    """Test that a restored ResumableDataLoader resumes after the consumed batches, without loading the skipped
+    examples.
+    """
+    data_loader, _ = _build_data_loader(seed=1)
+
+    _ = [batch.tolist() for batch in data_loader]
+    data_loader_iter = iter(data_loader)
+    consumed_batches = [next(data_loader_iter).tolist() for _ in range(2)]
+    state_dict = data_loader.state_dict()
+    remaining_batches = [batch.tolist() for batch in data_loader_iter]
+    next_epoch_batches = [batch.tolist() for batch in data_loader]
+
+    assert state_dict["num_batches"] == 2
+
+    resumed_data_loader, resumed_dataset = _build_data_loader(seed=2)
+    resumed_data_loader.load_state_dict(state_dict)
+    assert [batch.tolist() for batch in resumed_data_loader] == remaining_batches
+    # The examples in the skipped batches were never loaded.
+    assert sorted(resumed_dataset.loaded_idxs) == sorted(idx for batch in remaining_batches for idx in batch)
+    assert set(resumed_dataset.loaded_idxs).isdisjoint(idx for batch in consumed_batches for idx in batch)
+
+    assert [batch.tolist() for batch in resumed_data_loader] == next_epoch_batches
+
+
+def test_resumable_data_loader_state_dict_between_epochs():
+    data_loader, _ = _build_data_loader(seed=1)
+
+    _ = list(data_loader)
+    state_dict = data_loader.state_dict()
+    next_epoch_batches = [batch.tolist() for batch in data_loader]
+
+    assert state_dict["num_batches"] == 0
+
+    resumed_data_loader, _ = _build_data_loader(seed=2)
+    resumed_data_loader.load_state_dict(state_dict)
+    assert [batch.tolist() for batch in resumed_data_loader] == next_epoch_batches
+
+
+def test_resumable_data_loader_iterable_dataset():
+    class _IterableDataset(torch.utils.data.IterableDataset):
+        def __iter__(self):
+            yield from range(4)
+
+    with pytest.raises(ValueError):
+        ResumableDataLoader(DataLoader(_IterableDataset(), batch_size=None))
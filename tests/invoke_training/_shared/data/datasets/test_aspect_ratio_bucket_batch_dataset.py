@@ -0,0 +1,118 @@
+import pytest
+import torch
+import torch.utils.data
+
+from invoke_training._shared.data.datasets.aspect_ratio_bucket_batch_dataset import AspectRatioBucketBatchDataset
+from invoke_training._shared.data.utils.aspect_ratio_bucket_manager import AspectRatioBucketManager
+from invoke_training._shared.data.utils.resolution import Resolution
+
+SQUARE = (64, 64)
+WIDE = (32, 128)
+
+
+class _ListIterableDataset(torch.utils.data.IterableDataset):
+    def __init__(self, examples):
+        super().__init__()
+        self._examples = examples
+
+    def __len__(self):
+        return len(self._examples)
+
+    def __iter__(self):
+        yield from self._examples
+
+
+def _build_dataset(sizes: list[tuple[int, int]], batch_size: int, max_buffered_examples: int):
+    examples = [{"id": i, "original_size_hw": size} for i, size in enumerate(sizes)]
+    bucket_manager = AspectRatioBucketManager({Resolution(*SQUARE), Resolution(*WIDE)})
+    return AspectRatioBucketBatchDataset(
+        _ListIterableDataset(examples),
+        bucket_manager=bucket_manager,
+        batch_size=batch_size,
+        max_buffered_examples=max_buffered_examples,
+    )
+
+
+def test_aspect_ratio_bucket_batch_dataset_full_batches():
+    """Test that batches are emitted as soon as a bucket is full, and only contain examples from one bucket."""
+    sizes = [SQUARE, WIDE, SQUARE, WIDE, WIDE, SQUARE]
+    dataset = _build_dataset(sizes, batch_size=2, max_buffered_examples=10)
+
+    batches = [[example["id"] for example in batch] for batch in dataset]
+
+    # The partial batches are flushed at the end of the stream.
+    assert batches == [[0, 2], [1, 3], [5], [4]]
+
+
+def test_aspect_ratio_bucket_batch_dataset_bounded_buffer():
+    """Test that the fullest bucket is flushed as a partial batch when the buffer limit is reached."""
+    sizes = [SQUARE, SQUARE, WIDE, SQUARE, WIDE]
+    dataset = _build_dataset(sizes, batch_size=4, max_buffered_examples=4)
+
+    batches = [[example["id"] for example in batch] for batch in dataset]
+
+    # The buffer limit is reached on the 4th example, so the SQUARE bucket ([0, 1, 3]) is flushed.
+    assert batches == [[0, 1, 3], [2, 4]]
+
+
+def test_aspect_ratio_bucket_batch_dataset_yields_every_example_once():
+    sizes = [SQUARE if i % 3 == 0 else WIDE for i in range(50)]
+    dataset = _build_dataset(sizes, batch_size=4, max_buffered_examples=6)
+
+    batches = list(dataset)
+
+    assert sorted(example["id"] for batch in batches for example in batch) == list(range(50))
+    for batch in batches:
+        assert 0 < len(batch) <= 4
+        assert len({example["original_size_hw"] for example in batch}) == 1
+
+
+def test_aspect_ratio_bucket_batch_dataset_len():
+    dataset = _build_dataset([SQUARE] * 5, batch_size=2, max_buffered_examples=4)
+
+    assert len(dataset) == 3
+
+
+def test_aspect_ratio_bucket_batch_dataset_image_field():
+    """Test that the bucket is determined from the image if there is no "original_size_hw" field."""
+    examples = [{"id": i, "image": torch.zeros((3, *size))} for i, size in enumerate([WIDE, SQUARE, WIDE])]
+    bucket_manager = AspectRatioBucketManager({Resolution(*SQUARE), Resolution(*WIDE)})
+    dataset = AspectRatioBucketBatchDataset(
+        _ListIterableDataset(examples), bucket_manager=bucket_manager, batch_size=2, max_buffered_examples=4
+    )
+
+    assert [[example["id"] for example in batch] for batch in dataset] == [[0, 2], [1]]
+
+
+def test_aspect_ratio_bucket_batch_dataset_invalid_buffer_size():
+    with pytest.raises(ValueError):
+        _build_dataset([SQUARE], batch_size=4, max_buffered_examples=2)
+
+
+def test_aspect_ratio_bucket_batch_dataset_max_pixels_per_batch():
+    """Test that the batch size of each bucket is derived from max_pixels_per_batch."""
+    half = (32, 64)
+    sizes = [SQUARE, half, half, SQUARE, half, half]
+    examples = [{"id": i, "original_size_hw": size} for i, size in enumerate(sizes)]
+    dataset = AspectRatioBucketBatchDataset(
+        _ListIterableDataset(examples),
+        bucket_manager=AspectRatioBucketManager({Resolution(*SQUARE), Resolution(*half)}),
+        batch_size=1,
+        max_buffered_examples=10,
+        max_pixels_per_batch=2 * 64 * 64,
+    )
+
+    batches = [[example["id"] for example in batch] for batch in dataset]
+
+    assert batches == [[0, 3], [1, 2, 4, 5]]
+
+
+def test_aspect_ratio_bucket_batch_dataset_max_pixels_per_batch_buffer_too_small():
+    with pytest.raises(ValueError):
+        AspectRatioBucketBatchDataset(
+            _ListIterableDataset([]),
+            bucket_manager=AspectRatioBucketManager({Resolution(*SQUARE), Resolution(32, 64)}),
+            batch_size=1,
+            max_buffered_examples=3,
+            max_pixels_per_batch=2 * 64 * 64,
+        )
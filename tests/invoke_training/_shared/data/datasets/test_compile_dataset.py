@@ -0,0 +1,73 @@
+import torch
+
+from invoke_training._shared.data.data_loaders.dreambooth_sd_dataloader import build_dreambooth_sd_dataloader
+from invoke_training._shared.data.data_loaders.image_caption_sd_dataloader import build_image_caption_sd_dataloader
+from invoke_training._shared.data.datasets.compile_dataset import compile_dataset
+from invoke_training._shared.data.datasets.compiled_dataset import CompiledDataset
+from invoke_training.config.data.data_loader_config import (
+    AspectRatioBucketConfig,
+    DreamboothSDDataLoaderConfig,
+    ImageCaptionSDDataLoaderConfig,
+)
+from invoke_training.config.data.dataset_config import (
+    CompiledDatasetConfig,
+    ImageCaptionJsonlDatasetConfig,
+    ImageDirDatasetConfig,
+)
+
+from ..dataset_fixtures import image_caption_jsonl, image_dir  # noqa: F401
+
+
+def test_compile_dataset_image_caption(image_caption_jsonl, tmp_path):  # noqa: F811
+    """Test compiling an image-caption dataset, and training from the compiled dataset."""
+    config = ImageCaptionSDDataLoaderConfig(
+        dataset=ImageCaptionJsonlDatasetConfig(jsonl_path=str(image_caption_jsonl)),
+        aspect_ratio_buckets=AspectRatioBucketConfig(target_resolution=64, start_dim=32, end_dim=96, divisible_by=32),
+    )
+    out_dir = str(tmp_path / "compiled")
+
+    out_dirs = compile_dataset(config, out_dir)
+
+    assert out_dirs == [out_dir]
+    compiled_dataset = CompiledDataset(out_dir)
+    assert len(compiled_dataset) == 5
+    example = compiled_dataset[0]
+    assert example["caption"] == "caption 0"
+    assert example["original_size_hw"] == (128, 128)
+    # The square 128x128 images are resized (but not cropped) to the square 64x64 bucket.
+    assert example["image"].shape == (3, 64, 64)
+    assert example["mask"].shape == (1, 64, 64)
+
+    # Train from the compiled dataset.
+    config.dataset = CompiledDatasetConfig(dataset_dir=out_dir)
+    data_loader = build_image_caption_sd_dataloader(config, 4, use_masks=True, shuffle=False)
+    batch = next(iter(data_loader))
+
+    assert batch["image"].shape == (4, 3, 64, 64)
+    assert batch["image"].dtype == torch.float32
+    assert batch["mask"].shape == (4, 1, 64, 64)
+    assert batch["original_size_hw"][0] == (128, 128)
+    assert batch["caption"][0] == "caption 0"
+
+
+def test_compile_dataset_dreambooth(image_dir, tmp_path):  # noqa: F811
+    """Test compiling a DreamBooth dataset, and training from the compiled dataset."""
+    config = DreamboothSDDataLoaderConfig(
+        instance_caption="an image of a sks dog",
+        instance_dataset=ImageDirDatasetConfig(dataset_dir=str(image_dir)),
+        class_caption="an image of a dog",
+        class_dataset=ImageDirDatasetConfig(dataset_dir=str(image_dir)),
+        resolution=32,
+    )
+
+    out_dirs = compile_dataset(config, str(tmp_path))
+
+    assert out_dirs == [str(tmp_path / "instance"), str(tmp_path / "class")]
+
+    config.instance_dataset = CompiledDatasetConfig(dataset_dir=out_dirs[0])
+    config.class_dataset = CompiledDatasetConfig(dataset_dir=out_dirs[1])
+    data_loader = build_dreambooth_sd_dataloader(config, 2, shuffle=False)
+    batch = next(iter(data_loader))
+
+    assert batch["image"].shape == (2, 3, 32, 32)
+    assert batch["original_size_hw"][0] == (128, 128)
@@ -0,0 +1,79 @@
+import pickle
+
+import numpy as np
+import pytest
+import torch
+
+from invoke_training._shared.data.datasets.compiled_dataset import CompiledDataset, CompiledDatasetWriter
+from invoke_training._shared.data.utils.resolution import Resolution
+
+
+def test_compiled_dataset_round_trip(tmp_path):
+    """Test that examples written with CompiledDatasetWriter are read back unchanged by CompiledDataset."""
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, (3, 8 + i, 16), dtype=np.uint8) for i in range(3)]
+    mask = rng.integers(0, 256, (1, 9, 16), dtype=np.uint8)
+
+    # Use a tiny shard size so that the examples are split across multiple shards.
+    writer = CompiledDatasetWriter(str(tmp_path), shard_size_bytes=100)
+    writer.add(images[0], original_size_hw=(80, 160), caption="caption 0")
+    writer.add(images[1], original_size_hw=(90, 160), caption="caption 1", mask=mask)
+    writer.add(images[2], original_size_hw=(100, 160), caption="caption 2")
+    writer.close(metadata={"foo": "bar"})
+
+    dataset = CompiledDataset(str(tmp_path), id_prefix="prefix_")
+
+    assert len(dataset) == 3
+    assert dataset.metadata == {"foo": "bar"}
+    assert dataset.get_image_dimensions() == [Resolution(80, 160), Resolution(90, 160), Resolution(100, 160)]
+    for i in range(3):
+        example = dataset[i]
+        assert example["id"] == f"prefix_{i}"
+        assert example["caption"] == f"caption {i}"
+        assert example["original_size_hw"] == (80 + 10 * i, 160)
+        assert example["image"].dtype == torch.uint8
+        assert np.array_equal(example["image"].numpy(), images[i])
+    assert "mask" not in dataset[0]
+    assert np.array_equal(dataset[1]["mask"].numpy(), mask)
+
+
+def test_compiled_dataset_without_captions(tmp_path):
+    writer = CompiledDatasetWriter(str(tmp_path))
+    writer.add(np.zeros((3, 8, 8), dtype=np.uint8), original_size_hw=(8, 8))
+    writer.close()
+
+    dataset = CompiledDataset(str(tmp_path))
+
+    assert set(dataset[0].keys()) == {"id", "image", "original_size_hw"}
+    assert dataset.load_example_without_images(0) == {"id": "0"}
+
+
+def test_compiled_dataset_pickle(tmp_path):
+    """Test that a CompiledDataset can be pickled (e.g. to be sent to DataLoader workers) after its shards have been
+    memory-mapped.
+    """
+    writer = CompiledDatasetWriter(str(tmp_path))
+    writer.add(np.ones((3, 8, 8), dtype=np.uint8), original_size_hw=(8, 8))
+    writer.close()
+    dataset = CompiledDataset(str(tmp_path))
+    _ = dataset[0]
+
+    unpickled_dataset = pickle.loads(pickle.dumps(dataset))
+
+    assert torch.equal(unpickled_dataset[0]["image"], dataset[0]["image"])
+
+
+def test_compiled_dataset_incomplete(tmp_path):
+    """Test that a compiled dataset that was not closed (and so has no manifest) can not be loaded."""
+    writer = CompiledDatasetWriter(str(tmp_path))
+    writer.add(np.zeros((3, 8, 8), dtype=np.uint8), original_size_hw=(8, 8))
+
+    with pytest.raises(ValueError, match="is not a compiled dataset"):
+        _ = CompiledDataset(str(tmp_path))
+
+
+def test_compiled_dataset_writer_non_empty_dir(tmp_path):
+    (tmp_path / "file.txt").write_text("")
+
+    with pytest.raises(ValueError, match="is not empty"):
+        _ = CompiledDatasetWriter(str(tmp_path))
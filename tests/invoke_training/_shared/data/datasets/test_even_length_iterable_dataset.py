@@ -0,0 +1,65 @@
+from unittest import mock
+
+import pytest
+import torch.utils.data
+
+from invoke_training._shared.data.datasets.even_length_iterable_dataset import EvenLengthIterableDataset
+
+
+class _ListIterableDataset(torch.utils.data.IterableDataset):
+    def __init__(self, items: list):
+        super().__init__()
+        self._items = items
+
+    def __iter__(self):
+        return iter(self._items)
+
+
+@pytest.mark.parametrize(
+    ["items", "length", "expected_items"],
+    [
+        # Truncated.
+        ([0, 1, 2, 3, 4], 3, [0, 1, 2]),
+        # Padded by restarting the base dataset.
+        ([0, 1], 5, [0, 1, 0, 1, 0]),
+        ([0, 1, 2], 3, [0, 1, 2]),
+    ],
+)
+def test_even_length_iterable_dataset(items: list, length: int, expected_items: list):
+    dataset = EvenLengthIterableDataset(_ListIterableDataset(items), length=length)
+
+    assert len(dataset) == length
+    assert list(dataset) == expected_items
+    assert dataset.is_sharded
+
+
+def test_even_length_iterable_dataset_worker_split():
+    """Test that the length is split evenly between DataLoader workers."""
+    dataset = EvenLengthIterableDataset(_ListIterableDataset([0, 1]), length=5)
+
+    num_items_per_worker = []
+    for worker_id in range(2):
+        worker_info = mock.Mock(id=worker_id, num_workers=2)
+        with mock.patch(
+            "invoke_training._shared.data.datasets.even_length_iterable_dataset.get_worker_info",
+            return_value=worker_info,
+        ):
+            num_items_per_worker.append(len(list(dataset)))
+
+    assert num_items_per_worker == [3, 2]
+
+
+def test_even_length_iterable_dataset_empty_base_dataset():
+    dataset = EvenLengthIterableDataset(_ListIterableDataset([]), length=2)
+
+    with pytest.raises(RuntimeError):
+        list(dataset)
+
+
+def test_even_length_iterable_dataset_set_epoch():
+    base_dataset = mock.Mock()
+    dataset = EvenLengthIterableDataset(base_dataset, length=2)
+
+    dataset.set_epoch(3)
+
+    base_dataset.set_epoch.assert_called_once_with(3)
@@ -101,6 +101,16 @@ def test_hf_dir_image_caption_dataset_getitem(hf_dir_dataset: HFImageCaptionData
     assert example["id"] == 0
 
 
+def test_hf_dir_image_caption_dataset_load_example_without_images(hf_dir_dataset: HFImageCaptionDataset):
+    """Test that HFImageCaptionDataset.load_example_without_images(...) returns the non-image fields of an example."""
+    example = hf_dir_dataset.load_example_without_images(0)
+    full_example = hf_dir_dataset[0]
+
+    assert set(example.keys()) == {"caption", "id"}
+    assert example["id"] == full_example["id"]
+    assert example["caption"] == full_example["caption"]
+
+
 def test_hf_dir_image_caption_dataset_get_image_dimensions(hf_dir_dataset: HFImageCaptionDataset):
     """Test HFImageCaptionDataset.get_image_dimensions()."""
 
@@ -111,6 +121,21 @@ def test_hf_dir_image_caption_dataset_get_image_dimensions(hf_dir_dataset: HFIma
         assert image_dim == Resolution(128, 128)
 
 
+def test_hf_dir_image_caption_dataset_get_image_dimensions_non_square(tmp_path: Path):
+    """Test that HFImageCaptionDataset.get_image_dimensions() returns the (height, width) of each image, in order."""
+    sizes_hw = [(32, 64), (48, 16), (8, 8)]
+    metadata = []
+    for i, (height, width) in enumerate(sizes_hw):
+        Image.fromarray(np.ones((height, width, 3), dtype=np.uint8)).save(tmp_path / f"{i}.png")
+        metadata.append({"file_name": f"{i}.png", "text": f"caption {i}"})
+    save_jsonl(metadata, tmp_path / "metadata.jsonl")
+    dataset = HFImageCaptionDataset.from_dir(str(tmp_path))
+
+    image_dims = dataset.get_image_dimensions()
+
+    assert [image_dim.to_tuple() for image_dim in image_dims] == sizes_hw
+
+
 ################################################
 # Tests for HFImageCaptionDataset.from_hub(...)
 ################################################
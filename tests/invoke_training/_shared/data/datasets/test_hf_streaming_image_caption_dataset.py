@@ -0,0 +1,109 @@
+import os
+from pathlib import Path
+
+import datasets
+import pytest
+import torch
+from PIL import Image
+
+from invoke_training._shared.data.datasets.hf_streaming_image_caption_dataset import HFStreamingImageCaptionDataset
+
+from .test_hf_image_caption_dataset import hf_imagefolder_dir  # noqa: F401
+
+
+def _load_streaming_imagefolder(dataset_dir: Path) -> datasets.IterableDataset:
+    return datasets.load_dataset(
+        "imagefolder", data_files={"train": os.path.join(str(dataset_dir), "**")}, split="train", streaming=True
+    )
+
+
+def test_hf_streaming_image_caption_dataset(hf_imagefolder_dir: Path):  # noqa: F811
+    dataset = HFStreamingImageCaptionDataset(_load_streaming_imagefolder(hf_imagefolder_dir), num_examples=5)
+
+    assert len(dataset) == 5
+
+    examples = list(dataset)
+    assert len(examples) == 5
+    assert len({example["id"] for example in examples}) == 5
+
+    example = examples[0]
+    assert set(example.keys()) == {"id", "image", "caption"}
+    assert isinstance(example["image"], Image.Image)
+    assert example["image"].mode == "RGB"
+    assert example["caption"].startswith("Caption for")
+
+
+def test_hf_streaming_image_caption_dataset_no_images(hf_imagefolder_dir: Path):  # noqa: F811
+    dataset = HFStreamingImageCaptionDataset(
+        _load_streaming_imagefolder(hf_imagefolder_dir), num_examples=5, load_images=False
+    )
+
+    example = next(iter(dataset))
+    assert set(example.keys()) == {"id", "caption"}
+
+
+def test_hf_streaming_image_caption_dataset_shuffle(hf_imagefolder_dir: Path):  # noqa: F811
+    """Test that a shuffled epoch contains every example exactly once."""
+    dataset = HFStreamingImageCaptionDataset(
+        _load_streaming_imagefolder(hf_imagefolder_dir), num_examples=5, shuffle=True, load_images=False
+    )
+
+    torch.manual_seed(0)
+    captions = [example["caption"] for example in dataset]
+
+    assert sorted(captions) == sorted(f"Caption for {i}.jpg" for i in range(5))
+
+
+def test_hf_streaming_image_caption_dataset_bad_caption_column(hf_imagefolder_dir: Path):  # noqa: F811
+    hf_dataset = _load_streaming_imagefolder(hf_imagefolder_dir)
+    if hf_dataset.column_names is None:
+        pytest.skip("The column names of the streaming dataset are not known up front.")
+
+    with pytest.raises(ValueError):
+        HFStreamingImageCaptionDataset(hf_dataset, caption_column="does_not_exist", num_examples=5)
+
+
+def test_hf_streaming_image_caption_dataset_rank_split(hf_imagefolder_dir: Path):  # noqa: F811
+    """Test that a shuffled dataset is split between ranks without overlap, and that the shuffle order is derived from
+    the seed and the epoch.
+    """
+    captions_per_rank = []
+    for rank in range(2):
+        dataset = HFStreamingImageCaptionDataset(
+            _load_streaming_imagefolder(hf_imagefolder_dir),
+            num_examples=5,
+            shuffle=True,
+            load_images=False,
+            rank=rank,
+            world_size=2,
+            seed=1,
+        )
+        assert len(dataset) == 3
+
+        # Unlike the shared seed, the global RNG state must not affect the split.
+        torch.manual_seed(rank)
+        captions_per_rank.append([example["caption"] for example in dataset])
+
+    assert sorted(captions_per_rank[0] + captions_per_rank[1]) == sorted(f"Caption for {i}.jpg" for i in range(5))
+
+
+def test_hf_streaming_image_caption_dataset_set_epoch(hf_imagefolder_dir: Path):  # noqa: F811
+    dataset = HFStreamingImageCaptionDataset(
+        _load_streaming_imagefolder(hf_imagefolder_dir), num_examples=5, shuffle=True, load_images=False, seed=1
+    )
+
+    epoch_0_captions = [example["caption"] for example in dataset]
+    assert [example["caption"] for example in dataset] == epoch_0_captions
+
+    epoch_captions = []
+    for epoch in range(1, 4):
+        dataset.set_epoch(epoch)
+        epoch_captions.append([example["caption"] for example in dataset])
+    assert any(captions != epoch_0_captions for captions in epoch_captions)
+
+
+def test_hf_streaming_image_caption_dataset_rank_split_requires_seed(hf_imagefolder_dir: Path):  # noqa: F811
+    with pytest.raises(ValueError):
+        HFStreamingImageCaptionDataset(
+            _load_streaming_imagefolder(hf_imagefolder_dir), num_examples=5, shuffle=True, rank=0, world_size=2
+        )
@@ -38,6 +38,28 @@ def test_image_caption_dir_dataset_keep_in_memory(image_caption_dir):  # noqa: F
     assert example["caption"] == "caption 0"
 
 
+def test_image_caption_dir_dataset_load_example_without_images(image_caption_dir):  # noqa: F811
+    dataset = ImageCaptionDirDataset(str(image_caption_dir))
+
+    example = dataset.load_example_without_images(0)
+    full_example = dataset[0]
+
+    assert set(example.keys()) == {"id", "caption"}
+    assert example["id"] == full_example["id"]
+    assert example["caption"] == full_example["caption"]
+
+
+def test_image_caption_dir_dataset_get_image_source_fingerprint(image_caption_dir):  # noqa: F811
+    dataset = ImageCaptionDirDataset(str(image_caption_dir))
+
+    fingerprint = dataset.get_image_source_fingerprint(0)
+
+    assert fingerprint == dataset.get_image_source_fingerprint(0)
+    assert fingerprint != dataset.get_image_source_fingerprint(1)
+    PIL.Image.new("RGB", (8, 8)).save(dataset._image_paths[0])
+    assert fingerprint != dataset.get_image_source_fingerprint(0)
+
+
 def test_image_caption_dir_dataset_get_image_dimensions(image_caption_dir):  # noqa: F811
     dataset = ImageCaptionDirDataset(str(image_caption_dir))
 
@@ -2,9 +2,13 @@ import shutil
 from pathlib import Path
 
 import PIL.Image
+import pytest
 
-from invoke_training._shared.data.datasets.image_caption_jsonl_dataset import ImageCaptionJsonlDataset
-from invoke_training._shared.utils.jsonl import load_jsonl
+from invoke_training._shared.data.datasets.image_caption_jsonl_dataset import (
+    ImageCaptionExample,
+    ImageCaptionJsonlDataset,
+)
+from invoke_training._shared.utils.jsonl import load_jsonl, save_jsonl
 
 from ..dataset_fixtures import image_caption_jsonl  # noqa: F401
 
@@ -42,12 +46,21 @@ def test_image_caption_jsonl_dataset_keep_in_memory(image_caption_jsonl):  # noq
     assert isinstance(example["mask"], PIL.Image.Image)
     assert example["mask"].mode == "L"
 
-    # Confirm that accessing the same example again returns a shallow copy of the original example.
-    # In other words, modifying the returned dict should not modify the cached example, but the same image should be
-    # returned.
+    # Confirm that accessing the same example again returns a new example with the same image data. The image is
+    # reconstructed from the shared-memory store, so modifying the returned image does not modify the store.
     same_example = dataset[0]
     assert same_example is not example
-    assert same_example["image"] is example["image"]
+    assert same_example["image"] is not example["image"]
+    assert same_example["image"].tobytes() == example["image"].tobytes()
+    assert same_example["mask"].tobytes() == example["mask"].tobytes()
+
+
+def test_image_caption_jsonl_dataset_load_example_without_images(image_caption_jsonl):  # noqa: F811
+    dataset = ImageCaptionJsonlDataset(str(image_caption_jsonl))
+
+    example = dataset.load_example_without_images(0)
+
+    assert example == {"id": "0", "caption": "caption 0"}
 
 
 def test_image_caption_jsonl_dataset_get_image_dimensions(image_caption_jsonl):  # noqa: F811
@@ -74,3 +87,59 @@ def test_image_caption_jsonl_dataset_save_jsonl(image_caption_jsonl, tmp_path: P
     original_jsonl = load_jsonl(image_caption_jsonl)
     roundtrip_jsonl = load_jsonl(image_caption_jsonl_copy)
     assert original_jsonl == roundtrip_jsonl
+
+
+def test_image_caption_jsonl_dataset_get_image_dimensions_from_columns(tmp_path: Path):
+    """Test that image dimensions are read from the optional "width" and "height" columns without opening the images."""
+    jsonl_path = tmp_path / "data.jsonl"
+    save_jsonl(
+        [
+            {"image": "missing_0.jpg", "text": "caption 0", "width": 64, "height": 32},
+            {"image": "missing_1.jpg", "text": "caption 1", "width": 16, "height": 48},
+        ],
+        jsonl_path,
+    )
+    dataset = ImageCaptionJsonlDataset(str(jsonl_path))
+
+    image_dims = dataset.get_image_dimensions()
+
+    assert [d.to_tuple() for d in image_dims] == [(32, 64), (48, 16)]
+
+
+def test_image_caption_jsonl_dataset_blank_lines(tmp_path: Path):
+    """Test that blank lines in the jsonl file are skipped."""
+    jsonl_path = tmp_path / "data.jsonl"
+    jsonl_path.write_text(
+        '{"image": "0.jpg", "text": "caption 0"}\n\n{"image": "1.jpg", "text": "caption 1"}\n\n'
+        '{"image": "2.jpg", "text": "caption 2"}\n'
+    )
+    dataset = ImageCaptionJsonlDataset(str(jsonl_path))
+
+    assert len(dataset) == 3
+    assert dataset.load_example_without_images(2) == {"id": "2", "caption": "caption 2"}
+
+
+def test_image_caption_jsonl_dataset_bad_caption_column(tmp_path: Path):
+    jsonl_path = tmp_path / "data.jsonl"
+    save_jsonl([{"image": "0.jpg", "text": "caption 0"}], jsonl_path)
+
+    with pytest.raises(ValueError):
+        ImageCaptionJsonlDataset(str(jsonl_path), caption_column="caption")
+
+
+def test_image_caption_jsonl_dataset_edit_examples(tmp_path: Path):
+    """Test that modifications to `examples` are reflected in the dataset, and written by `save_jsonl()`."""
+    jsonl_path = tmp_path / "data.jsonl"
+    save_jsonl([{"image": "0.jpg", "text": "caption 0"}], jsonl_path)
+    dataset = ImageCaptionJsonlDataset(str(jsonl_path))
+
+    dataset.examples[0].caption = "new caption 0"
+    dataset.examples.append(ImageCaptionExample(image_path="1.jpg", caption="caption 1"))
+
+    assert len(dataset) == 2
+    assert dataset.load_example_without_images(0) == {"id": "0", "caption": "new caption 0"}
+
+    dataset.save_jsonl()
+    reloaded_dataset = ImageCaptionJsonlDataset(str(jsonl_path))
+    assert len(reloaded_dataset) == 2
+    assert reloaded_dataset.load_example_without_images(1) == {"id": "1", "caption": "caption 1"}
@@ -1,4 +1,6 @@
 import PIL.Image
+import PIL.ImageFile
+import torch
 
 from invoke_training._shared.data.datasets.image_dir_dataset import ImageDirDataset
 
@@ -32,12 +34,42 @@ def test_image_dir_dataset_keep_in_memory(image_dir):  # noqa: F811
     assert example["image"].mode == "RGB"
     assert example["id"] == "0"
 
-    # Confirm that accessing the same example again returns a shallow copy of the original example.
-    # In other words, modifying the returned dict should not modify the cached example, but the same image should be
-    # returned.
+    # Confirm that accessing the same example again returns a new example with the same image data. The image is
+    # reconstructed from the shared-memory store, so modifying the returned image does not modify the store.
     same_example = dataset[0]
     assert same_example is not example
-    assert same_example["image"] is example["image"]
+    assert same_example["image"] is not example["image"]
+    assert same_example["image"].tobytes() == example["image"].tobytes()
+
+
+def test_image_dir_dataset_lazy_image_decode(image_dir):  # noqa: F811
+    dataset = ImageDirDataset(str(image_dir), lazy_image_decode=True)
+
+    image = dataset[0]["image"]
+
+    # The image has been opened, but not decoded.
+    assert isinstance(image, PIL.ImageFile.ImageFile)
+    assert len(image.tile) > 0
+    assert image.format == "JPEG"
+
+
+def test_image_dir_dataset_decode_to_tensor(image_dir):  # noqa: F811
+    dataset = ImageDirDataset(str(image_dir), decode_to_tensor=True)
+
+    image = dataset[0]["image"]
+
+    assert isinstance(image, torch.Tensor)
+    assert image.dtype == torch.uint8
+    assert image.shape == (3, 128, 128)
+
+
+def test_image_dir_dataset_load_example_without_images(image_dir):  # noqa: F811
+    dataset = ImageDirDataset(str(image_dir))
+
+    example = dataset.load_example_without_images(0)
+
+    assert set(example.keys()) == {"id"}
+    assert example["id"] == dataset[0]["id"]
 
 
 def test_image_dir_dataset_get_image_dimensions(image_dir):  # noqa: F811
@@ -46,3 +78,23 @@ def test_image_dir_dataset_get_image_dimensions(image_dir):  # noqa: F811
     image_dims = dataset.get_image_dimensions()
 
     assert len(image_dims) == len(dataset)
+
+
+def test_image_dir_dataset_keep_in_memory_encoded(image_dir):  # noqa: F811
+    dataset = ImageDirDataset(str(image_dir), keep_in_memory=True, keep_in_memory_format="encoded")
+
+    image = dataset[0]["image"]
+
+    assert isinstance(image, PIL.Image.Image)
+    assert image.mode == "RGB"
+    assert image.size == (128, 128)
+
+
+def test_image_dir_dataset_keep_in_memory_max_mb(image_dir):  # noqa: F811
+    """Test that images are still loaded (from disk) when they do not fit in the in-memory store."""
+    dataset = ImageDirDataset(str(image_dir), keep_in_memory=True, keep_in_memory_max_mb=0)
+
+    image = dataset[0]["image"]
+
+    assert isinstance(image, PIL.Image.Image)
+    assert image.size == (128, 128)
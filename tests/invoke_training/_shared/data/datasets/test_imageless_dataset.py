@@ -0,0 +1,28 @@
+import pytest
+
+from invoke_training._shared.data.datasets.image_caption_jsonl_dataset import ImageCaptionJsonlDataset
+from invoke_training._shared.data.datasets.imageless_dataset import ImagelessDataset
+from invoke_training._shared.data.datasets.transform_dataset import TransformDataset
+
+from ..dataset_fixtures import image_caption_jsonl  # noqa: F401
+
+
+def test_imageless_dataset_len(image_caption_jsonl):  # noqa: F811
+    dataset = ImagelessDataset(ImageCaptionJsonlDataset(str(image_caption_jsonl)))
+
+    assert len(dataset) == 5
+
+
+def test_imageless_dataset_getitem(image_caption_jsonl):  # noqa: F811
+    dataset = ImagelessDataset(ImageCaptionJsonlDataset(str(image_caption_jsonl)))
+
+    example = dataset[0]
+
+    assert example == {"id": "0", "caption": "caption 0"}
+
+
+def test_imageless_dataset_unsupported_base_dataset(image_caption_jsonl):  # noqa: F811
+    base_dataset = TransformDataset(ImageCaptionJsonlDataset(str(image_caption_jsonl)), [])
+
+    with pytest.raises(ValueError):
+        _ = ImagelessDataset(base_dataset)
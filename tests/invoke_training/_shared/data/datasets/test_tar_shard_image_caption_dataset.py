@@ -0,0 +1,296 @@
+import io
+import json
+import math
+import os
+import socket
+import tarfile
+from pathlib import Path
+from unittest import mock
+
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from accelerate import Accelerator
+from PIL import Image
+
+from invoke_training._shared.accelerator.accelerator_utils import prepare_data_loader
+from invoke_training._shared.data.data_loaders.image_caption_sd_dataloader import build_image_caption_sd_dataloader
+from invoke_training._shared.data.datasets.tar_shard_image_caption_dataset import (
+    TarShardImageCaptionDataset,
+    expand_shard_paths,
+)
+from invoke_training.config.data.data_loader_config import AspectRatioBucketConfig, ImageCaptionSDDataLoaderConfig
+from invoke_training.config.data.dataset_config import ImageCaptionTarShardDatasetConfig
+
+
+def _encode_image(image: Image.Image, format: str) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def _add_file(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _write_shards(tmp_path: Path, num_shards: int, examples_per_shard: int, with_masks: bool = False) -> list[str]:
+    """Write tar shards of image-caption examples with keys "{shard_idx}_{example_idx}"."""
+    shard_paths = []
+    for shard_idx in range(num_shards):
+        shard_path = tmp_path / f"shard_{shard_idx:03d}.tar"
+        with tarfile.open(shard_path, "w") as tar:
+            for example_idx in range(examples_per_shard):
+                key = f"{shard_idx}_{example_idx}"
+                image = Image.new("RGB", (64, 48), color=(shard_idx * 10, example_idx * 10, 0))
+                _add_file(tar, f"{key}.jpg", _encode_image(image, "JPEG"))
+                _add_file(tar, f"{key}.txt", f"caption {key}\n".encode("utf-8"))
+                if with_masks:
+                    _add_file(tar, f"{key}.png", _encode_image(Image.new("L", (64, 48), color=255), "PNG"))
+        shard_paths.append(str(shard_path))
+    return shard_paths
+
+
+def test_expand_shard_paths(tmp_path: Path):
+    shard_paths = _write_shards(tmp_path, num_shards=3, examples_per_shard=1)
+
+    assert expand_shard_paths(str(tmp_path / "*.tar")) == shard_paths
+    assert expand_shard_paths([shard_paths[2], shard_paths[0]]) == [shard_paths[2], shard_paths[0]]
+    with pytest.raises(ValueError):
+        expand_shard_paths(str(tmp_path / "*.tgz"))
+
+
+def test_tar_shard_image_caption_dataset(tmp_path: Path):
+    shard_paths = _write_shards(tmp_path, num_shards=2, examples_per_shard=3, with_masks=True)
+    dataset = TarShardImageCaptionDataset(shard_paths)
+
+    assert len(dataset) == 6
+
+    examples = list(dataset)
+    assert [example["id"] for example in examples] == ["0_0", "0_1", "0_2", "1_0", "1_1", "1_2"]
+
+    example = examples[0]
+    assert set(example.keys()) == {"id", "caption", "image", "mask"}
+    assert example["caption"] == "caption 0_0"
+    assert isinstance(example["image"], Image.Image)
+    assert example["image"].mode == "RGB"
+    assert example["image"].size == (64, 48)
+    assert example["mask"].mode == "L"
+
+
+def test_tar_shard_image_caption_dataset_no_images(tmp_path: Path):
+    shard_paths = _write_shards(tmp_path, num_shards=1, examples_per_shard=2, with_masks=True)
+    dataset = TarShardImageCaptionDataset(shard_paths, load_images=False)
+
+    assert list(dataset) == [{"id": "0_0", "caption": "caption 0_0"}, {"id": "0_1", "caption": "caption 0_1"}]
+
+
+def test_tar_shard_image_caption_dataset_decode_to_tensor(tmp_path: Path):
+    shard_paths = _write_shards(tmp_path, num_shards=1, examples_per_shard=1, with_masks=True)
+    dataset = TarShardImageCaptionDataset(shard_paths, decode_to_tensor=True)
+
+    example = next(iter(dataset))
+    assert example["image"].dtype == torch.uint8
+    assert example["image"].shape == (3, 48, 64)
+    assert example["mask"].shape == (1, 48, 64)
+
+
+def test_tar_shard_image_caption_dataset_num_examples(tmp_path: Path):
+    """Test that `num_examples` is used as the length without reading the shards."""
+    shard_paths = _write_shards(tmp_path, num_shards=1, examples_per_shard=2)
+    dataset = TarShardImageCaptionDataset(shard_paths, num_examples=100)
+
+    assert len(dataset) == 100
+
+
+def test_tar_shard_image_caption_dataset_rank_split(tmp_path: Path):
+    """Test that the shards are split between ranks without overlap."""
+    shard_paths = _write_shards(tmp_path, num_shards=5, examples_per_shard=2)
+
+    ids_per_rank = []
+    for rank in range(2):
+        dataset = TarShardImageCaptionDataset(shard_paths, rank=rank, world_size=2, shuffle=True)
+        # The length is the total number of examples divided evenly between the ranks.
+        assert len(dataset) == 5
+        ids_per_rank.append({example["id"] for example in dataset})
+
+    assert len(ids_per_rank[0]) == 6
+    assert len(ids_per_rank[1]) == 4
+    assert ids_per_rank[0].isdisjoint(ids_per_rank[1])
+
+
+def test_tar_shard_image_caption_dataset_invalid_rank(tmp_path: Path):
+    shard_paths = _write_shards(tmp_path, num_shards=1, examples_per_shard=1)
+
+    with pytest.raises(ValueError):
+        TarShardImageCaptionDataset(shard_paths, rank=2, world_size=2)
+    # There are not enough shards for rank 1.
+    with pytest.raises(ValueError):
+        TarShardImageCaptionDataset(shard_paths, rank=1, world_size=2)
+
+
+def test_tar_shard_image_caption_dataset_shuffle(tmp_path: Path):
+    """Test that shuffling produces a permutation of the examples, which changes between epochs."""
+    shard_paths = _write_shards(tmp_path, num_shards=4, examples_per_shard=8)
+    dataset = TarShardImageCaptionDataset(shard_paths, shuffle=True, shuffle_buffer_size=10, load_images=False)
+    unshuffled_ids = [example["id"] for example in TarShardImageCaptionDataset(shard_paths, load_images=False)]
+
+    torch.manual_seed(0)
+    epoch_1_ids = [example["id"] for example in dataset]
+    epoch_2_ids = [example["id"] for example in dataset]
+
+    assert sorted(epoch_1_ids) == sorted(unshuffled_ids)
+    assert sorted(epoch_2_ids) == sorted(unshuffled_ids)
+    assert epoch_1_ids != unshuffled_ids
+    assert epoch_1_ids != epoch_2_ids
+
+
+def test_tar_shard_image_caption_dataset_worker_split(tmp_path: Path):
+    """Test that the shards are split between DataLoader workers, so that every example is yielded exactly once."""
+    shard_paths = _write_shards(tmp_path, num_shards=4, examples_per_shard=2)
+    dataset = TarShardImageCaptionDataset(shard_paths, shuffle=True, load_images=False)
+
+    ids = []
+    for worker_id in range(2):
+        worker_info = mock.Mock(id=worker_id, num_workers=2, seed=1234 + worker_id)
+        with (
+            mock.patch(
+                "invoke_training._shared.data.datasets.tar_shard_image_caption_dataset.get_worker_info",
+                return_value=worker_info,
+            ),
+            mock.patch("invoke_training._shared.data.utils.epoch_seed.get_worker_info", return_value=worker_info),
+        ):
+            worker_ids = [example["id"] for example in dataset]
+        assert len(worker_ids) == 4
+        ids.extend(worker_ids)
+
+    assert sorted(ids) == sorted(f"{shard_idx}_{example_idx}" for shard_idx in range(4) for example_idx in range(2))
+
+
+def test_tar_shard_image_caption_dataset_skips_examples_without_image(tmp_path: Path):
+    shard_path = tmp_path / "shard.tar"
+    with tarfile.open(shard_path, "w") as tar:
+        _add_file(tar, "a.txt", b"caption a")
+        _add_file(tar, "b.jpg", _encode_image(Image.new("RGB", (8, 8)), "JPEG"))
+        _add_file(tar, "b.txt", b"caption b")
+    dataset = TarShardImageCaptionDataset(str(shard_path))
+
+    assert [example["id"] for example in dataset] == ["b"]
+
+
+def test_tar_shard_image_caption_dataset_missing_caption(tmp_path: Path):
+    shard_path = tmp_path / "shard.tar"
+    with tarfile.open(shard_path, "w") as tar:
+        _add_file(tar, "a.jpg", _encode_image(Image.new("RGB", (8, 8)), "JPEG"))
+    dataset = TarShardImageCaptionDataset(str(shard_path))
+
+    with pytest.raises(ValueError):
+        list(dataset)
+
+
+def test_build_image_caption_sd_dataloader_tar_shards(tmp_path: Path):
+    """Smoke test of build_image_caption_sd_dataloader(...) with a tar shard dataset."""
+    _write_shards(tmp_path, num_shards=2, examples_per_shard=3, with_masks=True)
+    config = ImageCaptionSDDataLoaderConfig(
+        dataset=ImageCaptionTarShardDatasetConfig(shards=str(tmp_path / "*.tar")),
+        resolution=32,
+    )
+    data_loader = build_image_caption_sd_dataloader(config, 4, use_masks=True)
+
+    assert len(data_loader) == math.ceil(6 / 4)
+
+    batches = list(data_loader)
+    assert len(batches) == 2
+    assert batches[0]["image"].shape == (4, 3, 32, 32)
+    assert batches[0]["mask"].shape == (4, 1, 32, 32)
+    assert len(batches[1]["caption"]) == 2
+
+
+def test_build_image_caption_sd_dataloader_tar_shards_aspect_ratio_buckets(tmp_path: Path):
+    """Test that streamed examples are batched by aspect ratio bucket."""
+    _write_shards(tmp_path, num_shards=2, examples_per_shard=3)
+    config = ImageCaptionSDDataLoaderConfig(
+        dataset=ImageCaptionTarShardDatasetConfig(shards=str(tmp_path / "*.tar")),
+        aspect_ratio_buckets=AspectRatioBucketConfig(target_resolution=32, start_dim=16, end_dim=64, divisible_by=8),
+    )
+    data_loader = build_image_caption_sd_dataloader(config, 4)
+
+    batches = list(data_loader)
+    assert sum(len(batch["id"]) for batch in batches) == 6
+    for batch in batches:
+        # All images have the same aspect ratio, so they are all in the same (non-square) bucket.
+        _, _, height, width = batch["image"].shape
+        assert height < width
+
+
+def _run_tar_shard_data_loader(rank: int, world_size: int, tmp_dir: str, port: int):
+    os.environ.update(
+        {
+            "MASTER_ADDR": "127.0.0.1",
+            "MASTER_PORT": str(port),
+            "RANK": str(rank),
+            "LOCAL_RANK": str(rank),
+            "WORLD_SIZE": str(world_size),
+        }
+    )
+    accelerator = Accelerator(cpu=True)
+    try:
+        config = ImageCaptionSDDataLoaderConfig(
+            dataset=ImageCaptionTarShardDatasetConfig(shards=os.path.join(tmp_dir, "*.tar")),
+            aspect_ratio_buckets=AspectRatioBucketConfig(
+                target_resolution=32, start_dim=16, end_dim=64, divisible_by=16
+            ),
+            dataloader_num_workers=2,
+        )
+        data_loader = build_image_caption_sd_dataloader(
+            config,
+            batch_size=2,
+            num_processes=accelerator.num_processes,
+            process_index=accelerator.process_index,
+        )
+        data_loader = prepare_data_loader(accelerator, data_loader)
+
+        ids = []
+        for batch in data_loader:
+            ids.append(batch["id"])
+            # Every step synchronizes the processes (like a DDP backward pass), so an uneven number of batches would
+            # hang here.
+            accelerator.wait_for_everyone()
+        with open(os.path.join(tmp_dir, f"rank_{rank}.json"), "w") as f:
+            json.dump({"len": len(data_loader), "ids": ids}, f)
+    finally:
+        dist.destroy_process_group()
+
+
+@pytest.mark.skipif(not dist.is_available(), reason="torch.distributed is not available.")
+def test_build_image_caption_sd_dataloader_tar_shards_multi_process(tmp_path: Path):
+    """Test that a tar shard DataLoader prepared with accelerate is split between processes, without dispatching its
+    batches from the main process, and that every process yields the same number of batches even though the shards are
+    not split evenly between the processes.
+    """
+    # Rank 0 gets 3 shards (12 examples) and rank 1 gets 2 shards (8 examples).
+    _write_shards(tmp_path, num_shards=5, examples_per_shard=4)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    world_size = 2
+    mp.start_processes(
+        _run_tar_shard_data_loader, args=(world_size, str(tmp_path), port), nprocs=world_size, start_method="fork"
+    )
+
+    results = []
+    for rank in range(world_size):
+        with open(tmp_path / f"rank_{rank}.json") as f:
+            results.append(json.load(f))
+
+    # Each rank yields ceil(ceil(20 / 2) / 2) = 5 batches of its own shards.
+    for result in results:
+        assert result["len"] == 5
+        assert len(result["ids"]) == 5
+    rank_0_ids = {example_id for batch_ids in results[0]["ids"] for example_id in batch_ids}
+    rank_1_ids = {example_id for batch_ids in results[1]["ids"] for example_id in batch_ids}
+    assert {example_id.split("_")[0] for example_id in rank_0_ids} == {"0", "2", "4"}
+    assert {example_id.split("_")[0] for example_id in rank_1_ids} == {"1", "3"}
@@ -1,6 +1,6 @@
 import unittest.mock
 
-from invoke_training._shared.data.datasets.transform_dataset import TransformDataset
+from invoke_training._shared.data.datasets.transform_dataset import IterableTransformDataset, TransformDataset
 
 
 def test_transform_dataset_len():
@@ -32,3 +32,17 @@ def test_transform_dataset_getitem():
 
     assert out_example["field1"] == field1
     assert out_example["field2"] == field2
+
+
+def test_iterable_transform_dataset():
+    """Test that IterableTransformDataset applies its transforms to every example of the base dataset."""
+    base_dataset = [{"field1": 1}, {"field1": 2}]
+
+    def mock_transform(example):
+        example["field2"] = example["field1"] * 10
+        return example
+
+    dataset = IterableTransformDataset(base_dataset, [mock_transform])
+
+    assert len(dataset) == 2
+    assert list(dataset) == [{"field1": 1, "field2": 10}, {"field1": 2, "field2": 20}]
@@ -1,5 +1,8 @@
+import json
+
 from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import (
     AspectRatioBucketBatchSampler,
+    merge_small_aspect_ratio_buckets,
 )
 from invoke_training._shared.data.utils.aspect_ratio_bucket_manager import AspectRatioBucketManager
 from invoke_training._shared.data.utils.resolution import Resolution
@@ -96,3 +99,137 @@ def test_aspect_ratio_bucket_batch_sampler_seed():
     # Samples generated with different seeds should match, except for the example ordering.
     assert_shuffled_samples_match(base_samples, diff_seed_samples)
     assert base_samples != diff_seed_samples
+
+
+def test_aspect_ratio_bucket_batch_sampler_max_pixels_per_batch():
+    """Test that the batch size of each bucket is derived from max_pixels_per_batch."""
+    sampler = AspectRatioBucketBatchSampler(
+        buckets={Resolution(256, 256): [0, 1, 2, 3, 4], Resolution(512, 512): [5, 6, 7]},
+        batch_size=2,
+        shuffle=False,
+        seed=None,
+        max_pixels_per_batch=2 * 512 * 512,
+    )
+
+    assert sampler.get_bucket_batch_size(Resolution(256, 256)) == 8
+    assert sampler.get_bucket_batch_size(Resolution(512, 512)) == 2
+    assert list(sampler) == [[0, 1, 2, 3, 4], [5, 6], [7]]
+    assert len(sampler) == 3
+
+
+def test_aspect_ratio_bucket_batch_sampler_max_pixels_per_batch_min_batch_size():
+    """Test that buckets that are larger than max_pixels_per_batch still have a batch size of 1."""
+    sampler = AspectRatioBucketBatchSampler(
+        buckets={Resolution(512, 512): [0, 1]}, batch_size=2, shuffle=False, seed=None, max_pixels_per_batch=256 * 256
+    )
+
+    assert list(sampler) == [[0], [1]]
+    assert len(sampler) == 2
+
+
+def test_aspect_ratio_bucket_batch_sampler_partial_batch_policy_drop():
+    sampler = AspectRatioBucketBatchSampler(
+        buckets={Resolution(256, 768): [1, 3, 5], Resolution(512, 512): [4], Resolution(768, 256): [0, 2]},
+        batch_size=2,
+        shuffle=False,
+        seed=None,
+        partial_batch_policy="drop",
+    )
+
+    assert list(sampler) == [[1, 3], [0, 2]]
+    assert len(sampler) == 2
+    assert "2 dropped, skipping 2 examples per epoch" in str(sampler)
+
+
+def test_aspect_ratio_bucket_batch_sampler_partial_batch_policy_fill():
+    """Test that partial batches are filled with examples from the same bucket."""
+    sampler = AspectRatioBucketBatchSampler(
+        buckets={Resolution(256, 768): [1, 3, 5], Resolution(512, 512): [4], Resolution(768, 256): [0, 2]},
+        batch_size=2,
+        shuffle=False,
+        seed=None,
+        partial_batch_policy="fill",
+    )
+
+    assert list(sampler) == [[1, 3], [5, 1], [4, 4], [0, 2]]
+    assert len(sampler) == 4
+    assert "2 filled with 2 resampled examples per epoch" in str(sampler)
+
+
+def test_aspect_ratio_bucket_batch_sampler_partial_batch_policy_fill_shuffle():
+    """Test that filled batches are full, do not contain duplicates, and stay within one bucket when shuffling."""
+    buckets = {Resolution(256, 768): list(range(0, 7)), Resolution(768, 256): list(range(7, 10))}
+    sampler = AspectRatioBucketBatchSampler(
+        buckets=buckets, batch_size=3, shuffle=True, seed=1, partial_batch_policy="fill"
+    )
+
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 4
+    for batch in batches:
+        assert len(set(batch)) == 3
+        assert any(set(batch) <= set(bucket_images) for bucket_images in buckets.values())
+    assert {x for batch in batches for x in batch} == set(range(10))
+
+
+def test_merge_small_aspect_ratio_buckets():
+    """Test that buckets with fewer images than a batch are merged into the nearest non-empty bucket."""
+    bucket_manager = AspectRatioBucketManager(
+        {Resolution(256, 768), Resolution(384, 768), Resolution(512, 512), Resolution(768, 256)}
+    )
+    image_sizes = [Resolution(512, 512)] * 3 + [Resolution(256, 768)] + [Resolution(768, 256)] * 4
+
+    merged_bucket_manager = merge_small_aspect_ratio_buckets(bucket_manager, image_sizes, batch_size=2)
+
+    # The (384, 768) bucket is empty, so the (256, 768) image is merged into the (512, 512) bucket.
+    assert merged_bucket_manager.buckets == {Resolution(512, 512), Resolution(768, 256)}
+    sampler = AspectRatioBucketBatchSampler.from_image_sizes(merged_bucket_manager, image_sizes, batch_size=2)
+    assert all(len(batch) == 2 for batch in sampler)
+
+
+def test_merge_small_aspect_ratio_buckets_single_bucket():
+    """Test that the last bucket is kept, even if it has fewer images than a batch."""
+    bucket_manager = AspectRatioBucketManager({Resolution(256, 768), Resolution(512, 512)})
+    image_sizes = [Resolution(512, 512), Resolution(256, 768)]
+
+    merged_bucket_manager = merge_small_aspect_ratio_buckets(bucket_manager, image_sizes, batch_size=4)
+
+    assert merged_bucket_manager.buckets == {Resolution(512, 512)}
+
+
+def test_aspect_ratio_bucket_batch_sampler_state_dict():
+    """Test that restoring a state_dict() resumes the epoch with the same batch order, and continues with the same
+    batch order in the following epochs.
+    """
+    buckets = {Resolution(256, 512): list(range(0, 10)), Resolution(512, 256): list(range(10, 15))}
+    sampler = AspectRatioBucketBatchSampler(buckets=buckets, batch_size=2, shuffle=True, seed=1)
+
+    _ = list(sampler)
+    sampler_iter = iter(sampler)
+    _ = [next(sampler_iter) for _ in range(3)]
+    state_dict = sampler.state_dict()
+    remaining_batches = list(sampler_iter)
+    next_epoch_batches = list(sampler)
+
+    # The state is JSON-serializable.
+    state_dict = json.loads(json.dumps(state_dict))
+    assert state_dict["epoch"] == 1
+    assert state_dict["position"] == 3
+
+    resumed_sampler = AspectRatioBucketBatchSampler(buckets=buckets, batch_size=2, shuffle=True, seed=2)
+    resumed_sampler.load_state_dict(state_dict)
+    assert list(resumed_sampler) == remaining_batches
+    assert list(resumed_sampler) == next_epoch_batches
+    assert resumed_sampler.state_dict()["epoch"] == 3
+
+
+def test_aspect_ratio_bucket_batch_sampler_state_dict_between_epochs():
+    buckets = {Resolution(256, 512): list(range(0, 10)), Resolution(512, 256): list(range(10, 15))}
+    sampler = AspectRatioBucketBatchSampler(buckets=buckets, batch_size=2, shuffle=True, seed=1)
+
+    _ = list(sampler)
+    state_dict = sampler.state_dict()
+    next_epoch_batches = list(sampler)
+
+    resumed_sampler = AspectRatioBucketBatchSampler(buckets=buckets, batch_size=2, shuffle=True, seed=2)
+    resumed_sampler.load_state_dict(state_dict)
+    assert list(resumed_sampler) == next_epoch_batches
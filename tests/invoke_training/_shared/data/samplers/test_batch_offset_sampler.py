@@ -1,6 +1,8 @@
 from torch.utils.data.sampler import BatchSampler, SequentialSampler
 
+from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import AspectRatioBucketBatchSampler
 from invoke_training._shared.data.samplers.batch_offset_sampler import BatchOffsetSampler
+from invoke_training._shared.data.utils.resolution import Resolution
 
 
 def test_batch_offset_sampler():
@@ -21,3 +23,23 @@ def test_batch_offset_sampler_len():
     batch_sampler = BatchSampler(sequential_sampler, batch_size=2, drop_last=False)
     batch_offset_sampler = BatchOffsetSampler(sampler=batch_sampler, offset=10)
     assert len(batch_offset_sampler) == 3
+
+
+def test_batch_offset_sampler_state_dict():
+    """Test that the state of the wrapped sampler is passed through."""
+
+    def build_sampler(seed: int) -> BatchOffsetSampler:
+        batch_sampler = AspectRatioBucketBatchSampler(
+            {Resolution(512, 512): list(range(10))}, batch_size=2, shuffle=True, seed=seed
+        )
+        return BatchOffsetSampler(sampler=batch_sampler, offset=10)
+
+    sampler = build_sampler(seed=1)
+    sampler_iter = iter(sampler)
+    _ = next(sampler_iter)
+    state_dict = sampler.state_dict()
+    remaining_batches = list(sampler_iter)
+
+    resumed_sampler = build_sampler(seed=2)
+    resumed_sampler.load_state_dict(state_dict)
+    assert list(resumed_sampler) == remaining_batches
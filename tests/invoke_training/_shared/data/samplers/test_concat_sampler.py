@@ -1,4 +1,8 @@
+from torch.utils.data.sampler import SequentialSampler
+
+from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import AspectRatioBucketBatchSampler
 from invoke_training._shared.data.samplers.concat_sampler import ConcatSampler
+from invoke_training._shared.data.utils.resolution import Resolution
 
 
 def test_concat_sampler():
@@ -33,3 +37,29 @@ def test_concat_sampler_len():
 
     sampler = ConcatSampler([sampler_1, sampler_2, sampler_3])
     assert len(sampler) == 13
+
+
+def test_concat_sampler_state_dict():
+    """Test that restoring a state_dict() resumes after the last yielded sample, including samplers without state."""
+
+    def build_sampler(seed: int) -> ConcatSampler:
+        return ConcatSampler(
+            [
+                AspectRatioBucketBatchSampler({Resolution(512, 512): list(range(10))}, 2, shuffle=True, seed=seed),
+                SequentialSampler(range(3)),
+            ]
+        )
+
+    sampler = build_sampler(seed=1)
+    sampler_iter = iter(sampler)
+    _ = [next(sampler_iter) for _ in range(6)]
+    state_dict = sampler.state_dict()
+    remaining_samples = list(sampler_iter)
+    next_epoch_samples = list(sampler)
+
+    assert remaining_samples == [1, 2]
+
+    resumed_sampler = build_sampler(seed=2)
+    resumed_sampler.load_state_dict(state_dict)
+    assert list(resumed_sampler) == remaining_samples
+    assert list(resumed_sampler) == next_epoch_samples
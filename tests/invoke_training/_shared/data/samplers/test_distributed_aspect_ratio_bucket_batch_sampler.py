@@ -0,0 +1,149 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from invoke_training._shared.data.samplers.distributed_aspect_ratio_bucket_batch_sampler import (
+    DistributedAspectRatioBucketBatchSampler,
+)
+from invoke_training._shared.data.utils.resolution import Resolution
+
+# 5 batches with batch_size=2: [1, 3], [5], [4], [0, 2], [6].
+BUCKETS = {Resolution(256, 768): [1, 3, 5], Resolution(512, 512): [4], Resolution(768, 256): [0, 2, 6]}
+
+
+def _get_bucket(idx: int) -> Resolution:
+    return next(bucket for bucket, idxs in BUCKETS.items() if idx in idxs)
+
+
+def _build_samplers(num_replicas: int, **kwargs) -> list[DistributedAspectRatioBucketBatchSampler]:
+    """Build the sampler of every rank."""
+    samplers = []
+    for rank in range(num_replicas):
+        samplers.append(
+            DistributedAspectRatioBucketBatchSampler(
+                buckets=BUCKETS, batch_size=2, num_replicas=num_replicas, rank=rank, **kwargs
+            )
+        )
+    return samplers
+
+
+def test_distributed_aspect_ratio_bucket_batch_sampler():
+    """Test that the batches are split between ranks, with padding to keep the number of batches equal."""
+    samplers = _build_samplers(num_replicas=2)
+
+    assert list(samplers[0]) == [[1, 3], [4], [6]]
+    assert list(samplers[1]) == [[5], [0, 2], [1, 3]]
+    assert all(len(sampler) == 3 for sampler in samplers)
+
+
+def test_distributed_aspect_ratio_bucket_batch_sampler_drop_last():
+    samplers = _build_samplers(num_replicas=2, drop_last=True)
+
+    assert list(samplers[0]) == [[1, 3], [4]]
+    assert list(samplers[1]) == [[5], [0, 2]]
+    assert all(len(sampler) == 2 for sampler in samplers)
+
+
+def test_distributed_aspect_ratio_bucket_batch_sampler_more_replicas_than_batches():
+    samplers = _build_samplers(num_replicas=7)
+
+    assert [list(sampler) for sampler in samplers] == [[[1, 3]], [[5]], [[4]], [[0, 2]], [[6]], [[1, 3]], [[5]]]
+    assert all(len(sampler) == 1 for sampler in samplers)
+
+
+@pytest.mark.parametrize("drop_last", [True, False])
+def test_distributed_aspect_ratio_bucket_batch_sampler_shuffle(drop_last: bool):
+    """Test that shuffled batches are disjoint between ranks, and that each batch is within a single bucket."""
+    samplers = _build_samplers(num_replicas=2, shuffle=True, seed=1, drop_last=drop_last)
+    rank_batches = [list(sampler) for sampler in samplers]
+
+    assert len(rank_batches[0]) == len(rank_batches[1]) == len(samplers[0])
+    for batch in rank_batches[0] + rank_batches[1]:
+        assert len({_get_bucket(idx) for idx in batch}) == 1
+    if drop_last:
+        rank_idxs = [{idx for batch in batches for idx in batch} for batches in rank_batches]
+        assert rank_idxs[0].isdisjoint(rank_idxs[1])
+    else:
+        assert {idx for batches in rank_batches for batch in batches for idx in batch} == set(range(7))
+
+
+def test_distributed_aspect_ratio_bucket_batch_sampler_set_epoch():
+    """Test that the batch order is deterministic for a given epoch, and changes between epochs."""
+    sampler_1 = DistributedAspectRatioBucketBatchSampler(
+        buckets={Resolution(512, 512): list(range(100))}, batch_size=2, shuffle=True, num_replicas=2, rank=0
+    )
+    sampler_2 = DistributedAspectRatioBucketBatchSampler(
+        buckets={Resolution(512, 512): list(range(100))}, batch_size=2, shuffle=True, num_replicas=2, rank=0
+    )
+
+    epoch_0_batches = list(sampler_1)
+    # Without calling set_epoch(...), the order is repeated.
+    assert list(sampler_1) == epoch_0_batches
+    assert list(sampler_2) == epoch_0_batches
+
+    sampler_1.set_epoch(1)
+    sampler_2.set_epoch(1)
+    epoch_1_batches = list(sampler_1)
+    assert epoch_1_batches != epoch_0_batches
+    assert list(sampler_2) == epoch_1_batches
+
+
+def test_distributed_aspect_ratio_bucket_batch_sampler_invalid_rank():
+    with pytest.raises(ValueError):
+        DistributedAspectRatioBucketBatchSampler(buckets=BUCKETS, batch_size=2, num_replicas=2, rank=2)
+
+
+def test_distributed_aspect_ratio_bucket_batch_sampler_no_process_group():
+    with pytest.raises(RuntimeError):
+        DistributedAspectRatioBucketBatchSampler(buckets=BUCKETS, batch_size=2)
+
+
+def _run_distributed_sampler(rank: int, world_size: int, tmp_dir: str):
+    dist.init_process_group(
+        "gloo", init_method=f"file://{os.path.join(tmp_dir, 'dist_init')}", rank=rank, world_size=world_size
+    )
+    try:
+        sampler = DistributedAspectRatioBucketBatchSampler(buckets=BUCKETS, batch_size=2, shuffle=True, seed=1)
+        sampler.set_epoch(3)
+        with open(os.path.join(tmp_dir, f"rank_{rank}.json"), "w") as f:
+            json.dump(list(sampler), f)
+    finally:
+        dist.destroy_process_group()
+
+
+@pytest.mark.skipif(not dist.is_available(), reason="torch.distributed is not available.")
+def test_distributed_aspect_ratio_bucket_batch_sampler_gloo(tmp_path: Path):
+    """Test that the rank and number of replicas are read from an initialized (gloo) process group."""
+    world_size = 2
+    mp.start_processes(
+        _run_distributed_sampler, args=(world_size, str(tmp_path)), nprocs=world_size, start_method="fork"
+    )
+
+    expected_samplers = _build_samplers(num_replicas=world_size, shuffle=True, seed=1)
+    for rank, expected_sampler in enumerate(expected_samplers):
+        expected_sampler.set_epoch(3)
+        with open(tmp_path / f"rank_{rank}.json") as f:
+            assert json.load(f) == list(expected_sampler)
+
+
+def test_distributed_aspect_ratio_bucket_batch_sampler_state_dict():
+    sampler = DistributedAspectRatioBucketBatchSampler(
+        buckets={Resolution(512, 512): list(range(100))}, batch_size=2, shuffle=True, num_replicas=2, rank=1
+    )
+    sampler.set_epoch(3)
+    sampler_iter = iter(sampler)
+    _ = [next(sampler_iter) for _ in range(5)]
+    state_dict = sampler.state_dict()
+    remaining_batches = list(sampler_iter)
+
+    assert state_dict == {"epoch": 3, "position": 5}
+
+    resumed_sampler = DistributedAspectRatioBucketBatchSampler(
+        buckets={Resolution(512, 512): list(range(100))}, batch_size=2, shuffle=True, num_replicas=2, rank=1
+    )
+    resumed_sampler.load_state_dict(state_dict)
+    assert list(resumed_sampler) == remaining_batches
@@ -1,4 +1,10 @@
+from invoke_training._shared.data.samplers.aspect_ratio_bucket_batch_sampler import AspectRatioBucketBatchSampler
+from invoke_training._shared.data.samplers.distributed_aspect_ratio_bucket_batch_sampler import (
+    DistributedAspectRatioBucketBatchSampler,
+)
 from invoke_training._shared.data.samplers.interleaved_sampler import InterleavedSampler
+from invoke_training._shared.data.samplers.sampler_state import is_sharded_sampler, set_sampler_epoch
+from invoke_training._shared.data.utils.resolution import Resolution
 
 
 def test_interleaved_sampler():
@@ -33,3 +39,56 @@ def test_interleaved_sampler_len():
 
     sampler = InterleavedSampler([sampler_1, sampler_2, sampler_3])
     assert len(sampler) == 2 * 3
+
+
+def test_interleaved_sampler_state_dict():
+    """Test that restoring a state_dict() part way through a group of interleaved samples resumes at the next sample."""
+
+    def build_sampler(seed: int) -> InterleavedSampler:
+        return InterleavedSampler(
+            [
+                AspectRatioBucketBatchSampler({Resolution(512, 512): list(range(10))}, 2, shuffle=True, seed=seed),
+                AspectRatioBucketBatchSampler({Resolution(512, 512): list(range(10, 16))}, 2, shuffle=True, seed=seed),
+            ]
+        )
+
+    sampler = build_sampler(seed=1)
+    sampler_iter = iter(sampler)
+    _ = [next(sampler_iter) for _ in range(3)]
+    state_dict = sampler.state_dict()
+    remaining_samples = list(sampler_iter)
+    next_epoch_samples = list(sampler)
+
+    assert state_dict["position"] == 3
+
+    resumed_sampler = build_sampler(seed=2)
+    resumed_sampler.load_state_dict(state_dict)
+    assert list(resumed_sampler) == remaining_samples
+    assert list(resumed_sampler) == next_epoch_samples
+
+
+def test_interleaved_sampler_set_epoch():
+    """Test that is_sharded and set_epoch(...) are forwarded to the input samplers."""
+
+    def build_sampler(buckets: list[list[int]]) -> InterleavedSampler:
+        return InterleavedSampler(
+            [
+                DistributedAspectRatioBucketBatchSampler(
+                    {Resolution(512, 512): bucket}, 2, shuffle=True, num_replicas=2, rank=0
+                )
+                for bucket in buckets
+            ]
+        )
+
+    sampler = build_sampler([list(range(20)), list(range(20, 40))])
+    assert is_sharded_sampler(sampler)
+    assert not is_sharded_sampler(InterleavedSampler([[0, 1], [2, 3]]))
+
+    epoch_0_samples = list(sampler)
+    set_sampler_epoch(sampler, 1)
+    epoch_1_samples = list(sampler)
+    assert epoch_1_samples != epoch_0_samples
+
+    other_sampler = build_sampler([list(range(20)), list(range(20, 40))])
+    set_sampler_epoch(other_sampler, 1)
+    assert list(other_sampler) == epoch_1_samples
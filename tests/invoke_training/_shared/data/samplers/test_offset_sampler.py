@@ -18,3 +18,12 @@ def test_offset_sampler_len():
     sequential_sampler = SequentialSampler([0] * 5)
     offset_sampler = OffsetSampler(sampler=sequential_sampler, offset=10)
     assert len(offset_sampler) == 5
+
+
+def test_offset_sampler_state_dict_stateless():
+    """Test that the state of a wrapped sampler without state is None."""
+    offset_sampler = OffsetSampler(sampler=SequentialSampler([0] * 5), offset=10)
+
+    assert offset_sampler.state_dict() is None
+    offset_sampler.load_state_dict(None)
+    assert list(offset_sampler) == list(range(10, 15))
@@ -0,0 +1,62 @@
+from torch.utils.data import BatchSampler
+
+from invoke_training._shared.data.samplers.sampler_state import get_sampler_state_dict, load_sampler_state_dict
+from invoke_training._shared.data.samplers.seeded_random_sampler import SeededRandomSampler
+
+
+def test_seeded_random_sampler():
+    """Test that every index is yielded once per epoch, and that the order changes between epochs."""
+    sampler = SeededRandomSampler(range(100), seed=1)
+
+    epoch_0_indices = list(sampler)
+    epoch_1_indices = list(sampler)
+
+    assert sorted(epoch_0_indices) == list(range(100))
+    assert sorted(epoch_1_indices) == list(range(100))
+    assert epoch_0_indices != list(range(100))
+    assert epoch_1_indices != epoch_0_indices
+    assert len(sampler) == 100
+
+
+def test_seeded_random_sampler_seed():
+    """Test that the order of every epoch is determined by the seed."""
+    sampler_1 = SeededRandomSampler(range(100), seed=1)
+    sampler_2 = SeededRandomSampler(range(100), seed=1)
+    sampler_3 = SeededRandomSampler(range(100), seed=2)
+
+    assert [list(sampler_1) for _ in range(2)] == [list(sampler_2) for _ in range(2)]
+    assert list(SeededRandomSampler(range(100), seed=1)) != list(sampler_3)
+
+
+def test_seeded_random_sampler_state_dict():
+    """Test that restoring a state_dict() part way through an epoch resumes at the next index, and that the following
+    epochs are also restored.
+    """
+    sampler = SeededRandomSampler(range(100), seed=1)
+    _ = list(sampler)
+    sampler_iter = iter(sampler)
+    _ = [next(sampler_iter) for _ in range(5)]
+    state_dict = sampler.state_dict()
+    remaining_indices = list(sampler_iter)
+    next_epoch_indices = list(sampler)
+
+    assert state_dict == {"epoch": 1, "position": 5}
+
+    resumed_sampler = SeededRandomSampler(range(100), seed=1)
+    resumed_sampler.load_state_dict(state_dict)
+    assert resumed_sampler.state_dict() == state_dict
+    assert list(resumed_sampler) == remaining_indices
+    assert list(resumed_sampler) == next_epoch_indices
+
+
+def test_seeded_random_sampler_state_dict_batch_sampler():
+    """Test that the state of a SeededRandomSampler wrapped in a torch BatchSampler can be saved and restored."""
+    batch_sampler = BatchSampler(SeededRandomSampler(range(10), seed=1), batch_size=2, drop_last=False)
+    batch_sampler_iter = iter(batch_sampler)
+    _ = next(batch_sampler_iter)
+    state_dict = get_sampler_state_dict(batch_sampler)
+    remaining_batches = list(batch_sampler_iter)
+
+    resumed_batch_sampler = BatchSampler(SeededRandomSampler(range(10), seed=1), batch_size=2, drop_last=False)
+    load_sampler_state_dict(resumed_batch_sampler, state_dict)
+    assert list(resumed_batch_sampler) == remaining_batches
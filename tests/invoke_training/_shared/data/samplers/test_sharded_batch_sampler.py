@@ -0,0 +1,27 @@
+import pytest
+from torch.utils.data.sampler import BatchSampler, SequentialSampler
+
+from invoke_training._shared.data.samplers.sharded_batch_sampler import ShardedBatchSampler
+
+
+def test_sharded_batch_sampler():
+    """Test that every batch is yielded by exactly one shard."""
+    batch_sampler = BatchSampler(SequentialSampler([0] * 9), batch_size=2, drop_last=False)
+
+    shards = [list(ShardedBatchSampler(batch_sampler, num_shards=3, shard_idx=i)) for i in range(3)]
+
+    assert shards == [[[0, 1], [6, 7]], [[2, 3], [8]], [[4, 5]]]
+
+
+@pytest.mark.parametrize("num_batches", [0, 1, 4, 5, 6])
+def test_sharded_batch_sampler_len(num_batches: int):
+    batch_sampler = BatchSampler(SequentialSampler([0] * num_batches), batch_size=1, drop_last=False)
+    for shard_idx in range(3):
+        sampler = ShardedBatchSampler(batch_sampler, num_shards=3, shard_idx=shard_idx)
+        assert len(sampler) == len(list(sampler))
+
+
+def test_sharded_batch_sampler_invalid_shard_idx():
+    batch_sampler = BatchSampler(SequentialSampler([0] * 4), batch_size=2, drop_last=False)
+    with pytest.raises(ValueError):
+        ShardedBatchSampler(batch_sampler, num_shards=2, shard_idx=2)
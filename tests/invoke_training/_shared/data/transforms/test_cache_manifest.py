@@ -0,0 +1,50 @@
+from pathlib import Path
+
+from invoke_training._shared.data.transforms.cache_manifest import CacheManifest
+
+
+def test_cache_manifest_record_and_reload(tmp_path: Path):
+    """Test that recorded fingerprints are persisted and re-loaded by a new CacheManifest."""
+    manifest_path = str(tmp_path / "manifest.jsonl")
+
+    manifest = CacheManifest(manifest_path)
+    assert len(manifest) == 0
+    manifest.record(0, "fp_0")
+    manifest.record("1", "fp_1")
+
+    reloaded = CacheManifest(manifest_path)
+    assert len(reloaded) == 2
+    assert reloaded.get_fingerprint("0") == "fp_0"
+    assert reloaded.get_fingerprint(1) == "fp_1"
+    assert reloaded.get_fingerprint(2) is None
+
+
+def test_cache_manifest_is_valid(tmp_path: Path):
+    """Test that is_valid() only returns True for a matching fingerprint, and that the latest record wins."""
+    manifest = CacheManifest(str(tmp_path / "manifest.jsonl"))
+    manifest.record("a", "old")
+    manifest.record("a", "new")
+
+    assert manifest.is_valid("a", "new")
+    assert not manifest.is_valid("a", "old")
+    assert not manifest.is_valid("b", "new")
+
+    assert CacheManifest(str(tmp_path / "manifest.jsonl")).is_valid("a", "new")
+
+
+def test_cache_manifest_truncated_final_line(tmp_path: Path):
+    """Test that a partially-written final line (e.g. from an interrupted cache build) is ignored, and that subsequent
+    records are still readable.
+    """
+    manifest_path = tmp_path / "manifest.jsonl"
+    manifest_path.write_text('{"key": "0", "fingerprint": "fp_0"}\n{"key": "1", "finger')
+
+    manifest = CacheManifest(str(manifest_path))
+    assert len(manifest) == 1
+    assert manifest.is_valid("0", "fp_0")
+
+    manifest.record("1", "fp_1")
+
+    reloaded = CacheManifest(str(manifest_path))
+    assert len(reloaded) == 2
+    assert reloaded.is_valid("1", "fp_1")
@@ -20,3 +20,22 @@ def test_load_cache_transform():
 
     mock_cache.load.assert_called_once_with(1)
     assert out_example["output"] is cached_tensor
+
+
+def test_load_cache_transform_num_variants():
+    mock_cache = unittest.mock.MagicMock()
+    mock_cache.load.return_value = {"cached_tensor": torch.Tensor([1.0])}
+
+    tf = LoadCacheTransform(
+        cache=mock_cache,
+        cache_key_field="cache_key",
+        cache_field_to_output_field={"cached_tensor": "output"},
+        num_variants=3,
+    )
+
+    for _ in range(50):
+        _ = tf({"cache_key": 1})
+
+    # Every load should be of one of the variants of the example, and with high probability all variants are loaded.
+    loaded_keys = {call.args[0] for call in mock_cache.load.call_args_list}
+    assert loaded_keys == {"1_0", "1_1", "1_2"}
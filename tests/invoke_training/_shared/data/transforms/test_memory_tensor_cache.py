@@ -0,0 +1,119 @@
+import pickle
+from pathlib import Path
+
+import torch
+
+from invoke_training._shared.data.transforms.memory_tensor_cache import MemoryTensorCache
+from invoke_training._shared.data.transforms.sharded_tensor_disk_cache import ShardedTensorDiskCache
+from invoke_training._shared.data.transforms.tensor_cache import open_tensor_cache, write_key_map
+from invoke_training._shared.data.transforms.tensor_disk_cache import TensorDiskCache
+
+# The size of each entry in bytes: 4 float32 values.
+_ENTRY_SIZE = 16
+
+
+def _build_disk_cache(cache_dir: str, num_entries: int) -> ShardedTensorDiskCache:
+    cache = ShardedTensorDiskCache(cache_dir)
+    for i in range(num_entries):
+        cache.save(i, {"t": torch.full((4,), float(i)), "size": (i, i)})
+    return cache
+
+
+def test_memory_tensor_cache_hit_and_miss(tmp_path: Path):
+    cache = MemoryTensorCache(_build_disk_cache(str(tmp_path), 2), max_size_bytes=10 * _ENTRY_SIZE)
+
+    out_1 = cache.load(1)
+    out_2 = cache.load(1)
+
+    torch.testing.assert_close(out_1["t"], torch.full((4,), 1.0))
+    torch.testing.assert_close(out_2["t"], torch.full((4,), 1.0))
+    assert out_2["size"] == (1, 1)
+    assert cache.get_stats() == {
+        "hits": 1,
+        "misses": 1,
+        "num_entries": 1,
+        "size_bytes": _ENTRY_SIZE,
+        "max_size_bytes": 10 * _ENTRY_SIZE,
+    }
+
+
+def test_memory_tensor_cache_lru_eviction(tmp_path: Path):
+    cache = MemoryTensorCache(_build_disk_cache(str(tmp_path), 3), max_size_bytes=2 * _ENTRY_SIZE)
+
+    cache.load(0)
+    cache.load(1)
+    # Touch 0, so that 1 is the least-recently-used entry.
+    cache.load(0)
+    # Loading 2 evicts 1.
+    cache.load(2)
+
+    assert cache.num_entries == 2
+    assert cache.size_bytes == 2 * _ENTRY_SIZE
+
+    cache.reset_stats()
+    cache.load(0)
+    cache.load(2)
+    assert (cache.hits, cache.misses) == (2, 0)
+    cache.load(1)
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_memory_tensor_cache_entry_larger_than_budget(tmp_path: Path):
+    cache = MemoryTensorCache(_build_disk_cache(str(tmp_path), 1), max_size_bytes=_ENTRY_SIZE - 1)
+
+    torch.testing.assert_close(cache.load(0)["t"], torch.zeros((4,)))
+
+    assert cache.num_entries == 0
+    assert cache.size_bytes == 0
+
+
+def test_memory_tensor_cache_warm(tmp_path: Path):
+    cache = MemoryTensorCache(_build_disk_cache(str(tmp_path), 5), max_size_bytes=3 * _ENTRY_SIZE)
+
+    cache.warm()
+
+    assert cache.num_entries == 3
+    assert (cache.hits, cache.misses) == (0, 0)
+    for i in range(3):
+        torch.testing.assert_close(cache.load(i)["t"], torch.full((4,), float(i)))
+    assert (cache.hits, cache.misses) == (3, 0)
+
+
+def test_memory_tensor_cache_warm_pt(tmp_path: Path):
+    disk_cache = TensorDiskCache(str(tmp_path))
+    for i in range(2):
+        disk_cache.save(i, {"t": torch.full((4,), float(i))})
+    cache = MemoryTensorCache(disk_cache, max_size_bytes=10 * _ENTRY_SIZE)
+
+    cache.warm()
+
+    assert cache.num_entries == 2
+
+
+def test_memory_tensor_cache_shared_memory(tmp_path: Path):
+    """Test that cached tensors are held in shared memory, and that the cache can be pickled (as it is when it is sent
+    to DataLoader workers).
+    """
+    cache = MemoryTensorCache(_build_disk_cache(str(tmp_path), 1), max_size_bytes=10 * _ENTRY_SIZE)
+    cache.warm()
+
+    assert cache.load(0)["t"].is_shared()
+
+    cache_copy = pickle.loads(pickle.dumps(cache))
+    assert cache_copy.num_entries == 1
+    torch.testing.assert_close(cache_copy.load(0)["t"], torch.zeros((4,)))
+
+
+def test_open_tensor_cache_memory_tier(tmp_path: Path):
+    """Test that open_tensor_cache(...) places the memory tier beneath the key map."""
+    _build_disk_cache(str(tmp_path), 2)
+    write_key_map(str(tmp_path), {"a": "0", "b": "0", "c": "1"})
+
+    cache = open_tensor_cache(str(tmp_path), memory_cache_size_bytes=10 * _ENTRY_SIZE)
+
+    torch.testing.assert_close(cache.load("b")["t"], torch.zeros((4,)))
+    torch.testing.assert_close(cache.load("c")["t"], torch.ones((4,)))
+    memory_cache = cache._cache
+    assert isinstance(memory_cache, MemoryTensorCache)
+    # Each unique entry is only held in memory once.
+    assert memory_cache.num_entries == 2
@@ -190,6 +190,32 @@ def test_sd_image_transform_random_crop():
     )
 
 
+def test_sd_image_transform_random_crop_seed():
+    """Test that SDImageTransform random crops are deterministic when random_crop_seed is set."""
+    # Input image is 16 x 128. It is resized to 8 x 64 to cover the 8 x 8 resolution, leaving room for 57 horizontal
+    # crop positions.
+    in_image_np = np.zeros((16, 128, 3), dtype=np.uint8)
+
+    def get_crop(random_crop_seed: int, example_id: str) -> tuple[int, int]:
+        tf = SDImageTransform(
+            image_field_names=["image"],
+            fields_to_normalize_to_range_minus_one_to_one=["image"],
+            resolution=Resolution(8, 8),
+            center_crop=False,
+            random_crop_seed=random_crop_seed,
+        )
+        out_example = tf({"image": Image.fromarray(np.copy(in_image_np)), "id": example_id})
+        return out_example["crop_top_left_yx"]
+
+    # The same seed and id always produce the same crop.
+    assert get_crop(0, "a") == get_crop(0, "a")
+
+    # Different seeds, or different ids, produce different crops (with high probability over the 57 possible crop
+    # positions).
+    assert len({get_crop(seed, "a") for seed in range(4)}) > 1
+    assert len({get_crop(0, example_id) for example_id in ["a", "b", "c", "d"]}) > 1
+
+
 def test_sd_image_transform_center_crop_flip():
     """Test SDImageTransform center cropping with a horizontal flip."""
     # Input image is 5 x 9.
@@ -316,3 +342,93 @@ def test_sd_image_transform_resolution_input_validation(
             resolution=resolution,
             aspect_ratio_bucket_manager=aspect_ratio_bucket_manager,
         )
+
+
+@pytest.mark.parametrize("jpeg_draft", [False, True])
+def test_sd_image_transform_jpeg_draft(tmp_path, jpeg_draft: bool):
+    """Test that an undecoded JPEG produces the same output shape and metadata with and without jpeg_draft, and that the
+    draft decode reduces the decoded resolution.
+    """
+    image_path = tmp_path / "image.jpg"
+    rng = np.random.default_rng(0)
+    Image.fromarray(rng.integers(0, 256, (1200, 900, 3), dtype=np.uint8)).save(image_path)
+    resolution = Resolution(256, 192)
+    tf = SDImageTransform(
+        image_field_names=["image"],
+        fields_to_normalize_to_range_minus_one_to_one=["image"],
+        resolution=resolution,
+        jpeg_draft=jpeg_draft,
+    )
+
+    in_image = Image.open(image_path)
+    out_example = tf({"image": in_image})
+
+    assert out_example["image"].shape == (3, resolution.height, resolution.width)
+    assert out_example["original_size_hw"] == (1200, 900)
+    assert out_example["crop_top_left_yx"] == (0, 0)
+    if jpeg_draft:
+        # The largest scale that still covers the 256x192 target is 1/4.
+        assert in_image.size == (225, 300)
+    else:
+        assert in_image.size == (900, 1200)
+
+
+def test_sd_image_transform_jpeg_draft_non_jpeg(tmp_path):
+    """Test that jpeg_draft has no effect on undecoded images in other formats, other than converting them to RGB."""
+    image_path = tmp_path / "image.png"
+    Image.fromarray(np.ones((300, 200), dtype=np.uint8)).save(image_path)
+    resolution = Resolution(64, 64)
+    tf = SDImageTransform(
+        image_field_names=["image"],
+        fields_to_normalize_to_range_minus_one_to_one=["image"],
+        resolution=resolution,
+        jpeg_draft=True,
+    )
+
+    out_example = tf({"image": Image.open(image_path)})
+
+    assert out_example["image"].shape == (3, resolution.height, resolution.width)
+    assert out_example["original_size_hw"] == (300, 200)
+
+
+@pytest.mark.parametrize(
+    ["center_crop", "random_flip"],
+    [
+        (True, False),
+        (False, False),
+        (False, True),
+    ],
+)
+def test_sd_image_transform_tensor_matches_pil(center_crop: bool, random_flip: bool):
+    """Test that uint8 tensor images produce the same outputs as the equivalent PIL images."""
+    rng = np.random.default_rng(0)
+    in_image_np = rng.integers(0, 256, (300, 200, 3), dtype=np.uint8)
+    in_mask_np = rng.integers(0, 256, (300, 200), dtype=np.uint8)
+    resolution = Resolution(128, 96)
+    tf = SDImageTransform(
+        image_field_names=["image", "mask"],
+        fields_to_normalize_to_range_minus_one_to_one=["image"],
+        resolution=resolution,
+        center_crop=center_crop,
+        random_flip=random_flip,
+        random_crop_seed=123,
+    )
+
+    # Note: We patch random.random() so that the horizontal flip (if enabled) is applied in both cases.
+    with unittest.mock.patch("random.random", return_value=0.0):
+        pil_example = tf({"id": "0", "image": Image.fromarray(in_image_np), "mask": Image.fromarray(in_mask_np)})
+        tensor_example = tf(
+            {
+                "id": "0",
+                "image": torch.from_numpy(in_image_np).permute(2, 0, 1),
+                "mask": torch.from_numpy(in_mask_np).unsqueeze(0),
+            }
+        )
+
+    assert tensor_example["original_size_hw"] == pil_example["original_size_hw"] == (300, 200)
+    assert tensor_example["crop_top_left_yx"] == pil_example["crop_top_left_yx"]
+    for field_name in ["image", "mask"]:
+        assert tensor_example[field_name].dtype == pil_example[field_name].dtype == torch.float32
+        assert tensor_example[field_name].shape == pil_example[field_name].shape
+        # Allow for small rounding differences between the PIL and torch antialiased resize implementations.
+        torch.testing.assert_close(tensor_example[field_name], pil_example[field_name], rtol=0.0, atol=0.05)
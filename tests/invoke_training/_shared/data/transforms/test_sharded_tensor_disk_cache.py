@@ -0,0 +1,176 @@
+import pickle
+from pathlib import Path
+from unittest import mock
+
+import pytest
+import torch
+
+from invoke_training._shared.data.transforms.sharded_tensor_disk_cache import ShardedTensorDiskCache
+
+
+def test_sharded_tensor_disk_cache_roundtrip(tmp_path: Path):
+    """Test a ShardedTensorDiskCache cache roundtrip."""
+    cache = ShardedTensorDiskCache(str(tmp_path))
+
+    in_dict = {
+        "test_tensor": torch.rand((1, 2, 3)),
+        "test_int_tensor": torch.tensor([1, 2, 3]),
+        "test_tuple": (1, 2),
+        "test_list": [3, 4],
+        "test_scalar": 1,
+        "test_str": "abc",
+    }
+
+    # Roundtrip
+    cache.save(0, in_dict)
+    out_dict = cache.load(0)
+
+    assert set(in_dict.keys()) == set(out_dict.keys())
+    torch.testing.assert_close(out_dict["test_tensor"], in_dict["test_tensor"])
+    torch.testing.assert_close(out_dict["test_int_tensor"], in_dict["test_int_tensor"])
+    assert out_dict["test_tuple"] == in_dict["test_tuple"]
+    assert isinstance(out_dict["test_tuple"], tuple)
+    assert out_dict["test_list"] == in_dict["test_list"]
+    assert out_dict["test_scalar"] == in_dict["test_scalar"]
+    assert out_dict["test_str"] == in_dict["test_str"]
+
+
+def test_sharded_tensor_disk_cache_fail_overwrite(tmp_path: Path):
+    """Test that an attempt to overwrite an existing entry raises an AssertionError, unless overwrite=True."""
+    cache = ShardedTensorDiskCache(str(tmp_path))
+    cache.save(0, {"test_tensor": torch.zeros((2,))})
+
+    with pytest.raises(AssertionError):
+        cache.save(0, {"test_tensor": torch.zeros((2,))})
+
+    cache.save(0, {"test_tensor": torch.ones((2,))}, overwrite=True)
+    torch.testing.assert_close(cache.load(0)["test_tensor"], torch.ones((2,)))
+
+
+def test_sharded_tensor_disk_cache_overwrite_from_other_instance(tmp_path: Path):
+    """Test that an entry that is overwritten by another instance is re-read on the next load."""
+    reader = ShardedTensorDiskCache(str(tmp_path))
+    writer = ShardedTensorDiskCache(str(tmp_path), writer_id=1)
+    writer.save(0, {"test_tensor": torch.zeros((2,))})
+    torch.testing.assert_close(reader.load(0)["test_tensor"], torch.zeros((2,)))
+
+    writer.save(0, {"test_tensor": torch.ones((2,))}, overwrite=True)
+    torch.testing.assert_close(reader.load(0)["test_tensor"], torch.ones((2,)))
+
+
+def test_sharded_tensor_disk_cache_load_only_rereads_changed_index(tmp_path: Path):
+    """Test that load() only re-reads the index file when records have been appended to it."""
+    cache = ShardedTensorDiskCache(str(tmp_path))
+    cache.save(0, {"test_tensor": torch.zeros((2,))})
+    cache.load(0)
+
+    with mock.patch.object(cache, "_refresh_index", wraps=cache._refresh_index) as refresh_index:
+        cache.load(0)
+        cache.load(0)
+        assert refresh_index.call_count == 0
+
+        ShardedTensorDiskCache(str(tmp_path), writer_id=1).save(1, {"test_tensor": torch.ones((2,))})
+        torch.testing.assert_close(cache.load(1)["test_tensor"], torch.ones((2,)))
+        assert refresh_index.call_count == 1
+
+
+def test_sharded_tensor_disk_cache_read_only(tmp_path: Path):
+    """Test that a read-only cache reads the index once, and does not allow saving."""
+    ShardedTensorDiskCache(str(tmp_path)).save(0, {"test_tensor": torch.zeros((2,))})
+    cache = ShardedTensorDiskCache(str(tmp_path), read_only=True)
+    torch.testing.assert_close(cache.load(0)["test_tensor"], torch.zeros((2,)))
+
+    with mock.patch.object(cache, "_refresh_index") as refresh_index:
+        ShardedTensorDiskCache(str(tmp_path), writer_id=1).save(1, {"test_tensor": torch.ones((2,))})
+        assert 1 not in cache
+        with pytest.raises(KeyError):
+            cache.load(1)
+        assert cache.keys() == ["0"]
+        refresh_index.assert_not_called()
+
+    with pytest.raises(RuntimeError):
+        cache.save(2, {"test_tensor": torch.ones((2,))})
+
+
+def test_sharded_tensor_disk_cache_multiple_shards(tmp_path: Path):
+    """Test that entries are split across multiple shard files, and can be loaded by a newly-opened cache."""
+    cache = ShardedTensorDiskCache(str(tmp_path), max_shard_size_bytes=1000)
+
+    tensors = [torch.rand((10, 10)) for _ in range(5)]
+    for i, t in enumerate(tensors):
+        cache.save(i, {"t": t})
+
+    assert len(list(tmp_path.glob("shard-*.bin"))) > 1
+
+    reopened_cache = ShardedTensorDiskCache(str(tmp_path))
+    for i, t in enumerate(tensors):
+        torch.testing.assert_close(reopened_cache.load(i)["t"], t)
+
+
+def test_sharded_tensor_disk_cache_storage_dtype(tmp_path: Path):
+    """Test that floating point tensors are stored in the storage_dtype, and restored to their original dtype."""
+    cache = ShardedTensorDiskCache(str(tmp_path), storage_dtype=torch.float16)
+
+    in_tensor = torch.rand((4, 8))
+    cache.save("a", {"t": in_tensor, "i": torch.tensor([1, 2])})
+    out_dict = cache.load("a")
+
+    assert out_dict["t"].dtype == torch.float32
+    torch.testing.assert_close(out_dict["t"], in_tensor.to(torch.float16).to(torch.float32))
+    assert out_dict["i"].dtype == torch.int64
+
+    # The shard should hold 2 bytes per float element (plus the int tensor and alignment padding).
+    shard_size = sum(p.stat().st_size for p in tmp_path.glob("shard-*.bin"))
+    assert shard_size < in_tensor.numel() * 4
+
+
+def test_sharded_tensor_disk_cache_bfloat16(tmp_path: Path):
+    cache = ShardedTensorDiskCache(str(tmp_path))
+    in_tensor = torch.rand((3, 5)).to(torch.bfloat16)
+
+    cache.save(0, {"t": in_tensor})
+
+    out_tensor = cache.load(0)["t"]
+    assert out_tensor.dtype == torch.bfloat16
+    assert torch.equal(out_tensor, in_tensor)
+
+
+def test_sharded_tensor_disk_cache_load_after_pickle(tmp_path: Path):
+    """Test that a cache can be pickled (e.g. when passed to DataLoader worker processes) after it has been used."""
+    cache = ShardedTensorDiskCache(str(tmp_path))
+    in_tensor = torch.rand((2, 2))
+    cache.save(0, {"t": in_tensor})
+    cache.load(0)
+
+    unpickled_cache = pickle.loads(pickle.dumps(cache))
+
+    torch.testing.assert_close(unpickled_cache.load(0)["t"], in_tensor)
+
+
+def test_sharded_tensor_disk_cache_load_missing_key(tmp_path: Path):
+    cache = ShardedTensorDiskCache(str(tmp_path))
+    with pytest.raises(KeyError):
+        cache.load(0)
+
+
+def test_sharded_tensor_disk_cache_ignores_partial_index_line(tmp_path: Path):
+    """Test that a partially-written index record (e.g. from an interrupted cache build) is ignored."""
+    cache = ShardedTensorDiskCache(str(tmp_path))
+    cache.save(0, {"t": torch.zeros((2,))})
+    with open(tmp_path / ShardedTensorDiskCache.INDEX_FILE_NAME, "a") as f:
+        f.write('{"key": "1", "ten')
+
+    reopened_cache = ShardedTensorDiskCache(str(tmp_path))
+    assert 0 in reopened_cache
+    assert 1 not in reopened_cache
+
+
+def test_sharded_tensor_disk_cache_keys(tmp_path: Path):
+    cache = ShardedTensorDiskCache(str(tmp_path))
+    cache.save(1, {"t": torch.zeros((1,))})
+    cache.save("a", {"t": torch.zeros((1,))})
+
+    assert cache.keys() == ["1", "a"]
+    # Entries written by another instance are included.
+    ShardedTensorDiskCache(str(tmp_path)).save(2, {"t": torch.zeros((1,))})
+    assert cache.keys() == ["1", "a", "2"]
@@ -0,0 +1,79 @@
+from pathlib import Path
+
+import torch
+
+from invoke_training._shared.data.transforms.key_mapped_tensor_cache import KeyMappedTensorCache
+from invoke_training._shared.data.transforms.sharded_tensor_disk_cache import ShardedTensorDiskCache
+from invoke_training._shared.data.transforms.tensor_cache import (
+    get_variant_cache_key,
+    open_tensor_cache,
+    open_tensor_cache_from_config,
+    read_cache_info,
+    read_key_map,
+    write_cache_info,
+    write_key_map,
+)
+from invoke_training._shared.data.transforms.tensor_disk_cache import TensorDiskCache
+from invoke_training.config.data.output_cache_config import OutputCacheConfig
+
+
+def test_open_tensor_cache_detect_format(tmp_path: Path):
+    """Test that open_tensor_cache(...) detects the format of an existing cache."""
+    pt_dir = str(tmp_path / "pt")
+    sharded_dir = str(tmp_path / "sharded")
+
+    open_tensor_cache(pt_dir, cache_format="pt").save(0, {"t": torch.zeros((1,))})
+    open_tensor_cache(sharded_dir, cache_format="sharded").save(0, {"t": torch.zeros((1,))})
+
+    assert isinstance(open_tensor_cache(pt_dir), TensorDiskCache)
+    assert isinstance(open_tensor_cache(sharded_dir), ShardedTensorDiskCache)
+
+
+def test_open_tensor_cache_from_config(tmp_path: Path):
+    cache = open_tensor_cache_from_config(
+        str(tmp_path), OutputCacheConfig(cache_format="sharded", storage_dtype="bfloat16")
+    )
+    assert isinstance(cache, ShardedTensorDiskCache)
+
+    cache.save(0, {"t": torch.ones((2,))})
+    # The cache is readable with format detection.
+    torch.testing.assert_close(open_tensor_cache(str(tmp_path)).load(0)["t"], torch.ones((2,)))
+
+
+def test_open_tensor_cache_from_config_default(tmp_path: Path):
+    assert isinstance(open_tensor_cache_from_config(str(tmp_path)), TensorDiskCache)
+
+
+def test_cache_info_round_trip(tmp_path: Path):
+    assert read_cache_info(str(tmp_path)) == {}
+
+    write_cache_info(str(tmp_path), {"num_variants": 4})
+
+    assert read_cache_info(str(tmp_path)) == {"num_variants": 4}
+
+
+def test_get_variant_cache_key():
+    assert get_variant_cache_key(5, 0, 1) == 5
+    assert get_variant_cache_key("instance_5", 0, 1) == "instance_5"
+    assert get_variant_cache_key(5, 3, 4) == "5_3"
+
+
+def test_open_tensor_cache_key_map(tmp_path: Path):
+    """Test that open_tensor_cache(...) resolves keys through the cache's key map, unless use_key_map is False."""
+    cache = open_tensor_cache(str(tmp_path), cache_format="pt")
+    cache.save("entry_a", {"t": torch.zeros((1,))})
+    cache.save("entry_b", {"t": torch.ones((1,))})
+    write_key_map(str(tmp_path), {"0": "entry_a", "1": "entry_a", "2": "entry_b"})
+
+    assert read_key_map(str(tmp_path)) == {"0": "entry_a", "1": "entry_a", "2": "entry_b"}
+
+    key_mapped_cache = open_tensor_cache(str(tmp_path))
+    assert isinstance(key_mapped_cache, KeyMappedTensorCache)
+    torch.testing.assert_close(key_mapped_cache.load(1)["t"], torch.zeros((1,)))
+    torch.testing.assert_close(key_mapped_cache.load("2")["t"], torch.ones((1,)))
+
+    assert isinstance(open_tensor_cache(str(tmp_path), use_key_map=False), TensorDiskCache)
+
+
+def test_read_key_map_missing(tmp_path: Path):
+    assert read_key_map(str(tmp_path)) is None
@@ -31,3 +31,26 @@ def test_tensor_disk_cache_fail_overwrite(tmp_path):
 
     with pytest.raises(AssertionError):
         cache.save(0, in_dict)
+
+
+def test_tensor_disk_cache_overwrite(tmp_path):
+    """Test that an existing TensorDiskCache cache entry can be replaced when overwrite=True."""
+    cache = TensorDiskCache(str(tmp_path))
+    cache.save(0, {"test_tensor": torch.zeros((1, 2, 3))})
+
+    new_tensor = torch.rand((1, 2, 3))
+    cache.save(0, {"test_tensor": new_tensor}, overwrite=True)
+
+    torch.testing.assert_close(cache.load(0)["test_tensor"], new_tensor)
+    # No temporary files should be left behind.
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["0.pt"]
+
+
+def test_tensor_disk_cache_keys(tmp_path: Path):
+    cache = TensorDiskCache(str(tmp_path))
+    cache.save(1, {"t": torch.zeros((1,))})
+    cache.save("a", {"t": torch.zeros((1,))})
+    # Files other than cache entries are ignored.
+    (tmp_path / "manifest.jsonl").touch()
+
+    assert sorted(cache.keys()) == ["1", "a"]
@@ -1,5 +1,6 @@
 from contextlib import nullcontext
 
+import numpy as np
 import pytest
 
 from invoke_training._shared.data.utils.aspect_ratio_bucket_manager import AspectRatioBucketManager
@@ -84,3 +85,71 @@ def test_get_aspect_ratio_bucket(resolution: Resolution, expected_bucket: Resolu
     nearest_bucket = arbm.get_aspect_ratio_bucket(resolution)
 
     assert nearest_bucket == expected_bucket
+
+
+def _get_aspect_ratio_bucket_reference(arbm: AspectRatioBucketManager, resolution: Resolution) -> Resolution:
+    """The original O(num_buckets) implementation of get_aspect_ratio_bucket(...)."""
+    return min(arbm.buckets, key=lambda x: abs(x.aspect_ratio() - resolution.aspect_ratio()))
+
+
+def _get_test_resolutions() -> list[Resolution]:
+    rng = np.random.default_rng(0)
+    resolutions = [Resolution(int(h), int(w)) for h, w in rng.integers(1, 4096, size=(2000, 2))]
+    # Extreme aspect ratios, outside of the range of the buckets.
+    resolutions += [Resolution(1, 4096), Resolution(4096, 1), Resolution(1, 1)]
+    return resolutions
+
+
+@pytest.mark.parametrize(
+    "buckets",
+    [
+        AspectRatioBucketManager.build_aspect_ratio_buckets(1024, 512, 2048, 64),
+        AspectRatioBucketManager.build_aspect_ratio_buckets(512, 256, 768, 32),
+        {Resolution(512, 512)},
+    ],
+)
+def test_get_aspect_ratio_bucket_matches_reference(buckets: set[Resolution]):
+    arbm = AspectRatioBucketManager(buckets)
+    resolutions = _get_test_resolutions()
+
+    expected = [_get_aspect_ratio_bucket_reference(arbm, resolution) for resolution in resolutions]
+
+    assert [arbm.get_aspect_ratio_bucket(resolution) for resolution in resolutions] == expected
+    assert arbm.get_aspect_ratio_buckets(resolutions) == expected
+
+
+@pytest.mark.parametrize(
+    "resolution",
+    [
+        # Exactly half-way between the aspect ratios 1/2 and 2/2.
+        Resolution(3, 4),
+        # Exactly half-way between the aspect ratios 2/2 and 4/2.
+        Resolution(3, 2),
+    ],
+)
+def test_get_aspect_ratio_bucket_ties(resolution: Resolution):
+    """Test that ties between equally close aspect ratios, and between buckets with the same aspect ratio, are broken
+    in the same way as the reference implementation.
+    """
+    # Buckets (1, 1), (2, 2) and (4, 4) all have an aspect ratio of 1.
+    buckets = {
+        Resolution(1, 2),
+        Resolution(1, 1),
+        Resolution(2, 2),
+        Resolution(4, 4),
+        Resolution(4, 2),
+    }
+    arbm = AspectRatioBucketManager(buckets)
+
+    expected = _get_aspect_ratio_bucket_reference(arbm, resolution)
+
+    assert arbm.get_aspect_ratio_bucket(resolution) == expected
+    assert arbm.get_aspect_ratio_buckets([resolution]) == [expected]
+
+
+def test_get_aspect_ratio_buckets_empty():
+    arbm = AspectRatioBucketManager.from_constraints(
+        target_resolution=1024, start_dim=768, end_dim=1280, divisible_by=128
+    )
+
+    assert arbm.get_aspect_ratio_buckets([]) == []
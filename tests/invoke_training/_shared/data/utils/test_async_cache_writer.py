@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+from invoke_training._shared.data.utils.async_cache_writer import AsyncCacheWriter
+
+
+@pytest.mark.parametrize("num_threads", [1, 3])
+def test_async_cache_writer_runs_all_jobs(num_threads: int):
+    results = []
+    lock = threading.Lock()
+
+    def make_job(i: int):
+        def job():
+            with lock:
+                results.append(i)
+
+        return job
+
+    with AsyncCacheWriter(num_threads=num_threads, max_pending_jobs=2) as writer:
+        for i in range(20):
+            writer.submit(make_job(i))
+
+    assert sorted(results) == list(range(20))
+
+
+def test_async_cache_writer_flush():
+    results = []
+
+    writer = AsyncCacheWriter(num_threads=1)
+    for i in range(5):
+        writer.submit(lambda i=i: results.append(i))
+    writer.flush()
+
+    # With a single writer thread, jobs are run in submission order.
+    assert results == list(range(5))
+    writer.close()
+
+
+def test_async_cache_writer_backpressure():
+    """Test that submit() blocks while the queue is full."""
+    release = threading.Event()
+    writer = AsyncCacheWriter(num_threads=1, max_pending_jobs=1)
+
+    # The first job occupies the writer thread, and the second job fills the queue.
+    writer.submit(release.wait)
+    writer.submit(lambda: None)
+
+    submitted = threading.Event()
+
+    def submit_third_job():
+        writer.submit(lambda: None)
+        submitted.set()
+
+    thread = threading.Thread(target=submit_third_job)
+    thread.start()
+    assert not submitted.wait(timeout=0.2)
+
+    release.set()
+    assert submitted.wait(timeout=5.0)
+    thread.join()
+    writer.close()
+
+
+def test_async_cache_writer_reraises_job_error():
+    def failing_job():
+        raise OSError("disk full")
+
+    writer = AsyncCacheWriter(num_threads=2)
+    writer.submit(failing_job)
+
+    with pytest.raises(RuntimeError) as exc_info:
+        writer.close()
+    assert isinstance(exc_info.value.__cause__, OSError)
+
+
+def test_async_cache_writer_submit_after_close():
+    writer = AsyncCacheWriter()
+    writer.close()
+
+    with pytest.raises(RuntimeError):
+        writer.submit(lambda: None)
+
+
+@pytest.mark.parametrize(["num_threads", "max_pending_jobs"], [(0, 1), (1, 0)])
+def test_async_cache_writer_invalid_args(num_threads: int, max_pending_jobs: int):
+    with pytest.raises(ValueError):
+        _ = AsyncCacheWriter(num_threads=num_threads, max_pending_jobs=max_pending_jobs)
@@ -0,0 +1,65 @@
+import json
+import os
+from pathlib import Path
+
+import torch
+
+from invoke_training._shared.data.utils.cache_fingerprint import (
+    fingerprint_files,
+    fingerprint_params,
+    fingerprint_str,
+    fingerprint_tensors,
+    get_persistent_cache_dir,
+)
+
+
+def test_fingerprint_str():
+    assert fingerprint_str("a cat") == fingerprint_str("a cat")
+    assert fingerprint_str("a cat") != fingerprint_str("a dog")
+
+
+def test_fingerprint_params_key_order():
+    """Test that fingerprint_params() does not depend on key order."""
+    assert fingerprint_params({"a": 1, "b": [1, 2]}) == fingerprint_params({"b": [1, 2], "a": 1})
+    assert fingerprint_params({"a": 1}) != fingerprint_params({"a": 2})
+
+
+def test_fingerprint_tensors():
+    t = torch.rand((3, 4, 4))
+
+    assert fingerprint_tensors([t]) == fingerprint_tensors([t.clone()])
+    # Contents.
+    assert fingerprint_tensors([t]) != fingerprint_tensors([t + 1.0])
+    # Shape.
+    assert fingerprint_tensors([t]) != fingerprint_tensors([t.reshape(4, 3, 4)])
+    # Dtype.
+    assert fingerprint_tensors([t.to(torch.bfloat16)]) != fingerprint_tensors([t.to(torch.float16)])
+    # Non-contiguous tensors are supported.
+    assert fingerprint_tensors([t.transpose(1, 2)]) == fingerprint_tensors([t.transpose(1, 2).contiguous()])
+
+
+def test_fingerprint_files(tmp_path: Path):
+    path = tmp_path / "a.txt"
+    path.write_text("a")
+    fingerprint = fingerprint_files([path])
+
+    assert fingerprint_files([str(path)]) == fingerprint
+    # The file is modified.
+    path.write_text("ab")
+    assert fingerprint_files([path]) != fingerprint
+
+
+def test_get_persistent_cache_dir(tmp_path: Path):
+    params = {"model": "test_model", "weight_dtype": "float16"}
+
+    cache_dir = get_persistent_cache_dir(str(tmp_path), "vae_outputs", params)
+
+    assert os.path.isdir(cache_dir)
+    assert os.path.basename(cache_dir).startswith("vae_outputs-")
+    with open(os.path.join(cache_dir, "cache_params.json")) as f:
+        assert json.load(f) == params
+
+    # The same params map to the same directory, different params map to a different directory.
+    assert get_persistent_cache_dir(str(tmp_path), "vae_outputs", dict(params)) == cache_dir
+    assert get_persistent_cache_dir(str(tmp_path), "vae_outputs", {**params, "weight_dtype": "float32"}) != cache_dir
+    assert get_persistent_cache_dir(str(tmp_path), "text_encoder_outputs", params) != cache_dir
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+
+from invoke_training._shared.data.utils.decode_image import decode_image_to_tensor
+
+
+@pytest.mark.parametrize("pil_mode", ["RGB", "RGBA", "L"])
+def test_decode_image_to_tensor_rgb(tmp_path, pil_mode: str):
+    """Test that decode_image_to_tensor(...) matches PIL's `convert("RGB")` for lossless images in various modes."""
+    image_path = tmp_path / "image.png"
+    rng = np.random.default_rng(0)
+    shape = {"RGB": (32, 48, 3), "RGBA": (32, 48, 4), "L": (32, 48)}[pil_mode]
+    image_np = rng.integers(0, 256, shape, dtype=np.uint8)
+    Image.fromarray(image_np, mode=pil_mode).save(image_path)
+
+    image = decode_image_to_tensor(image_path)
+
+    expected = np.array(Image.open(image_path).convert("RGB"))
+    assert image.dtype == torch.uint8
+    assert image.shape == (3, 32, 48)
+    assert np.array_equal(image.permute(1, 2, 0).numpy(), expected)
+
+
+def test_decode_image_to_tensor_greyscale(tmp_path):
+    image_path = tmp_path / "mask.png"
+    rng = np.random.default_rng(0)
+    Image.fromarray(rng.integers(0, 256, (32, 48, 3), dtype=np.uint8)).save(image_path)
+
+    mask = decode_image_to_tensor(image_path, mode="L")
+
+    assert mask.dtype == torch.uint8
+    assert mask.shape == (1, 32, 48)
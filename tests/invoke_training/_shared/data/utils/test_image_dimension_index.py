@@ -0,0 +1,104 @@
+import os
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import PIL.Image
+
+from invoke_training._shared.data.utils import image_dimension_index
+from invoke_training._shared.data.utils.image_dimension_index import ImageDimensionIndex, get_image_dimensions
+from invoke_training._shared.data.utils.resolution import Resolution
+
+
+def _save_image(path: Path, height: int, width: int):
+    PIL.Image.fromarray(np.zeros((height, width, 3), dtype=np.uint8)).save(path)
+
+
+def test_get_image_dimensions_without_index(tmp_path: Path):
+    _save_image(tmp_path / "a.png", 16, 32)
+
+    assert get_image_dimensions([str(tmp_path / "a.png")]) == [Resolution(16, 32)]
+
+
+def test_get_image_dimensions_reuses_index(tmp_path: Path):
+    image_paths = [str(tmp_path / "a.png"), str(tmp_path / "b.png")]
+    _save_image(tmp_path / "a.png", 16, 32)
+    _save_image(tmp_path / "b.png", 8, 8)
+    index_path = str(tmp_path / "index.jsonl")
+
+    assert get_image_dimensions(image_paths, index_path) == [Resolution(16, 32), Resolution(8, 8)]
+
+    # On the second call, no images are read.
+    with mock.patch.object(image_dimension_index, "read_image_dimensions") as read_image_dimensions:
+        assert get_image_dimensions(image_paths, index_path) == [Resolution(16, 32), Resolution(8, 8)]
+    read_image_dimensions.assert_not_called()
+
+
+def test_get_image_dimensions_updates_modified_images(tmp_path: Path):
+    image_path = str(tmp_path / "a.png")
+    index_path = str(tmp_path / "index.jsonl")
+    _save_image(tmp_path / "a.png", 16, 32)
+    assert get_image_dimensions([image_path], index_path) == [Resolution(16, 32)]
+
+    # Replace the image, and make sure that the modification time changes.
+    _save_image(tmp_path / "a.png", 64, 32)
+    stat = os.stat(image_path)
+    os.utime(image_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert get_image_dimensions([image_path], index_path) == [Resolution(64, 32)]
+    # The updated record is persisted.
+    assert ImageDimensionIndex(index_path).get(image_path) == Resolution(64, 32)
+
+
+def test_image_dimension_index_ignores_partial_line(tmp_path: Path):
+    _save_image(tmp_path / "a.png", 16, 32)
+    _save_image(tmp_path / "b.png", 8, 8)
+    index_path = str(tmp_path / "index.jsonl")
+    get_image_dimensions([str(tmp_path / "a.png")], index_path)
+
+    # Simulate an interrupted write.
+    with open(index_path, "a") as f:
+        f.write('{"path": "trunc')
+
+    index = ImageDimensionIndex(index_path)
+    assert len(index) == 1
+    index.record(str(tmp_path / "b.png"), Resolution(8, 8))
+
+    index = ImageDimensionIndex(index_path)
+    assert len(index) == 2
+    assert index.get(str(tmp_path / "b.png")) == Resolution(8, 8)
+
+
+def test_image_dimension_index_unwritable(tmp_path: Path):
+    """Test that an index that can't be written still works in memory."""
+    _save_image(tmp_path / "a.png", 16, 32)
+    index = ImageDimensionIndex(str(tmp_path / "missing_dir" / "index.jsonl"))
+
+    index.record(str(tmp_path / "a.png"), Resolution(16, 32))
+
+    assert index.get(str(tmp_path / "a.png")) == Resolution(16, 32)
+
+
+def test_get_image_dimensions_parallel(tmp_path: Path):
+    """Test that the results of a multi-threaded, multi-chunk scan are in the same order as the input paths."""
+    image_paths = []
+    expected_dims = []
+    for i in range(10):
+        image_path = tmp_path / f"{i}.png"
+        _save_image(image_path, 8 + i, 16)
+        image_paths.append(str(image_path))
+        expected_dims.append(Resolution(8 + i, 16))
+    index_path = str(tmp_path / "index.jsonl")
+
+    image_dims = get_image_dimensions(image_paths, index_path, num_workers=4, chunk_size=3)
+
+    assert image_dims == expected_dims
+    assert len(ImageDimensionIndex(index_path)) == 10
+    # A second scan that mixes indexed and new images.
+    _save_image(tmp_path / "new.png", 4, 4)
+    image_paths.append(str(tmp_path / "new.png"))
+    expected_dims.append(Resolution(4, 4))
+
+    image_dims = get_image_dimensions(image_paths, index_path, num_workers=4, chunk_size=3)
+
+    assert image_dims == expected_dims
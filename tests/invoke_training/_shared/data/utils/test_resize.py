@@ -1,5 +1,6 @@
 import numpy as np
 import pytest
+import torch
 from PIL import Image
 
 from invoke_training._shared.data.utils.resize import resize_to_cover
@@ -33,3 +34,18 @@ def test_resize_to_cover(in_resolution: Resolution, size_to_cover: Resolution, e
 
     assert out_img.height == expected_resolution.height
     assert out_img.width == expected_resolution.width
+
+
+def test_resize_to_cover_tensor():
+    """Test that resize_to_cover() resizes CxHxW tensors to the same size as PIL images, with similar pixel values."""
+    rng = np.random.default_rng(0)
+    in_img_np = rng.integers(0, 256, (100, 60, 3), dtype=np.uint8)
+
+    out_img_pil = resize_to_cover(Image.fromarray(in_img_np), Resolution(40, 40))
+    out_img_tensor = resize_to_cover(torch.from_numpy(in_img_np).permute(2, 0, 1), Resolution(40, 40))
+
+    assert out_img_tensor.shape == (3, 67, 40)
+    assert (out_img_pil.height, out_img_pil.width) == (67, 40)
+    expected = torch.from_numpy(np.array(out_img_pil)).permute(2, 0, 1)
+    # Allow for small rounding differences between the PIL and torch antialiased resize implementations.
+    torch.testing.assert_close(out_img_tensor.float(), expected.float(), rtol=0.0, atol=3.0)
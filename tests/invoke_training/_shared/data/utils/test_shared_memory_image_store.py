@@ -0,0 +1,116 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader
+
+from invoke_training._shared.data.datasets.image_dir_dataset import ImageDirDataset
+from invoke_training._shared.data.utils.shared_memory_image_store import SharedMemoryImageStore
+
+
+def _write_images(tmp_path: Path, mode: str = "RGB") -> list[str]:
+    """Write random PNG images (lossless, so that they can be compared exactly) of different sizes."""
+    rng = np.random.default_rng(0)
+    image_paths = []
+    for i, (height, width) in enumerate([(16, 24), (32, 8), (20, 20)]):
+        shape = (height, width, 3) if mode == "RGB" else (height, width)
+        image_path = tmp_path / f"{i}.png"
+        Image.fromarray(rng.integers(0, 256, shape, dtype=np.uint8)).save(image_path)
+        image_paths.append(str(image_path))
+    return image_paths
+
+
+@pytest.mark.parametrize("store_format", ["decoded", "encoded"])
+@pytest.mark.parametrize("mode", ["RGB", "L"])
+def test_shared_memory_image_store_pil(tmp_path: Path, store_format: str, mode: str):
+    image_paths = _write_images(tmp_path, mode=mode)
+    store = SharedMemoryImageStore(image_paths, mode=mode, store_format=store_format)
+
+    assert len(store) == 3
+    for idx, image_path in enumerate(image_paths):
+        assert idx in store
+        image = store.load(idx)
+        expected_image = Image.open(image_path).convert(mode)
+        assert image.mode == mode
+        assert image.size == expected_image.size
+        assert image.tobytes() == expected_image.tobytes()
+
+
+@pytest.mark.parametrize("store_format", ["decoded", "encoded"])
+def test_shared_memory_image_store_tensor(tmp_path: Path, store_format: str):
+    image_paths = _write_images(tmp_path)
+    store = SharedMemoryImageStore(image_paths, store_format=store_format)
+
+    image = store.load(1, decode_to_tensor=True)
+
+    assert image.dtype == torch.uint8
+    assert image.shape == (3, 32, 8)
+    expected_image = torch.from_numpy(np.asarray(Image.open(image_paths[1]).convert("RGB"))).permute(2, 0, 1)
+    assert torch.equal(image, expected_image)
+
+    # Modifying the returned image must not modify the store.
+    image.zero_()
+    assert torch.equal(store.load(1, decode_to_tensor=True), expected_image)
+
+
+def test_shared_memory_image_store_decoded_size(tmp_path: Path):
+    image_paths = _write_images(tmp_path)
+    store = SharedMemoryImageStore(image_paths)
+
+    assert store.num_bytes == (16 * 24 + 32 * 8 + 20 * 20) * 3
+
+
+def test_shared_memory_image_store_max_bytes(tmp_path: Path):
+    """Test that images that do not fit within `max_bytes` are not stored."""
+    image_paths = _write_images(tmp_path)
+    # Room for the first and second images, but not the third.
+    store = SharedMemoryImageStore(image_paths, max_bytes=(16 * 24 + 32 * 8) * 3)
+
+    assert 0 in store
+    assert 1 in store
+    assert 2 not in store
+    assert store.load(1).size == (8, 32)
+    assert store.load(2) is None
+
+
+def test_shared_memory_image_store_max_bytes_skips_large_images(tmp_path: Path):
+    """Test that an image that does not fit within `max_bytes` is skipped, and that later images can still be stored."""
+    image_paths = _write_images(tmp_path)
+    # Too small for the first image (16 * 24 * 3 bytes), but room for the second.
+    store = SharedMemoryImageStore(image_paths, max_bytes=1000)
+
+    assert 0 not in store
+    assert 1 in store
+    assert 2 not in store
+    assert store.load(0) is None
+    assert store.load(1).size == (8, 32)
+
+
+def test_shared_memory_image_store_missing_paths(tmp_path: Path):
+    image_paths = _write_images(tmp_path)
+    store = SharedMemoryImageStore([image_paths[0], None], mode="L")
+
+    assert 0 in store
+    assert 1 not in store
+    assert store.load(1) is None
+
+
+def test_shared_memory_image_store_empty():
+    store = SharedMemoryImageStore([])
+
+    assert len(store) == 0
+    assert store.num_bytes == 0
+
+
+def test_shared_memory_image_store_dataloader_workers(tmp_path: Path):
+    """Test that the store can be read from DataLoader worker processes."""
+    _write_images(tmp_path)
+    dataset = ImageDirDataset(str(tmp_path), image_extensions=[".png"], keep_in_memory=True, decode_to_tensor=True)
+
+    images = [example["image"] for example in DataLoader(dataset, batch_size=None, num_workers=2)]
+
+    assert len(images) == 3
+    for idx, image in enumerate(images):
+        assert torch.equal(image, dataset[idx]["image"])
@@ -0,0 +1,461 @@
+import json
+import os
+import types
+
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader
+
+from invoke_training._shared.data.datasets.transform_dataset import TransformDataset
+from invoke_training._shared.data.transforms.tensor_cache import open_tensor_cache, read_cache_info
+from invoke_training._shared.stable_diffusion.output_cache import (
+    finalize_output_caches,
+    get_cache_batch_size,
+    get_caption_source_params,
+    populate_augmented_output_caches,
+    populate_output_caches,
+    sample_cached_latent_dist,
+)
+from invoke_training.config.data.data_loader_config import AspectRatioBucketConfig, ImageCaptionSDDataLoaderConfig
+from invoke_training.config.data.dataset_config import ImageCaptionDirDatasetConfig
+from invoke_training.config.data.output_cache_config import OutputCacheConfig
+
+
+def _build_caption_data_loader(captions: list[str]) -> DataLoader:
+    examples = [{"id": str(i), "caption": caption} for i, caption in enumerate(captions)]
+    return DataLoader(
+        examples,
+        batch_size=2,
+        collate_fn=lambda batch: {"id": [e["id"] for e in batch], "caption": [e["caption"] for e in batch]},
+    )
+
+
+class _CaptionEncoder:
+    """A fake caption encoder that records the captions that it was called with."""
+
+    def __init__(self):
+        self.encoded_captions: list[str] = []
+
+    def __call__(self, captions: list[str]) -> dict[str, torch.Tensor]:
+        self.encoded_captions.extend(captions)
+        lengths = torch.tensor([float(len(c)) for c in captions])
+        return {"text_encoder_output": lengths.reshape(-1, 1, 1).expand(-1, 4, 8).clone()}
+
+
+def test_populate_output_caches_text_encoder_outputs(tmp_path):
+    captions = ["a", "bb", "ccc", "dddd", "eeeee"]
+    encode_captions = _CaptionEncoder()
+
+    populate_output_caches(
+        _build_caption_data_loader(captions),
+        encode_captions=encode_captions,
+        text_encoder_output_cache_dir=str(tmp_path),
+    )
+
+    assert encode_captions.encoded_captions == captions
+    cache = open_tensor_cache(str(tmp_path))
+    for i, caption in enumerate(captions):
+        text_encoder_output = cache.load(str(i))["text_encoder_output"]
+        assert text_encoder_output.shape == (4, 8)
+        assert torch.all(text_encoder_output == len(caption))
+
+
+def test_populate_output_caches_skips_valid_entries(tmp_path):
+    """Test that only examples whose captions have changed are re-encoded when the cache is populated again."""
+    populate_output_caches(
+        _build_caption_data_loader(["a", "bb", "ccc"]),
+        encode_captions=_CaptionEncoder(),
+        text_encoder_output_cache_dir=str(tmp_path),
+    )
+
+    encode_captions = _CaptionEncoder()
+    populate_output_caches(
+        _build_caption_data_loader(["a", "changed", "ccc"]),
+        encode_captions=encode_captions,
+        text_encoder_output_cache_dir=str(tmp_path),
+    )
+
+    assert encode_captions.encoded_captions == ["changed"]
+    cache = open_tensor_cache(str(tmp_path))
+    assert torch.all(cache.load("1")["text_encoder_output"] == len("changed"))
+
+
+def test_populate_output_caches_deduplicates_captions(tmp_path):
+    """Test that each unique caption is only encoded and stored once."""
+    captions = ["a", "bb", "a", "a", "bb", "ccc"]
+    encode_captions = _CaptionEncoder()
+
+    populate_output_caches(
+        _build_caption_data_loader(captions),
+        encode_captions=encode_captions,
+        text_encoder_output_cache_dir=str(tmp_path),
+    )
+
+    assert encode_captions.encoded_captions == ["a", "bb", "ccc"]
+    assert len(list(tmp_path.glob("*.pt"))) == 3
+    # Every example can still be loaded by id.
+    cache = open_tensor_cache(str(tmp_path))
+    for i, caption in enumerate(captions):
+        assert torch.all(cache.load(str(i))["text_encoder_output"] == len(caption))
+
+
+class _FakeVAE:
+    """A fake VAE whose 'latents' are the 8x average-pooled input images, with a log-variance of -1."""
+
+    device = torch.device("cpu")
+    dtype = torch.float32
+    config = types.SimpleNamespace(scaling_factor=1.0)
+
+    def encode(self, images: torch.Tensor):
+        latents = torch.nn.functional.avg_pool2d(images, kernel_size=8)
+        parameters = torch.cat([latents, torch.full_like(latents, -1.0)], dim=1)
+        return types.SimpleNamespace(latent_dist=types.SimpleNamespace(sample=lambda: latents, parameters=parameters))
+
+
+def _build_image_data_loader(num_examples: int, random_crop_seed: int | None) -> DataLoader:
+    """Build a DataLoader that mimics a transformed image data loader. Each 'crop' is a constant image whose value
+    depends on the example and the crop seed.
+    """
+    examples = []
+    for i in range(num_examples):
+        crop_value = float(i) if random_crop_seed is None else float(i + 10 * random_crop_seed)
+        image = torch.full((3, 16, 32), crop_value)
+        # Make the left half of each image distinguishable from the right half, so that flips can be detected.
+        image[:, :, :16] += 0.5
+        examples.append(
+            {
+                "id": str(i),
+                "caption": f"caption {i}",
+                "image": image,
+                "original_size_hw": (16, 40),
+                "crop_top_left_yx": (0, 2),
+            }
+        )
+
+    def collate_fn(batch):
+        return {
+            "id": [e["id"] for e in batch],
+            "caption": [e["caption"] for e in batch],
+            "image": torch.stack([e["image"] for e in batch]),
+            "original_size_hw": [e["original_size_hw"] for e in batch],
+            "crop_top_left_yx": [e["crop_top_left_yx"] for e in batch],
+        }
+
+    return DataLoader(examples, batch_size=2, collate_fn=collate_fn)
+
+
+def test_populate_augmented_output_caches_single_variant(tmp_path):
+    vae_output_cache_dir = str(tmp_path / "vae")
+
+    populate_augmented_output_caches(
+        lambda load_images, random_crop_seed: _build_image_data_loader(3, random_crop_seed),
+        center_crop=True,
+        random_flip=False,
+        vae=_FakeVAE(),
+        vae_output_cache_dir=vae_output_cache_dir,
+    )
+
+    assert read_cache_info(vae_output_cache_dir) == {"num_variants": 1, "latent_distribution": False}
+    cache = open_tensor_cache(vae_output_cache_dir)
+    for i in range(3):
+        assert cache.load(str(i))["vae_output"].shape == (3, 2, 4)
+
+
+def test_populate_augmented_output_caches_latent_distribution(tmp_path):
+    vae_output_cache_dir = str(tmp_path / "vae")
+
+    populate_augmented_output_caches(
+        lambda load_images, random_crop_seed: _build_image_data_loader(3, random_crop_seed),
+        center_crop=True,
+        random_flip=False,
+        vae=_FakeVAE(),
+        vae_output_cache_dir=vae_output_cache_dir,
+        output_cache_config=OutputCacheConfig(cache_latent_distribution=True),
+    )
+
+    assert read_cache_info(vae_output_cache_dir) == {"num_variants": 1, "latent_distribution": True}
+    cache = open_tensor_cache(vae_output_cache_dir)
+    for i in range(3):
+        entry = cache.load(str(i))
+        assert "vae_output" not in entry
+        # The mean and log-variance are concatenated along the channel dimension.
+        assert entry["vae_latent_dist"].shape == (6, 2, 4)
+        assert torch.allclose(entry["vae_latent_dist"][3:], torch.tensor(-1.0))
+
+
+class _SourceFingerprintDataset(torch.utils.data.Dataset):
+    """A dataset that can fingerprint its source images without loading them, and records which images are loaded."""
+
+    def __init__(self, image_data_loader: DataLoader, source_fingerprints: list[str]):
+        self._examples = image_data_loader.dataset
+        self.source_fingerprints = source_fingerprints
+        self.loaded_idxs: list[int] = []
+
+    def __len__(self) -> int:
+        return len(self._examples)
+
+    def __getitem__(self, idx: int) -> dict:
+        self.loaded_idxs.append(idx)
+        return self._examples[idx]
+
+    def load_example_without_images(self, idx: int) -> dict:
+        return {"id": self._examples[idx]["id"], "caption": self._examples[idx]["caption"]}
+
+    def get_image_source_fingerprint(self, idx: int) -> str:
+        return self.source_fingerprints[idx]
+
+
+def test_populate_augmented_output_caches_source_fingerprints(tmp_path):
+    """Test that, for a dataset that can fingerprint its source images, only the images with missing or stale VAE
+    output cache entries are loaded.
+    """
+    source_fingerprints = ["a", "b", "c"]
+    datasets: list[_SourceFingerprintDataset] = []
+
+    def build_data_loader(load_images: bool, random_crop_seed: int | None) -> DataLoader:
+        image_data_loader = _build_image_data_loader(3, random_crop_seed)
+        dataset = _SourceFingerprintDataset(image_data_loader, source_fingerprints)
+        if load_images:
+            datasets.append(dataset)
+        return DataLoader(
+            TransformDataset(dataset, []), batch_size=2, shuffle=False, collate_fn=image_data_loader.collate_fn
+        )
+
+    def populate(encode_captions: _CaptionEncoder):
+        populate_augmented_output_caches(
+            build_data_loader,
+            center_crop=False,
+            random_flip=True,
+            vae=_FakeVAE(),
+            vae_output_cache_dir=str(tmp_path / "vae"),
+            encode_captions=encode_captions,
+            text_encoder_output_cache_dir=str(tmp_path / "text"),
+            output_cache_config=OutputCacheConfig(num_crop_variants=2),
+        )
+
+    encode_captions = _CaptionEncoder()
+    populate(encode_captions)
+    assert [sorted(dataset.loaded_idxs) for dataset in datasets] == [[0, 1, 2], [0, 1, 2]]
+    assert encode_captions.encoded_captions == ["caption 0", "caption 1", "caption 2"]
+
+    # A warm cache is validated without loading any images.
+    datasets.clear()
+    populate(_CaptionEncoder())
+    assert [dataset.loaded_idxs for dataset in datasets] == [[], []]
+
+    # Only the examples whose source images have changed are loaded.
+    datasets.clear()
+    source_fingerprints[1] = "b2"
+    populate(_CaptionEncoder())
+    assert [dataset.loaded_idxs for dataset in datasets] == [[1], [1]]
+
+    cache = open_tensor_cache(str(tmp_path / "vae"))
+    for i in range(3):
+        for crop_variant in range(2):
+            assert torch.allclose(
+                cache.load(f"{i}_{crop_variant * 2}")["vae_output"][:, :, 2:],
+                torch.tensor(float(i + 10 * crop_variant)),
+            )
+
+
+def test_sample_cached_latent_dist():
+    mean = torch.randn((2, 4, 8, 8))
+    logvar = torch.full_like(mean, -2.0)
+    latent_dist_params = torch.cat([mean, logvar], dim=1)
+
+    torch.manual_seed(0)
+    samples = torch.stack([sample_cached_latent_dist(latent_dist_params, scaling_factor=0.5) for _ in range(200)])
+
+    assert samples.shape == (200, 2, 4, 8, 8)
+    # The samples are scaled, and are drawn from N(mean, exp(logvar)).
+    assert torch.allclose(samples.mean(dim=0), mean * 0.5, atol=0.1)
+    expected_std = 0.5 * torch.exp(torch.tensor(0.5 * -2.0))
+    assert torch.allclose((samples - mean * 0.5).std(), expected_std, atol=0.01)
+
+
+def test_populate_output_caches_vae_memory_options(tmp_path):
+    """Test that VAE slicing and tiling are enabled while the cache is populated, and disabled again afterwards."""
+
+    class _RecordingVAE(_FakeVAE):
+        def __init__(self):
+            self.use_slicing = False
+            self.use_tiling = False
+            self.options_during_encode = []
+
+        def enable_slicing(self):
+            self.use_slicing = True
+
+        def disable_slicing(self):
+            self.use_slicing = False
+
+        def enable_tiling(self):
+            self.use_tiling = True
+
+        def disable_tiling(self):
+            self.use_tiling = False
+
+        def encode(self, images: torch.Tensor):
+            self.options_during_encode.append((self.use_slicing, self.use_tiling, torch.is_inference_mode_enabled()))
+            return super().encode(images)
+
+    vae = _RecordingVAE()
+    populate_output_caches(
+        _build_image_data_loader(3, None),
+        vae=vae,
+        vae_output_cache_dir=str(tmp_path),
+        output_cache_config=OutputCacheConfig(vae_slicing=True, vae_tiling=True),
+    )
+
+    assert vae.options_during_encode == [(True, True, True), (True, True, True)]
+    assert not vae.use_slicing
+    assert not vae.use_tiling
+
+
+def test_get_cache_batch_size():
+    assert get_cache_batch_size(None, train_batch_size=4) == 4
+    assert get_cache_batch_size(OutputCacheConfig(), train_batch_size=4) == 4
+    assert get_cache_batch_size(OutputCacheConfig(cache_batch_size=32), train_batch_size=4) == 32
+
+
+def test_get_caption_source_params():
+    """Test that the caption source params include the dataset and caption settings, but not the image settings (which
+    do not affect the text encoder outputs).
+    """
+    config = ImageCaptionSDDataLoaderConfig(
+        dataset=ImageCaptionDirDatasetConfig(dataset_dir="/data"), caption_prefix="prefix", resolution=512
+    )
+    changed_image_config = config.model_copy(
+        update={
+            "resolution": 1024,
+            "center_crop": False,
+            "aspect_ratio_buckets": AspectRatioBucketConfig(
+                target_resolution=1024, start_dim=512, end_dim=2048, divisible_by=128
+            ),
+        }
+    )
+    changed_caption_config = config.model_copy(update={"caption_prefix": "other prefix"})
+
+    params = get_caption_source_params(config)
+
+    assert params["caption_prefix"] == "prefix"
+    assert params["dataset"]["dataset_dir"] == "/data"
+    assert "resolution" not in params
+    assert get_caption_source_params(changed_image_config) == params
+    assert get_caption_source_params(changed_caption_config) != params
+
+
+def test_populate_augmented_output_caches_variants(tmp_path):
+    vae_output_cache_dir = str(tmp_path / "vae")
+    text_encoder_output_cache_dir = str(tmp_path / "text")
+    encode_captions = _CaptionEncoder()
+
+    populate_augmented_output_caches(
+        lambda load_images, random_crop_seed: _build_image_data_loader(3, random_crop_seed),
+        center_crop=False,
+        random_flip=True,
+        vae=_FakeVAE(),
+        vae_output_cache_dir=vae_output_cache_dir,
+        encode_captions=encode_captions,
+        text_encoder_output_cache_dir=text_encoder_output_cache_dir,
+        output_cache_config=OutputCacheConfig(num_crop_variants=2),
+    )
+
+    # 2 crop variants x 2 flip variants.
+    assert read_cache_info(vae_output_cache_dir) == {"num_variants": 4, "latent_distribution": False}
+    cache = open_tensor_cache(vae_output_cache_dir)
+    for i in range(3):
+        for crop_variant in range(2):
+            unflipped = cache.load(f"{i}_{crop_variant * 2}")
+            flipped = cache.load(f"{i}_{crop_variant * 2 + 1}")
+
+            # Each crop variant comes from a separately-seeded pass over the dataset.
+            assert torch.allclose(unflipped["vae_output"][:, :, 2:], torch.tensor(float(i + 10 * crop_variant)))
+            assert torch.allclose(flipped["vae_output"], torch.flip(unflipped["vae_output"], dims=[-1]))
+
+            # The crop position of the flipped variant is mirrored, in the same way as in SDImageTransform.
+            assert unflipped["crop_top_left_yx"] == (0, 2)
+            assert flipped["crop_top_left_yx"] == (0, 40 - 32 - 2)
+
+    # The text encoder outputs are only computed once.
+    assert encode_captions.encoded_captions == ["caption 0", "caption 1", "caption 2"]
+
+
+def _populate_caches_on_rank(rank: int, world_size: int, tmp_dir: str):
+    dist.init_process_group(
+        "gloo", init_method=f"file://{os.path.join(tmp_dir, 'dist_init')}", rank=rank, world_size=world_size
+    )
+    try:
+        captions = ["a", "bb", "a", "ccc", "dddd", "a", "eeeee"]
+        encode_captions = _CaptionEncoder()
+
+        def build_data_loader(load_images: bool, random_crop_seed: int | None) -> DataLoader:
+            data_loader = _build_image_data_loader(len(captions), random_crop_seed)
+            for example, caption in zip(data_loader.dataset, captions, strict=True):
+                example["caption"] = caption
+            return data_loader
+
+        populate_augmented_output_caches(
+            build_data_loader,
+            center_crop=True,
+            random_flip=True,
+            vae=_FakeVAE(),
+            vae_output_cache_dir=os.path.join(tmp_dir, "vae"),
+            encode_captions=encode_captions,
+            text_encoder_output_cache_dir=os.path.join(tmp_dir, "text"),
+            output_cache_config=OutputCacheConfig(cache_format="sharded"),
+            process_index=rank,
+            num_processes=world_size,
+        )
+        dist.barrier()
+        finalize_output_caches(
+            vae_output_cache_dir=os.path.join(tmp_dir, "vae"),
+            text_encoder_output_cache_dir=os.path.join(tmp_dir, "text"),
+            num_processes=world_size,
+        )
+
+        with open(os.path.join(tmp_dir, f"encoded_captions_{rank}.json"), "w") as f:
+            json.dump(encode_captions.encoded_captions, f)
+    finally:
+        dist.destroy_process_group()
+
+
+@pytest.mark.skipif(not dist.is_available(), reason="torch.distributed is not available.")
+def test_populate_augmented_output_caches_distributed(tmp_path):
+    """Test populating the caches from multiple processes with the gloo backend."""
+    world_size = 2
+    mp.start_processes(
+        _populate_caches_on_rank, args=(world_size, str(tmp_path)), nprocs=world_size, start_method="fork"
+    )
+
+    # The batches [0, 1], [4, 5] are processed by rank 0, and the batches [2, 3], [6] by rank 1.
+    with open(tmp_path / "encoded_captions_0.json") as f:
+        assert json.load(f) == ["a", "bb", "dddd"]
+    with open(tmp_path / "encoded_captions_1.json") as f:
+        assert json.load(f) == ["a", "ccc", "eeeee"]
+
+    vae_cache = open_tensor_cache(str(tmp_path / "vae"))
+    text_encoder_cache = open_tensor_cache(str(tmp_path / "text"))
+    for i, caption in enumerate(["a", "bb", "a", "ccc", "dddd", "a", "eeeee"]):
+        unflipped = vae_cache.load(f"{i}_0")["vae_output"]
+        flipped = vae_cache.load(f"{i}_1")["vae_output"]
+        assert torch.allclose(unflipped[:, :, 2:], torch.tensor(float(i)))
+        assert torch.allclose(flipped, torch.flip(unflipped, dims=[-1]))
+        assert torch.all(text_encoder_cache.load(str(i))["text_encoder_output"] == len(caption))
+
+
+def test_finalize_output_caches_incomplete(tmp_path):
+    """Test that finalize_output_caches() raises if a process did not finish populating its share of a cache."""
+    populate_augmented_output_caches(
+        lambda load_images, random_crop_seed: _build_caption_data_loader(["a", "bb", "ccc"]),
+        center_crop=True,
+        random_flip=False,
+        encode_captions=_CaptionEncoder(),
+        text_encoder_output_cache_dir=str(tmp_path),
+        process_index=0,
+        num_processes=2,
+    )
+
+    with pytest.raises(RuntimeError, match="process 1 of 2 did not finish"):
+        finalize_output_caches(text_encoder_output_cache_dir=str(tmp_path), num_processes=2)
@@ -1,6 +1,17 @@
+import os
+import pickle
 from pathlib import Path
+from unittest import mock
 
-from invoke_training._shared.utils.jsonl import load_jsonl, save_jsonl
+import numpy as np
+import pytest
+
+from invoke_training._shared.utils.jsonl import (
+    IndexedJsonlReader,
+    get_jsonl_offset_index_path,
+    load_jsonl,
+    save_jsonl,
+)
 
 
 def test_jsonl_roundtrip(tmp_path: Path):
@@ -11,3 +22,116 @@ def test_jsonl_roundtrip(tmp_path: Path):
     out_objs = load_jsonl(jsonl_path)
 
     assert in_objs == out_objs
+
+
+def test_load_jsonl_blank_lines(tmp_path: Path):
+    """Test that load_jsonl skips blank lines rather than stopping at the first one."""
+    jsonl_path = tmp_path / "test.jsonl"
+    jsonl_path.write_text('{"a": 1}\n\n{"a": 2}\n   \n{"a": 3}')
+
+    assert load_jsonl(jsonl_path) == [{"a": 1}, {"a": 2}, {"a": 3}]
+
+
+def test_indexed_jsonl_reader(tmp_path: Path):
+    in_objs = [{"a": i, "text": "é" * i} for i in range(10)]
+    jsonl_path = tmp_path / "test.jsonl"
+    save_jsonl(in_objs, jsonl_path)
+
+    reader = IndexedJsonlReader(jsonl_path)
+
+    assert len(reader) == 10
+    assert [reader[i] for i in range(10)] == in_objs
+    assert reader[-1] == in_objs[-1]
+    with pytest.raises(IndexError):
+        reader[10]
+
+
+def test_indexed_jsonl_reader_blank_lines(tmp_path: Path):
+    jsonl_path = tmp_path / "test.jsonl"
+    jsonl_path.write_text('\n{"a": 1}\n\n{"a": 2}\n   \n{"a": 3}')
+
+    reader = IndexedJsonlReader(jsonl_path)
+
+    assert [reader[i] for i in range(len(reader))] == [{"a": 1}, {"a": 2}, {"a": 3}]
+
+
+def test_indexed_jsonl_reader_persisted_index(tmp_path: Path):
+    """Test that the offset index is persisted, and reused until the jsonl file changes."""
+    jsonl_path = tmp_path / "test.jsonl"
+    save_jsonl([{"a": 1}, {"a": 2}], jsonl_path)
+
+    IndexedJsonlReader(jsonl_path)
+    assert get_jsonl_offset_index_path(jsonl_path).exists()
+
+    with mock.patch.object(IndexedJsonlReader, "_build_index") as build_index:
+        reader = IndexedJsonlReader(jsonl_path)
+    build_index.assert_not_called()
+    assert reader[1] == {"a": 2}
+
+    # Modify the jsonl file. The index should be rebuilt.
+    save_jsonl([{"a": 1}, {"a": 2}, {"a": 3}], jsonl_path)
+    stat = os.stat(jsonl_path)
+    os.utime(jsonl_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    reader = IndexedJsonlReader(jsonl_path)
+    assert len(reader) == 3
+    assert reader[2] == {"a": 3}
+
+
+def test_indexed_jsonl_reader_pickle(tmp_path: Path):
+    jsonl_path = tmp_path / "test.jsonl"
+    save_jsonl([{"a": 1}, {"a": 2}], jsonl_path)
+    reader = IndexedJsonlReader(jsonl_path)
+    # Open the file handle before pickling.
+    assert reader[0] == {"a": 1}
+
+    unpickled_reader = pickle.loads(pickle.dumps(reader))
+
+    assert len(unpickled_reader) == 2
+    assert unpickled_reader[1] == {"a": 2}
+
+
+def test_indexed_jsonl_reader_pickle_stale_index(tmp_path: Path):
+    """Test that an unpickled reader rebuilds the offset index if the persisted index no longer matches the jsonl
+    file.
+    """
+    jsonl_path = tmp_path / "test.jsonl"
+    save_jsonl([{"a": 1}, {"a": 2}], jsonl_path)
+    reader = IndexedJsonlReader(jsonl_path)
+    pickled_reader = pickle.dumps(reader)
+
+    # Overwrite the persisted index with the index of a different jsonl file.
+    other_jsonl_path = tmp_path / "other.jsonl"
+    save_jsonl([{"a": 10}, {"a": 20}, {"a": 30}], other_jsonl_path)
+    IndexedJsonlReader(other_jsonl_path)
+    os.replace(get_jsonl_offset_index_path(other_jsonl_path), get_jsonl_offset_index_path(jsonl_path))
+
+    unpickled_reader = pickle.loads(pickled_reader)
+    assert len(unpickled_reader) == 2
+    assert unpickled_reader[1] == {"a": 2}
+
+
+def test_indexed_jsonl_reader_pickle_modified_file(tmp_path: Path):
+    """Test that unpickling a reader fails if the jsonl file was modified after it was indexed."""
+    jsonl_path = tmp_path / "test.jsonl"
+    save_jsonl([{"a": 1}, {"a": 2}], jsonl_path)
+    pickled_reader = pickle.dumps(IndexedJsonlReader(jsonl_path))
+
+    save_jsonl([{"a": 1}, {"a": 2}, {"a": 3}], jsonl_path)
+
+    with pytest.raises(RuntimeError, match="was modified"):
+        pickle.loads(pickled_reader)
+
+
+def test_indexed_jsonl_reader_process_specific_tmp_index(tmp_path: Path):
+    """Test that the index is written through a process-specific temporary file, and that no temporary file is left
+    behind.
+    """
+    jsonl_path = tmp_path / "test.jsonl"
+    save_jsonl([{"a": 1}], jsonl_path)
+
+    with mock.patch("numpy.save", wraps=np.save) as save:
+        IndexedJsonlReader(jsonl_path)
+
+    tmp_index_path = save.call_args.args[0]
+    assert tmp_index_path == f"{get_jsonl_offset_index_path(jsonl_path)}.{os.getpid()}.tmp.npy"
+    assert {p.name for p in tmp_path.iterdir()} == {jsonl_path.name, get_jsonl_offset_index_path(jsonl_path).name}